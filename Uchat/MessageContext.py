@@ -1,9 +1,20 @@
-from PyQt5.QtCore import Qt
+from enum import Enum
+from typing import Optional
 
 from Uchat.network.messages.message import Message
 from Uchat.peer import Peer
 
 
+class DeliveryState(Enum):
+    """
+    How far a message this user wrote got towards a peer
+    """
+    PENDING = 0  # Queued, waiting for room in the peer's socket, or for the peer to be reachable
+    SENT = 1  # Handed to the peer's socket in full
+    FAILED = 2  # The peer had no active conversation, or its socket failed
+    DELIVERED = 3  # Acknowledged by the peer
+
+
 class MessageContext:
     """
     Used for easy transmission of a chat message and contextual information required to process it
@@ -13,6 +24,4 @@ class MessageContext:
         self.msg = msg
         self.sender = sender
         self.is_sender = sender.is_self()
-
-    def display_flags(self) -> Qt.AlignmentFlag:
-        return Qt.AlignRight if self.is_sender else Qt.AlignLeft
+        self.delivery: Optional[DeliveryState] = None  # Of chats this user wrote, None for received ones
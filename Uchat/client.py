@@ -1,13 +1,35 @@
+import random
+import secrets
 import selectors
-from typing import Optional, Dict
-
-from PyQt5.QtCore import QObject, pyqtSignal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Callable, Tuple, Union
 
 from Uchat.MessageContext import MessageContext
-from Uchat.model.conversation import Conversation, ConversationState
+from Uchat.model.avatarStore import has_avatar, load_avatar, store_avatar
+from Uchat.model.conversation import Conversation, ConversationState, DeliveryState
+from Uchat.model.conversationFsm import traced
+from Uchat.model.groupConversation import GroupConversation
+from Uchat.model.history import History
+from Uchat.model.inlineImage import InlineImage, ImageAssembly, chunk_image, read_image, save_image
+from Uchat.model.outbox import Outbox
+from Uchat.helper import metrics
 from Uchat.helper.error import print_err
-from Uchat.network.messages.message import GreetingMessage, ChatMessage, MessageType, FarewellMessage, Message
+from Uchat.helper.globals import GOSSIP_MAX_HOPS, OUTBOX_RETRY_INITIAL, OUTBOX_RETRY_MAX, ACK_DELAY, ACK_EVERY, \
+    LISTENING_PORT, HISTORY_BATCH, IMAGE_MAX_PENDING, FSM_TRACE_LOGGED, FRAME_MAX_BYTES, CHAT_MAX_BYTES, \
+    GOSSIP_LAZY_DELAY
+from Uchat.helper.log import get_logger
+from Uchat.helper.profiler import profiled
+from Uchat.network.discovery import LanDiscovery
+from Uchat.network.messages.message import GreetingMessage, ChatMessage, MessageType, FarewellMessage, Message, \
+    GroupChatMessage, AckMessage, SyncMessage, HistoryMessage, ImageMessage, AvatarMessage, AvatarRequestMessage, \
+    WIRE_V2, WIRE_V3
+from Uchat.network.rateLimit import RateLimiter
 from Uchat.network.tcp import TcpSocket
+from Uchat.network.timers import TimerQueue, Timer
+from Uchat.network.tls import TlsIdentity, HANDSHAKE_RECORD
+from Uchat.network.udp import UdpSocket
 from Uchat.peer import Peer
 
 """
@@ -15,27 +37,140 @@ Represents a client in the p2p network
 Has the ability to send and receive messages to other clients
 """
 
+_log = get_logger('client')
+_conversations_gauge = metrics.gauge('uchat_conversations', 'Conversations currently held')
+_accepts = metrics.counter('uchat_connections_accepted_total', 'Incoming connections accepted by the listening socket')
+_handshake_latency = metrics.histogram('uchat_handshake_seconds', 'Time from sending a greeting to its acknowledgement')
+_receipt_latency = metrics.histogram('uchat_handle_receipt_seconds', 'Time spent handling a single received message')
+_closed = metrics.counter('uchat_connections_closed_total', 'Conversations whose peer closed the connection')
+_unexpected = metrics.counter('uchat_unexpected_messages_total', 'Messages received in a state not expecting them')
+_gossip_received = {result: metrics.counter('uchat_gossip_received_total', 'Group messages received, by novelty',
+                                            result=result) for result in ('new', 'duplicate')}
+_gossip_forwarded = metrics.counter('uchat_gossip_forwarded_total', 'Group messages forwarded on to other members')
+_gossip_hops = metrics.histogram('uchat_gossip_hops', 'Times group messages were forwarded before arriving',
+                                 unit_scale=1)
+_fan_out_latency = metrics.histogram('uchat_group_fan_out_seconds',
+                                     'Time taken to hand a group message to every member')
+_outbox_retries = metrics.counter('uchat_outbox_retries_total', 'Reconnection attempts to peers with queued messages')
+_outbox_flushed = metrics.counter('uchat_outbox_flushed_total', 'Queued messages sent once their peer was reachable')
+_acks_sent = {kind: metrics.counter('uchat_acks_sent_total', 'Acknowledgements sent, riding on a chat or on their own',
+                                    kind=kind) for kind in ('piggybacked', 'standalone')}
+_duplicates = metrics.counter('uchat_duplicate_chats_total', 'Chats received again, and dropped')
+_sync_rounds = metrics.counter('uchat_history_sync_rounds_total', 'History reconciliation messages sent')
+_reconciled = {direction: metrics.counter('uchat_history_reconciled_total', 'Chats found missing by reconciliation, '
+                                          'sent or received in bulk', direction=direction)
+               for direction in ('sent', 'received')}
+_images = {direction: metrics.counter('uchat_images_total', 'Inline images sent, or received whole',
+                                      direction=direction) for direction in ('sent', 'received')}
+_avatars = {result: metrics.counter('uchat_avatars_named_total', 'Avatars peers named, by whether they were stored',
+                                    result=result) for result in ('stored', 'fetched')}
+
+
+class ClientListener:
+    """
+    Interface for reacting to a client's events, all methods are optional
+    Called from the thread driving the client's selector
+    """
+
+    def friend_added(self, peer: Peer):
+        """
+        A peer was added as a friend
+        """
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        """
+        A peer connected, the connection must be accepted or rejected
+        """
 
-class Client(QObject):
+    def chat_started(self, peer: Peer):
+        """
+        A conversation with a peer became active, or should be shown
+        """
 
-    # Signals a client can emit
-    new_friend_added_signal = pyqtSignal(Peer)  # Emitted when a friend is added
-    tcp_conn_received_signal = pyqtSignal(Peer, TcpSocket) # Emitted when a user needs to permit a new connection rqst
-    start_chat_signal = pyqtSignal(Peer)
-    chat_received_signal = pyqtSignal(Peer)
+    def chat_received(self, peer: Peer):
+        """
+        A chat message was received from a peer
+        """
 
-    def __init__(self, parent: Optional[QObject], selector, info: Peer):
+    def peer_discovered(self, peer: Peer):
+        """
+        A client announced itself on the LAN, or changed its username or colour
+        """
+
+    def peer_lost(self, peer: Peer):
+        """
+        A client on the LAN left, or stopped announcing itself
+        """
+
+    def conversation_created(self, peer: Peer, conversation: Union[Conversation, GroupConversation]):
+        """
+        A conversation, or a group standing in for peer, was created
+        """
+
+    def conversation_deleted(self, peer: Peer):
+        """
+        The conversation, or group, held with peer was deleted
+        """
+
+    def image_received(self, peer: Peer, image: InlineImage):
+        """
+        Every chunk of an image arrived and it was saved, it was shown by its preview since its first chunk
+        """
+
+    def avatar_received(self, peer: Peer, digest: str):
+        """
+        A peer named its avatar, which is stored, whether it was already or its bytes were just fetched
+        """
+
+
+class _PendingConnection:
+    """
+    Selector data of an accepted socket whose first bytes, and any TLS handshake, haven't arrived yet
+    """
+
+    def __init__(self, awaiting_user: bool = False):
+        self.tls = False  # Whether the peer opened with a TLS handshake
+        self.awaiting_user = awaiting_user  # Connected already, read ahead until the user accepts or rejects it
+
+
+class Client:
+    """
+    Headless networking core, independent of any UI toolkit
+    Front-ends observe it by registering a ClientListener
+    """
+
+    def __init__(self, selector, info: Peer, identity: Optional[TlsIdentity] = None, udp: bool = False,
+                 discovery: bool = False, outbox: Optional[Outbox] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
         """
         Constructs a new client
         :param selector: Reference to selector used for I/O multiplexing
         :param info: Peer information pertaining to this user
+        :param identity: TLS identity, when set conversations this client starts are encrypted
+        :param udp: Whether to accept UDP connections, and try UDP first for the unencrypted conversations it starts
+        :param discovery: Whether to announce this user on the LAN, and connect to peers found there directly
+        :param outbox: Where chat messages to unreachable peers are kept, without one they are refused
+        :param rate_limiter: Limits on the frames peers may have decoded, without one they're read as fast as sent
         """
-        super().__init__(parent)
-
         self._info = info
+        self.__identity = identity
+        self.__listeners: List[ClientListener] = list()
 
         # Conversations that this client is a member of
         self.__conversations: Dict[Peer, Conversation] = dict()  # TODO: Change to be a mapping between ipv4 and conv
+        self.__greeting_sent_at: Dict[Peer, int] = dict()  # Peer -> perf_counter_ns of our unacknowledged greeting
+
+        # Group conversations, by group id and by the pseudo-peer that stands in for them
+        self.__groups: Dict[int, GroupConversation] = dict()
+        self.__member_id = secrets.randbits(64)  # Identifies this user as the origin of its group messages
+        self.__group_peers: Dict[Peer, GroupConversation] = dict()
+
+        # Held while queueing or flushing, so write interest is never dropped for a socket with queued bytes
+        self.__send_queue_lock = threading.Lock()
+
+        # Sockets of peers over their rate limit are unregistered until the limit admits frames again
+        self.__rate_limiter = rate_limiter
+        self.__paused: Dict[TcpSocket, Timer] = dict()  # Socket -> timer registering it again, guarded by the send lock
 
         self.__listening_socket = TcpSocket(self._info.address()[1])  # Create ipv4 TCP socket
         self.__selector = selector  # Reference to selector that is driving I/O multiplexing
@@ -43,6 +178,39 @@ class Client(QObject):
         self.__listening_socket.listen()  # Set up listening socket to listen on its address
         self.__selector.register(self.__listening_socket, selectors.EVENT_READ, data=None)
 
+        # Delayed acknowledgements, the UDP transport, LAN discovery and retries are driven by timers, which the
+        # network thread runs between selector wake-ups
+        self.__timers = TimerQueue()
+        self.__selector.register(self.__timers, selectors.EVENT_READ, data=None)
+        self.__ack_timers: Dict[Peer, Timer] = dict()  # Peer -> pending acknowledgement, guarded by the send lock
+        self.__histories: Dict[str, History] = dict()  # Username -> chats exchanged, kept across conversations
+        self.__images: Dict[Tuple[Peer, int], ImageAssembly] = dict()  # (Peer, image id) -> image being received
+        self.__avatar_requests: Dict[str, Peer] = dict()  # Hash of an avatar being fetched -> peer asked for it
+
+        self.__udp_listener: Optional[UdpSocket] = None
+        if udp:
+            self.__udp_listener = UdpSocket(self.__timers, self._info.address()[1])
+            self.__udp_listener.listen()
+            self.__selector.register(self.__udp_listener, selectors.EVENT_READ, data=None)
+
+        self.__discovery: Optional[LanDiscovery] = None
+        if discovery:
+            lan = LanDiscovery(self.__timers, self._info, self.__peer_discovered, self.__peer_lost)
+            if lan.start():
+                self.__discovery = lan
+                self.__selector.register(self.__discovery, selectors.EVENT_READ, data=None)
+
+        # Messages to unreachable peers wait in the outbox, while the peer is retried with exponential backoff
+        self.__outbox = outbox
+        self.__retries: Dict[Tuple[str, int], Timer] = dict()  # Listening address -> pending reconnection attempt
+        self.__retry_lock = threading.Lock()
+        self.__retry_executor: Optional[ThreadPoolExecutor] = None
+        if outbox:
+            # Attempts connect, which blocks, so they are run off the network thread
+            self.__retry_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+            for peer in outbox.peers():
+                self.__schedule_retry(peer, 1)
+
     def create_conversation(self, peer: Peer, comm_sock: Optional[TcpSocket]) -> Conversation:
         """
         Creates and returns a new conversation
@@ -50,10 +218,73 @@ class Client(QObject):
         :param comm_sock: Socket used for sending and receiving in this conversation
         :return: the newly created conversation
         """
-        conv = Conversation(None, self._info, peer, comm_sock)
+        conv = Conversation(self._info, peer, comm_sock)
         self.__conversations[peer] = conv
+        _conversations_gauge.set(len(self.__conversations))
+        for listener in self.__listeners:
+            listener.conversation_created(peer, conv)
         return conv
 
+    def create_group(self, members: List[Peer], group_id: Optional[int] = None, name: Optional[str] = None,
+                     relay_fanout: int = 0, started_by_personal: bool = True) -> GroupConversation:
+        """
+        Creates a new group conversation, greeting any member that no conversation is yet held with
+        :param members: Peers taking part, other than this user
+        :param group_id: Identifier of the group, a random one is chosen for groups created by this user
+        :param name: Name shown for the group
+        :param relay_fanout: Members each message is sent or forwarded to, 0 to send every message to every member
+        :param started_by_personal: Whether this user created the group, False when joining on a member's message
+        :return: the newly created group conversation
+        """
+        for member in [member for member in members if self.__too_old_for_groups(member)]:
+            print_err(4, "{} runs a client too old to take part in groups.".format(member.username()))
+            members = [other for other in members if other is not member]
+
+        group = GroupConversation(self._info, group_id if group_id is not None else secrets.randbits(64), members,
+                                  name, relay_fanout, started_by_personal)
+        self.__groups[group.group_id()] = group
+        self.__group_peers[group.peer()] = group
+        for listener in self.__listeners:
+            listener.conversation_created(group.peer(), group)
+
+        for member in members:
+            if not self.__conversations.get(member):
+                self.create_conversation(member, None)
+                self.send_greeting(member, False)
+
+        return group
+
+    def add_listener(self, listener: ClientListener):
+        self.__listeners.append(listener)
+
+    def remove_listener(self, listener: ClientListener):
+        if listener in self.__listeners:
+            self.__listeners.remove(listener)
+
+    def add_friend(self, peer: Peer):
+        """
+        Notifies listeners that a peer should be added as a friend
+        :param peer: New friend
+        """
+        for listener in self.__listeners:
+            listener.friend_added(peer)
+
+    def __peer_discovered(self, peer: Peer):
+        for listener in self.__listeners:
+            listener.peer_discovered(peer)
+
+    def __peer_lost(self, peer: Peer):
+        for listener in self.__listeners:
+            listener.peer_lost(peer)
+
+    def start_chat(self, peer: Peer):
+        """
+        Notifies listeners that the conversation with peer should be shown
+        :param peer: Peer whose conversation is starting
+        """
+        for listener in self.__listeners:
+            listener.chat_started(peer)
+
     def delete_conversation(self, peer: Peer):
         """
         Deletes an existing conversation associated with a peer
@@ -61,7 +292,28 @@ class Client(QObject):
         :param peer: Peer to delete associated conversation of
         """
 
+        if group := self.__group_peers.pop(peer, None):
+            self.__groups.pop(group.group_id(), None)
+            group.destroy()
+            for listener in self.__listeners:
+                listener.conversation_deleted(peer)
+            return
+
+        self.__greeting_sent_at.pop(peer, None)
+        for key in [key for key in self.__images if key[0] == peer]:
+            del self.__images[key]
+        for digest in [digest for digest, asked in self.__avatar_requests.items() if asked == peer]:
+            del self.__avatar_requests[digest]
+        with self.__send_queue_lock:
+            if timer := self.__ack_timers.pop(peer, None):
+                timer.cancel()
+            if (conv := self.__conversations.get(peer)) and (timer := self.__paused.pop(conv.sock(), None)):
+                timer.cancel()
         if conv := self.__conversations.pop(peer, None):
+            _conversations_gauge.set(len(self.__conversations))
+            if self.__identity and conv.sock():
+                # Session tickets arrive after the handshake, so the session is kept as the connection ends
+                self.__identity.remember_session(peer.address(), conv.sock())
             try:
                 if self.__selector.get_key(conv.sock()):
                     self.__selector.unregister(conv.sock())
@@ -69,6 +321,8 @@ class Client(QObject):
                 pass
 
             conv.destroy()
+            for listener in self.__listeners:
+                listener.conversation_deleted(peer)
 
     def poll_connection_accept(self, listening_sock: TcpSocket):
         """
@@ -76,13 +330,52 @@ class Client(QObject):
         """
         new_sock = listening_sock.accept_conn()  # We must have had bound and listened to get here
 
-        if new_sock:
-            new_peer = Peer(new_sock.get_remote_addr(), False, new_sock.get_remote_addr()[0])
-            self.create_conversation(new_peer, new_sock)
-            # Poll for accept / decline
-            self.tcp_conn_received_signal.emit(new_peer, new_sock)
-        else:
+        if not new_sock:
             print_err(2, "Unable to accept incoming connection\n")
+        elif self.__identity:
+            # Wait for the peer's first bytes, which tell an encrypted connection from a plaintext one
+            self.__selector.register(new_sock, selectors.EVENT_READ, data=_PendingConnection())
+        else:
+            self.__connection_accepted(new_sock)
+
+    def __connection_accepted(self, new_sock: TcpSocket):
+        _accepts.inc()
+        self.__limit(new_sock)
+        new_peer = Peer(new_sock.get_remote_addr(), False, new_sock.get_remote_addr()[0])
+        self.create_conversation(new_peer, new_sock)
+        # Poll for accept / decline
+        for listener in self.__listeners:
+            listener.connection_requested(new_peer, new_sock)
+
+    def __advance_pending(self, sock: TcpSocket, pending: _PendingConnection):
+        """
+        Steps an accepted connection towards being a conversation, without blocking the network thread
+        Encrypted connections are handshaken as their records arrive, plaintext ones are passed on as they are
+        """
+        if not pending.tls:
+            if not (head := sock.peek()):
+                self.__selector.unregister(sock)
+                sock.free()
+                return
+            if head[0] == HANDSHAKE_RECORD:
+                pending.tls = True
+                sock.start_tls_server(self.__identity.server_context())
+
+        if pending.tls and not (done := sock.continue_handshake()):
+            if done is False:
+                self.__selector.unregister(sock)
+                sock.free()
+            return
+
+        # Initiators are pinned under the address they'd be connected to on, those presenting no identity predate pins
+        if pending.tls and (certificate := sock.peer_certificate()) and \
+                not self.__identity.check_pin((sock.get_remote_addr()[0], LISTENING_PORT), certificate):
+            self.__selector.unregister(sock)
+            sock.free()
+            return
+
+        self.__selector.unregister(sock)  # Registered again with its peer once the user accepts
+        self.__connection_accepted(sock)
 
     def accept_connection(self, new_peer: Peer, new_sock: TcpSocket):
         """
@@ -91,10 +384,16 @@ class Client(QObject):
         :param new_sock: Good socket
         """
 
-        self.__selector.register(new_sock, selectors.EVENT_READ, data=new_peer)
+        try:
+            self.__selector.modify(new_sock, selectors.EVENT_READ, data=new_peer)  # Was reading ahead
+        except KeyError:
+            self.__selector.register(new_sock, selectors.EVENT_READ, data=new_peer)
+
+        if isinstance(new_sock, UdpSocket) and new_sock.has_buffered_bytes():
+            # Frames read ahead won't make the socket readable again, hand them over from the network thread
+            self.__timers.call_later(0, lambda: self.handle_connection(new_sock))
 
-        print('Accepting new connection \n L {} to R {}'.format(new_sock.get_local_addr(),
-                                                                new_sock.get_remote_addr()))
+        _log.info('Accepting new connection L %s to R %s', new_sock.get_local_addr(), new_sock.get_remote_addr())
 
     def reject_connection(self, peer: Peer):
         """
@@ -104,23 +403,84 @@ class Client(QObject):
         self.send_greeting(peer, True, False)
         self.delete_conversation(peer)
 
-    def handle_connection(self, updated_sock: TcpSocket):
+    def handle_connection(self, updated_sock: TcpSocket, mask: int = selectors.EVENT_READ):
         """
         Determine if the provided socket is a new connection or a previously accepted connection
         providing a new mag
+        :param mask: Events the socket is ready for
         :return:
         """
 
         if updated_sock is self.__listening_socket:  # We have an incoming connection
             self.poll_connection_accept(updated_sock)
+        elif updated_sock is self.__timers:
+            self.__timers.drain_wakeups()
+        elif updated_sock is self.__discovery:
+            self.__discovery.receive()
+        elif updated_sock is self.__udp_listener:
+            if new_sock := self.__udp_listener.accept_conn():
+                # Acknowledged by the network thread while the user decides, so the peer doesn't presume it lost
+                self.__selector.register(new_sock, selectors.EVENT_READ, data=_PendingConnection(True))
+                self.__connection_accepted(new_sock)
         else:
             # Must be the socket of an existing conversation
 
             # Get conversation index from its selector's data field (as saved on creation)
-            sel_key = self.__selector.get_key(updated_sock)
+            try:
+                sel_key = self.__selector.get_key(updated_sock)
+            except (KeyError, ValueError):
+                return  # Unregistered by a command handled earlier in the same batch of events
+            if isinstance(sel_key.data, _PendingConnection):
+                if sel_key.data.awaiting_user:
+                    updated_sock.read_ahead()
+                else:
+                    self.__advance_pending(updated_sock, sel_key.data)
+                return
             peer: Peer = sel_key.data
 
-            self.handle_receipt(peer, updated_sock)
+            if mask & selectors.EVENT_WRITE:
+                with self.__send_queue_lock:
+                    if not updated_sock.flush():
+                        # Send queue drained, stop waiting for the socket to be writable
+                        self.__selector.modify(updated_sock, selectors.EVENT_READ, data=peer)
+
+            if mask & selectors.EVENT_READ:
+                for msg in updated_sock.recv_messages():
+                    self.handle_receipt(peer, msg)
+
+                if updated_sock.is_closed() and (conv := self.__conversations.get(peer)):
+                    _closed.inc()
+                    _log.info('%s closed the connection', peer)
+                    self.__requeue_unacknowledged(peer, conv)
+                    self.delete_conversation(peer)
+                elif (limit := updated_sock.rate_limit()) and (delay := limit.delay()):
+                    self.__pause_reading(updated_sock, peer, delay)
+
+    def __limit(self, sock: TcpSocket):
+        """
+        Gives a new connection its rate limit, if peers are limited
+        """
+        if self.__rate_limiter and (remote := sock.get_remote_addr()):
+            sock.rate_limit(self.__rate_limiter.connection(remote[0]))
+
+    def __pause_reading(self, sock: TcpSocket, peer: Peer, delay: float):
+        """
+        Stops reading a socket whose peer is over its rate limit, so it's slowed by its send buffer filling
+        Frames already read stay buffered in the socket, they are decoded once reading resumes
+        """
+        with self.__send_queue_lock:
+            if sock not in self.__paused:
+                self.__selector.unregister(sock)
+                self.__paused[sock] = self.__timers.call_later(delay, lambda: self.__resume_reading(sock, peer))
+
+    def __resume_reading(self, sock: TcpSocket, peer: Peer):
+        with self.__send_queue_lock:
+            if self.__paused.pop(sock, None) is None:
+                return  # Conversation deleted meanwhile
+            self.__selector.register(sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if sock.has_queued_bytes()
+                                                                   else 0), data=peer)
+        # Frames left buffered won't make the socket readable again
+        self.handle_connection(sock)
 
     def destroy(self):
         """
@@ -128,11 +488,27 @@ class Client(QObject):
         :return:
         """
         #TODO: Explore using a thread lock on self.__conversations (or make it atomic) to prevent dict size changing between deleting here and on farewell receipt
-        for peer in self.__conversations.keys():
+        for peer in list(self.__conversations.keys()):
             self.send_farewell(peer)
 
             self.delete_conversation(peer)
-            self.__listening_socket.free()
+
+        self.__selector.unregister(self.__listening_socket)
+        self.__listening_socket.free()
+        if self.__udp_listener:
+            self.__selector.unregister(self.__udp_listener)
+            self.__udp_listener.free()
+
+        if self.__discovery:
+            self.__selector.unregister(self.__discovery)
+            self.__discovery.stop()
+
+        with self.__retry_lock:
+            for timer in self.__retries.values():
+                timer.cancel()
+            self.__retries.clear()
+        if self.__retry_executor:
+            self.__retry_executor.shutdown(wait=False)
 
     # Message Handling
 
@@ -143,19 +519,24 @@ class Client(QObject):
             conv.peer().username(msg.get_username())
             conv.peer().color(msg.get_hex_code())
 
-        print('Receiving greeting')
+        _log.debug('Receiving greeting from %s', peer)
 
         # Send peer to ConversationView
-        self.start_chat_signal.emit(peer)
+        self.start_chat(peer)
 
         # Send response
         if not msg.ack:
             self.send_greeting(peer, True, True)
 
+        self.__announce_avatar(peer)
+        self.__flush_outbox(peer)
+
     def handle_greeting_response_receipt(self, peer: Peer, msg):
+        if (sent_at := self.__greeting_sent_at.pop(peer, None)) is not None:
+            _handshake_latency.record((time.perf_counter_ns() - sent_at) // 1000)
+
         if conv := self.conversation(peer):
-            status = '' if msg.wants_to_talk else 'not'
-            print('User has {} accepted your conversation!'.format(status))
+            _log.info('%s has %saccepted the conversation', peer, '' if msg.wants_to_talk else 'not ')
 
             if not msg.wants_to_talk:
                 # Destroy sock
@@ -163,28 +544,204 @@ class Client(QObject):
 
         if msg.wants_to_talk:
             self.handle_greeting_receipt(peer, msg)
+            self.__start_sync(peer)
 
     def handle_farewell_receipt(self, peer: Peer):
-        print("Receiving farewell")
+        _log.debug('Receiving farewell from %s', peer)
         if conv := self.conversation(peer):
             # Deregister from socket
             self.delete_conversation(peer)
 
     def handle_chat_receipt(self, peer: Peer, msg):
-        # Eventually log this message and its sender information
-        print(msg.message, end='\n')
-        self.chat_received_signal.emit(peer)
+        # Message text stays out of the log, only its size is recorded
+        _log.debug('Receiving chat from %s', peer, extra={'fields': {'chars': len(msg.message)}})
+        for listener in self.__listeners:
+            listener.chat_received(peer)
 
-    def handle_receipt(self, peer: Peer, comm_sock: TcpSocket):
-        if conv := self.conversation(peer):
-            msg = comm_sock.recv_message()
-            pre_expecting_types = conv.expecting_types()
+    def handle_sync_receipt(self, peer: Peer, msg: SyncMessage):
+        """
+        Answers a round of history reconciliation, sending the chats the peer was found to be missing
+        """
+        history = self.history(peer)
+        replies, missing = history.reconcile(msg.ranges)
+
+        messages: List[Message] = list()
+        if missing:
+            _reconciled['sent'].inc(len(missing))
+            _log.info('Sending %d chats %s was missing', len(missing), peer)
+            entries = history.entries(missing)
+            messages.extend(HistoryMessage.batches(entries, HISTORY_BATCH, FRAME_MAX_BYTES))
+        if replies:
+            _sync_rounds.inc()
+            messages.append(SyncMessage(replies))
+        self.__send_all(peer, messages)
+
+    def handle_history_receipt(self, peer: Peer, msg: HistoryMessage):
+        """
+        Adds the chats this user was found to be missing to the history and to the conversation
+        """
+        if not (conv := self.__conversations.get(peer)):
+            return
 
-            # Construct message context
-            context = MessageContext(msg, conv.peer())
+        history = self.history(peer)
+        from_peer = 0
+        for chat, written_by_peer in msg.entries:
+            if not history.add(chat, not written_by_peer):
+                continue
+            context = MessageContext(chat, conv.peer() if written_by_peer else conv.personal())
             conv.add_message(context)
+            if written_by_peer:
+                from_peer += 1
+            else:
+                conv.track_delivery(context, DeliveryState.DELIVERED)
+
+        _reconciled['received'].inc(len(msg.entries))
+        _log.info('Received %d chats missing from the history with %s', len(msg.entries), peer)
+        if from_peer:
+            for listener in self.__listeners:
+                listener.chat_received(peer)
+
+    @profiled('client.handle_image_receipt')
+    def handle_image_receipt(self, peer: Peer, conv: Conversation, msg: ImageMessage):
+        """
+        Gathers the chunks of an image, showing it by its preview from the first, and saving it once all arrived
+        """
+        key = (peer, msg.image_id)
+        if msg.index == 0:
+            if sum(1 for pending, _ in self.__images if pending == peer) >= IMAGE_MAX_PENDING:
+                print_err(3, "Dropped an image from {}, too many are part way through".format(peer.username()))
+                return
+            assembly = self.__images[key] = ImageAssembly(msg)
+            conv.add_message(MessageContext(assembly.image(), conv.peer()))
+            _log.debug('Receiving image from %s', peer, extra={'fields': {'chunks': msg.count}})
+            for listener in self.__listeners:
+                listener.chat_received(peer)
+        elif not (assembly := self.__images.get(key)) or not assembly.add(msg):
+            self.__images.pop(key, None)
+            print_err(3, "Dropped chunk {} of an image from {}, out of order or too large"
+                      .format(msg.index, peer.username()))
+            return
+
+        if assembly.is_complete():
+            del self.__images[key]
+            if save_image(msg.image_id, assembly.data()):
+                _images['received'].inc()
+                for listener in self.__listeners:
+                    listener.image_received(peer, assembly.image())
+
+    def handle_avatar_receipt(self, peer: Peer, conv: Conversation, msg: AvatarMessage):
+        """
+        Notes the avatar a peer named, asking for its bytes only if no avatar with its hash is stored
+        """
+        digest = msg.digest.hex()
+        if msg.data:
+            if self.__avatar_requests.get(digest) is not peer:
+                print_err(3, "Dropped an avatar from {}, it wasn't asked for".format(peer.username()))
+                return
+            del self.__avatar_requests[digest]
+            if not store_avatar(msg.data, digest):
+                return
+        elif not digest:
+            return  # The peer has no avatar
+        elif not has_avatar(digest):
+            _avatars['fetched'].inc()
+            if digest not in self.__avatar_requests:
+                self.__avatar_requests[digest] = peer
+                _log.debug('Fetching avatar of %s', peer)
+                self.__send_all(peer, [AvatarRequestMessage(msg.digest)])
+            conv.peer().avatar(digest)  # Shown once its bytes arrive
+            return
+        else:
+            _avatars['stored'].inc()
+
+        conv.peer().avatar(digest)
+        for listener in self.__listeners:
+            listener.avatar_received(conv.peer(), digest)
 
-            if msg and msg.m_type in pre_expecting_types:
+    def handle_avatar_request_receipt(self, peer: Peer, msg: AvatarRequestMessage):
+        """
+        Sends this user's avatar to a peer that doesn't store it, no other avatar is given out
+        """
+        if msg.digest.hex() != self._info.avatar() or (data := load_avatar(self._info.avatar())) is None:
+            print_err(4, "{} asked for an avatar that isn't this user's".format(peer.username()))
+            return
+        _log.debug('Sending avatar to %s', peer, extra={'fields': {'bytes': len(data)}})
+        self.__send_all(peer, [AvatarMessage(msg.digest, data)])
+
+    def handle_group_chat_receipt(self, peer: Peer, msg: GroupChatMessage):
+        """
+        Adds a member's message to its group's timeline, joining the group on its first message
+        Messages of relayed groups are forwarded on, the first time they arrive
+        Members joining only know the member they joined on, so the group's creator relays their messages to the rest
+        """
+        if not (group := self.__groups.get(msg.group_id)):
+            group = self.create_group([peer], msg.group_id, relay_fanout=msg.fanout, started_by_personal=False)
+            self.start_chat(group.peer())
+
+        group.add_member(peer)  # Members learn of each other as they speak
+
+        if not group.mark_seen(msg.origin, msg.message_id, peer):
+            _gossip_received['duplicate'].inc()
+            return
+
+        _gossip_received['new'].inc()
+        _gossip_hops.record(msg.hops)
+
+        author = group.origin_peer(msg.origin, msg.origin_name, peer, msg.hops)
+        group.add_message(MessageContext(ChatMessage(msg.message, msg.time_stamp), author))
+
+        for listener in self.__listeners:
+            listener.chat_received(group.peer())
+
+        if (msg.fanout and msg.hops + 1 < GOSSIP_MAX_HOPS) or (not msg.fanout and not msg.hops and
+                                                                group.started_by_personal()):
+            _gossip_forwarded.inc()
+            self.__fan_out(group, msg.forwarded())
+
+    @profiled('client.handle_receipt')
+    def handle_receipt(self, peer: Peer, msg: Optional[Message]):
+        with _receipt_latency.time():
+            self.__handle_receipt(peer, msg)
+
+    def __handle_receipt(self, peer: Peer, msg: Optional[Message]):
+        if conv := self.conversation(peer):
+            expected = msg is not None and msg.m_type in conv.expecting_types()
+
+            if expected and msg.m_type is MessageType.ACK:
+                conv.acknowledge(msg.ack)  # Not part of the conversation's history
+                return
+            if expected and msg.m_type is MessageType.SYNC:
+                self.handle_sync_receipt(peer, msg)
+                return
+            if expected and msg.m_type is MessageType.HISTORY:
+                self.handle_history_receipt(peer, msg)  # Adds the chats it carries one by one
+                return
+            if expected and msg.m_type is MessageType.IMAGE:
+                self.handle_image_receipt(peer, conv, msg)  # Added to the conversation once, on its first chunk
+                return
+            if expected and msg.m_type is MessageType.AVATAR:
+                self.handle_avatar_receipt(peer, conv, msg)  # Not part of the conversation's history
+                return
+            if expected and msg.m_type is MessageType.AVATAR_REQUEST:
+                self.handle_avatar_request_receipt(peer, msg)
+                return
+            if expected and msg.m_type is MessageType.CHAT:
+                conv.acknowledge(msg.ack)
+                if not conv.receive_chat(msg.seq):
+                    _duplicates.inc()
+                    _log.debug('Dropped chat %d from %s, already received', msg.seq, peer)
+                    return
+                self.__owe_ack(peer, conv)
+                if not self.history(peer).add(msg, False):
+                    _duplicates.inc()  # Sent again after reconnecting, from the peer's outbox
+                    return
+
+            if not (msg and msg.m_type is MessageType.GROUP_CHAT):  # Group messages belong to the group's timeline
+                # Construct message context
+                context = MessageContext(msg, conv.peer())
+                conv.add_message(context)
+
+            if expected:
                 if msg.m_type is MessageType.GREETING:
                     if msg.ack:
                         self.handle_greeting_response_receipt(peer, msg)
@@ -194,10 +751,15 @@ class Client(QObject):
                     self.handle_farewell_receipt(peer)
                 elif msg.m_type is MessageType.CHAT:
                     self.handle_chat_receipt(peer, msg)
+                elif msg.m_type is MessageType.GROUP_CHAT:
+                    self.handle_group_chat_receipt(peer, msg)
                 else:
                     print_err(3, "Handling unknown msg type: {}".format(msg.m_type))
             else:
+                _unexpected.inc()
                 print_err(3, "Received unexpected message type")
+                for transition in traced(conv.peer().username(), FSM_TRACE_LOGGED):
+                    _log.debug('Traced transition %s', transition)
 
     # Message sending
     def send_greeting(self, peer: Peer, ack: bool, wants_to_talk: bool = True):
@@ -206,27 +768,163 @@ class Client(QObject):
         """
         if conv := self.conversation(peer):
             greeting = GreetingMessage(int(conv.personal().color(), 16), conv.personal().username(), ack, wants_to_talk)
-            print('Sending greeting')
+            _log.debug('Sending greeting to %s', peer)
+            if not ack:
+                self.__greeting_sent_at[peer] = time.perf_counter_ns()
             self.send(peer, greeting)
 
+    def __announce_avatar(self, peer: Peer):
+        """
+        Names this user's avatar to a peer by its hash, once greetings agreed a version that exchanges avatars
+        """
+        conv = self.__conversations.get(peer)
+        if self._info.avatar() and conv and conv.sock() and conv.sock().wire_version() >= WIRE_V3:
+            self.__send_all(peer, [AvatarMessage(bytes.fromhex(self._info.avatar()))])
+
     def send_chat(self, peer: Peer, chat_message: ChatMessage):
         """
         Gets a line of input from stdin and sends it to another client as a wrapped ChatMessage
         """
-        if conv := self.conversation(peer):
-            if conv.state() is ConversationState.ACTIVE:
-                # As we are in an active conversation, safe to create msg
-                print('Sending chat')
-                self.send(peer, chat_message)
-            else:
-                print_err(4, "Will not send {}... on {}.".format(chat_message.message[:10], conv.state()))
+        if len(chat_message.message.encode()) > CHAT_MAX_BYTES:
+            print_err(4, "Will not send a chat longer than {} bytes.".format(CHAT_MAX_BYTES))
+        elif group := self.__group_peers.get(peer):
+            self.send_group_chat(group, chat_message)
+        elif (conv := self.conversation(peer)) and conv.state() is ConversationState.ACTIVE:
+            # As we are in an active conversation, safe to create msg
+            _log.debug('Sending chat to %s', peer)
+            self.send(peer, chat_message)
+        elif self.__outbox:
+            # Kept until the peer can be reached, the conversation shows it meanwhile
+            _log.debug('Queueing chat to %s', peer)
+            self.__outbox.put(peer, chat_message)
+            if conv:
+                context = MessageContext(chat_message, conv.personal())
+                conv.add_message(context)
+                conv.track_delivery(context, DeliveryState.PENDING)
+            self.__schedule_retry(peer, 0)
+        elif conv:
+            print_err(4, "Will not send {}... on {}.".format(chat_message.message[:10], conv.state()))
         else:
             print_err(4, "Conversation does not yet exist.")
 
+    def send_image(self, peer: Peer, path: str, width: int, height: int, preview: bytes) -> Optional[InlineImage]:
+        """
+        Sends an image inline, a chunk at a time, so chats written meanwhile go out between its chunks
+        The image is saved as received ones are, so both sides show it from the same place
+        :param path: File holding the encoded image
+        :param preview: A tiny encoding of the image, shown by the peer until every chunk has arrived
+        :return: the image as added to the conversation, None if it wasn't sent
+        """
+        if peer in self.__group_peers:
+            print_err(4, "Images are only sent in conversations with a single peer.")
+            return None
+        if not ((conv := self.conversation(peer)) and conv.state() is ConversationState.ACTIVE and conv.sock()):
+            print_err(4, "Will not send an image on {}.".format(conv.state() if conv else 'a missing conversation'))
+            return None
+        if conv.sock().wire_version() < WIRE_V2:
+            print_err(4, "{} runs a client too old to receive images.".format(peer.username()))
+            return None
+        if (data := read_image(path)) is None:
+            return None
+
+        chunks = chunk_image(data, width, height, preview)
+        image = InlineImage(chunks[0].image_id, width, height, preview, chunks[0].time_stamp)
+        if not save_image(image.image_id, data):
+            return None
+
+        _log.debug('Sending image to %s', peer, extra={'fields': {'bytes': len(data), 'chunks': len(chunks)}})
+        _images['sent'].inc()
+        conv.add_message(MessageContext(image, conv.personal()))
+        self.__send_image_chunk(peer, conv.sock(), chunks, 0)
+        return image
+
+    def __send_image_chunk(self, peer: Peer, sock: TcpSocket, chunks: List[ImageMessage], index: int):
+        """
+        Queues a chunk of an image, the next is queued once this one is written, on the network thread
+        The rest of the image is dropped should the conversation's connection change meanwhile
+        """
+        if not ((conv := self.__conversations.get(peer)) and conv.sock() is sock and not sock.is_closed()):
+            return
+
+        def on_sent(sent: bool):
+            if sent and index + 1 < len(chunks):
+                self.__timers.call_later(0, lambda: self.__send_image_chunk(peer, sock, chunks, index + 1))
+
+        with self.__send_queue_lock:
+            self.__queue_frame(peer, sock, chunks[index].to_bytes(sock.wire_version()), on_sent)
+
+    def send_group_chat(self, group: GroupConversation, chat_message: ChatMessage):
+        """
+        Sends a chat message to every member of a group, or to a few of them in relayed groups
+        The message is encoded once, and the same frame is queued on each member's socket without blocking
+        """
+        message_id = group.next_message_id()
+        group.mark_seen(self.__member_id, message_id)  # Drop copies relayed back to us
+        group.add_message(MessageContext(chat_message, self._info))
+
+        msg = GroupChatMessage(group.group_id(), self.__member_id, message_id, chat_message.message,
+                               self._info.username(), group.relay_fanout(), 0, chat_message.time_stamp)
+        self.__fan_out(group, msg, message_id)
+
+    def __fan_out(self, group: GroupConversation, msg: GroupChatMessage, tracked_id: Optional[int] = None,
+                  eager: bool = True):
+        """
+        Queues a group message on the sockets of every member with an active conversation not known to hold it
+        In relayed groups a random few are sent it at once, and the rest once GOSSIP_LAZY_DELAY has passed, so every
+        member is reached without most of them being sent copies they were forwarded meanwhile
+        :param tracked_id: Message id to track each member's delivery under, for messages written by this user
+        :param eager: Whether this is the message's first pass, rather than the one sending it on to the rest
+        """
+        holders = group.holders(msg.origin, msg.message_id)
+        targets = list()
+        for member in group.members():
+            conv = self.__conversations.get(member)
+            if member in holders:
+                continue
+            if conv and conv.state() is ConversationState.ACTIVE and conv.sock() and \
+                    not self.__too_old_for_groups(member):
+                targets.append((member, conv.sock()))
+            elif tracked_id is not None:
+                group.track_delivery(tracked_id, member, DeliveryState.FAILED)
+
+        if eager and group.relay_fanout() and len(targets) > group.relay_fanout():
+            targets = random.sample(targets, group.relay_fanout())
+            for member, _ in targets:
+                group.mark_seen(msg.origin, msg.message_id, member)  # Left out of the later pass
+            self.__timers.call_later(GOSSIP_LAZY_DELAY, lambda: self.__fan_out(group, msg, tracked_id, False))
+
+        frames: Dict[int, bytes] = dict()  # Wire version -> the message encoded in it, members may speak either
+        group.count_frames_sent(len(targets))
+
+        with _fan_out_latency.time(), self.__send_queue_lock:
+            for member, sock in targets:
+                on_sent = None
+                if tracked_id is not None:
+                    group.track_delivery(tracked_id, member, DeliveryState.PENDING)
+                    on_sent = (lambda sent, member=member: group.track_delivery(
+                        tracked_id, member, DeliveryState.SENT if sent else DeliveryState.FAILED))
+
+                version = sock.wire_version()
+                if version not in frames:
+                    frames[version] = msg.to_bytes(version)
+                self.__queue_frame(member, sock, frames[version], on_sent)
+
+    def __too_old_for_groups(self, member: Peer) -> bool:
+        """
+        :return: whether member was greeted over a connection read only in v1, whose clients can't read group messages
+        Members not yet greeted aren't, until they are
+        """
+        conv = self.__conversations.get(member)
+        return bool(conv and conv.state() is ConversationState.ACTIVE and conv.sock() and
+                    conv.sock().wire_version() < WIRE_V2)
+
     def send_farewell(self, peer: Peer):
+        if peer in self.__group_peers:
+            return  # Leaving a group is local, members are still spoken to in their own conversations
+
         if conv := self.conversation(peer):
             if conv.state() is not ConversationState.CLOSED:
-                print("Sending farewell")
+                _log.debug('Sending farewell to %s', peer)
                 farewell_msg = FarewellMessage()
                 self.send(peer, farewell_msg)
             else:
@@ -237,9 +935,20 @@ class Client(QObject):
         Generic function, used to send bytes to the peer
         """
 
-        if conv := self.conversation(peer):
-            message_bytes = message.to_bytes()
+        if conv := self.__conversations.get(peer):
             other_address = conv.peer().address()
+            if not conv.sock() and self.__discovery and (neighbour := self.__discovery.locate(conv.peer())):
+                # On the same LAN, connect directly rather than through an address that may only route from outside
+                other_address = neighbour.address()
+
+            if not conv.sock() and self.__udp_listener and not self.__identity:
+                udp_sock = UdpSocket(self.__timers)
+                if udp_sock.connect(other_address):
+                    self.__limit(udp_sock)
+                    self.__selector.register(udp_sock, selectors.EVENT_READ, data=peer)
+                    conv.sock(udp_sock)
+                else:
+                    _log.info('Falling back to TCP for %s', peer)
 
             if not conv.sock():
                 # Create a new TCP socket to communicate with other_address
@@ -247,7 +956,16 @@ class Client(QObject):
                 child_sock.set_timeout(5)  # Times out operations after 5 seconds
 
                 if child_sock.connect(other_address):  # Could a connection be established?
+                    if self.__identity and not self.__identity.secure(child_sock, other_address):
+                        # Handshake failed, or the peer isn't who it was when first pinned
+                        child_sock.free()
+                        return
+                    if not child_sock.is_tls():
+                        # The timeout only bounds connecting, it would make queued sends wait for room in the buffer
+                        child_sock.set_timeout(None)
+
                     # Full-duplex socket, must listen for incoming messages and use for sending new ones
+                    self.__limit(child_sock)
                     self.__selector.register(child_sock, selectors.EVENT_READ, data=peer)
                     conv.sock(child_sock)
 
@@ -256,9 +974,217 @@ class Client(QObject):
                 context = MessageContext(message, conv.personal())
                 conv.add_message(context)
 
-                send_sock.send_bytes(message_bytes)
+                with self.__send_queue_lock:
+                    on_sent = None
+                    if message.m_type is MessageType.CHAT:
+                        if send_sock.wire_version() >= WIRE_V2:  # Peers reading only v1 neither number nor ack chats
+                            # Numbered as it's queued, so chats reach the socket in the order of their numbers
+                            conv.number_chat(context)
+                            self.__carry_ack(peer, message)
+                        self.history(peer).add(message, True)
+                        conv.track_delivery(context, DeliveryState.PENDING)
+                        on_sent = lambda sent: conv.track_delivery(context, DeliveryState.SENT if sent
+                                                                   else DeliveryState.FAILED)
+                    self.__queue_frame(peer, send_sock, message.to_bytes(send_sock.wire_version()), on_sent)
+
+    def __queue_frame(self, peer: Peer, sock: TcpSocket, frame: bytes,
+                      on_sent: Optional[Callable[[bool], None]] = None):
+        """
+        Sends a frame without blocking, leaving whatever the kernel doesn't accept to the network thread
+        Must be called with the send queue lock held
+        """
+        if sock.queue_bytes(frame, on_sent) and sock not in self.__paused:
+            # Kernel buffer full, the rest is sent once the network thread sees the socket writable
+            self.__selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, data=peer)
+
+    def __send_all(self, peer: Peer, messages: List[Message]):
+        """
+        Sends messages to a peer in a single write, if its conversation has a socket
+        """
+        conv = self.__conversations.get(peer)
+        if messages and conv and (sock := conv.sock()):
+            with self.__send_queue_lock:
+                self.__queue_frame(peer, sock, b''.join(message.to_bytes(sock.wire_version()) for message in messages))
+
+    def __start_sync(self, peer: Peer):
+        """
+        Starts reconciling the history with a peer this user talked with before, from a fingerprint of all of it
+        Only the side that greeted starts, and the round trips that follow narrow down to the chats either side missed
+        Peers reading only v1 can't reconcile, they'd fail to decode the fingerprint
+        """
+        conv = self.__conversations.get(peer)
+        if not (conv and conv.sock() and conv.sock().wire_version() >= WIRE_V2):
+            return
+        history = self.history(peer)
+        if history.size():
+            _sync_rounds.inc()
+            self.__send_all(peer, [SyncMessage([history.summary()])])
+
+    def __carry_ack(self, peer: Peer, chat_message: ChatMessage):
+        """
+        Lets a chat going out carry the acknowledgement owed to the peer, in place of a frame of its own
+        Must be called with the send queue lock held
+        """
+        if timer := self.__ack_timers.pop(peer, None):
+            timer.cancel()
+        if chat_message.ack:
+            _acks_sent['piggybacked'].inc()
+
+    def __owe_ack(self, peer: Peer, conv: Conversation):
+        """
+        Acknowledges a received chat, at once every ACK_EVERY chats, otherwise after ACK_DELAY unless a chat going
+        out carries it first, so acknowledgements of a burst are coalesced
+        """
+        with self.__send_queue_lock:
+            if conv.owed_acks() >= ACK_EVERY:
+                self.__send_ack(peer)
+            elif peer not in self.__ack_timers:
+                self.__ack_timers[peer] = self.__timers.call_later(ACK_DELAY, lambda: self.__send_delayed_ack(peer))
+
+    def __send_delayed_ack(self, peer: Peer):
+        with self.__send_queue_lock:
+            self.__send_ack(peer)
+
+    def __send_ack(self, peer: Peer):
+        """
+        Sends the acknowledgement owed to a peer in a frame of its own
+        Must be called with the send queue lock held
+        """
+        if timer := self.__ack_timers.pop(peer, None):
+            timer.cancel()
+
+        conv = self.__conversations.get(peer)
+        if conv and conv.sock() and conv.state() is ConversationState.ACTIVE and (ack := conv.take_ack()):
+            _acks_sent['standalone'].inc()
+            self.__queue_frame(peer, conv.sock(), AckMessage(ack).to_bytes(conv.sock().wire_version()))
+
+    def __requeue_unacknowledged(self, peer: Peer, conv: Conversation):
+        """
+        Queues the chats a closed connection left unacknowledged, to be sent again once the peer is reachable
+        Without an outbox they are marked failed
+        """
+        if not (contexts := conv.unacknowledged()):
+            return
+
+        if not self.__outbox:
+            for context in contexts:
+                conv.track_delivery(context, DeliveryState.FAILED)
+            return
+
+        # A peer that connected to us is known by the address it connected from, not the one it listens on
+        target = peer if conv.started_by_personal() else \
+            Peer((peer.ipv4(), LISTENING_PORT), False, peer.username(), peer.color())
+        target = self.__outbox.queued_peer(target) or target
+        _log.info('Queueing %d unacknowledged chats to %s', len(contexts), target)
+        self.__outbox.give_back(target, [context.msg for context in contexts])
+        for context in contexts:
+            conv.track_delivery(context, DeliveryState.PENDING)
+        self.__schedule_retry(target, 1)
+
+    def __schedule_retry(self, peer: Peer, attempt: int):
+        """
+        Schedules an attempt to reach a peer that messages are queued for, unless one is already pending
+        :param attempt: Attempts made so far, the wait doubles with each, the first is made at once
+        """
+        with self.__retry_lock:
+            if peer.address() in self.__retries:
+                return
+            delay = 0 if not attempt else \
+                min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_INITIAL * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+            self.__retries[peer.address()] = self.__timers.call_later(
+                delay, lambda: self.__retry_executor.submit(self.__retry, peer, attempt))
+
+    def __retry(self, peer: Peer, attempt: int):
+        """
+        Greets a peer that messages are queued for, if no conversation with it is active or awaiting a reply
+        Queued messages are sent once the greeting is answered, until then the next attempt is scheduled
+        """
+        with self.__retry_lock:
+            self.__retries.pop(peer.address(), None)
+
+        self.__outbox.expire()
+        if not self.__outbox.pending(peer):
+            return
+
+        conv = self.__conversations.get(peer) or next(
+            (conv for conv in self.__conversations.values() if conv.peer().address() == peer.address()), None)
+        if conv and conv.state() is ConversationState.ACTIVE:
+            self.__flush_outbox(conv.peer())
+            return
+
+        if not (conv and conv.sock()):
+            _outbox_retries.inc()
+            _log.debug('Retrying %s, attempt %d', peer, attempt + 1)
+            if not conv:
+                conv = self.create_conversation(peer, None)
+            self.send_greeting(conv.peer(), False)
+
+        self.__schedule_retry(peer, attempt + 1)
+
+    def __flush_outbox(self, peer: Peer):
+        """
+        Sends every message queued for a peer whose conversation just became active, in a single write
+        Should the connection fail before they are written, they are queued again
+        """
+        conv = self.__conversations.get(peer)
+        if not (self.__outbox and conv and conv.sock() and conv.state() is ConversationState.ACTIVE):
+            return
+        if not (queued_peer := self.__outbox.queued_peer(peer)) or not (messages := self.__outbox.take(peer)):
+            return
+
+        # Messages queued since this run started are still in flight, so held in memory, rather than spilled
+        contexts = {id(context.msg): context for context in conv.chat_message_contexts().live()}
+        for message in messages:
+            if id(message) not in contexts:  # Queued before a restart, or before the conversation existed
+                contexts[id(message)] = MessageContext(message, conv.personal())
+                conv.add_message(contexts[id(message)])
+
+        _outbox_flushed.inc(len(messages))
+        _log.info('Sending %d queued messages to %s', len(messages), peer)
+        history = self.history(peer)
+        numbered = conv.sock().wire_version() >= WIRE_V2
+        with self.__send_queue_lock:
+            for message in messages:
+                if numbered:
+                    conv.number_chat(contexts[id(message)])
+                history.add(message, True)
+            if numbered:
+                self.__carry_ack(peer, messages[-1])
+
+            def on_sent(sent: bool):
+                if not sent:
+                    self.__outbox.give_back(queued_peer, messages)
+                for message in messages:
+                    conv.track_delivery(contexts[id(message)], DeliveryState.SENT if sent else DeliveryState.PENDING)
+
+            frames = b''.join(message.to_bytes(conv.sock().wire_version()) for message in messages)
+            self.__queue_frame(peer, conv.sock(), frames, on_sent)
+
+    def run_timers(self) -> Optional[float]:
+        """
+        Runs the transport's due timers, from the thread driving the selector
+        :return: seconds the selector may wait before timers are next due, None to wait indefinitely
+        """
+        return self.__timers.run_due()
 
     # Getters & Setters
 
     def conversation(self, peer: Peer) -> Optional[Conversation]:
-        return self.__conversations.get(peer)
+        return self.__conversations.get(peer) or self.__group_peers.get(peer)
+
+    def history(self, peer: Peer) -> History:
+        """
+        :return: chats exchanged with a peer, found by username, across every conversation held with it
+        """
+        if not (history := self.__histories.get(peer.username())):
+            history = self.__histories.setdefault(peer.username(), History())
+        return history
+
+    def nearby_peers(self) -> List[Peer]:
+        """
+        :return: clients currently announcing themselves on the LAN, empty unless discovery is enabled
+        """
+        return self.__discovery.neighbours() if self.__discovery else list()
+
+    def group(self, group_id: int) -> Optional[GroupConversation]:
+        return self.__groups.get(group_id)
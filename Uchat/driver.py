@@ -1,28 +1,71 @@
+import os
 import selectors
 import socket
 import sys
 import threading
 
 from Uchat.client import Client
-from Uchat.helper.globals import LISTENING_PORT
+from Uchat.helper import bootTimer, metrics, profiler
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import LISTENING_PORT, METRICS_ENV, PROFILE_ENV, UDP_ENV, DISCOVERY_ENV, FSM_TRACE_ENV, \
+    CAPTURE_ENV, NETWORK_PROCESS_ENV
+from Uchat.helper.log import setup_logging
 from Uchat.helper.logger import get_user_account_data
+from Uchat.model.conversationFsm import trace_transitions
+from Uchat.model.outbox import Outbox
+from Uchat.network import capture
+from Uchat.network.clientFactory import headless_client, load_identity, rate_limiter
 from Uchat.peer import Peer
-from Uchat.ui.application import Application
 
 sel = selectors.DefaultSelector()
 
+_wakeups = metrics.counter('uchat_selector_wakeups_total', 'Times the network thread woke from select')
+_events_per_wakeup = metrics.histogram('uchat_selector_events', 'Ready sockets per selector wake-up', unit_scale=1)
+_registered = metrics.gauge('uchat_selector_registered_sockets', 'Sockets registered with the selector')
+
 
 def poll_selector(client: Client):
     while True:
         try:
-            events = sel.select(timeout=None)
-            for key, mask in events:
-                client.handle_connection(key.fileobj)
+            events = sel.select(timeout=client.run_timers())
+            _wakeups.inc()
+            _events_per_wakeup.record(len(events))
+            _registered.set(len(sel.get_map()))
+            with profiler.section('poll_selector'):
+                for key, mask in events:
+                    client.handle_connection(key.fileobj, mask)
         except socket.error:
             client.destroy()
 
 
+def _gui_client(info: Peer):
+    """
+    :return: the client the GUI drives, its networking in a child process when the environment asks for one
+    """
+    if os.environ.get(NETWORK_PROCESS_ENV):
+        from Uchat.ui.processClient import ProcessClient
+        return ProcessClient(info, headless_client)
+
+    from Uchat.ui.qtClient import QtClient
+    return QtClient(sel, info, load_identity(info), bool(os.environ.get(UDP_ENV)),
+                    bool(os.environ.get(DISCOVERY_ENV)), Outbox(), rate_limiter())
+
+
 def run():
+    setup_logging()
+
+    if metrics_spec := os.environ.get(METRICS_ENV):
+        metrics.export_on_demand(metrics_spec)
+    if profile_spec := os.environ.get(PROFILE_ENV):
+        profiler.configure(profile_spec)
+    if capture_path := os.environ.get(CAPTURE_ENV):
+        capture.record_to(capture_path)
+    if trace_size := os.environ.get(FSM_TRACE_ENV):
+        try:
+            trace_transitions(int(trace_size))
+        except ValueError:
+            print_err(4, "Transitions to trace should be a number, not {}".format(trace_size))
+
     # Handle debug vs normal operation set-up
     if len(sys.argv) > 1 and sys.argv[1] == 'DEBUG':
         # Set up for debugging mode
@@ -30,18 +73,31 @@ def run():
         if int(sys.argv[3]) == 2500:
             info = Peer(('', int(sys.argv[3])), True, 'debug_dan', '#FAB')
 
-            client = Client(None, sel, info)
+            client = _gui_client(info)
         else:
             info = Peer(('', int(sys.argv[3])), True, 'test_tom', '#BD2')
-            client = Client(None, sel, info)
+            client = _gui_client(info)
     else:
         user_data = get_user_account_data()
         info = Peer(('', LISTENING_PORT), True, user_data.username() if user_data else "",
-                    user_data.hex_code() if user_data else "")
-        client = Client(None, sel, info)
+                    user_data.hex_code() if user_data else "", user_data.avatar() if user_data else "")
+        client = _gui_client(info)
+
+        if user_data and user_data.upnp():
+            # Find the gateway in the background, while the UI loads, so port forwarding doesn't wait on SSDP
+            from Uchat.network.upnp import start_gateway_discovery
+            start_gateway_discovery()
+
+    if not os.environ.get(NETWORK_PROCESS_ENV):  # Networking runs on a thread of this process
+        network_thread = threading.Thread(target=poll_selector, args=(client,))
+        network_thread.daemon = True
+        network_thread.start()
+        bootTimer.mark_phase('network thread started')
+    else:
+        bootTimer.mark_phase('network process started')
 
-    network_thread = threading.Thread(target=poll_selector, args=(client,))
-    network_thread.daemon = True
-    network_thread.start()
+    # Deferred import, the windows and dialogs are only needed once networking is up
+    from Uchat.ui.application import Application
+    bootTimer.mark_phase('ui imports')
 
     Application(client)
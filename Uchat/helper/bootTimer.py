@@ -0,0 +1,61 @@
+"""
+Records the wall-clock phases of the application's boot sequence, used for diagnosing slow cold starts
+"""
+import os
+import sys
+import time
+from typing import List, Tuple
+
+from Uchat.helper.globals import BOOT_PROFILE_ENV, BOOT_EXIT_ENV
+
+_boot_start: float = time.perf_counter()  # Reference point, as close to interpreter start as possible
+_phases: List[Tuple[str, float]] = list()  # (phase name, perf_counter at the phase's end)
+
+
+def is_enabled() -> bool:
+    """
+    :return: whether or not the boot timeline was requested through the environment
+    """
+    return bool(os.environ.get(BOOT_PROFILE_ENV))
+
+
+def should_exit_after_boot() -> bool:
+    """
+    :return: whether the application should quit as soon as its main window is ready (used for cold start budgets)
+    """
+    return bool(os.environ.get(BOOT_EXIT_ENV))
+
+
+def mark_phase(name: str):
+    """
+    Marks the end of a boot phase. Cheap enough to be left in place when profiling is disabled
+    :param name: Name of the phase that just finished
+    """
+    _phases.append((name, time.perf_counter()))
+
+
+def phases() -> List[Tuple[str, float, float]]:
+    """
+    :return: a list of (phase name, phase duration in ms, elapsed ms since boot) tuples, in the order they occurred
+    """
+    timeline = list()
+    previous = _boot_start
+
+    for name, end in _phases:
+        timeline.append((name, (end - previous) * 1000, (end - _boot_start) * 1000))
+        previous = end
+
+    return timeline
+
+
+def report():
+    """
+    Writes the boot timeline to stderr, if it was requested
+    """
+    if not is_enabled():
+        return
+
+    print('Boot timeline (ms):', file=sys.stderr)
+    for name, duration, elapsed in phases():
+        print('  {:<28} {:>9.2f} {:>9.2f}'.format(name, duration, elapsed), file=sys.stderr)
+    sys.stderr.flush()
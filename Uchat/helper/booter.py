@@ -8,7 +8,6 @@ from PyQt5.QtCore import QThread, QObject, pyqtSignal
 from Uchat.helper.globals import LISTENING_PORT
 from Uchat.helper.logger import get_user_account_data
 from Uchat.model.account import Account
-from Uchat.network.upnp import ensure_port_is_forwarded, delete_port_mapping
 
 
 class BootThread(QThread):
@@ -29,9 +28,15 @@ class BootThread(QThread):
         :return:
         """
 
+        # Resolve the external IP ahead of time, so the account dialog never waits on it
+        from Uchat.network.ip import refresh_external_ip  # Deferred, HTTP is never loaded while booting the UI
+        refresh_external_ip()
+
         # PORT FORWARDING
         if self.__user_account and self.__user_account.upnp():
             # Account exists and UPnP was approved
+            from Uchat.network.upnp import ensure_port_is_forwarded  # Deferred, UPnP is only loaded when approved
+
             try:
                 ensure_port_is_forwarded()
             except Exception:
@@ -58,4 +63,6 @@ def execute_closure_methods():
     # PORT FORWARDING
     if user_account and user_account.upnp():
         # Account exists and UPnP was approved
+        from Uchat.network.upnp import delete_port_mapping  # Deferred, UPnP is only loaded when approved
+
         delete_port_mapping()
@@ -1,9 +1,11 @@
 """
 Error handling for application
 """
-from sys import stderr
+import logging
 from typing import Dict
 
+from Uchat.helper.log import get_logger
+
 error_codes: Dict[int, str] = {
     1: 'FILE I/O error',
     2: 'Network error',
@@ -12,10 +14,13 @@ error_codes: Dict[int, str] = {
     99: 'Unknown error occurred'
 }
 
+_log = get_logger('error')
+
 
 def print_err(error_code: int, additional_info: str = ''):
     """
     Logs an encounted error, its error code, and any additional information
+    Errors are queued for the background log writer, repeats from the same call site are rate limited
 
     :param error_code: Error code of error encountered, used for troubleshooting
     :param additional_info: Optional string containing additional information about the error
@@ -23,6 +28,7 @@ def print_err(error_code: int, additional_info: str = ''):
     if error_code not in error_codes:
         error_code = 99  # Unknown error code
 
-    print('\n{} (Error {})'.format(error_codes[error_code], error_code), file=stderr)
-    if additional_info:
-        print("Additional information: {}\n".format(additional_info), file=stderr)
+    level = logging.WARNING if error_code == 4 else logging.ERROR
+    # stacklevel attributes the record to the caller, which is what repeats are limited by
+    _log.log(level, '%s (Error %d) %s', error_codes[error_code], error_code, additional_info.strip(), stacklevel=2,
+             extra={'fields': {'code': error_code}})
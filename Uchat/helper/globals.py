@@ -3,7 +3,93 @@ Global values needed throughout the program, centrally managed here
 """
 
 LISTENING_PORT = 52789  # Socket for a Uchat client to listen for incoming connections on
-IP_API_URL = 'https://api.ipify.or3g'  # API used to get a text response containing the router's external IPv4 address
+IP_API_URL = 'https://api.ipify.org'  # API used to get a text response containing the router's external IPv4 address
 IP_API_FAILSAFE_URL = 'https://ip4.seeip.org/json' # API used to get a JSON response containing the router's external IPV4 address
 WINDOW_TITLE = 'UChat - Secure P2P Messaging'  # Default window title
-VERSION = "1.0.0"  # Current UChat version
\ No newline at end of file
+VERSION = "1.0.0"  # Current UChat version
+BOOT_PROFILE_ENV = 'UCHAT_BOOT_PROFILE'  # When set, the boot timeline is written to stderr once the window is ready
+BOOT_EXIT_ENV = 'UCHAT_BOOT_EXIT'  # When set, the application quits as soon as its main window is ready
+BOOT_BUDGET_MS = 1500  # Cold start budget, from interpreter start to a ready main window
+UPNP_CACHE_TTL = 24 * 60 * 60  # Seconds a discovered UPnP gateway is trusted before it is rediscovered
+UPNP_REQUEST_TIMEOUT = 2  # Seconds allowed for a single request to the UPnP gateway
+UPNP_CLOSE_DEADLINE = 1  # Hard deadline, in seconds, for the gateway to remove the port mapping while closing
+UPNP_CLOSE_DISCOVERY_WAIT = 0.5  # Seconds closing waits on a discovery still pending, before removing the mapping
+EXTERNAL_IP_TTL = 5 * 60  # Seconds the external IP is cached before it is refreshed in the background
+EXTERNAL_IP_TIMEOUT = 3  # Seconds an external IP lookup may take before the endpoint is given up on
+METRICS_ENV = 'UCHAT_METRICS'  # Metrics export: http://127.0.0.1:<port>, unix:<path>, or a file dumped on SIGUSR1
+LOG_LEVEL_ENV = 'UCHAT_LOG_LEVEL'  # Minimum level written to the log, ex. DEBUG
+LOG_MAX_BYTES = 1 << 20  # Size a log file may grow to before it is rotated
+LOG_BACKUP_COUNT = 3  # Rotated log files kept
+LOG_REPEAT_LIMIT = 5  # Records let through from a single call site per window, the rest are counted and dropped
+LOG_REPEAT_WINDOW = 10  # Seconds in a repeat-limiting window
+PROFILE_ENV = 'UCHAT_PROFILE'  # Profiling modes enabled at start up: timing, sample, or all
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+GROUP_TRACKED_MESSAGES = 1000  # Group messages whose per-member delivery state is remembered
+GOSSIP_FANOUT = 6  # Members each message of a relayed group is sent or forwarded to
+GOSSIP_MAX_HOPS = 8  # Times a relayed message may be forwarded before it is dropped
+GOSSIP_LAZY_DELAY = 0.1  # Seconds before a relayed message is sent on to the members not sent it at once
+GOSSIP_SEEN_CACHE = 4096  # Messages remembered per group, to drop copies arriving by another route
+TLS_ENV = 'UCHAT_TLS'  # When set, conversations this user starts are encrypted, incoming ones are accepted either way
+TLS_CERT_DAYS = 3650  # Days a generated identity certificate is valid for
+TLS_HANDSHAKE_TIMEOUT = 5  # Seconds allowed for the client side of a TLS handshake
+TLS_SESSION_CACHE = 256  # Peers whose last TLS session is kept for resumption
+UDP_ENV = 'UCHAT_UDP'  # When set, conversations this user starts try the UDP transport first, falling back to TCP
+UDP_CONNECT_TIMEOUT = 1  # Seconds a UDP handshake may take before falling back to TCP
+UDP_MAX_PAYLOAD = 1200  # Stream bytes per datagram, safely below common path MTUs
+UDP_INITIAL_WINDOW = 10  # Datagrams sent before the first acknowledgement
+UDP_RECV_WINDOW = 512  # Datagrams a receiver buffers out of order, also the largest congestion window
+UDP_INITIAL_RTO = 0.25  # Seconds before the first retransmission, until a round trip is measured
+UDP_MIN_RTO = 0.05  # Bounds on the retransmission timeout, in seconds
+UDP_MAX_RTO = 4
+UDP_MAX_RETRANSMITS = 10  # Transmissions of one datagram before the connection is given up on
+UDP_DELAYED_ACK = 0.01  # Seconds an in-order datagram may wait to be acknowledged alongside the next
+UDP_DUP_THRESHOLD = 3  # Later datagrams acknowledged before a missing one is retransmitted
+UDP_PACING_GAIN = 1.25  # Pacing rate over the congestion window's rate, so the window can still grow
+DISCOVERY_ENV = 'UCHAT_DISCOVERY'  # When set, this user is announced to, and learns of, other clients on the LAN
+DISCOVERY_GROUP = '239.255.82.89'  # Administratively scoped multicast group that announcements are sent to
+DISCOVERY_PORT = 52790  # Port announcements are sent to, shared by every client on a host
+DISCOVERY_INTERVAL = 5  # Seconds between a client's announcements, on a quiet segment
+DISCOVERY_SEGMENT_RATE = 20  # Announcements per second a whole segment may carry, busy segments announce less often
+DISCOVERY_TTL_FACTOR = 3  # Announcement intervals a neighbour is remembered for without being heard from again
+OUTBOX_RETRY_INITIAL = 2  # Seconds before reconnecting to a peer that messages were queued for
+OUTBOX_RETRY_MAX = 5 * 60  # Longest wait between reconnection attempts, the wait doubles after each failure
+OUTBOX_MAX_AGE = 7 * 24 * 60 * 60  # Seconds a queued message is kept before it expires undelivered
+OUTBOX_MAX_MESSAGES = 1000  # Messages queued per peer, the oldest are dropped beyond it
+OUTBOX_MAX_BYTES = 16 << 20  # Bytes of queued messages kept on disk across every peer, the oldest are dropped beyond it
+ACK_DELAY = 0.05  # Seconds a received chat's acknowledgement waits for a reply to ride on, or for more chats to cover
+ACK_EVERY = 32  # Chats received before they are acknowledged without waiting
+ACK_WINDOW = 1024  # Unacknowledged chats whose delivery is tracked per conversation, the oldest are let go beyond it
+HISTORY_MAX_AGE = 7 * 24 * 60 * 60  # Seconds a chat is kept per peer, to reconcile histories after reconnecting
+HISTORY_MAX_MESSAGES = 10000  # Chats kept per peer for reconciliation, the oldest are let go beyond it
+HISTORY_SYNC_IDS = 16  # Ranges holding at most this many chats are reconciled by listing their ids
+HISTORY_SYNC_SPLIT = 16  # Parts a differing range is split into, each summarised by a fingerprint
+HISTORY_BATCH = 256  # Chats per frame when sending those a peer was found to be missing
+RATE_LIMIT_ENV = 'UCHAT_RATE_LIMIT'  # Policy for frames over a peer's rate limit: drop, delay or disconnect
+RATE_LIMIT_POLICY = 'delay'  # Policy applied when the variable isn't set
+RATE_LIMIT_FRAMES = 200  # Frames per second a connection may have decoded, sustained
+RATE_LIMIT_BURST = 500  # Frames a connection may have decoded at once after a quiet spell, ex. a flushed outbox
+RATE_LIMIT_IP_FRAMES = 500  # Frames per second every connection from one IP may have decoded, together
+RATE_LIMIT_IP_BURST = 1000  # Frames every connection from one IP may have decoded at once, together
+CONVERSATION_MEMORY_BUDGET = 8 << 20  # Bytes of chat messages a conversation holds in memory, the oldest are spilled
+MEMORY_BUDGET = 64 << 20  # Bytes of chat messages held in memory across every conversation
+CHAT_LOG_PAGE = 64  # Spilled chat messages read back from disk at once
+CHAT_LOG_CACHED_PAGES = 16  # Pages of spilled chat messages kept once read back, as a view scrolls through them
+FSM_TRACE_ENV = 'UCHAT_FSM_TRACE'  # When set, this many of the most recent conversation state transitions are kept
+FSM_TRACE_LOGGED = 8  # Most recent transitions of a conversation logged when it receives an unexpected message
+CAPTURE_ENV = 'UCHAT_CAPTURE'  # When set, frames received over TCP are recorded to this capture file, for replaying
+NETWORK_PROCESS_ENV = 'UCHAT_NETWORK_PROCESS'  # When set, networking runs in a child process, apart from the UI
+IPC_RING_BYTES = 8 << 20  # Bytes of events the network process may have waiting for the UI, and of commands back
+IMAGE_CHUNK_BYTES = 64 << 10  # Bytes of an image sent per frame, chats written meanwhile go out between its chunks
+IMAGE_MAX_BYTES = 16 << 20  # Largest image that may be sent, or received, inline
+IMAGE_MAX_PENDING = 4  # Images a peer may be part way through sending at once, as each is held in memory until whole
+PREVIEW_PIXELS = 16  # Longest side of the preview sent ahead of an image, shown until the image is whole
+THUMBNAIL_PIXELS = 240  # Longest side an image is shown at in a conversation
+THUMBNAIL_WORKERS = 2  # Threads decoding and scaling images into thumbnails, off the GUI thread
+THUMBNAIL_QUEUE = 64  # Thumbnails waiting to be made, past it the least recently requested are dropped until asked for
+THUMBNAIL_CACHE_BYTES = 64 << 20  # Bytes of thumbnails kept on disk, the least recently shown are removed beyond it
+PIXMAP_CACHE_BYTES = 32 << 20  # Bytes of thumbnails held as pixmaps, ready to paint
+AVATAR_MAX_BYTES = 256 << 10  # Largest avatar that may be sent, or received, chosen photos are scaled down to fit
+FRAME_MAX_BYTES = AVATAR_MAX_BYTES + (4 << 10)  # Longest frame a peer may send, an avatar and its header
+CHAT_MAX_BYTES = 0xFFFF  # Longest chat that may be sent, in UTF-8 bytes, as long as v1 can count
+AVATAR_PIXELS = 256  # Side of the square a chosen photo is cropped and scaled to, before it's stored and hashed
+AVATAR_SIZES = (35, 40, 70)  # Sides, in pixels, avatars are shown at, each kept scaled on disk once an avatar arrives
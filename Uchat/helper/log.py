@@ -0,0 +1,167 @@
+"""
+Asynchronous, structured application logging
+Callers only enqueue records, a background thread formats and writes them, so no thread ever blocks on terminal or disk
+Log files are JSON lines, rotated under data/logs
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+from Uchat.helper.globals import LOG_LEVEL_ENV, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_REPEAT_LIMIT, LOG_REPEAT_WINDOW
+
+ROOT_LOGGER = 'uchat'
+LOG_FILE_NAME = 'uchat.log'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    :param name: Component name, ex. 'client' or 'network.tcp'
+    :return: a logger feeding the application's pipeline
+    Disabled levels are rejected by a cached level check before any argument is formatted, so hot paths should
+    pass arguments lazily, ex. log.debug('Sent %d bytes', size)
+    """
+    return logging.getLogger('{}.{}'.format(ROOT_LOGGER, name))
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the writer thread
+    The stock handler renders every message on the calling thread, which is the cost being moved off the hot path
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Rate limits records repeated from the same call site, so an error on every received frame can't flood the log
+    At most `limit` records per call site pass in each window, the number dropped is reported by the next to pass
+    """
+
+    def __init__(self, limit: int = LOG_REPEAT_LIMIT, window: float = LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.__limit = limit
+        self.__window = window
+        self.__sites: Dict[Tuple[str, int], list] = dict()  # Call site -> [window start, passed, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        site = self.__sites.setdefault((record.pathname, record.lineno), [now, 0, 0])
+
+        if now - site[0] >= self.__window:
+            if site[2]:
+                record.suppressed = site[2]
+            site[:] = [now, 0, 0]
+
+        if site[1] >= self.__limit:
+            site[2] += 1
+            return False
+
+        site[1] += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line
+    Structured fields passed as extra={'fields': {...}} are included as-is
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        if fields := getattr(record, 'fields', None):
+            entry.update(fields)
+        if suppressed := getattr(record, 'suppressed', None):
+            entry['suppressed_repeats'] = suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """
+    Formats records for humans reading stderr
+    """
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s', '%H:%M:%S')
+
+    def format(self, record: logging.LogRecord) -> str:
+        txt = super().format(record)
+        if fields := getattr(record, 'fields', None):
+            txt += ' ' + ' '.join('{}={}'.format(key, value) for key, value in fields.items())
+        if suppressed := getattr(record, 'suppressed', None):
+            txt += ' ({} repeats suppressed)'.format(suppressed)
+        return txt
+
+
+def setup_logging(level: Optional[str] = None, console_level: str = 'WARNING', log_dir: str = 'data/logs'):
+    """
+    Starts the logging pipeline, safe to call more than once
+    :param level: Minimum level recorded, defaults to the UCHAT_LOG_LEVEL environment variable, or INFO
+    :param console_level: Minimum level also echoed to stderr
+    :param log_dir: Folder that rotating log files are written to
+    """
+    global _listener
+
+    if _listener:
+        return
+
+    level = (level or os.environ.get(LOG_LEVEL_ENV) or 'INFO').upper()
+    handlers = list()
+
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(os.path.join(log_dir, LOG_FILE_NAME),
+                                                            maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                                            encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    except OSError as err:
+        print('Unable to open log file, logging to stderr only\n' + repr(err), file=sys.stderr)
+        console_level = level
+
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(ConsoleFormatter())
+    console_handler.setLevel(console_level.upper())
+    handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    enqueue_handler = _EnqueueHandler(records)
+    enqueue_handler.addFilter(RepeatFilter())  # Filtered on the caller's thread, so dropped records are never queued
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.addHandler(enqueue_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    Flushes queued records and stops the writer thread
+    """
+    global _listener
+
+    if _listener:
+        _listener.stop()
+        _listener = None
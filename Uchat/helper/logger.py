@@ -19,6 +19,11 @@ class DataType(Enum):
     LOG = 'logs'
     USER = 'user'
     ICONS = 'icons'
+    CACHE = 'cache'
+    OUTBOX = 'outbox'
+    IMAGES = 'images'
+    THUMBNAILS = 'thumbnails'
+    AVATARS = 'avatars'
 
 
 class FileName(Enum):
@@ -27,6 +32,10 @@ class FileName(Enum):
     """
     GLOBAL = 'global.json'
     FRIENDS = 'friends.json'
+    GATEWAY = 'gateway.json'
+    PINS = 'pins.json'
+    IDENTITY_CERT = 'identity.crt'
+    IDENTITY_KEY = 'identity.key'
 
 
 def write_to_data_file(data_type: DataType, file_name: FileName, obj: Any, append_mode: bool):
@@ -40,6 +49,7 @@ def write_to_data_file(data_type: DataType, file_name: FileName, obj: Any, appen
 
     try:
         file_path = get_file_path(data_type, file_name)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
         with open(file_path, 'ab' if append_mode else 'wb') as file:
             pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
     except OSError as err:
@@ -56,6 +66,7 @@ def write_list_to_data_file(data_type: DataType, file_name: FileName, obj_list:
     file_path = get_file_path(data_type, file_name)
 
     try:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
         with open(file_path, 'wb') as file:
             for obj in obj_list:
                 pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
@@ -73,6 +84,24 @@ def get_user_account_data() -> Optional[Account]:
     return json_data
 
 
+def get_cached_gateway() -> Optional[Any]:
+    """
+    Deserializes the last discovered UPnP gateway
+    :return: a Gateway object, if one was previously cached
+    """
+
+    return _get_data_from_file(DataType.CACHE, FileName.GATEWAY)
+
+
+def get_pinned_identities() -> Dict[str, str]:
+    """
+    Deserializes the identities pinned for known hosts
+    :return: a mapping of 'host:port' to the fingerprint of the certificate it first presented
+    """
+
+    return _get_data_from_file(DataType.USER, FileName.PINS) or dict()
+
+
 def get_friends() -> List[Peer]:
     """
     Converts a JSON file to it's respective list of objects
@@ -0,0 +1,323 @@
+"""
+Lightweight runtime metrics: counters, gauges and HDR-style latency histograms
+Recording never takes a lock, every thread updates its own cells and snapshots sum them
+Snapshots are exported in the Prometheus text format, to a file or a local-only HTTP / Unix socket endpoint
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from Uchat.helper.error import print_err
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _ThreadCells:
+    """
+    Per-thread storage of a metric's values, so recording never contends on a lock
+    """
+
+    def __init__(self, width: int):
+        self.__width = width
+        self.__local = threading.local()
+        self.__all_cells: List[List[int]] = list()
+        self.__lock = threading.Lock()  # Only taken the first time a thread records
+
+    def cells(self) -> List[int]:
+        try:
+            return self.__local.cells
+        except AttributeError:
+            cells = [0] * self.__width
+            with self.__lock:
+                self.__all_cells.append(cells)
+            self.__local.cells = cells
+            return cells
+
+    def totals(self) -> List[int]:
+        with self.__lock:
+            all_cells = list(self.__all_cells)
+        return [sum(column) for column in zip(*all_cells)] if all_cells else [0] * self.__width
+
+
+class Counter:
+    """
+    Monotonically increasing count, ex. bytes sent
+    """
+
+    def __init__(self, name: str, help_txt: str, labels: Labels):
+        self.name, self.help, self.labels = name, help_txt, labels
+        self.__cells = _ThreadCells(1)
+
+    def inc(self, amount: int = 1):
+        self.__cells.cells()[0] += amount
+
+    def value(self) -> int:
+        return self.__cells.totals()[0]
+
+
+class Gauge:
+    """
+    Value that goes up and down, ex. number of open conversations
+    """
+
+    def __init__(self, name: str, help_txt: str, labels: Labels):
+        self.name, self.help, self.labels = name, help_txt, labels
+        self.__value = 0
+
+    def set(self, value: float):
+        self.__value = value
+
+    def value(self) -> float:
+        return self.__value
+
+
+class Histogram:
+    """
+    Log-linear histogram in the style of HdrHistogram
+    Each power of two is split into 2 ** SUB_BITS linear buckets, bounding the relative error of any quantile
+    """
+
+    SUB_BITS = 4  # 16 buckets per power of two, ~6% worst case relative error
+    MAX_EXPONENT = 40  # Values up to 2 ** 40 units (~18 minutes, in microseconds)
+
+    def __init__(self, name: str, help_txt: str, labels: Labels, unit_scale: float = 1e-6):
+        """
+        :param unit_scale: Size of one recorded unit, in the exported unit (defaults to microseconds as seconds)
+        """
+        self.name, self.help, self.labels = name, help_txt, labels
+        self.unit_scale = unit_scale
+        self.__sub_count = 1 << self.SUB_BITS
+        self.__bucket_count = (self.MAX_EXPONENT + 1) * self.__sub_count
+        # Cells hold every bucket, then the count and the sum of recorded values
+        self.__cells = _ThreadCells(self.__bucket_count + 2)
+
+    def _index(self, value: int) -> int:
+        if value < 2 * self.__sub_count:
+            return value
+
+        # Keep the top SUB_BITS + 1 bits of the value, the first of which is always set
+        shift = value.bit_length() - self.SUB_BITS - 1
+        index = (shift + 1) * self.__sub_count + (value >> shift) - self.__sub_count
+        return min(index, self.__bucket_count - 1)
+
+    def _lower_bound(self, index: int) -> int:
+        if index < 2 * self.__sub_count:
+            return index
+
+        shift, sub = divmod(index, self.__sub_count)
+        return (sub + self.__sub_count) << (shift - 1)
+
+    def record(self, value: float):
+        """
+        :param value: Observation, in recorded units
+        """
+        value = max(0, int(value))
+        cells = self.__cells.cells()
+        cells[self._index(value)] += 1
+        cells[-2] += 1
+        cells[-1] += value
+
+    def time(self) -> '_Timer':
+        """
+        :return: a context manager recording the elapsed microseconds of its body
+        """
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], int, int]:
+        """
+        :return: bucket counts, total count and sum of recorded values
+        """
+        totals = self.__cells.totals()
+        return totals[:-2], totals[-2], totals[-1]
+
+    def quantile(self, q: float, snapshot: Optional[Tuple[List[int], int, int]] = None) -> float:
+        """
+        :param q: Quantile between 0 and 1
+        :return: the approximate value at quantile q, in recorded units
+        """
+        buckets, count, _ = snapshot or self.snapshot()
+        if not count:
+            return 0
+
+        target = q * count
+        seen = 0
+        for index, bucket in enumerate(buckets):
+            seen += bucket
+            if bucket and seen >= target:
+                return self._lower_bound(index)
+        return self._lower_bound(len(buckets) - 1)
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self.__histogram = histogram
+        self.__start = 0
+
+    def __enter__(self):
+        self.__start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__histogram.record((time.perf_counter_ns() - self.__start) // 1000)
+
+
+class MetricsRegistry:
+    """
+    Holds every metric of the process, keyed by name and labels
+    """
+
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self):
+        self.__metrics: Dict[Tuple[str, Labels], object] = dict()
+        self.__lock = threading.Lock()
+
+    def __get(self, kind: type, name: str, help_txt: str, labels: Dict[str, str], **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+
+        if (metric := self.__metrics.get(key)) is None:
+            with self.__lock:
+                if (metric := self.__metrics.get(key)) is None:
+                    metric = kind(name, help_txt, key[1], **kwargs)
+                    self.__metrics[key] = metric
+        return metric
+
+    def counter(self, name: str, help_txt: str = '', **labels: str) -> Counter:
+        return self.__get(Counter, name, help_txt, labels)
+
+    def gauge(self, name: str, help_txt: str = '', **labels: str) -> Gauge:
+        return self.__get(Gauge, name, help_txt, labels)
+
+    def histogram(self, name: str, help_txt: str = '', unit_scale: float = 1e-6, **labels: str) -> Histogram:
+        return self.__get(Histogram, name, help_txt, labels, unit_scale=unit_scale)
+
+    def to_prometheus(self) -> str:
+        """
+        :return: a snapshot of every metric, in the Prometheus text exposition format
+        """
+        with self.__lock:
+            metrics = sorted(self.__metrics.values(), key=lambda m: (m.name, m.labels))
+
+        lines = list()
+        described = set()
+
+        for metric in metrics:
+            if metric.name not in described:
+                kind = {Counter: 'counter', Gauge: 'gauge', Histogram: 'summary'}[type(metric)]
+                lines.append('# HELP {} {}'.format(metric.name, metric.help))
+                lines.append('# TYPE {} {}'.format(metric.name, kind))
+                described.add(metric.name)
+
+            if isinstance(metric, Histogram):
+                snapshot = metric.snapshot()
+                for q in self.QUANTILES:
+                    labels = metric.labels + (('quantile', str(q)),)
+                    lines.append('{}{} {}'.format(metric.name, _format_labels(labels),
+                                                  metric.quantile(q, snapshot) * metric.unit_scale))
+                lines.append('{}_sum{} {}'.format(metric.name, _format_labels(metric.labels),
+                                                  snapshot[2] * metric.unit_scale))
+                lines.append('{}_count{} {}'.format(metric.name, _format_labels(metric.labels), snapshot[1]))
+            else:
+                lines.append('{}{} {}'.format(metric.name, _format_labels(metric.labels), metric.value()))
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, file_path: str):
+        """
+        Writes a snapshot to file_path, atomically replacing any previous snapshot
+        """
+        temp_path = '{}.tmp'.format(file_path)
+        try:
+            with open(temp_path, 'w') as file:
+                file.write(self.to_prometheus())
+            os.replace(temp_path, file_path)
+        except OSError as err:
+            print_err(1, "Unable to write metrics snapshot\n" + repr(err))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, value.replace('"', '\\"')) for key, value in labels) + '}'
+
+
+REGISTRY = MetricsRegistry()  # Process-wide registry
+
+
+def counter(name: str, help_txt: str = '', **labels: str) -> Counter:
+    return REGISTRY.counter(name, help_txt, **labels)
+
+
+def gauge(name: str, help_txt: str = '', **labels: str) -> Gauge:
+    return REGISTRY.gauge(name, help_txt, **labels)
+
+
+def histogram(name: str, help_txt: str = '', unit_scale: float = 1e-6, **labels: str) -> Histogram:
+    return REGISTRY.histogram(name, help_txt, unit_scale, **labels)
+
+
+def start_exporter(spec: str) -> Optional['socketserver.BaseServer']:
+    """
+    Serves snapshots on demand, on a background thread
+    :param spec: 'http://127.0.0.1:<port>' for a loopback HTTP endpoint, or 'unix:<path>' for a Unix socket
+    :return: the running server, or None if spec was invalid
+    """
+    # Deferred, the servers are only loaded when metrics are exported
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Scrapes are not worth logging
+
+    class UnixMetricsHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(REGISTRY.to_prometheus().encode())
+
+    try:
+        if spec.startswith('unix:'):
+            path = spec[len('unix:'):]
+            if os.path.exists(path):
+                os.unlink(path)
+            server = socketserver.UnixStreamServer(path, UnixMetricsHandler)
+        else:
+            host, port = spec.replace('http://', '').rstrip('/').rsplit(':', 1)
+            if host not in ('127.0.0.1', 'localhost', '::1'):
+                # Metrics reveal who the user talks to, never expose them beyond this host
+                print_err(4, "Refusing to export metrics on non-loopback address {}".format(host))
+                return None
+            server = HTTPServer((host, int(port)), MetricsHandler)
+    except (OSError, ValueError, AttributeError) as err:
+        print_err(2, "Unable to start metrics exporter on {}\n".format(spec) + str(err))
+        return None
+
+    thread = threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True)
+    thread.start()
+    return server
+
+
+def export_on_demand(spec: str):
+    """
+    Sets up exporting of snapshots, as configured by the user
+    :param spec: An endpoint understood by start_exporter, or a file path that snapshots are written to on SIGUSR1
+    and when the application exits
+    """
+    if spec.startswith(('http://', 'unix:')):
+        start_exporter(spec)
+        return
+
+    import atexit
+    import signal
+
+    atexit.register(REGISTRY.dump, spec)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: REGISTRY.dump(spec))
@@ -0,0 +1,211 @@
+"""
+Switchable, built-in profiling of the network and UI hot paths
+Timing mode records the wall time of every call to a profiled section, sampling mode periodically captures every
+thread's stack and aggregates them as collapsed stacks, the input format of flamegraph.pl and speedscope
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from Uchat.helper import metrics
+from Uchat.helper.globals import PROFILE_SAMPLE_INTERVAL
+from Uchat.helper.log import get_logger
+
+_log = get_logger('profiler')
+
+_timing = False  # Read on every profiled call, kept as a plain global so a disabled check stays cheap
+_sections: Dict[str, metrics.Histogram] = dict()
+_sampler: Optional['StackSampler'] = None
+_last_samples = ''  # Collapsed stacks of the last stopped sampler, still available to dump
+
+
+class _NullSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+def _histogram(name: str) -> metrics.Histogram:
+    if (histogram := _sections.get(name)) is None:
+        histogram = metrics.histogram('uchat_profile_seconds', 'Wall time of profiled sections', section=name)
+        _sections[name] = histogram
+    return histogram
+
+
+def section(name: str):
+    """
+    :param name: Name the section's timings are recorded under
+    :return: a context manager timing its body while timing is enabled, or a shared no-op one otherwise
+    """
+    return _histogram(name).time() if _timing else _NULL_SECTION
+
+
+def profiled(name: str) -> Callable:
+    """
+    Decorates a function, timing each of its calls while timing is enabled
+    :param name: Name the function's timings are recorded under
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _timing:
+                return func(*args, **kwargs)
+
+            with _histogram(name).time():
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class StackSampler:
+    """
+    Samples the stacks of every other thread at a fixed interval, from a daemon thread
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.__interval = interval
+        self.__stacks: StackCounter = StackCounter()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        own_id = threading.get_ident()
+
+        while not self.__stop.wait(self.__interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples = list()
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = list()
+                while frame:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(Path(code.co_filename).stem, code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                samples.append(';'.join(reversed(stack)))
+
+            with self.__lock:
+                self.__stacks.update(samples)
+
+    def collapsed(self) -> str:
+        """
+        :return: every sampled stack and its count, one per line, root first
+        """
+        with self.__lock:
+            stacks = sorted(self.__stacks.items())
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in stacks)
+
+
+def is_timing() -> bool:
+    return _timing
+
+
+def set_timing(enabled: bool):
+    global _timing
+    _timing = enabled
+    _log.info('Section timing %s', 'enabled' if enabled else 'disabled')
+
+
+def is_sampling() -> bool:
+    return _sampler is not None
+
+
+def set_sampling(enabled: bool):
+    """
+    Starts or stops the stack sampler, samples collected so far are kept until the next start
+    """
+    global _sampler, _last_samples
+
+    if enabled and not _sampler:
+        _sampler = StackSampler()
+        _sampler.start()
+    elif not enabled and _sampler:
+        _sampler.stop()
+        _last_samples = _sampler.collapsed()
+        _sampler = None
+    _log.info('Stack sampling %s', 'enabled' if enabled else 'disabled')
+
+
+def timings_report() -> str:
+    """
+    :return: a table of each profiled section's call count and wall time
+    """
+    lines = ['{:<28} {:>9} {:>10} {:>10} {:>10}'.format('section', 'calls', 'total ms', 'p50 us', 'p99 us')]
+
+    for name, histogram in sorted(_sections.items()):
+        snapshot = histogram.snapshot()
+        lines.append('{:<28} {:>9} {:>10.1f} {:>10} {:>10}'.format(name, snapshot[1], snapshot[2] / 1000,
+                                                                   histogram.quantile(0.5, snapshot),
+                                                                   histogram.quantile(0.99, snapshot)))
+    return '\n'.join(lines) + '\n'
+
+
+def dump_profile(directory: str = 'data/logs') -> List[str]:
+    """
+    Writes the timings report, and any sampled stacks, to timestamped files
+    :param directory: Folder to write to
+    :return: paths of the files written
+    """
+    prefix = Path(directory) / 'profile-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+    written = list()
+
+    try:
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+
+        timings_path = prefix.with_suffix('.txt')
+        timings_path.write_text(timings_report())
+        written.append(str(timings_path))
+
+        if stacks := _sampler.collapsed() if _sampler else _last_samples:
+            stacks_path = prefix.with_suffix('.folded')
+            stacks_path.write_text(stacks)
+            written.append(str(stacks_path))
+    except OSError as err:
+        _log.error('Unable to write profile: %r', err)
+
+    _log.info('Profile written to %s', ', '.join(written))
+    return written
+
+
+def configure(spec: str):
+    """
+    Enables profiling as configured by the user, dumping the profile on SIGUSR2 and when the application exits
+    :param spec: Comma separated modes, 'timing' and / or 'sample', or 'all'
+    """
+    modes = {mode.strip().lower() for mode in spec.split(',')}
+
+    if modes & {'timing', 'all'}:
+        set_timing(True)
+    if modes & {'sample', 'all'}:
+        set_sampling(True)
+
+    import atexit
+    import signal
+
+    atexit.register(dump_profile)
+    if hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, lambda signum, frame: dump_profile())
@@ -5,6 +5,7 @@ class Account:
     """
     Used to store the information associated with the user, specifically the data stored in data/user/global
     """
+    __avatar = ''  # Accounts created before avatars were chosen have none
 
     def __init__(self, username: str = '', hex_code: str = '', allows_UPnP: bool = False):
         self.__username = username
@@ -21,6 +22,11 @@ class Account:
             self.__hex_code = new_hex
         return self.__hex_code
 
+    def avatar(self, new_avatar: Optional[str] = None) -> str:
+        if new_avatar:
+            self.__avatar = new_avatar
+        return self.__avatar
+
     def upnp(self, new_status: Optional[bool] = None) -> bool:
         if new_status is not None:
             self.__allows_UPnP = new_status
@@ -0,0 +1,77 @@
+"""
+Avatars stored under the hash of their bytes, so each is kept once however many peers show it
+Peers name their avatar by hash alone, its bytes are only sent to those that don't already store them
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import AVATAR_MAX_BYTES
+from Uchat.helper.logger import DataType, get_file_path
+
+
+def avatar_digest(data: bytes) -> str:
+    """
+    :return: the hash an avatar is stored and named under, as hex
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def avatar_path(digest: str) -> Path:
+    """
+    :return: where the avatar with this hash is stored, the format is read from its bytes when decoded
+    """
+    return get_file_path(DataType.AVATARS, file_name_str=digest)
+
+
+def variant_path(digest: str, size: int) -> Path:
+    """
+    :return: where the avatar with this hash is kept scaled to be shown size pixels across
+    """
+    return get_file_path(DataType.AVATARS, file_name_str='{}-{}.png'.format(digest, size))
+
+
+def has_avatar(digest: str) -> bool:
+    return bool(digest) and avatar_path(digest).exists()
+
+
+def store_avatar(data: bytes, digest: Optional[str] = None) -> Optional[str]:
+    """
+    Stores an avatar under its hash, written aside then moved into place, so it's never found half written
+    :param digest: Hash the avatar was named by, its bytes are checked against it
+    :return: the avatar's hash, None if it wasn't stored
+    """
+    if len(data) > AVATAR_MAX_BYTES:
+        print_err(4, "An avatar of {} bytes is larger than the {} it may be".format(len(data), AVATAR_MAX_BYTES))
+        return None
+    if digest and avatar_digest(data) != digest:
+        print_err(3, "Avatar doesn't match the hash {} it was named by".format(digest))
+        return None
+
+    digest = digest or avatar_digest(data)
+    path = avatar_path(digest)
+    if path.exists():
+        return digest
+
+    partial = path.with_suffix('.partial')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial.write_bytes(data)
+        os.replace(partial, path)
+        return digest
+    except OSError as err:
+        print_err(1, "Unable to store avatar {}\n".format(path) + repr(err))
+        return None
+
+
+def load_avatar(digest: str) -> Optional[bytes]:
+    """
+    :return: the bytes of the avatar stored under digest, None if none is
+    """
+    try:
+        return avatar_path(digest).read_bytes()
+    except OSError as err:
+        print_err(1, "Unable to read avatar {}\n".format(digest) + repr(err))
+        return None
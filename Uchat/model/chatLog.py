@@ -0,0 +1,236 @@
+"""
+Chat messages of a conversation, held in memory up to a budget, per conversation and across every conversation
+Past it, the oldest messages are spilled to an anonymous segment file on disk, and read back a page at a time when asked
+for, as when a view scrolls back to them. A message keeps its index wherever it is held, so views never notice
+"""
+import pickle
+import sys
+import tempfile
+import threading
+import weakref
+from array import array
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterator, List, Optional, Union
+
+from Uchat.MessageContext import MessageContext, DeliveryState
+from Uchat.helper import metrics
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import CONVERSATION_MEMORY_BUDGET, MEMORY_BUDGET, CHAT_LOG_PAGE, CHAT_LOG_CACHED_PAGES, \
+    ACK_WINDOW
+from Uchat.helper.log import get_logger
+
+_log = get_logger('model.chat_log')
+_resident = metrics.gauge('uchat_chat_log_resident_bytes', 'Estimated bytes of chat messages held in memory')
+_spilled = metrics.counter('uchat_chat_log_spilled_total', 'Chat messages spilled to disk, over a memory budget')
+_pages_read = metrics.counter('uchat_chat_log_pages_read_total', 'Pages of spilled chat messages read back from disk')
+
+_CONTEXT_BYTES = 320  # Estimated bytes of a message context and its chat message, besides the text
+_SPILL_TO = 0.75  # Share of a budget memory is brought down to once over it, so each message isn't spilled on its own
+_DELIVERY = [None] + list(DeliveryState)  # Delivery states of spilled messages, by the byte they are recorded as
+
+_logs = weakref.WeakSet()  # Every chat log, so the global budget is shared between them
+_logs_bytes = 0  # Estimated bytes every log holds in memory together, kept as they append and spill
+_logs_lock = threading.Lock()  # Guards both, never held while a log's lock is taken
+
+
+class ChatLog:
+    """
+    Sequence of message contexts, the newest in memory and the oldest spilled to disk once over budget
+    Messages whose delivery may still change stay in memory after being spilled, so they're found when it does
+    Appended to by the network thread and read by views, from the UI thread
+    """
+
+    def __init__(self, budget: int = CONVERSATION_MEMORY_BUDGET):
+        """
+        :param budget: Bytes of messages this log keeps in memory, beyond which the oldest are spilled
+        """
+        self.__budget = budget
+        self.__lock = threading.RLock()
+        self.__resident: Deque[MessageContext] = deque()  # Messages from index base on, oldest first
+        self.__sizes: Deque[int] = deque()  # Estimated bytes of each resident message
+        self.__bytes = 0
+        self.__base = 0  # Index of the oldest resident message, those before it are spilled
+
+        self.__segment = None  # Temporary file spilled messages are appended to, made on first spill
+        self.__offsets = array('Q', [0])  # Where each spilled message's record starts in the segment, then the end
+        self.__deliveries = bytearray()  # Delivery of each spilled message, updated should it change after spilling
+        self.__pinned: Dict[int, MessageContext] = OrderedDict()  # Index -> spilled message still in flight
+        self.__pages: Dict[int, List[MessageContext]] = OrderedDict()  # Page number -> messages read back, LRU
+
+        with _logs_lock:
+            _logs.add(self)
+
+    def append(self, context: MessageContext):
+        size = sys.getsizeof(context.msg.message) + _CONTEXT_BYTES
+        with self.__lock:
+            self.__resident.append(context)
+            self.__sizes.append(size)
+            self.__bytes += size
+            _resize(size)
+            if self.__bytes > self.__budget:
+                self.__spill(int(self.__budget * _SPILL_TO))
+        if _logs_bytes > MEMORY_BUDGET:
+            _enforce_global_budget()
+
+    def __del__(self):
+        _resize(-self.__bytes)  # Its messages are let go of with it
+
+    def delivery_changed(self, context: MessageContext) -> Optional[int]:
+        """
+        Records a change to the delivery of a message this user wrote
+        :return: the message's index, None if it was spilled and let go of since
+        """
+        with self.__lock:
+            # Recent messages are searched first, those are the ones whose delivery changes
+            for offset in range(len(self.__resident) - 1, -1, -1):
+                if self.__resident[offset] is context:
+                    return self.__base + offset
+
+            for index, pinned in self.__pinned.items():
+                if pinned is context:
+                    self.__deliveries[index] = _DELIVERY.index(context.delivery)
+                    if context.delivery is DeliveryState.DELIVERED:
+                        del self.__pinned[index]
+                    self.__pages.pop(index // CHAT_LOG_PAGE, None)
+                    return index
+        return None
+
+    def live(self) -> List[MessageContext]:
+        """
+        :return: the messages held in memory, without reading back those spilled
+        """
+        with self.__lock:
+            return list(self.__pinned.values()) + list(self.__resident)
+
+    def spill(self, target: int):
+        """
+        Spills the oldest messages, until at most target bytes of them are held in memory
+        """
+        with self.__lock:
+            self.__spill(target)
+
+    def __spill(self, target: int):
+        records = list()
+        count = 0
+        remaining = self.__bytes
+        while remaining > target and count < len(self.__resident):
+            records.append(pickle.dumps(self.__resident[count], pickle.HIGHEST_PROTOCOL))
+            remaining -= self.__sizes[count]
+            count += 1
+        if not count:
+            return
+
+        try:
+            if not self.__segment:
+                self.__segment = tempfile.TemporaryFile(prefix='uchat-', suffix='.segment')
+            self.__segment.seek(self.__offsets[-1])
+            self.__segment.write(b''.join(records))
+        except OSError as err:
+            print_err(1, "Unable to spill chat messages to disk\n" + repr(err))
+            self.__budget = sys.maxsize  # Kept in memory from now on
+            return
+
+        self.__pages.pop(self.__base // CHAT_LOG_PAGE, None)  # Partly spilled page, read back short
+        freed = 0
+        for record in records:
+            context = self.__resident.popleft()
+            freed += self.__sizes.popleft()
+            self.__offsets.append(self.__offsets[-1] + len(record))
+            self.__deliveries.append(_DELIVERY.index(context.delivery))
+            if context.delivery not in (None, DeliveryState.DELIVERED):
+                self.__pinned[self.__base] = context
+            self.__base += 1
+        self.__bytes -= freed
+        _resize(-freed)
+
+        while len(self.__pinned) > ACK_WINDOW:
+            self.__pinned.popitem(last=False)  # Stuck in flight, its delivery is shown as last recorded
+        _spilled.inc(count)
+        _log.debug('Spilled %d chat messages, %d held in memory', count, len(self.__resident))
+
+    def __page(self, page: int) -> List[MessageContext]:
+        """
+        :return: the spilled messages of a page, read back from the segment unless recently read
+        """
+        if (contexts := self.__pages.get(page)) is not None:
+            self.__pages.move_to_end(page)
+            return contexts
+
+        start = page * CHAT_LOG_PAGE
+        end = min(start + CHAT_LOG_PAGE, self.__base)
+        self.__segment.seek(self.__offsets[start])
+        data = self.__segment.read(self.__offsets[end] - self.__offsets[start])
+        _pages_read.inc()
+
+        contexts = list()
+        for index in range(start, end):
+            context = pickle.loads(data[self.__offsets[index] - self.__offsets[start]:
+                                        self.__offsets[index + 1] - self.__offsets[start]])
+            context.delivery = _DELIVERY[self.__deliveries[index]]
+            contexts.append(context)
+
+        self.__pages[page] = contexts
+        if len(self.__pages) > CHAT_LOG_CACHED_PAGES:
+            self.__pages.popitem(last=False)
+        return contexts
+
+    # Sequence
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__base + len(self.__resident)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[MessageContext, List[MessageContext]]:
+        with self.__lock:
+            if isinstance(index, slice):
+                return [self[i] for i in range(*index.indices(len(self)))]
+            if index < 0:
+                index += self.__base + len(self.__resident)
+            if index >= self.__base:
+                return self.__resident[index - self.__base]
+            if index < 0:
+                raise IndexError('chat log index out of range')
+            if pinned := self.__pinned.get(index):
+                return pinned
+            return self.__page(index // CHAT_LOG_PAGE)[index % CHAT_LOG_PAGE]
+
+    def __iter__(self) -> Iterator[MessageContext]:
+        for index in range(len(self)):
+            yield self[index]
+
+    # Getters
+
+    def resident_bytes(self) -> int:
+        return self.__bytes
+
+    def spilled(self) -> int:
+        """
+        :return: messages spilled to disk
+        """
+        return self.__base
+
+
+def _resize(change: int):
+    """
+    Adds to the bytes every log holds in memory together
+    """
+    global _logs_bytes
+
+    with _logs_lock:
+        _logs_bytes += change
+        _resident.set(_logs_bytes)
+
+
+def _enforce_global_budget():
+    """
+    Spills from the logs holding the most, until every log together is back within the global budget
+    Called without any log's lock held, so logs are only ever locked one at a time
+    """
+    with _logs_lock:
+        logs = list(_logs)
+
+    target = int(MEMORY_BUDGET * _SPILL_TO)
+    for log in sorted(logs, key=lambda l: l.resident_bytes(), reverse=True):
+        if _logs_bytes <= target:
+            break
+        log.spill(max(0, log.resident_bytes() - (_logs_bytes - target)))
@@ -1,76 +1,81 @@
-from enum import Enum
-from typing import List, Set, Tuple
-
+import threading
+from collections import deque
+from typing import List, FrozenSet, Tuple, Optional, Deque
+
+from Uchat.MessageContext import MessageContext, DeliveryState
+from Uchat.helper.globals import ACK_WINDOW
+from Uchat.model.chatLog import ChatLog
+from Uchat.model.conversationFsm import ConversationState, EXPECTED_TYPES, transition_key, next_state
+from Uchat.network.messages.message import MessageType, ChatMessage
 from Uchat.network.tcp import TcpSocket
-from Uchat.ui.delegate import profilePhotoPixmap
-from typing import Optional, Any
-from PyQt5.QtCore import QObject, QAbstractListModel, QModelIndex, QVariant, Qt
-
-from Uchat.MessageContext import MessageContext
-from Uchat.network.messages.message import FarewellMessage, GreetingMessage, MessageType, ChatMessage
 from Uchat.peer import Peer
 
 
-class ConversationState(Enum):
+class ConversationListener:
     """
-    If viewing a conversation as a Finite State Automata, this would be it's current state
-    See docs for the respective FSM for reference
+    Interface for observing a conversation, all methods are optional
+    Called from whichever thread adds the message, usually the network thread
     """
-    INACTIVE = 0  # Newly created conversation, no action has been taken by any participant
-    AWAIT = 1  # A user has sent it's peer a greeting that has not yet been responded to
-    ACTIVE = 2  # The requesting client ('requester') has received a conversation acceptance request, can now chat
-    CLOSED = 3  # The conversation is permanently closed, whether to declination or a participant leaving after chatting
+
+    def chat_message_will_be_added(self, conversation: 'Conversation', index: int):
+        """
+        A chat message is about to be inserted at index
+        """
+
+    def chat_message_added(self, conversation: 'Conversation', index: int):
+        """
+        A chat message was inserted at index
+        """
+
+    def state_changed(self, conversation: 'Conversation', old_state: ConversationState):
+        """
+        The conversation moved from old_state to its current state
+        """
+
+    def delivery_changed(self, conversation: 'Conversation', index: int):
+        """
+        The chat message at index, written by this user, got further towards the peer
+        """
 
 
-class Conversation(QAbstractListModel):
+class Conversation:
     """
     A conversation is held between two or more clients. A client can be engaged in multiple, simultaneous conversations.
     Responsible for tracking messages sent during current conversation, it's participants, and it's status
     """
 
-    def __init__(self, parent: Optional[QObject], personal: Peer, peer: Peer, sock: Optional[TcpSocket]):
+    def __init__(self, personal: Peer, peer: Peer, sock: Optional[TcpSocket]):
         """
-        :param parent: Parent of object\
+        :param personal: Peer information pertaining to this user
+        :param peer: Peer this conversation is held with
         :param sock: TCPSocket used for full-duplex communication in this conversation
         """
-        super().__init__(parent)
-
         self._state: ConversationState = ConversationState.INACTIVE
-        self.__ctrl_messages: List[MessageContext] = list()  # Tracks every non-chat message part of conversation
-        self.__chat_messages: List[MessageContext] = list()  # Tracks every chat message part of conversation
+        self.__chat_messages = ChatLog()  # Tracks every chat message part of conversation, the oldest spilled to disk
+
+        # Control messages are compacted to who greeted first and the state changes they caused
+        self.__started_by_personal: Optional[bool] = None
+        self.__transitions: List[Tuple[ConversationState, bool]] = list()  # New state, whether this user caused it
+        self.__listeners: List[ConversationListener] = list()
 
         # TCP Socket used for communicating in this conversation, full-duplex
         self.__comm_sock: Optional[TcpSocket] = sock
         self.__personal = personal
         self.__peer = peer
 
-    # Model overrides
-    def rowCount(self, parent: QModelIndex = ...) -> int:
-        """
-        Display as many rows as there are chat messages in list of messages
-        :param parent:
-        :return:
-        """
-        rows = len(self.__chat_messages)
-        return rows
+        # Chats are numbered in each direction, and acknowledged cumulatively, guarded as both threads send
+        self.__delivery_lock = threading.Lock()
+        self.__next_seq = 1
+        self.__unacked: Deque[Tuple[int, MessageContext]] = deque()  # Sent chats awaiting acknowledgement, in order
+        self.__received = 0  # Every chat up to this sequence number was received
+        self.__owed_acks = 0  # Chats received since the peer was last sent an acknowledgement
 
-    def data(self, index: QModelIndex, role: int = ...) -> Any:
-        if not index.isValid() or index.row() >= len(self.__chat_messages):
-            return QVariant()
+    def add_listener(self, listener: ConversationListener):
+        self.__listeners.append(listener)
 
-        context = self.__chat_messages[index.row()]
-
-        if role == Qt.DisplayRole:
-            # Message bubble view
-            return context.msg.message
-        elif role == Qt.DecorationRole:
-            # Profile photo view
-            sender = self.__personal if context.is_sender else self.__peer
-            username = sender.username()
-            color = sender.color()
-            return profilePhotoPixmap.build_pixmap(color, username)
-        else:
-            return QVariant()
+    def remove_listener(self, listener: ConversationListener):
+        if listener in self.__listeners:
+            self.__listeners.remove(listener)
 
     def add_message(self, context: MessageContext):
         """
@@ -81,42 +86,118 @@ class Conversation(QAbstractListModel):
         message = context.msg
 
         if isinstance(message, ChatMessage):
-            # UI should only be notified to update with chat messages
+            # Listeners should only be notified to update with chat messages
             insertion_idx = len(self.__chat_messages)
-            self.beginInsertRows(QModelIndex(), insertion_idx, insertion_idx)
+            for listener in self.__listeners:
+                listener.chat_message_will_be_added(self, insertion_idx)
             self.__chat_messages.append(context)
-            self.endInsertRows()
-        else:
-            # Handle all control messages
-            if isinstance(message, GreetingMessage):
-                if not message.wants_to_talk:
-                    self._state = ConversationState.CLOSED
-                else:
-                    # Only two variables remain, is_ack and sender
-                    if (not context.is_sender and message.ack) or (context.is_sender and message.ack):
-                        self._state = ConversationState.ACTIVE
-                    elif context.is_sender and not message.ack:
-                        self._state = ConversationState.AWAIT
-                    else:
-                        self._state = ConversationState.INACTIVE
-            elif isinstance(message, FarewellMessage):
-                if self._state != ConversationState.ACTIVE:
-                    # Never started, so set to inactive
-                    self._state = ConversationState.INACTIVE
-                else:
-                    self._state = ConversationState.CLOSED
-
-            self.__ctrl_messages.append(context)
-
-    def expecting_types(self) -> Set[MessageType]:
-        if self._state is ConversationState.INACTIVE:
-            return {MessageType.GREETING}
-        elif self._state is ConversationState.AWAIT:
-            return {MessageType.GREETING}
-        elif self._state is ConversationState.ACTIVE:
-            return {MessageType.CHAT, MessageType.FAREWELL}
+            for listener in self.__listeners:
+                listener.chat_message_added(self, insertion_idx)
         else:
-            return set()
+            old_state = self._state
+            if message is not None:  # Frames that failed to decode leave the state as it was
+                self._state = next_state(transition_key(old_state, message, context.is_sender), self.__peer.username())
+
+            if self.__started_by_personal is None:
+                self.__started_by_personal = context.is_sender
+
+            if self._state is not old_state:
+                self.__transitions.append((self._state, context.is_sender))
+                for listener in self.__listeners:
+                    listener.state_changed(self, old_state)
+
+    # Delivery tracking
+
+    def number_chat(self, context: MessageContext):
+        """
+        Numbers a chat this user is sending, and has it acknowledge every chat received so far
+        Its delivery is tracked until acknowledged, for the most recent ACK_WINDOW chats
+        """
+        with self.__delivery_lock:
+            context.msg.seq = self.__next_seq
+            context.msg.ack = self.__received
+            self.__next_seq += 1
+            self.__owed_acks = 0
+
+            self.__unacked.append((context.msg.seq, context))
+            if len(self.__unacked) > ACK_WINDOW:
+                self.__unacked.popleft()  # The peer isn't acknowledging, stop tracking the oldest
+
+    def receive_chat(self, seq: int) -> bool:
+        """
+        Records the arrival of a numbered chat
+        :return: whether the chat is new, False for a copy of one already received
+        """
+        if not seq:
+            return True  # Unnumbered, neither deduplicated nor acknowledged
+
+        with self.__delivery_lock:
+            if seq <= self.__received:
+                return False
+            self.__received = seq  # Conversations run over ordered transports, anything skipped isn't coming
+            self.__owed_acks += 1
+            return True
+
+    def take_ack(self) -> int:
+        """
+        :return: sequence number to acknowledge the peer's chats up to, 0 if every received chat was acknowledged
+        """
+        with self.__delivery_lock:
+            if not self.__owed_acks:
+                return 0
+            self.__owed_acks = 0
+            return self.__received
+
+    def acknowledge(self, ack: int) -> int:
+        """
+        Marks every tracked chat up to a sequence number delivered
+        :return: chats newly acknowledged
+        """
+        delivered = list()
+        with self.__delivery_lock:
+            while self.__unacked and self.__unacked[0][0] <= ack:
+                delivered.append(self.__unacked.popleft()[1])
+
+        for context in delivered:
+            self.track_delivery(context, DeliveryState.DELIVERED)
+        return len(delivered)
+
+    def track_delivery(self, context: MessageContext, state: DeliveryState):
+        """
+        Records how far a chat this user wrote got, delivered chats stay delivered
+        """
+        if context.delivery is DeliveryState.DELIVERED or context.delivery is state:
+            return
+        context.delivery = state
+
+        if (index := self.__chat_messages.delivery_changed(context)) is not None:
+            for listener in self.__listeners:
+                listener.delivery_changed(self, index)
+
+    def unacknowledged(self) -> List[MessageContext]:
+        """
+        :return: chats sent and tracked, but not yet acknowledged, oldest first
+        """
+        with self.__delivery_lock:
+            return [context for _, context in self.__unacked]
+
+    def owed_acks(self) -> int:
+        return self.__owed_acks
+
+    def started_by_personal(self) -> bool:
+        """
+        :return: whether this user greeted first, so the peer is known by the address it listens on
+        """
+        return bool(self.__started_by_personal)
+
+    def transitions(self) -> List[Tuple[ConversationState, bool]]:
+        """
+        :return: each state the conversation moved to, oldest first, with whether this user's message moved it there
+        """
+        return list(self.__transitions)
+
+    def expecting_types(self) -> FrozenSet[MessageType]:
+        return EXPECTED_TYPES[self._state]
 
     def state(self):
         return self._state
@@ -131,14 +212,14 @@ class Conversation(QAbstractListModel):
             self.__personal = new_personal
         return self.__personal
 
-    def chat_message_contexts(self) -> List[MessageContext]:
+    def chat_message_contexts(self) -> ChatLog:
         """
-        :return: the contexts contained in the tracked chat message list
+        :return: the contexts contained in the tracked chat message list, spilled ones are read back when indexed
         """
         return self.__chat_messages
 
     def connected_addr(self, addr: Optional[Tuple[str, int]] = None) -> (str, int):
-        return self.__chatting_peer.address(addr)
+        return self.__peer.address(addr)
 
     def sock(self, new_sock: Optional[TcpSocket] = None) -> Optional[TcpSocket]:
         if new_sock:
@@ -0,0 +1,114 @@
+"""
+The conversation protocol as a finite state automaton, see docs/messageTruthTable.pdf
+Every transition is precomputed into a table over (state, message type, ack, sender, wants_to_talk), and the types
+each state expects into frozen sets, so handling a message takes one lookup and allocates nothing
+"""
+import threading
+import time
+from collections import deque
+from enum import Enum
+from itertools import product
+from typing import Deque, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from Uchat.network.messages.message import Message, MessageType
+
+
+class ConversationState(Enum):
+    """
+    If viewing a conversation as a Finite State Automata, this would be it's current state
+    See docs for the respective FSM for reference
+    """
+    INACTIVE = 0  # Newly created conversation, no action has been taken by any participant
+    AWAIT = 1  # A user has sent it's peer a greeting that has not yet been responded to
+    ACTIVE = 2  # The requesting client ('requester') has received a conversation acceptance request, can now chat
+    CLOSED = 3  # The conversation is permanently closed, whether to declination or a participant leaving after chatting
+
+
+TransitionKey = Tuple[ConversationState, MessageType, bool, bool, bool]  # State, type, ack, sender, wants_to_talk
+
+
+class Transition(NamedTuple):
+    """
+    A transition taken, as recorded by the trace
+    """
+    time_stamp: float
+    peer: str
+    key: TransitionKey
+    new_state: ConversationState
+
+
+def _truth_table(state: ConversationState, m_type: MessageType, ack: bool, is_sender: bool,
+                 wants_to_talk: bool) -> ConversationState:
+    """
+    :return: the state a conversation moves to on a message, as the truth table has it
+    """
+    if m_type is MessageType.GREETING:
+        if not wants_to_talk:
+            return ConversationState.CLOSED
+        if ack:
+            return ConversationState.ACTIVE
+        return ConversationState.AWAIT if is_sender else ConversationState.INACTIVE
+    if m_type is MessageType.FAREWELL:
+        # Never started, so back to inactive
+        return ConversationState.CLOSED if state is ConversationState.ACTIVE else ConversationState.INACTIVE
+    return state  # Chats and the messages riding alongside them don't move the conversation
+
+
+TRANSITIONS: Dict[TransitionKey, ConversationState] = {
+    key: _truth_table(*key) for key in product(ConversationState, MessageType, (False, True), (False, True),
+                                               (False, True))
+}
+
+EXPECTED_TYPES: Dict[ConversationState, FrozenSet[MessageType]] = {
+    ConversationState.INACTIVE: frozenset({MessageType.GREETING}),
+    ConversationState.AWAIT: frozenset({MessageType.GREETING}),
+    ConversationState.ACTIVE: frozenset({MessageType.CHAT, MessageType.GROUP_CHAT, MessageType.FAREWELL,
+                                         MessageType.ACK, MessageType.SYNC, MessageType.HISTORY,
+                                         MessageType.IMAGE, MessageType.AVATAR, MessageType.AVATAR_REQUEST}),
+    ConversationState.CLOSED: frozenset()
+}
+
+_trace: Optional[Deque[Transition]] = None  # Most recent transitions taken by any conversation, when tracing
+_trace_lock = threading.Lock()
+
+
+def transition_key(state: ConversationState, message: Message, is_sender: bool) -> TransitionKey:
+    """
+    :return: the key of the transition a message takes, only greetings carry ack and wants_to_talk flags
+    """
+    if message.m_type is MessageType.GREETING:
+        return state, MessageType.GREETING, message.ack, is_sender, message.wants_to_talk
+    return state, message.m_type, False, is_sender, True
+
+
+def next_state(key: TransitionKey, peer: str = '') -> ConversationState:
+    """
+    :param peer: Who the conversation is held with, recorded by the trace
+    :return: the state the transition leads to
+    """
+    new_state = TRANSITIONS[key]
+    if _trace is not None:
+        with _trace_lock:
+            _trace.append(Transition(time.time(), peer, key, new_state))
+    return new_state
+
+
+def trace_transitions(size: int):
+    """
+    Records the most recent transitions taken, for debugging
+    :param size: Transitions kept, the oldest are dropped beyond it, 0 to stop tracing
+    """
+    global _trace
+    with _trace_lock:
+        _trace = deque(_trace or (), maxlen=size) if size > 0 else None
+
+
+def traced(peer: Optional[str] = None, last: Optional[int] = None) -> List[Transition]:
+    """
+    :param peer: Only return the transitions of the conversation with this user
+    :param last: Only return this many of the most recent transitions
+    :return: the transitions recorded, oldest first, empty if not tracing
+    """
+    with _trace_lock:
+        transitions = [transition for transition in _trace or () if peer is None or transition.peer == peer]
+    return transitions[-last:] if last else transitions
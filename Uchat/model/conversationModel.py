@@ -0,0 +1,97 @@
+"""
+Qt adapter exposing a headless conversation as a list model
+"""
+from typing import Optional, Any, Union
+
+from PyQt5.QtCore import QObject, QAbstractListModel, QModelIndex, QVariant, Qt
+
+from Uchat.helper.profiler import profiled
+from Uchat.model.chatLog import ChatLog
+from Uchat.model.conversation import Conversation, ConversationListener, DeliveryState
+from Uchat.model.groupConversation import GroupConversation
+from Uchat.peer import Peer
+from Uchat.ui.delegate import profilePhotoPixmap
+
+_DELIVERY_TIPS = {
+    DeliveryState.PENDING: 'Waiting to be sent',
+    DeliveryState.SENT: 'Sent',
+    DeliveryState.FAILED: 'Not sent',
+    DeliveryState.DELIVERED: 'Delivered'
+}
+
+
+class ConversationModel(QAbstractListModel, ConversationListener):
+    """
+    Presents the chat messages of a conversation to views, one row per message
+    """
+
+    def __init__(self, parent: Optional[QObject], conversation: Union[Conversation, GroupConversation]):
+        super().__init__(parent)
+
+        self.__conversation = conversation
+        self.__conversation.add_listener(self)
+
+    # Model overrides
+    def rowCount(self, parent: QModelIndex = ...) -> int:
+        """
+        Display as many rows as there are chat messages in list of messages
+        :param parent:
+        :return:
+        """
+        rows = len(self.__conversation.chat_message_contexts())
+        return rows
+
+    @profiled('conversation_model.data')
+    def data(self, index: QModelIndex, role: int = ...) -> Any:
+        contexts = self.__conversation.chat_message_contexts()
+
+        if not index.isValid() or index.row() >= len(contexts):
+            return QVariant()
+
+        context = contexts[index.row()]
+
+        if role == Qt.DisplayRole:
+            # Message bubble view
+            return context.msg.message
+        elif role == Qt.DecorationRole:
+            # Profile photo view
+            sender = context.sender  # Group timelines mix messages from several members
+            username = sender.username()
+            color = sender.color()
+            return profilePhotoPixmap.build_pixmap(color, username, avatar=sender.avatar())
+        elif role == Qt.TextAlignmentRole:
+            return Qt.AlignRight if context.is_sender else Qt.AlignLeft
+        elif role == Qt.ToolTipRole and context.is_sender and context.delivery:
+            return _DELIVERY_TIPS[context.delivery]
+        else:
+            return QVariant()
+
+    # Conversation listener
+    def chat_message_will_be_added(self, conversation: Conversation, index: int):
+        self.beginInsertRows(QModelIndex(), index, index)
+
+    def chat_message_added(self, conversation: Conversation, index: int):
+        self.endInsertRows()
+
+    def delivery_changed(self, conversation: Conversation, index: int):
+        model_index = self.index(index)
+        self.dataChanged.emit(model_index, model_index, [Qt.ToolTipRole])
+
+    # Getters
+    def conversation(self) -> Union[Conversation, GroupConversation]:
+        return self.__conversation
+
+    def peer(self) -> Peer:
+        return self.__conversation.peer()
+
+    def chat_message_contexts(self) -> ChatLog:
+        """
+        :return: the contexts contained in the conversation's chat message list
+        """
+        return self.__conversation.chat_message_contexts()
+
+    def detach(self):
+        """
+        Stops observing the conversation, to be called once the conversation is deleted
+        """
+        self.__conversation.remove_listener(self)
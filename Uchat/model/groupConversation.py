@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from typing import List, Dict, Optional, Set, Tuple
+
+from Uchat.MessageContext import MessageContext
+from Uchat.helper.globals import GROUP_TRACKED_MESSAGES, GOSSIP_SEEN_CACHE
+from Uchat.model.chatLog import ChatLog
+from Uchat.model.conversation import ConversationListener, ConversationState, DeliveryState
+from Uchat.peer import Peer
+
+
+class GroupConversation:
+    """
+    A conversation held between this client and several members, carried over the pairwise conversation held with each
+    Presents one merged timeline, under a pseudo-peer standing in for the whole group
+
+    Relayed groups spread the cost of large rooms, messages go to a few members who each forward them to a few more
+    Members then only need conversations with some of the others, and a seen-set drops messages arriving twice
+    The rest of a member's conversations are sent the message a moment later, unless they've sent it meanwhile
+    """
+
+    def __init__(self, personal: Peer, group_id: int, members: List[Peer], name: Optional[str] = None,
+                 relay_fanout: int = 0, started_by_personal: bool = True):
+        """
+        :param personal: Peer information pertaining to this user
+        :param group_id: Identifier shared by every member's copy of the group
+        :param members: Peers, other than this user, taking part
+        :param name: Name shown for the group, defaults to its members' usernames
+        :param relay_fanout: Members each message is first sent or forwarded to, 0 to send every message to every member
+        :param started_by_personal: Whether this user created the group, rather than joining on a member's message
+        """
+        self.__personal = personal
+        self.__group_id = group_id
+        self.__members: List[Peer] = list(members)
+        self.__chat_messages = ChatLog()
+        self.__listeners: List[ConversationListener] = list()
+        self.__next_message_id = 0
+        self.__relay_fanout = relay_fanout
+        self.__started_by_personal = started_by_personal
+        self.__frames_sent = 0  # Frames this user uploaded to members, its own messages and forwarded ones
+
+        # (Origin, message id) of recently received messages, oldest first, to drop copies arriving by other routes
+        # Each with the members known to hold it, having sent it here or been sent it
+        self.__seen: Dict[Tuple[int, int], Set[Peer]] = OrderedDict()
+        self.__origins: Dict[int, Peer] = dict()  # Origin id -> peer shown as the author of its messages
+
+        # Message id -> delivery state per member, only the most recent messages are tracked
+        self.__deliveries: Dict[int, Dict[Peer, DeliveryState]] = OrderedDict()
+
+        name = name or ', '.join(member.username() for member in self.__members)
+        self.__peer = Peer(('', 0), False, name)  # Pseudo-peer, identifies the group to views
+
+    def add_listener(self, listener: ConversationListener):
+        self.__listeners.append(listener)
+
+    def remove_listener(self, listener: ConversationListener):
+        if listener in self.__listeners:
+            self.__listeners.remove(listener)
+
+    def add_message(self, context: MessageContext):
+        """
+        Adds a chat message to the merged timeline
+        :param context: Message Context containing message and sender
+        """
+        insertion_idx = len(self.__chat_messages)
+        for listener in self.__listeners:
+            listener.chat_message_will_be_added(self, insertion_idx)
+        self.__chat_messages.append(context)
+        for listener in self.__listeners:
+            listener.chat_message_added(self, insertion_idx)
+
+    def add_member(self, member: Peer):
+        if member not in self.__members:
+            self.__members.append(member)
+
+    def remove_member(self, member: Peer):
+        if member in self.__members:
+            self.__members.remove(member)
+
+    def next_message_id(self) -> int:
+        self.__next_message_id += 1
+        return self.__next_message_id
+
+    def mark_seen(self, origin: int, message_id: int, holder: Optional[Peer] = None) -> bool:
+        """
+        Records that a message was received, forgetting the oldest once the seen-set is full
+        :param holder: Member known to hold the message, the one it came from or was sent to
+        :return: whether the message is new, False if it was already seen
+        """
+        key = (origin, message_id)
+        if (holders := self.__seen.get(key)) is not None:
+            if holder:
+                holders.add(holder)
+            return False
+
+        self.__seen[key] = {holder} if holder else set()
+        if len(self.__seen) > GOSSIP_SEEN_CACHE:
+            self.__seen.popitem(last=False)
+        return True
+
+    def holders(self, origin: int, message_id: int) -> Set[Peer]:
+        """
+        :return: members known to hold a recently seen message
+        """
+        return set(self.__seen.get((origin, message_id), ()))
+
+    def origin_peer(self, origin: int, name: str, sender: Peer, hops: int) -> Peer:
+        """
+        :param origin: Origin id of a received message
+        :param name: Username the origin signed the message with
+        :param sender: Member the message was received from
+        :param hops: Times the message was forwarded
+        :return: the peer to show as the message's author
+        """
+        if hops == 0:
+            # Received straight from its author
+            self.__origins[origin] = sender
+        elif origin not in self.__origins:
+            self.__origins[origin] = Peer(('', 0), False, name or 'member')
+        return self.__origins[origin]
+
+    def count_frames_sent(self, frames: int):
+        self.__frames_sent += frames
+
+    # Delivery tracking
+
+    def track_delivery(self, message_id: int, member: Peer, state: DeliveryState):
+        """
+        Records how far a message got towards a member
+        """
+        if message_id not in self.__deliveries:
+            self.__deliveries[message_id] = dict()
+            while len(self.__deliveries) > GROUP_TRACKED_MESSAGES:
+                self.__deliveries.popitem(last=False)
+
+        self.__deliveries[message_id][member] = state
+
+    def delivery(self, message_id: int) -> Dict[Peer, DeliveryState]:
+        """
+        :return: the delivery state of a message towards each member, empty if it is no longer tracked
+        """
+        return dict(self.__deliveries.get(message_id, dict()))
+
+    # Getters
+
+    def group_id(self) -> int:
+        return self.__group_id
+
+    def members(self) -> List[Peer]:
+        return list(self.__members)
+
+    def relay_fanout(self) -> int:
+        return self.__relay_fanout
+
+    def started_by_personal(self) -> bool:
+        """
+        :return: whether this user created the group, so it knows every member and relays between those who joined
+        """
+        return self.__started_by_personal
+
+    def frames_sent(self) -> int:
+        return self.__frames_sent
+
+    def state(self) -> ConversationState:
+        return ConversationState.ACTIVE if self.__members else ConversationState.CLOSED
+
+    def peer(self) -> Peer:
+        return self.__peer
+
+    def personal(self) -> Peer:
+        return self.__personal
+
+    def chat_message_contexts(self) -> ChatLog:
+        """
+        :return: the contexts of every member's chat messages, in the order they arrived
+        """
+        return self.__chat_messages
+
+    def sock(self) -> None:
+        return None  # Members are reached through their own conversations
+
+    def destroy(self):
+        self.__members.clear()
@@ -0,0 +1,168 @@
+"""
+Chats exchanged with a peer, kept across conversations so two histories can be reconciled after reconnecting
+Histories are compared by range fingerprints, ranges that match are dropped and those that differ are split, until
+they are small enough to list, so the cost of reconciling follows the size of the difference, not of the history
+"""
+import bisect
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from Uchat.helper.globals import HISTORY_MAX_AGE, HISTORY_MAX_MESSAGES, HISTORY_SYNC_IDS, HISTORY_SYNC_SPLIT
+from Uchat.network.messages.message import ChatMessage, SyncRange, SyncMode
+
+_MASK = 0xFFFFFFFFFFFFFFFF
+_END = _MASK  # Upper bound of the last range, above every message id
+_PRUNE_SLACK = 1.1  # Chats are kept this far past the bounds before pruning, so prefixes aren't recomputed for each
+
+
+def _mix(message_id: int) -> int:
+    """
+    Spreads a message id's bits, ids of messages written close together differ in few of them
+    """
+    z = (message_id + 0x9E3779B97F4A7C15) & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+
+class History:
+    """
+    Chats exchanged with one peer, ordered by message id, which orders them by when they were written
+    A range's fingerprint is the XOR of its messages' mixed ids, read from prefix XORs in constant time
+    Chats mostly arrive in order, so the prefixes are only recomputed past a chat that arrived late
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__ids: List[int] = list()  # Sorted
+        self.__entries: Dict[int, Tuple[ChatMessage, bool]] = dict()  # Message id -> chat, written by this user
+        self.__prefix: List[int] = [0]  # XOR of the first i mixed ids at i, computed up to its length
+
+    def add(self, chat: ChatMessage, personal: bool) -> bool:
+        """
+        Keeps a chat, unless it's older than histories are kept for
+        :param personal: Whether this user wrote it
+        :return: whether the chat is new, False if it was already held
+        """
+        with self.__lock:
+            if chat.message_id in self.__entries:
+                return False
+            if chat.message_id < self.__horizon():
+                return True  # New, but too old to be reconciled
+
+            index = bisect.bisect(self.__ids, chat.message_id)
+            self.__ids.insert(index, chat.message_id)
+            self.__entries[chat.message_id] = (chat, personal)
+            del self.__prefix[index + 1:]
+
+            if len(self.__ids) > HISTORY_MAX_MESSAGES * _PRUNE_SLACK or \
+                    self.__ids[0] < _id_at(time.time() - HISTORY_MAX_AGE * _PRUNE_SLACK):
+                self.__prune()
+            return True
+
+    def summary(self) -> SyncRange:
+        """
+        :return: the range a reconciliation starts with, every chat kept, as a single fingerprint
+        """
+        with self.__lock:
+            lower = self.__horizon()
+            return self.__fingerprint(lower, _END)
+
+    def reconcile(self, ranges: List[SyncRange]) -> Tuple[List[SyncRange], List[int]]:
+        """
+        Compares the peer's view of some ranges with this history's
+        :return: ranges to answer with, empty once the histories match, and ids of chats the peer is missing
+        """
+        replies = list()
+        missing = list()
+        with self.__lock:
+            horizon = self.__horizon()
+            for sync_range in ranges:
+                lower = max(sync_range.lower, horizon)
+                if lower >= sync_range.upper:
+                    continue  # Older than kept here, no opinion on it
+
+                if sync_range.mode is SyncMode.FINGERPRINT:
+                    own = self.__fingerprint(lower, sync_range.upper)
+                    if lower != sync_range.lower or (own.fingerprint, own.count) != \
+                            (sync_range.fingerprint, sync_range.count):
+                        replies.extend(self.__describe(lower, sync_range.upper))
+                elif sync_range.mode is SyncMode.IDS:
+                    listed = set(sync_range.ids)
+                    missing.extend(message_id for message_id in self.__range_ids(lower, sync_range.upper)
+                                   if message_id not in listed)
+                    need = [message_id for message_id in sync_range.ids
+                            if message_id >= lower and message_id not in self.__entries]
+                    if need:
+                        replies.append(SyncRange(lower, sync_range.upper, SyncMode.NEED, ids=need))
+                else:
+                    missing.extend(message_id for message_id in sync_range.ids if message_id in self.__entries)
+        return replies, missing
+
+    def entries(self, message_ids: List[int]) -> List[Tuple[ChatMessage, bool]]:
+        """
+        :return: the chats held with the given ids, each with whether this user wrote it
+        """
+        with self.__lock:
+            return [self.__entries[message_id] for message_id in message_ids if message_id in self.__entries]
+
+    def __describe(self, lower: int, upper: int) -> List[SyncRange]:
+        """
+        Lists the ids of a small range, or splits a large one into parts holding as many chats each, fingerprinted
+        """
+        start = bisect.bisect_left(self.__ids, lower)
+        end = bisect.bisect_left(self.__ids, upper)
+        count = end - start
+        if count <= HISTORY_SYNC_IDS:
+            return [SyncRange(lower, upper, SyncMode.IDS, ids=self.__ids[start:end])]
+
+        bounds = [lower] + [self.__ids[start + count * part // HISTORY_SYNC_SPLIT]
+                            for part in range(1, HISTORY_SYNC_SPLIT)] + [upper]
+        parts = list()
+        for part_lower, part_upper in zip(bounds, bounds[1:]):
+            summary = self.__fingerprint(part_lower, part_upper)
+            parts.append(summary if summary.count > HISTORY_SYNC_IDS else
+                         SyncRange(part_lower, part_upper, SyncMode.IDS, ids=self.__range_ids(part_lower, part_upper)))
+        return parts
+
+    def __fingerprint(self, lower: int, upper: int) -> SyncRange:
+        start = bisect.bisect_left(self.__ids, lower)
+        end = bisect.bisect_left(self.__ids, upper)
+        while len(self.__prefix) <= end:
+            self.__prefix.append(self.__prefix[-1] ^ _mix(self.__ids[len(self.__prefix) - 1]))
+        return SyncRange(lower, upper, SyncMode.FINGERPRINT, end - start, self.__prefix[end] ^ self.__prefix[start])
+
+    def __range_ids(self, lower: int, upper: int) -> List[int]:
+        return self.__ids[bisect.bisect_left(self.__ids, lower):bisect.bisect_left(self.__ids, upper)]
+
+    def __horizon(self) -> int:
+        """
+        :return: the lowest id kept, by age, or by count once the history is full
+        """
+        horizon = _id_at(time.time() - HISTORY_MAX_AGE)
+        if len(self.__ids) >= HISTORY_MAX_MESSAGES:
+            horizon = max(horizon, self.__ids[len(self.__ids) - HISTORY_MAX_MESSAGES])
+        return horizon
+
+    def __prune(self):
+        """
+        Lets go of chats below the horizon, in one go as every prefix must be recomputed
+        """
+        cut = bisect.bisect_left(self.__ids, self.__horizon())
+        for message_id in self.__ids[:cut]:
+            del self.__entries[message_id]
+        del self.__ids[:cut]
+        self.__prefix = [0]
+
+    # Getters
+
+    def size(self) -> int:
+        return len(self.__ids)
+
+
+def _id_at(time_stamp: float) -> int:
+    """
+    :return: the lowest message id of chats written at or after time_stamp
+    """
+    return max(0, int(time_stamp * 1000)) << 16
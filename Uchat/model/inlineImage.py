@@ -0,0 +1,116 @@
+"""
+Images sent inline in a conversation, cut into chunks on the wire and saved to disk, under their id, once whole
+A conversation's timeline holds only an image's size and preview, so it stays as light as a chat
+"""
+import os
+from pathlib import Path
+from typing import List, Optional
+
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import IMAGE_CHUNK_BYTES, IMAGE_MAX_BYTES
+from Uchat.helper.logger import DataType, get_file_path
+from Uchat.network.messages.message import ChatMessage, ImageMessage, new_message_id
+
+
+class InlineImage(ChatMessage):
+    """
+    An image in a conversation's timeline, standing in for a chat without text
+    Whole once the file at its path exists, until then it's shown by its preview
+    """
+
+    def __init__(self, image_id: int, width: int, height: int, preview: bytes, time_stamp=None):
+        super().__init__('', time_stamp, message_id=image_id)
+        self.image_id = image_id
+        self.width = width
+        self.height = height
+        self.preview = preview
+
+    def path(self) -> Path:
+        return image_path(self.image_id)
+
+    def is_complete(self) -> bool:
+        return self.path().exists()
+
+
+class ImageAssembly:
+    """
+    The chunks of an image being received, which arrive in order over the conversation's socket
+    """
+
+    def __init__(self, first: ImageMessage):
+        self.__image = InlineImage(first.image_id, first.width, first.height, first.preview, first.time_stamp)
+        self.__count = first.count
+        self.__chunks: List[bytes] = [first.data]
+        self.__size = len(first.data)
+
+    def add(self, chunk: ImageMessage) -> bool:
+        """
+        :return: whether the chunk is the one expected next, and keeps the image within the size allowed
+        """
+        if chunk.index != len(self.__chunks) or chunk.index >= self.__count or \
+                self.__size + len(chunk.data) > IMAGE_MAX_BYTES:
+            return False
+        self.__chunks.append(chunk.data)
+        self.__size += len(chunk.data)
+        return True
+
+    def is_complete(self) -> bool:
+        return len(self.__chunks) >= self.__count
+
+    def image(self) -> InlineImage:
+        return self.__image
+
+    def data(self) -> bytes:
+        return b''.join(self.__chunks)
+
+
+def image_path(image_id: int) -> Path:
+    """
+    :return: where the image is saved once whole, the format is read from its bytes when decoded
+    """
+    return get_file_path(DataType.IMAGES, file_name_str='{:016x}'.format(image_id))
+
+
+def save_image(image_id: int, data: bytes) -> bool:
+    """
+    Saves a whole image, written aside then moved into place, so it's never found half written
+    :return: whether it was saved
+    """
+    path = image_path(image_id)
+    partial = path.with_suffix('.partial')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial.write_bytes(data)
+        os.replace(partial, path)
+        return True
+    except OSError as err:
+        print_err(1, "Unable to save image {}\n".format(path) + repr(err))
+        return False
+
+
+def chunk_image(data: bytes, width: int, height: int, preview: bytes,
+                chunk_size: int = IMAGE_CHUNK_BYTES) -> List[ImageMessage]:
+    """
+    Cuts an encoded image into the messages it's sent as
+    :param preview: A tiny encoding of the image, sent in the first chunk
+    :return: the chunks, in order, under an id chosen as a chat's is
+    """
+    first = ImageMessage(0, 0, max(1, -(-len(data) // chunk_size)), data[:chunk_size], width, height, preview)
+    first.image_id = new_message_id(first.time_stamp)
+    return [first] + [ImageMessage(first.image_id, index, first.count,
+                                   data[index * chunk_size:(index + 1) * chunk_size], width, height,
+                                   time_stamp=first.time_stamp) for index in range(1, first.count)]
+
+
+def read_image(path: str) -> Optional[bytes]:
+    """
+    :return: the encoded image at path, None if it can't be read or is too large to send inline
+    """
+    try:
+        if os.path.getsize(path) > IMAGE_MAX_BYTES:
+            print_err(4, "{} is larger than the {} bytes an image may be".format(path, IMAGE_MAX_BYTES))
+            return None
+        return Path(path).read_bytes()
+    except OSError as err:
+        print_err(1, "Unable to read image {}\n".format(path) + repr(err))
+        return None
@@ -0,0 +1,278 @@
+"""
+Chat messages written to peers that couldn't be reached, kept on disk until they can be delivered
+"""
+import os
+import pickle
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from Uchat.helper import metrics
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import OUTBOX_MAX_AGE, OUTBOX_MAX_MESSAGES, OUTBOX_MAX_BYTES
+from Uchat.helper.log import get_logger
+from Uchat.helper.logger import DataType, get_file_path
+from Uchat.network.messages.message import ChatMessage
+from Uchat.peer import Peer
+
+_log = get_logger('outbox')
+_queued = metrics.gauge('uchat_outbox_messages', 'Chat messages waiting for their peer to be reachable')
+_queued_bytes = metrics.gauge('uchat_outbox_bytes', 'Bytes of chat messages queued on disk')
+_dropped = {reason: metrics.counter('uchat_outbox_dropped_total', 'Queued messages discarded undelivered, by reason',
+                                    reason=reason) for reason in ('expired', 'overflow')}
+
+
+class _Queue:
+    """
+    Messages queued for one peer, oldest first, and the file holding them
+    The file starts with the peer, followed by one record per message, so queueing a message only appends
+    """
+
+    def __init__(self, peer: Peer, path: Path):
+        self.peer = peer
+        self.path = path
+        self.entries: Deque[Tuple[ChatMessage, int]] = deque()  # Message, bytes of its record
+        self.size = 0
+
+
+class Outbox:
+    """
+    Per-peer queues of chat messages, persisted under data/outbox so they survive restarts
+    Bounded per peer, across every peer, and by age, the oldest messages going first
+    A message's age is taken from its time stamp, which is when it was written
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        """
+        :param directory: Folder queues are kept in, data/outbox by default
+        """
+        self.__directory = directory if directory else get_file_path(DataType.OUTBOX, file_name_str='')
+        self.__lock = threading.Lock()
+        self.__queues: Dict[Tuple[str, int], _Queue] = dict()  # Peer's listening address -> queue
+        self.__size = 0
+        self.__load()
+
+    def put(self, peer: Peer, message: ChatMessage):
+        """
+        Queues a message, appending it to the peer's file
+        :param peer: Peer the message is written to, by its listening address
+        """
+        with self.__lock:
+            self.__put([message], peer)
+
+    def take(self, peer: Peer) -> List[ChatMessage]:
+        """
+        Removes and returns every message queued for a peer, found by its address, else by its username
+        Messages past their age are dropped rather than returned
+        :return: the messages, oldest first
+        """
+        with self.__lock:
+            if not (queue := self.__find(peer)):
+                return list()
+
+            self.__expire(queue, time.time())
+            self.__discard(queue)
+            return [message for message, _ in queue.entries]
+
+    def give_back(self, peer: Peer, messages: List[ChatMessage]):
+        """
+        Queues messages again, after a delivery they were taken for failed, ahead of any queued since
+        """
+        with self.__lock:
+            if queue := self.__find(peer):
+                self.__discard(queue)
+                messages = messages + [message for message, _ in queue.entries]
+            self.__put(messages, peer)
+
+    def expire(self) -> int:
+        """
+        Drops messages queued for longer than they may be kept
+        :return: messages dropped
+        """
+        now = time.time()
+        dropped = 0
+        with self.__lock:
+            for queue in list(self.__queues.values()):
+                if count := self.__expire(queue, now):
+                    dropped += count
+                    self.__store(queue)
+        return dropped
+
+    def __put(self, messages: List[ChatMessage], peer: Peer):
+        if not (queue := self.__queues.get(peer.address())):
+            queue = _Queue(peer, self.__directory / '{}_{}.queue'.format(*peer.address()))
+            self.__queues[peer.address()] = queue
+
+        records = [pickle.dumps(message, pickle.HIGHEST_PROTOCOL) for message in messages]
+        appendable = queue.entries or queue.path.exists()
+        for message, record in zip(messages, records):
+            queue.entries.append((message, len(record)))
+            queue.size += len(record)
+            self.__size += len(record)
+
+        if len(queue.entries) > OUTBOX_MAX_MESSAGES or self.__size > OUTBOX_MAX_BYTES:
+            self.__shed(queue)
+            self.__store(queue)
+        elif appendable:
+            self.__append(queue, b''.join(records))
+        else:
+            self.__store(queue)
+
+    def __find(self, peer: Peer) -> Optional[_Queue]:
+        """
+        Peers that connected to us are known by the address they connected from, so the username is tried after it
+        """
+        if queue := self.__queues.get(peer.address()):
+            return queue
+        for queue in self.__queues.values():
+            if queue.peer.username() == peer.username():
+                return queue
+        return None
+
+    def __expire(self, queue: _Queue, now: float) -> int:
+        dropped = 0
+        while queue.entries and now - queue.entries[0][0].time_stamp > OUTBOX_MAX_AGE:
+            self.__drop_oldest(queue)
+            dropped += 1
+        if dropped:
+            _dropped['expired'].inc(dropped)
+            _log.warning('Expired %d messages queued for %s', dropped, queue.peer)
+        return dropped
+
+    def __shed(self, queue: _Queue):
+        """
+        Drops the oldest messages past the bounds, from the peer that overflowed, then from the longest queues
+        """
+        dropped = 0
+        while len(queue.entries) > OUTBOX_MAX_MESSAGES:
+            self.__drop_oldest(queue)
+            dropped += 1
+
+        while self.__size > OUTBOX_MAX_BYTES:
+            longest = max(self.__queues.values(), key=lambda q: q.size)
+            self.__drop_oldest(longest)
+            dropped += 1
+            if longest is not queue:
+                self.__store(longest)
+
+        _dropped['overflow'].inc(dropped)
+        _log.warning('Outbox full, dropped %d of the oldest queued messages', dropped)
+
+    def __drop_oldest(self, queue: _Queue):
+        size = queue.entries.popleft()[1]
+        queue.size -= size
+        self.__size -= size
+
+    def __discard(self, queue: _Queue):
+        """
+        Forgets a queue, and its file
+        """
+        if self.__queues.get(queue.peer.address()) is queue:
+            del self.__queues[queue.peer.address()]
+            self.__size -= queue.size
+        self.__update_gauges()
+        try:
+            os.remove(queue.path)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            print_err(1, repr(err))
+
+    def __append(self, queue: _Queue, records: bytes):
+        try:
+            with open(queue.path, 'ab') as file:
+                file.write(records)
+                file.flush()
+                os.fsync(file.fileno())
+        except OSError as err:
+            print_err(1, repr(err))
+        self.__update_gauges()
+
+    def __store(self, queue: _Queue):
+        """
+        Writes a queue's whole file, through a temporary file so a crash leaves either the old or the new one
+        """
+        if not queue.entries:
+            self.__discard(queue)
+            return
+
+        temp_path = queue.path.with_suffix('.tmp')
+        try:
+            self.__directory.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, 'wb') as file:
+                pickle.dump(queue.peer, file, pickle.HIGHEST_PROTOCOL)
+                for message, _ in queue.entries:
+                    pickle.dump(message, file, pickle.HIGHEST_PROTOCOL)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, queue.path)
+        except OSError as err:
+            print_err(1, repr(err))
+        self.__update_gauges()
+
+    def __load(self):
+        """
+        Reads every queue left on disk, keeping the messages before any record torn by a crash
+        """
+        if not self.__directory.is_dir():
+            return
+
+        for path in sorted(self.__directory.glob('*.queue')):
+            queue = None
+            try:
+                with open(path, 'rb') as file:
+                    queue = _Queue(pickle.load(file), path)
+                    while True:
+                        start = file.tell()
+                        try:
+                            message = pickle.load(file)
+                        except EOFError:
+                            break
+                        queue.entries.append((message, file.tell() - start))
+                        queue.size += file.tell() - start
+            except (OSError, pickle.UnpicklingError, ValueError, AttributeError, TypeError) as err:
+                if not queue:
+                    print_err(1, "Unable to read queued messages {}\n{}".format(path, repr(err)))
+                    continue
+                _log.warning('Queued messages in %s were cut short, kept %d', path.name, len(queue.entries))
+                self.__store(queue)  # Later messages would otherwise be appended after the torn record
+
+            if queue.entries:
+                self.__queues[queue.peer.address()] = queue
+                self.__size += queue.size
+
+        self.__update_gauges()
+        if self.__queues:
+            _log.info('Loaded %d queued messages for %d peers', sum(len(q.entries) for q in self.__queues.values()),
+                      len(self.__queues))
+
+    def __update_gauges(self):
+        _queued.set(sum(len(queue.entries) for queue in self.__queues.values()))
+        _queued_bytes.set(self.__size)
+
+    # Getters
+
+    def peers(self) -> List[Peer]:
+        """
+        :return: peers with messages queued for them
+        """
+        with self.__lock:
+            return [queue.peer for queue in self.__queues.values()]
+
+    def queued_peer(self, peer: Peer) -> Optional[Peer]:
+        """
+        :return: the peer, as messages were queued for it, found by address else by username
+        """
+        with self.__lock:
+            queue = self.__find(peer)
+            return queue.peer if queue else None
+
+    def pending(self, peer: Peer) -> int:
+        """
+        :return: messages queued for a peer
+        """
+        with self.__lock:
+            queue = self.__find(peer)
+            return len(queue.entries) if queue else 0
@@ -1,12 +1,13 @@
 """
 Establishes module's model
 """
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 
 from PyQt5.QtCore import QAbstractListModel, QModelIndex, QVariant, Qt
 from PyQt5.QtGui import QBrush
 from PyQt5.QtWidgets import QWidget
 
+from Uchat.helper.profiler import profiled
 from Uchat.helper.logger import get_friends, DataType, FileName, write_list_to_data_file
 from Uchat.peer import Peer
 from Uchat.ui.delegate import profilePhotoPixmap
@@ -22,6 +23,7 @@ class PeerList(QAbstractListModel):
 
         self.is_stateless = is_stateless
         self._peers: List[Peer] = get_friends() if not is_stateless else []
+        self._nearby: Dict[Peer, Peer] = dict()  # Peer -> the LAN neighbour it was found as
 
     def __del__(self):
         # Destructor
@@ -38,6 +40,7 @@ class PeerList(QAbstractListModel):
 
         return len(self._peers)
 
+    @profiled('peer_list.data')
     def data(self, index: QModelIndex, role: int = ...) -> Any:
         """
         Determines what to display for a row
@@ -54,7 +57,10 @@ class PeerList(QAbstractListModel):
             # Message bubble view
             return friend.username()
         elif role == Qt.DecorationRole:
-            return profilePhotoPixmap.build_pixmap(friend.color(), friend.username())
+            return profilePhotoPixmap.build_pixmap(friend.color(), friend.username(), nearby=friend in self._nearby,
+                                                   avatar=friend.avatar())
+        elif role == Qt.ToolTipRole and (neighbour := self._nearby.get(friend)):
+            return 'On this network, at {}:{}'.format(*neighbour.address())
         elif role == Qt.ForegroundRole:
             return QBrush(Qt.white)
         else:
@@ -72,6 +78,24 @@ class PeerList(QAbstractListModel):
             self._peers.append(new_peer)
             self.endInsertRows()
 
+    def set_nearby(self, neighbour: Peer, nearby: bool):
+        """
+        Marks the peers a LAN neighbour is, by address or else by username, as present on the LAN or no longer
+        :param neighbour: Client found, or lost, by LAN discovery
+        :param nearby: Whether it is present
+        """
+        for row, peer in enumerate(self._peers):
+            if peer.address() == neighbour.address() or peer.username() == neighbour.username():
+                if nearby:
+                    self._nearby[peer] = neighbour
+                elif self._nearby.get(peer) is not neighbour:
+                    continue
+                else:
+                    del self._nearby[peer]
+
+                model_index = self.index(row)
+                self.dataChanged.emit(model_index, model_index, [Qt.DecorationRole, Qt.ToolTipRole])
+
     def at(self, index: int) -> Optional[Peer]:
         """
         :param index: Index of peer
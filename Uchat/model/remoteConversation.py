@@ -0,0 +1,73 @@
+"""
+The UI's copy of a conversation held by the network process, kept up to date by the events it sends
+"""
+from typing import List
+
+from Uchat.MessageContext import MessageContext, DeliveryState
+from Uchat.model.chatLog import ChatLog
+from Uchat.model.conversation import ConversationListener, ConversationState
+from Uchat.peer import Peer
+
+
+class RemoteConversation:
+    """
+    Offers views and models what they read of a conversation, or of a group
+    Changed only from the UI thread, as batches of events arrive
+    Every change is made by commands to the network process
+    """
+
+    def __init__(self, personal: Peer, peer: Peer, state: ConversationState = ConversationState.INACTIVE,
+                 is_group: bool = False):
+        self.__personal = personal
+        self.__peer = peer
+        self.__state = state
+        self.__is_group = is_group
+        self.__chat_messages = ChatLog()
+        self.__listeners: List[ConversationListener] = list()
+
+    def add_listener(self, listener: ConversationListener):
+        self.__listeners.append(listener)
+
+    def remove_listener(self, listener: ConversationListener):
+        if listener in self.__listeners:
+            self.__listeners.remove(listener)
+
+    def add_message(self, context: MessageContext):
+        insertion_idx = len(self.__chat_messages)
+        for listener in self.__listeners:
+            listener.chat_message_will_be_added(self, insertion_idx)
+        self.__chat_messages.append(context)
+        for listener in self.__listeners:
+            listener.chat_message_added(self, insertion_idx)
+
+    def change_state(self, state: ConversationState):
+        old_state, self.__state = self.__state, state
+        if state is not old_state:
+            for listener in self.__listeners:
+                listener.state_changed(self, old_state)
+
+    def change_delivery(self, index: int, delivery: DeliveryState):
+        if index >= len(self.__chat_messages):
+            return
+        context = self.__chat_messages[index]
+        context.delivery = delivery
+        self.__chat_messages.delivery_changed(context)
+        for listener in self.__listeners:
+            listener.delivery_changed(self, index)
+
+    # Getters
+
+    def state(self) -> ConversationState:
+        return self.__state
+
+    def peer(self) -> Peer:
+        return self.__peer
+
+    def personal(self) -> Peer:
+        return self.__personal
+
+    def is_group(self) -> bool:
+        return self.__is_group
+
+    def chat_message_contexts(self) -> ChatLog:
+        return self.__chat_messages
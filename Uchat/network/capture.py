@@ -0,0 +1,152 @@
+"""
+Opt-in capture of the frames received over conversation sockets, so traffic seen in use can be replayed later
+Frames are recorded as they are cut from the stream, before decoding, each with its connection, arrival time and the
+wire version it was read in, so a replay decodes them exactly as they were decoded then
+"""
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+
+from Uchat.helper import metrics
+from Uchat.helper.error import print_err
+from Uchat.helper.log import get_logger
+
+_log = get_logger('network.capture')
+_captured = metrics.counter('uchat_capture_frames_total', 'Frames recorded to the capture file')
+
+CAPTURE_MAGIC = b'UCAP'
+CAPTURE_FORMAT = 1
+_HEADER = struct.Struct('<4sBd')  # Magic, format, wall-clock time the capture started at
+_RECORD = struct.Struct('<BIQI')  # Kind, connection, nanoseconds since the capture started, bytes that follow
+_FLUSH_INTERVAL = 1_000_000_000  # Nanoseconds records may stay buffered, so a killed process loses little
+
+OPENED = 0  # A connection's first frame arrived, followed by its remote address as 'host:port'
+FRAME = 1  # A frame arrived, followed by the wire version it was read in, then its payload
+CLOSED = 2  # A connection was closed, nothing follows
+
+
+class CaptureRecord(NamedTuple):
+    kind: int
+    connection: int
+    time_ns: int  # Since the capture started
+    version: int  # Wire version of frames, 0 for other records
+    data: bytes  # Payload of frames, remote address of opened connections
+
+
+class _Writer:
+    """
+    Appends records to a capture file, from any thread reading sockets
+    """
+
+    def __init__(self, file: BinaryIO):
+        self.__file = file
+        self.__lock = threading.Lock()
+        self.__start = time.monotonic_ns()
+        self.__flushed = 0  # Nanoseconds since the start the file was last flushed at
+        self.__connections = 0
+        file.write(_HEADER.pack(CAPTURE_MAGIC, CAPTURE_FORMAT, time.time()))
+
+    def write(self, kind: int, connection: int, data: bytes = b''):
+        with self.__lock:
+            if self.__file.closed:
+                return
+            elapsed = time.monotonic_ns() - self.__start
+            self.__file.write(_RECORD.pack(kind, connection, elapsed, len(data)))
+            self.__file.write(data)
+            if kind != FRAME or elapsed - self.__flushed > _FLUSH_INTERVAL:
+                self.__file.flush()
+                self.__flushed = elapsed
+
+    def next_connection(self) -> int:
+        with self.__lock:
+            self.__connections += 1
+            return self.__connections
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+_writer: Optional[_Writer] = None
+
+
+def record_to(path: str) -> bool:
+    """
+    Starts recording every frame received over TCP to a capture file, replacing it, until the process exits
+    :return: whether the file could be opened
+    """
+    global _writer
+    try:
+        file = open(path, 'wb')
+    except OSError as os_err:
+        print_err(1, "Unable to open capture file {}\n".format(path) + str(os_err))
+        return False
+
+    import atexit
+    stop()
+    _writer = _Writer(file)
+    atexit.register(stop)
+    _log.info('Capturing received frames to %s', path)
+    return True
+
+
+def stop():
+    """
+    Stops recording, writing out what is buffered
+    """
+    global _writer
+    if _writer:
+        _writer.close()
+        _writer = None
+
+
+def recording() -> bool:
+    return _writer is not None
+
+
+def open_connection(remote: Optional[Tuple[str, int]]) -> int:
+    """
+    :param remote: Address the connection's frames come from
+    :return: the number the connection's records are written under, 0 if not recording
+    """
+    if not (writer := _writer):
+        return 0
+    connection = writer.next_connection()
+    writer.write(OPENED, connection, '{}:{}'.format(*remote).encode() if remote else b'')
+    return connection
+
+
+def record_frame(connection: int, version: int, payload: bytes):
+    if writer := _writer:
+        writer.write(FRAME, connection, bytes((version,)) + payload)
+        _captured.inc()
+
+
+def close_connection(connection: int):
+    if writer := _writer:
+        writer.write(CLOSED, connection)
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """
+    :return: the records of a capture file, in the order they were written, which is the order they arrived in
+    """
+    data = Path(path).read_bytes()
+    if len(data) < _HEADER.size or _HEADER.unpack_from(data)[:2] != (CAPTURE_MAGIC, CAPTURE_FORMAT):
+        raise ValueError('{} is not a capture file'.format(path))
+
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        kind, connection, time_ns, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        body = data[offset:offset + length]
+        offset += length
+        if len(body) < length:
+            break  # Cut short by the process exiting mid-write
+
+        if kind == FRAME:
+            yield CaptureRecord(kind, connection, time_ns, body[0], body[1:])
+        else:
+            yield CaptureRecord(kind, connection, time_ns, 0, body)
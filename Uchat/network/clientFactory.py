@@ -0,0 +1,48 @@
+"""
+Builds clients configured by the environment, importable by the network process without loading the UI
+"""
+import os
+import selectors
+from typing import Optional
+
+from Uchat.client import Client
+from Uchat.helper import bootTimer
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import TLS_ENV, UDP_ENV, DISCOVERY_ENV, RATE_LIMIT_ENV
+from Uchat.model.outbox import Outbox
+from Uchat.network.rateLimit import RateLimiter, RatePolicy
+from Uchat.network.tls import TlsIdentity
+from Uchat.peer import Peer
+
+
+def load_identity(info: Peer) -> Optional[TlsIdentity]:
+    """
+    :return: this user's TLS identity when encrypted conversations are enabled, conversations are plaintext otherwise
+    """
+    if not os.environ.get(TLS_ENV):
+        return None
+
+    if identity := TlsIdentity.load(info.username()):
+        bootTimer.mark_phase('tls identity loaded')
+    return identity
+
+
+def rate_limiter() -> RateLimiter:
+    """
+    :return: limits on the frames peers may have decoded, over-limit frames handled by the policy in the environment
+    """
+    if policy := os.environ.get(RATE_LIMIT_ENV):
+        try:
+            return RateLimiter(RatePolicy(policy.lower()))
+        except ValueError:
+            print_err(4, "Unknown rate limit policy {}, expected one of {}".format(
+                policy, ', '.join(p.value for p in RatePolicy)))
+    return RateLimiter()
+
+
+def headless_client(selector: selectors.BaseSelector, info: Peer) -> Client:
+    """
+    :return: the client run by the network process, configured by the environment as the GUI's own would be
+    """
+    return Client(selector, info, load_identity(info), bool(os.environ.get(UDP_ENV)),
+                  bool(os.environ.get(DISCOVERY_ENV)), Outbox(), rate_limiter())
@@ -0,0 +1,249 @@
+"""
+Discovery of other clients on the LAN, through announcements sent to a multicast group
+Each client periodically announces its username, colour and listening port, and remembers those it hears for a few
+announcement intervals, so friends on the same network are reached directly instead of through an address typed in
+Intervals stretch with the number of neighbours, so a segment carries a bounded rate of announcements however many
+clients share it
+"""
+import random
+import secrets
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Uchat.helper import metrics
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import DISCOVERY_GROUP, DISCOVERY_PORT, DISCOVERY_INTERVAL, DISCOVERY_SEGMENT_RATE, \
+    DISCOVERY_TTL_FACTOR
+from Uchat.helper.log import get_logger
+from Uchat.network.timers import TimerQueue, Timer
+from Uchat.peer import Peer
+
+_log = get_logger('network.discovery')
+_announcements = {direction: metrics.counter('uchat_discovery_announcements_total', 'LAN announcements, by direction',
+                                             direction=direction) for direction in ('in', 'out')}
+_malformed = metrics.counter('uchat_discovery_malformed_total', 'Datagrams on the discovery group that were not '
+                                                                 'announcements')
+_neighbours = metrics.gauge('uchat_discovery_neighbours', 'Clients currently known on the LAN')
+
+# Magic, version, flags, instance, listening port, seconds to live, colour, followed by the username
+_ANNOUNCEMENT = struct.Struct('!4sBBQHHI')
+_MAGIC = b'UCHT'
+_VERSION = 1
+_LEAVING = 0x01  # Flag of the announcement sent while closing, neighbours forget the sender at once
+_QUERY = 0x02  # Flag of a client's first announcement, some neighbours answer early so it needn't wait an interval
+_MAX_USERNAME = 20  # Bytes of username carried, as in a greeting
+
+
+class _Neighbour:
+    __slots__ = ('peer', 'instance', 'expires_at')
+
+    def __init__(self, peer: Peer, instance: int, expires_at: float):
+        self.peer = peer
+        self.instance = instance  # Random per run of the client, tells a restarted client from the one it replaced
+        self.expires_at = expires_at
+
+
+class LanDiscovery:
+    """
+    Announces this user to the LAN and keeps a table of the clients heard, each expiring unless announced again
+    Driven by the network thread, which reads the socket when readable and runs the announcement timers
+    """
+
+    def __init__(self, timers: TimerQueue, info: Peer, on_found: Callable[[Peer], None],
+                 on_lost: Callable[[Peer], None], group: str = DISCOVERY_GROUP, port: int = DISCOVERY_PORT):
+        """
+        :param timers: Queue run by the network thread
+        :param info: This user, whose listening port is announced
+        :param on_found: Called with a neighbour first heard, or whose username or colour changed
+        :param on_lost: Called with a neighbour that left or went unheard for too long
+        """
+        self.__timers = timers
+        self.__info = info
+        self.__on_found = on_found
+        self.__on_lost = on_lost
+        self.__group = (group, port)
+        self.__instance = secrets.randbits(64)
+        self.__random = random.Random()
+        self.__lock = threading.Lock()
+        self.__table: Dict[Tuple[str, int], _Neighbour] = dict()  # Listening address -> neighbour
+        self.__sock: Optional[socket.socket] = None
+        self.__announce_timer: Optional[Timer] = None
+        self.__sweep_timer: Optional[Timer] = None
+        self.__answered_at = float('-inf')  # When an announcement was last brought forward to answer a query
+
+    def start(self) -> bool:
+        """
+        Joins the multicast group and makes the first announcement
+        :return: whether discovery is running
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Every client on the host binds the same port, each receives its own copy of multicast datagrams
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', self.__group[1]))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            struct.pack('4s4s', socket.inet_aton(self.__group[0]), socket.inet_aton('0.0.0.0')))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)  # Never routed off the segment
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)  # Clients on this host hear each other
+            sock.setblocking(False)
+        except OSError as os_err:
+            sock.close()
+            print_err(2, "Unable to join the LAN discovery group\n" + str(os_err))
+            return False
+
+        self.__sock = sock
+        _log.info('Announcing on %s:%s', *self.__group)
+        self.__announce(_QUERY)
+        self.__sweep_timer = self.__timers.call_later(DISCOVERY_INTERVAL, self.__sweep)
+        return True
+
+    def stop(self):
+        """
+        Tells neighbours this user is leaving, then leaves the group
+        """
+        if not self.__sock:
+            return
+
+        for timer in (self.__announce_timer, self.__sweep_timer):
+            if timer:
+                timer.cancel()
+        self.__send(_LEAVING)
+        self.__sock.close()
+        self.__sock = None
+
+    def receive(self):
+        """
+        Handles every announcement waiting on the socket, once the selector reports it readable
+        """
+        while self.__sock:
+            try:
+                datagram, source = self.__sock.recvfrom(_ANNOUNCEMENT.size + _MAX_USERNAME)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as os_err:
+                _log.warning('Discovery receive failed: %s', os_err)
+                return
+            self.__on_announcement(datagram, source[0])
+
+    def __on_announcement(self, datagram: bytes, host: str):
+        try:
+            magic, version, flags, instance, port, ttl, color = _ANNOUNCEMENT.unpack_from(datagram)
+        except struct.error:
+            magic = None
+        if magic != _MAGIC or version != _VERSION:
+            _malformed.inc()
+            return
+
+        if instance == self.__instance:
+            return  # Our own, looped back
+        _announcements['in'].inc()
+
+        address = (host, port)
+        username = datagram[_ANNOUNCEMENT.size:].decode('utf-8', 'replace')
+        color = hex(color)  # As a greeting's colour is read
+
+        with self.__lock:
+            neighbour = self.__table.get(address)
+            if flags & _LEAVING:
+                if neighbour and neighbour.instance == instance:
+                    del self.__table[address]
+                    _neighbours.set(len(self.__table))
+                else:
+                    neighbour = None  # A late goodbye from a client since replaced at the address
+            elif neighbour:
+                before = (neighbour.peer.username(), neighbour.peer.color())
+                neighbour.peer.username(username)
+                neighbour.peer.color(color)
+                changed = before != (neighbour.peer.username(), neighbour.peer.color())
+                neighbour.instance = instance
+                neighbour.expires_at = time.monotonic() + ttl
+                neighbour = neighbour if changed else None
+            else:
+                neighbour = _Neighbour(Peer(address, False, username, color), instance, time.monotonic() + ttl)
+                self.__table[address] = neighbour
+                _neighbours.set(len(self.__table))
+
+        if flags & _QUERY:
+            self.__answer_query()
+        if neighbour:
+            _log.debug('%s %s', 'Lost' if flags & _LEAVING else 'Found', neighbour.peer)
+            (self.__on_lost if flags & _LEAVING else self.__on_found)(neighbour.peer)
+
+    def __announce(self, flags: int = 0):
+        self.__send(flags)
+        interval = self.announcement_interval()
+        self.__announce_timer = self.__timers.call_later(interval * self.__random.uniform(0.8, 1.2), self.__announce)
+
+    def __answer_query(self):
+        """
+        Brings the next announcement forward, within a second, for a client that just joined
+        Only a share of neighbours answer each query, and each at most once an interval, so joins can't flood a segment
+        """
+        now = time.monotonic()
+        if now - self.__answered_at < self.announcement_interval() or \
+                self.__random.random() >= DISCOVERY_SEGMENT_RATE / (len(self.__table) + 1):
+            return
+
+        self.__answered_at = now
+        if self.__announce_timer:
+            self.__announce_timer.cancel()
+        self.__announce_timer = self.__timers.call_later(self.__random.uniform(0, 1), self.__announce)
+
+    def __send(self, flags: int):
+        username = self.__info.username().encode('utf-8')[:_MAX_USERNAME]
+        ttl = min(0xFFFF, int(self.announcement_interval() * DISCOVERY_TTL_FACTOR) + 1)
+        datagram = _ANNOUNCEMENT.pack(_MAGIC, _VERSION, flags, self.__instance, self.__info.address()[1], ttl,
+                                      self.__info.color_as_int() & 0xFFFFFF) + username
+        try:
+            self.__sock.sendto(datagram, self.__group)
+            _announcements['out'].inc()
+        except OSError as os_err:
+            _log.warning('Discovery announcement failed: %s', os_err)
+
+    def __sweep(self):
+        """
+        Forgets neighbours that went unheard for longer than they asked to be remembered
+        """
+        now = time.monotonic()
+        with self.__lock:
+            expired = [address for address, neighbour in self.__table.items() if neighbour.expires_at <= now]
+            lost = [self.__table.pop(address).peer for address in expired]
+            _neighbours.set(len(self.__table))
+
+        for peer in lost:
+            _log.debug('%s expired', peer)
+            self.__on_lost(peer)
+        self.__sweep_timer = self.__timers.call_later(DISCOVERY_INTERVAL, self.__sweep)
+
+    def locate(self, peer: Peer) -> Optional[Peer]:
+        """
+        Finds a peer among the neighbours, by its address, else by its username
+        :return: the neighbour, whose address reaches the peer directly on the LAN
+        """
+        with self.__lock:
+            if neighbour := self.__table.get(peer.address()):
+                return neighbour.peer
+            for neighbour in self.__table.values():
+                if neighbour.peer.username() == peer.username():
+                    return neighbour.peer
+        return None
+
+    # Getters
+
+    def announcement_interval(self) -> float:
+        """
+        :return: seconds between this client's announcements, longer as more neighbours share the segment's rate
+        """
+        return max(DISCOVERY_INTERVAL, (len(self.__table) + 1) / DISCOVERY_SEGMENT_RATE)
+
+    def neighbours(self) -> List[Peer]:
+        with self.__lock:
+            return [neighbour.peer for neighbour in self.__table.values()]
+
+    def fileno(self) -> int:
+        return self.__sock.fileno() if self.__sock else -1
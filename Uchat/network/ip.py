@@ -2,12 +2,20 @@
 Functions for helping with IP
 """
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, TimeoutError
 from enum import Enum
-from typing import Optional
+from typing import Optional, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from Uchat.helper.globals import IP_API_URL, IP_API_FAILSAFE_URL
+from Uchat.helper.globals import IP_API_URL, IP_API_FAILSAFE_URL, EXTERNAL_IP_TTL, EXTERNAL_IP_TIMEOUT
+from Uchat.helper.validators import is_valid_ipv4
+
+# Endpoints raced against each other when resolving the external IP, as (url, responds with JSON)
+IP_API_ENDPOINTS: List[Tuple[str, bool]] = [(IP_API_URL, False), (IP_API_FAILSAFE_URL, True)]
 
 
 class SupportedTransportProtocols(Enum):
@@ -15,6 +23,15 @@ class SupportedTransportProtocols(Enum):
     TCP = 1
 
 
+_session: Optional[requests.Session] = None  # Pooled HTTP connections, shared by every lookup
+_executor = ThreadPoolExecutor(max_workers=len(IP_API_ENDPOINTS) + 1, thread_name_prefix='external-ip')
+
+_lock = threading.Lock()  # Guards the cached IP and the pending refresh
+_external_ip: Optional[str] = None
+_resolved_at: float = 0
+_refresh: Optional[Future] = None
+
+
 def __is_port_open(external_port: int, protocol: SupportedTransportProtocols) -> bool:
     """
     Used to determine if a local port is open to reach this host from outside the local network
@@ -23,6 +40,10 @@ def __is_port_open(external_port: int, protocol: SupportedTransportProtocols) ->
     :return: whether or not the port is open
     """
 
+    # Get external IP of this host's router (could be behind 1+ NATs)
+    if not (external_ip := get_external_ip()):
+        return False
+
     # Create socket of proper type
     if protocol is SupportedTransportProtocols.TCP:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -32,36 +53,37 @@ def __is_port_open(external_port: int, protocol: SupportedTransportProtocols) ->
     sock.settimeout(2)  # Timeout socket after two seconds of no response
 
     try:
-        # Get external API of this host's router (could be behind 1+ NATs)
-        external_ip = get_http_response(IP_API_URL)
-
         # Connect to external IP, external port
         sock.connect((external_ip, external_port))
         return True
-    except requests.exceptions.HTTPError as err:
-        # HTTP Error Occurred
-
-        # Get status code from err
-
-        pass
-    except requests.exceptions.RequestException as err:
-        # Catch all for requests library
-        external_ip = get_http_response(IP_API_FAILSAFE_URL)
-        pass
-    except (socket.timeout, OSError) as err:
+    except (socket.timeout, OSError):
         # Connection-related exception
         return False
+    finally:
+        sock.close()
+
+
+def _get_session() -> requests.Session:
+    global _session
 
+    if not _session:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(IP_API_ENDPOINTS), pool_maxsize=len(IP_API_ENDPOINTS))
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
 
-def get_http_response(url: str, return_json: bool) -> Optional[str]:
+
+def get_http_response(url: str, return_json: bool, timeout: float = EXTERNAL_IP_TIMEOUT) -> Optional[str]:
     """
     Function gets HTTP response from given URL
     :param url: url for rest API
     :param return_json: bool to check if HTTP response is JSON object or anything else
+    :param timeout: Seconds to wait on connecting and on each read
     :return: string holding the IP address
     """
     try:
-        https_response = requests.get(url)
+        https_response = _get_session().get(url, timeout=timeout)
         https_response.raise_for_status()
         if return_json:
             # If the return type from the API is a JSON object, extract IP
@@ -69,17 +91,73 @@ def get_http_response(url: str, return_json: bool) -> Optional[str]:
             external_ip = json_obj.get('ip', None)
         else:
             external_ip = https_response.text
-        return external_ip
-    except requests.exceptions.RequestException as err:
+        return external_ip.strip() if external_ip else None
+    except (requests.exceptions.RequestException, ValueError):
         return None
 
 
-def get_external_ip() -> Optional[str]:
+def resolve_external_ip(endpoints: Optional[List[Tuple[str, bool]]] = None,
+                        timeout: float = EXTERNAL_IP_TIMEOUT) -> Optional[str]:
     """
-    :return: Either string holding IP address, or None to show no IP was able to be found
+    Races every endpoint concurrently, so a dead endpoint never delays a live one
+    :param endpoints: (url, responds with JSON) pairs to query, defaults to IP_API_ENDPOINTS
+    :param timeout: Seconds to wait on any answer at all
+    :return: the first valid IPv4 address returned, or None
+    """
+    pending = [_executor.submit(get_http_response, url, is_json, timeout)
+               for url, is_json in (endpoints or IP_API_ENDPOINTS)]
+
+    try:
+        for future in as_completed(pending, timeout=timeout):
+            if (external_ip := future.result()) and is_valid_ipv4(external_ip):
+                return external_ip
+    except TimeoutError:
+        pass
+    finally:
+        for future in pending:
+            future.cancel()
+    return None
+
+
+def refresh_external_ip() -> Future:
     """
-    if not (external_ip := get_http_response(IP_API_URL, False)):
-        external_ip = get_http_response(IP_API_FAILSAFE_URL, True)
+    Resolves the external IP in the background, updating the cache once done
+    Only one refresh is ever in flight
+
+    :return: a future resolving to the refreshed IP, or None
+    """
+    global _refresh
+
+    with _lock:
+        if not _refresh or _refresh.done():
+            _refresh = _executor.submit(_refresh_cache)
+        return _refresh
+
+
+def _refresh_cache() -> Optional[str]:
+    global _external_ip, _resolved_at
+
+    if external_ip := resolve_external_ip():
+        with _lock:
+            _external_ip = external_ip
+            _resolved_at = time.monotonic()
     return external_ip
 
 
+def get_external_ip(max_age: float = EXTERNAL_IP_TTL) -> Optional[str]:
+    """
+    Gets the cached external IP, resolving it only when nothing is cached yet
+    A stale IP is still returned immediately, while a fresh one is resolved in the background
+
+    :param max_age: Seconds after which the cached IP is refreshed
+    :return: Either string holding IP address, or None to show no IP was able to be found
+    """
+    with _lock:
+        external_ip, age = _external_ip, time.monotonic() - _resolved_at
+
+    if not external_ip:
+        return refresh_external_ip().result()
+
+    if age > max_age:
+        refresh_external_ip()
+    return external_ip
@@ -1,11 +1,27 @@
 """
 Establishes the types of messages supported by Uchat and their encoding / decoding over the net
+
+Two wire versions are spoken, chosen per connection by the greetings that open it
+v1 packs each message in native byte order behind a 4-byte length, with float time stamps and ASCII text
+v2 packs them little-endian behind a varint length, with varint integers, millisecond time stamps and UTF-8 text
+v3 frames are v2's, offered by clients that also exchange avatars, which are only sent to peers speaking it
+Greetings are always sent in v1, which every client reads, and offer the newest version their sender speaks
 """
+import itertools
+import secrets
 from datetime import datetime
 from enum import Enum
 from struct import Struct
-import struct
 from abc import abstractmethod, ABC
+from typing import List, Optional, Sequence, Tuple
+
+WIRE_V1 = 1
+WIRE_V2 = 2
+WIRE_V3 = 3
+WIRE_VERSION = WIRE_V3  # Newest wire version this client speaks, offered in its greetings
+
+_message_counter = itertools.count(secrets.randbits(16))
+_U64 = Struct('<Q')
 
 
 class MessageType(Enum):
@@ -15,6 +31,13 @@ class MessageType(Enum):
     GREETING = 0
     CHAT = 1
     FAREWELL = 2
+    GROUP_CHAT = 3
+    ACK = 4
+    SYNC = 5
+    HISTORY = 6
+    IMAGE = 7
+    AVATAR = 8
+    AVATAR_REQUEST = 9
 
 
 class Message:
@@ -25,12 +48,13 @@ class Message:
         self.m_type: MessageType = m_type  # Type of mag
 
     @abstractmethod
-    def to_bytes(self) -> bytes:
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
         """
         Abstract method that must be implemented in child classes
         Converts self to bytes to be sent over a socket
 
-        :returns The bytes representation of self
+        :param version: Wire version of the connection the bytes are sent on
+        :returns The bytes representation of self, framed
         """
 
 
@@ -38,16 +62,19 @@ class GreetingMessage(Message, ABC):
     """
     Message used to establish communications with a peer,
     doubly-serving as a friend request and an introduction
+    Always sent in v1, the wire version it offers sits in a byte v1 clients packed as padding, and ignore
     """
-    _greeting_format = 'B I ? ? 20p'
+    _greeting_format = 'B B 2x I ? ? 20p'
 
-    def __init__(self, color_as_int: int, username: str, ack: bool, wants_to_talk: bool = True):
+    def __init__(self, color_as_int: int, username: str, ack: bool, wants_to_talk: bool = True,
+                 version: int = WIRE_VERSION):
         super().__init__(MessageType.GREETING)
 
         self.__color: int = color_as_int  # Must be encoded and decoded into 3 bytes
         self.__username: str = username  # Must be between 3 - 20 characters
         self.ack: bool = ack  # True if this is acknowledging an original greeting
         self.wants_to_talk: bool = wants_to_talk  # True if the sender wants to comm
+        self.version: int = version  # Newest wire version the sender speaks, 0 from clients predating versions
 
     def get_hex_code(self):
         """
@@ -58,49 +85,125 @@ class GreetingMessage(Message, ABC):
     def get_username(self):
         return self.__username
 
-    def to_bytes(self) -> bytes:
-        return _pack(self._greeting_format, self.m_type.value, self.__color, self.ack,
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        return _pack(self._greeting_format, self.m_type.value, self.version, self.__color, self.ack,
                      self.wants_to_talk, self.__username.encode())
 
     @classmethod
-    def from_bytes(cls, obj_bytes: bytes):
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
         """
         Given a bytearray of the form { string size message_bytes }, returns a new GreetingMessage
         :param obj_bytes:
         :return:
         """
         param_tuple = Struct(GreetingMessage._greeting_format).unpack(obj_bytes)
-        return cls(param_tuple[1], param_tuple[4].decode('ascii'), param_tuple[2], param_tuple[3])
+        return cls(param_tuple[2], param_tuple[5].decode('ascii'), param_tuple[3], param_tuple[4], param_tuple[1])
 
 
 class ChatMessage(Message, ABC):
     """
     Actual messages sent
+    From v2 on, each carries its sequence number in the conversation, and acknowledges those received so far
+    Its message id is chosen by its writer and never changes, so copies sent again are known wherever they arrive
     """
 
-    def __init__(self, message: str, time_stamp=None):
+    def __init__(self, message: str, time_stamp=None, seq: int = 0, ack: int = 0, message_id: int = 0):
         super().__init__(MessageType.CHAT)
         self.time_stamp: float = datetime.now().timestamp() if not time_stamp else time_stamp
-        self.message_len: int = len(message)
+        self.message_len: int = len(message)  # Characters, as v1 counts them
         self.message = message
+        self.seq: int = seq  # Position in the sender's stream of chats, from 1, 0 if the sender doesn't number them
+        self.ack: int = ack  # Every chat up to this sequence number was received from the peer, 0 if none yet
+        self.message_id: int = message_id if message_id else new_message_id(self.time_stamp)
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(b''.join((bytes((self.m_type.value,)), _varint(self.seq), _varint(self.ack),
+                                       _U64.pack(self.message_id), _varint(_millis(self.time_stamp)),
+                                       _text(self.message))))
 
-    def to_bytes(self) -> bytes:
+        # Laid out as clients predating v2 read it, so chats are unnumbered and their ids are chosen by the receiver
         chat_format = 'B H f {}s'.format(self.message_len)
-        return _pack(chat_format, self.m_type.value, self.message_len,
-                     self.time_stamp, self.message.encode())
+        return _pack(chat_format, self.m_type.value, self.message_len, self.time_stamp, self.message.encode())
 
     @classmethod
-    def from_bytes(cls, obj_bytes: bytes):
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
         """
 
         :param obj_bytes: ChatMessage's bytes (received over network)
+        :param version: Wire version they were sent in
         :return: a ChatMessage object built using obj_bytes
         """
+        if version >= WIRE_V2:
+            reader = WireReader(obj_bytes)
+            seq, ack, message_id, time_stamp = reader.varint(), reader.varint(), reader.u64(), reader.millis()
+            return cls(reader.text(), time_stamp, seq, ack, message_id)
+
         message_len = Struct('H').unpack(obj_bytes[2:4])[0]
         param_tuple = Struct('B H f {}s'.format(message_len)).unpack(obj_bytes)
         return cls(param_tuple[3].decode('ascii'), param_tuple[2])
 
 
+class GroupChatMessage(Message, ABC):
+    """
+    Chat message sent to the members of a group conversation
+    Encoded once by the sender per wire version, the same frame is sent to each member speaking it
+    In relayed groups, members forward the frame on to others, origin and message_id identify it wherever it arrives
+    """
+    _header_format = 'B Q Q I B B H'  # Prefix of the full format, up to the message length
+
+    def __init__(self, group_id: int, origin: int, message_id: int, message: str, origin_name: str = '',
+                 fanout: int = 0, hops: int = 0, time_stamp=None):
+        super().__init__(MessageType.GROUP_CHAT)
+        self.group_id: int = group_id  # Random 64-bit identifier, chosen by the group's creator
+        self.origin: int = origin  # Random 64-bit identifier of the member that wrote the message
+        self.message_id: int = message_id  # Sequence number of the message, per origin
+        self.fanout: int = fanout  # Members each receiver forwards to, 0 if the group isn't relayed
+        self.hops: int = hops  # Times the message has been forwarded
+        self.origin_name: str = origin_name  # Username of the origin, shown when relayed by another member
+        self.time_stamp: float = datetime.now().timestamp() if not time_stamp else time_stamp
+        self.message_len: int = len(message)
+        self.message = message
+
+    def forwarded(self) -> 'GroupChatMessage':
+        """
+        :return: the copy of this message a member forwards on
+        """
+        return GroupChatMessage(self.group_id, self.origin, self.message_id, self.message, self.origin_name,
+                                self.fanout, self.hops + 1, self.time_stamp)
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(b''.join((bytes((self.m_type.value,)), _U64.pack(self.group_id), _U64.pack(self.origin),
+                                       _varint(self.message_id), _varint(self.fanout), _varint(self.hops),
+                                       _varint(_millis(self.time_stamp)), _text(self.origin_name),
+                                       _text(self.message))))
+
+        group_chat_format = '{} f 20p {}s'.format(self._header_format, self.message_len)
+        return _pack(group_chat_format, self.m_type.value, self.group_id, self.origin, self.message_id, self.fanout,
+                     self.hops, self.message_len, self.time_stamp, self.origin_name.encode(), self.message.encode())
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
+        """
+
+        :param obj_bytes: GroupChatMessage's bytes (received over network)
+        :param version: Wire version they were sent in
+        :return: a GroupChatMessage object built using obj_bytes
+        """
+        if version >= WIRE_V2:
+            reader = WireReader(obj_bytes)
+            group_id, origin, message_id = reader.u64(), reader.u64(), reader.varint()
+            fanout, hops, time_stamp, origin_name = reader.varint(), reader.varint(), reader.millis(), reader.text()
+            return cls(group_id, origin, message_id, reader.text(), origin_name, fanout, hops, time_stamp)
+
+        header = Struct(cls._header_format)
+        message_len = header.unpack(obj_bytes[:header.size])[6]
+        param_tuple = Struct('{} f 20p {}s'.format(cls._header_format, message_len)).unpack(obj_bytes)
+        return cls(param_tuple[1], param_tuple[2], param_tuple[3], param_tuple[9].decode('ascii'),
+                   param_tuple[8].decode('ascii'), param_tuple[4], param_tuple[5], param_tuple[7])
+
+
 class FarewellMessage(Message, ABC):
     """
     Used to close a conversation and its respective sockets
@@ -110,11 +213,13 @@ class FarewellMessage(Message, ABC):
     def __init__(self):
         super().__init__(MessageType.FAREWELL)
 
-    def to_bytes(self) -> bytes:
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(bytes((self.m_type.value,)))
         return _pack(FarewellMessage._farewell_format, self.m_type.value)
 
     @classmethod
-    def from_bytes(cls):
+    def from_bytes(cls, obj_bytes: bytes = b'', version: int = WIRE_V1):
         """
         As its an empty object (just holds m_type), return an instance of it without arguments
         :return:
@@ -122,8 +227,438 @@ class FarewellMessage(Message, ABC):
         return cls()
 
 
+class AckMessage(Message, ABC):
+    """
+    Acknowledges every chat received up to a sequence number
+    Sent when no chat is going out to carry the acknowledgement
+    """
+    _ack_format = 'B I'
+
+    def __init__(self, ack: int):
+        super().__init__(MessageType.ACK)
+        self.ack: int = ack
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(bytes((self.m_type.value,)) + _varint(self.ack))
+        return _pack(AckMessage._ack_format, self.m_type.value, self.ack)
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
+        if version >= WIRE_V2:
+            return cls(WireReader(obj_bytes).varint())
+        return cls(Struct(AckMessage._ack_format).unpack(obj_bytes)[1])
+
+
+class SyncMode(Enum):
+    """
+    What a range of a SyncMessage carries
+    """
+    FINGERPRINT = 0  # Summary of the sender's messages in the range, the receiver compares its own
+    IDS = 1  # Every message id the sender holds in the range, the receiver sends what isn't listed
+    NEED = 2  # Message ids the sender is missing, in answer to a list
+
+
+class SyncRange:
+    """
+    A range of message ids, lower bound included, upper bound excluded, and what the sender knows of it
+    """
+    __slots__ = ('lower', 'upper', 'mode', 'count', 'fingerprint', 'ids')
+    _format = Struct('Q Q I I')  # Lower, upper, mode, count of messages (or of ids listed)
+
+    def __init__(self, lower: int, upper: int, mode: SyncMode, count: int = 0, fingerprint: int = 0,
+                 ids: Sequence[int] = ()):
+        self.lower = lower
+        self.upper = upper
+        self.mode = mode
+        self.count = count if mode is SyncMode.FINGERPRINT else len(ids)
+        self.fingerprint = fingerprint
+        self.ids = ids
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            # Ids are listed in order, as varint gaps, which are far shorter than the ids themselves
+            parts = [_U64.pack(self.lower), _U64.pack(self.upper), bytes((self.mode.value,)), _varint(self.count)]
+            if self.mode is SyncMode.FINGERPRINT:
+                parts.append(_U64.pack(self.fingerprint))
+            else:
+                previous = 0
+                for message_id in sorted(self.ids):
+                    parts.append(_varint(message_id - previous))
+                    previous = message_id
+            return b''.join(parts)
+
+        head = self._format.pack(self.lower, self.upper, self.mode.value, self.count)
+        if self.mode is SyncMode.FINGERPRINT:
+            return head + Struct('Q').pack(self.fingerprint)
+        return head + Struct('{}Q'.format(self.count)).pack(*self.ids)
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, offset: int) -> Tuple['SyncRange', int]:
+        """
+        :return: the range starting at offset, in v1, and the offset following it
+        """
+        lower, upper, mode, count = cls._format.unpack_from(obj_bytes, offset)
+        offset += cls._format.size
+        mode = SyncMode(mode)
+        if mode is SyncMode.FINGERPRINT:
+            return cls(lower, upper, mode, count, Struct('Q').unpack_from(obj_bytes, offset)[0]), offset + 8
+        ids = Struct('{}Q'.format(count)).unpack_from(obj_bytes, offset)
+        return cls(lower, upper, mode, ids=ids), offset + 8 * count
+
+    @classmethod
+    def read(cls, reader: 'WireReader') -> 'SyncRange':
+        """
+        :return: the next range in v2
+        """
+        lower, upper, mode, count = reader.u64(), reader.u64(), SyncMode(reader.u8()), reader.varint()
+        if mode is SyncMode.FINGERPRINT:
+            return cls(lower, upper, mode, count, reader.u64())
+
+        ids = list()
+        message_id = 0
+        for _ in range(count):
+            message_id += reader.varint()
+            ids.append(message_id)
+        return cls(lower, upper, mode, ids=ids)
+
+
+class SyncMessage(Message, ABC):
+    """
+    One round of history reconciliation, ranges of message ids whose contents the sender summarises or lists
+    Ranges found to match are left out of the answer, so each round narrows down to where the histories differ
+    """
+    _header_format = Struct('B I')  # Type, count of ranges
+
+    def __init__(self, ranges: List[SyncRange]):
+        super().__init__(MessageType.SYNC)
+        self.ranges = ranges
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(b''.join([bytes((self.m_type.value,)), _varint(len(self.ranges))] +
+                                      [sync_range.to_bytes(version) for sync_range in self.ranges]))
+        return _frame(self._header_format.pack(self.m_type.value, len(self.ranges)) +
+                      b''.join(sync_range.to_bytes() for sync_range in self.ranges))
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
+        if version >= WIRE_V2:
+            reader = WireReader(obj_bytes)
+            return cls([SyncRange.read(reader) for _ in range(reader.varint())])
+
+        offset = cls._header_format.size
+        ranges = list()
+        for _ in range(cls._header_format.unpack_from(obj_bytes)[1]):
+            sync_range, offset = SyncRange.from_bytes(obj_bytes, offset)
+            ranges.append(sync_range)
+        return cls(ranges)
+
+
+class HistoryMessage(Message, ABC):
+    """
+    Chat messages the receiver was found to be missing, sent in bulk
+    Each is flagged with whether the sender of this message wrote it
+    """
+    _header_format = Struct('B I')  # Type, count of entries
+    _entry_format = Struct('Q f ? H')  # Message id, time stamp, written by the sender, message length
+
+    _ENTRY_BYTES = 32  # Most bytes an entry takes besides its text, in any version, and a frame besides its entries
+
+    def __init__(self, entries: List[Tuple[ChatMessage, bool]]):
+        super().__init__(MessageType.HISTORY)
+        self.entries = entries
+
+    @classmethod
+    def batches(cls, entries: List[Tuple[ChatMessage, bool]], max_entries: int,
+                max_bytes: int) -> List['HistoryMessage']:
+        """
+        Splits chats into as few messages as hold them, each of at most max_entries chats and max_bytes once framed
+        """
+        messages, batch, size = list(), list(), cls._ENTRY_BYTES
+        for entry in entries:
+            entry_size = cls._ENTRY_BYTES + len(entry[0].message.encode())
+            if batch and (len(batch) == max_entries or size + entry_size > max_bytes):
+                messages.append(cls(batch))
+                batch, size = list(), cls._ENTRY_BYTES
+            batch.append(entry)
+            size += entry_size
+        if batch:
+            messages.append(cls(batch))
+        return messages
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            parts = [bytes((self.m_type.value,)), _varint(len(self.entries))]
+            for chat, written_by_sender in self.entries:
+                parts += [_U64.pack(chat.message_id), _varint(_millis(chat.time_stamp)), bytes((written_by_sender,)),
+                          _text(chat.message)]
+            return _frame_v2(b''.join(parts))
+
+        parts = [self._header_format.pack(self.m_type.value, len(self.entries))]
+        for chat, written_by_sender in self.entries:
+            parts.append(self._entry_format.pack(chat.message_id, chat.time_stamp, written_by_sender, chat.message_len))
+            parts.append(chat.message.encode())
+        return _frame(b''.join(parts))
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
+        entries = list()
+        if version >= WIRE_V2:
+            reader = WireReader(obj_bytes)
+            for _ in range(reader.varint()):
+                message_id, time_stamp, written_by_sender = reader.u64(), reader.millis(), bool(reader.u8())
+                entries.append((ChatMessage(reader.text(), time_stamp, message_id=message_id), written_by_sender))
+            return cls(entries)
+
+        offset = cls._header_format.size
+        for _ in range(cls._header_format.unpack_from(obj_bytes)[1]):
+            message_id, time_stamp, written_by_sender, message_len = cls._entry_format.unpack_from(obj_bytes, offset)
+            offset += cls._entry_format.size
+            text = Struct('{}s'.format(message_len)).unpack_from(obj_bytes, offset)[0].decode('ascii')
+            offset += message_len
+            entries.append((ChatMessage(text, time_stamp, message_id=message_id), written_by_sender))
+        return cls(entries)
+
+
+class ImageMessage(Message, ABC):
+    """
+    One chunk of an image sent inline, images are cut into chunks so one never holds up the chats written after it
+    Every chunk carries the image's size, the first also a tiny preview, shown until the last chunk arrives
+    """
+    _header_format = 'B Q I I H H f I I'  # Prefix of the full format, up to the lengths of the preview and the data
+
+    def __init__(self, image_id: int, index: int, count: int, data: bytes, width: int = 0, height: int = 0,
+                 preview: bytes = b'', time_stamp=None):
+        super().__init__(MessageType.IMAGE)
+        self.image_id: int = image_id  # Chosen by the sender, as the message ids of chats are
+        self.index: int = index  # Position of this chunk in the image, from 0
+        self.count: int = count  # Chunks the image was cut into
+        self.width: int = width  # Pixels, as decoded by the sender
+        self.height: int = height
+        self.time_stamp: float = datetime.now().timestamp() if not time_stamp else time_stamp
+        self.preview = preview  # Encoded image of a few pixels across, empty past the first chunk
+        self.data = data  # The chunk's share of the encoded image
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(b''.join((bytes((self.m_type.value,)), _U64.pack(self.image_id), _varint(self.index),
+                                       _varint(self.count), _varint(self.width), _varint(self.height),
+                                       _varint(_millis(self.time_stamp)), _blob(self.preview), _blob(self.data))))
+
+        image_format = '{} {}s {}s'.format(self._header_format, len(self.preview), len(self.data))
+        return _pack(image_format, self.m_type.value, self.image_id, self.index, self.count, self.width, self.height,
+                     self.time_stamp, len(self.preview), len(self.data), self.preview, self.data)
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
+        """
+
+        :param obj_bytes: ImageMessage's bytes (received over network)
+        :param version: Wire version they were sent in
+        :return: an ImageMessage object built using obj_bytes
+        """
+        if version >= WIRE_V2:
+            reader = WireReader(obj_bytes)
+            image_id, index, count = reader.u64(), reader.varint(), reader.varint()
+            width, height, time_stamp, preview = reader.varint(), reader.varint(), reader.millis(), reader.blob()
+            return cls(image_id, index, count, reader.blob(), width, height, preview, time_stamp)
+
+        header = Struct(cls._header_format)
+        preview_len, data_len = header.unpack(obj_bytes[:header.size])[7:]
+        param_tuple = Struct('{} {}s {}s'.format(cls._header_format, preview_len, data_len)).unpack(obj_bytes)
+        return cls(param_tuple[1], param_tuple[2], param_tuple[3], param_tuple[10], param_tuple[4], param_tuple[5],
+                   param_tuple[9], param_tuple[6])
+
+
+class AvatarMessage(Message, ABC):
+    """
+    Names the sender's avatar by the hash of its bytes, sent once greetings are exchanged
+    Carries the bytes too only when answering an AvatarRequestMessage, peers that hold them already never ask
+    """
+    _header_format = 'B 32s I'  # Prefix of the full format, up to the length of the data
+
+    def __init__(self, digest: bytes, data: bytes = b''):
+        super().__init__(MessageType.AVATAR)
+        self.digest = digest  # SHA-256 of the encoded avatar
+        self.data = data  # The encoded avatar, empty when only naming it
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(b''.join((bytes((self.m_type.value,)), _blob(self.digest), _blob(self.data))))
+        return _pack('{} {}s'.format(self._header_format, len(self.data)), self.m_type.value, self.digest,
+                     len(self.data), self.data)
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
+        if version >= WIRE_V2:
+            reader = WireReader(obj_bytes)
+            return cls(reader.blob(), reader.blob())
+
+        header = Struct(cls._header_format)
+        data_len = header.unpack(obj_bytes[:header.size])[2]
+        param_tuple = Struct('{} {}s'.format(cls._header_format, data_len)).unpack(obj_bytes)
+        return cls(param_tuple[1], param_tuple[3])
+
+
+class AvatarRequestMessage(Message, ABC):
+    """
+    Asks a peer for the bytes of the avatar it named, sent only when no avatar with that hash is stored
+    """
+    _request_format = 'B 32s'
+
+    def __init__(self, digest: bytes):
+        super().__init__(MessageType.AVATAR_REQUEST)
+        self.digest = digest
+
+    def to_bytes(self, version: int = WIRE_V1) -> bytes:
+        if version >= WIRE_V2:
+            return _frame_v2(bytes((self.m_type.value,)) + _blob(self.digest))
+        return _pack(AvatarRequestMessage._request_format, self.m_type.value, self.digest)
+
+    @classmethod
+    def from_bytes(cls, obj_bytes: bytes, version: int = WIRE_V1):
+        if version >= WIRE_V2:
+            return cls(WireReader(obj_bytes).blob())
+        return cls(Struct(AvatarRequestMessage._request_format).unpack(obj_bytes)[1])
+
+
+class WireReader:
+    """
+    Reads the fields of a v2 payload in order, following its type byte
+    Raises ValueError, or IndexError, on a payload cut short
+    """
+    __slots__ = ('__data', '__offset')
+
+    def __init__(self, data: bytes, offset: int = 1):
+        self.__data = data
+        self.__offset = offset
+
+    def u8(self) -> int:
+        value = self.__data[self.__offset]
+        self.__offset += 1
+        return value
+
+    def u64(self) -> int:
+        value = _U64.unpack_from(self.__data, self.__offset)[0]
+        self.__offset += _U64.size
+        return value
+
+    def varint(self) -> int:
+        value, self.__offset = read_varint(self.__data, self.__offset)
+        return value
+
+    def millis(self) -> float:
+        """
+        :return: a time stamp sent as integer milliseconds, in seconds
+        """
+        return self.varint() / 1000
+
+    def text(self) -> str:
+        length = self.varint()
+        end = self.__offset + length
+        if end > len(self.__data):
+            raise ValueError('Text runs past the end of the frame')
+        value = self.__data[self.__offset:end].decode('utf-8')
+        self.__offset = end
+        return value
+
+    def blob(self) -> bytes:
+        length = self.varint()
+        end = self.__offset + length
+        if end > len(self.__data):
+            raise ValueError('Bytes run past the end of the frame')
+        value = bytes(self.__data[self.__offset:end])
+        self.__offset = end
+        return value
+
+
+def read_varint(data, offset: int = 0) -> Tuple[int, int]:
+    """
+    :param data: Bytes holding an unsigned LEB128 varint at offset
+    :return: its value, and the offset following it
+    Raises IndexError if data ends before the varint does
+    """
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1  # Most lengths and counters fit a single byte
+
+    value = byte & 0x7F
+    shift = 7
+    while True:
+        offset += 1
+        byte = data[offset]
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset + 1
+        shift += 7
+        if shift > 63:
+            raise ValueError('Varint longer than 64 bits')
+
+
+def _varint(value: int) -> bytes:
+    if value < 0x80:
+        return bytes((value,))
+
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _text(value: str) -> bytes:
+    """
+    :return: the UTF-8 bytes of value, behind their count
+    """
+    encoded = value.encode('utf-8')
+    return _varint(len(encoded)) + encoded
+
+
+def _blob(value: bytes) -> bytes:
+    """
+    :return: value, behind its length
+    """
+    return _varint(len(value)) + value
+
+
+def _millis(time_stamp: float) -> int:
+    return max(0, round(time_stamp * 1000))
+
+
+def frame_type(frame: bytes, version: int) -> Optional[MessageType]:
+    """
+    :param frame: A whole frame, length included
+    :return: the type of message it holds
+    """
+    try:
+        if version >= WIRE_V2:
+            return MessageType(frame[read_varint(frame)[1]])
+        return MessageType(frame[4])  # Type byte follows the length prefix
+    except (IndexError, ValueError):
+        return None
+
+
+def new_message_id(time_stamp: float) -> int:
+    """
+    :return: an identifier for a chat written at time_stamp, its milliseconds followed by 16 bits of a counter
+    Identifiers sort by the time their messages were written, so recent history is a contiguous range of them
+    The counter starts at random, so chats one writer sends in the same millisecond differ, and rarely another's
+    """
+    return (int(time_stamp * 1000) << 16 | next(_message_counter) & 0xFFFF) & 0xFFFFFFFFFFFFFFFF
+
+
 def _pack(format_str: str, *packed_args) -> bytes:
     # Convert greeting msg to bytearray
     message_bytes: bytes = Struct(format_str).pack(*packed_args)
     # Insert 4 bytes of length at beginning
-    return Struct('I').pack(struct.calcsize(format_str)) + message_bytes
+    return _frame(message_bytes)
+
+
+def _frame(message_bytes: bytes) -> bytes:
+    return Struct('I').pack(len(message_bytes)) + message_bytes
+
+
+def _frame_v2(message_bytes: bytes) -> bytes:
+    return _varint(len(message_bytes)) + message_bytes
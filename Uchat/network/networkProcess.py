@@ -0,0 +1,304 @@
+"""
+Runs the networking core in a child process, so decoding and painting no longer share an interpreter and its GIL
+The child sends what the UI shows as events, batched once per selector wake-up, and the UI sends back commands, each
+direction through a ring in shared memory. Peers are named across the two processes by numbers both sides agree on
+"""
+import multiprocessing
+import pickle
+import selectors
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from Uchat.client import Client, ClientListener
+from Uchat.helper import metrics
+from Uchat.helper.log import get_logger, setup_logging
+from Uchat.model.conversation import Conversation, ConversationListener
+from Uchat.model.groupConversation import GroupConversation
+from Uchat.model.inlineImage import InlineImage
+from Uchat.network.sharedRing import Channel, SharedRing
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+
+_log = get_logger('network.process')
+_batches = metrics.counter('uchat_ipc_batches_total', 'Batches of events the network process sent the UI')
+_events = metrics.counter('uchat_ipc_events_total', 'Events the network process sent the UI')
+
+_BATCH_EVENTS = 256  # Events per record, so the history of a reconnection never outgrows the ring
+_STOP_TIMEOUT = 5  # Seconds the network process is given to say farewell to every peer before it's killed
+
+PeerRef = Tuple[int, Tuple[str, int], bool, str, str, str]  # Number, address, is self, username, colour, avatar
+
+
+class PeerTable:
+    """
+    Peers known to both processes, each under a number agreed on by both
+    The network process numbers the peers it learns of evenly, the UI oddly, and this user is 0
+    References carry the peer's details, so the other process can build the peer, or update its own copy
+    """
+
+    def __init__(self, personal: Peer, first: int):
+        self.__peers: Dict[int, Peer] = {0: personal}
+        self.__numbers: Dict[Peer, int] = {personal: 0}
+        self.__next = first
+
+    def ref(self, peer: Peer) -> PeerRef:
+        if (number := self.__numbers.get(peer)) is None:
+            number = self.__next
+            self.__next += 2
+            self.bind(peer, number)
+        return number, peer.address(), peer.is_self(), peer.username(), peer.color(), peer.avatar()
+
+    def bind(self, peer: Peer, number: int):
+        """
+        Numbers a peer as the other process did
+        """
+        self.__peers[number] = peer
+        self.__numbers[peer] = number
+
+    def peer(self, ref: PeerRef) -> Peer:
+        """
+        :return: the peer referenced, built on first reference and kept up to date after
+        """
+        number, address, is_self, username, color, avatar = ref
+        if (peer := self.__peers.get(number)) is None:
+            peer = Peer(tuple(address), is_self, username, color, avatar)
+            self.bind(peer, number)
+        else:
+            peer.username(username)
+            peer.color(color)
+            peer.avatar(avatar)
+        return peer
+
+
+class _Bridge(ClientListener, ConversationListener):
+    """
+    Turns the client's events into batches for the UI, and the UI's commands into calls on the client
+    Events are batched until the network thread is done with a wake-up, those raised from other threads are sent at once
+    """
+
+    def __init__(self, client: Client, personal: Peer, events: Channel):
+        self.__client = client
+        self.__events = events
+        self.__peers = PeerTable(personal, 2)
+        self.__lock = threading.Lock()
+        self.__pending: List[Tuple] = list()
+        self.__loop_thread = threading.get_ident()
+        self.__requested: Dict[Peer, TcpSocket] = dict()  # Peer -> socket of a connection awaiting the user
+        self.__group_number: Optional[int] = None  # Number the UI gave the group being created, to bind its peer to
+        self.running = True
+
+        client.add_listener(self)
+        self.__commands: Dict[str, Callable] = {
+            'create_conversation': self.__create_conversation,
+            'send_greeting': lambda ref, ack, wants_to_talk: client.send_greeting(self.__peer(ref), ack, wants_to_talk),
+            'create_group': self.__create_group,
+            'accept_connection': self.__accept_connection,
+            'reject_connection': lambda ref: client.reject_connection(self.__peer(ref)),
+            'send_farewell': lambda ref: client.send_farewell(self.__peer(ref)),
+            'delete_conversation': lambda ref: client.delete_conversation(self.__peer(ref)),
+            'send_chat': lambda ref, chat: client.send_chat(self.__peer(ref), chat),
+            'send_image': lambda ref, *image: client.send_image(self.__peer(ref), *image),
+            'destroy': self.__destroy
+        }
+
+    def command(self, record: bytes):
+        name, args = pickle.loads(record)
+        self.__commands[name](*args)
+
+    def flush(self):
+        """
+        Sends the events raised since last flushed to the UI
+        """
+        with self.__lock:
+            batch, self.__pending = self.__pending, list()
+        if batch:
+            _batches.inc()
+            _events.inc(len(batch))
+            self.__events.send([pickle.dumps(batch[start:start + _BATCH_EVENTS], pickle.HIGHEST_PROTOCOL)
+                                for start in range(0, len(batch), _BATCH_EVENTS)])
+
+    def __emit(self, *event):
+        with self.__lock:
+            self.__pending.append(event)
+        if threading.get_ident() != self.__loop_thread:
+            self.flush()
+
+    def __peer(self, ref) -> Peer:
+        return self.__peers.peer(ref)
+
+    def __ref(self, peer: Peer) -> PeerRef:
+        return self.__peers.ref(peer)
+
+    # Commands
+
+    def __create_conversation(self, ref: PeerRef):
+        if not self.__client.conversation(peer := self.__peer(ref)):
+            self.__client.create_conversation(peer, None)
+
+    def __create_group(self, member_refs: List[PeerRef], group_ref: PeerRef, group_id: Optional[int],
+                       name: Optional[str], relay_fanout: int):
+        self.__group_number = group_ref[0]
+        try:
+            self.__client.create_group([self.__peer(ref) for ref in member_refs], group_id, name, relay_fanout)
+        finally:
+            self.__group_number = None
+
+    def __accept_connection(self, ref: PeerRef):
+        peer = self.__peer(ref)
+        if sock := self.__requested.pop(peer, None):
+            self.__client.accept_connection(peer, sock)
+
+    def __destroy(self):
+        self.__client.destroy()
+        self.__emit('stopped', time.process_time())
+        self.running = False
+
+    # Client listener
+
+    def friend_added(self, peer: Peer):
+        self.__emit('friend', self.__ref(peer))
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        self.__requested[peer] = sock
+        self.__emit('requested', self.__ref(peer))
+
+    def chat_started(self, peer: Peer):
+        self.__emit('started', self.__ref(peer))
+
+    def chat_received(self, peer: Peer):
+        self.__emit('received', self.__ref(peer))
+
+    def peer_discovered(self, peer: Peer):
+        self.__emit('discovered', self.__ref(peer))
+        self.__emit('nearby', [self.__ref(neighbour) for neighbour in self.__client.nearby_peers()])
+
+    def peer_lost(self, peer: Peer):
+        self.__emit('lost', self.__ref(peer))
+        self.__emit('nearby', [self.__ref(neighbour) for neighbour in self.__client.nearby_peers()])
+
+    def conversation_created(self, peer: Peer, conversation: Union[Conversation, GroupConversation]):
+        if self.__group_number is not None and isinstance(conversation, GroupConversation):
+            self.__peers.bind(peer, self.__group_number)
+        conversation.add_listener(self)
+        self.__emit('created', self.__ref(peer), conversation.state(), isinstance(conversation, GroupConversation))
+
+    def conversation_deleted(self, peer: Peer):
+        self.__requested.pop(peer, None)
+        self.__emit('deleted', self.__ref(peer))
+
+    def image_received(self, peer: Peer, image: InlineImage):
+        self.__emit('image', self.__ref(peer), image.image_id)
+
+    def avatar_received(self, peer: Peer, digest: str):
+        self.__emit('avatar', self.__ref(peer), digest)
+
+    # Conversation listener
+
+    def chat_message_added(self, conversation: Union[Conversation, GroupConversation], index: int):
+        context = conversation.chat_message_contexts()[index]
+        self.__emit('chat', self.__ref(conversation.peer()), context.msg, self.__ref(context.sender), context.delivery)
+
+    def state_changed(self, conversation: Conversation, old_state):
+        self.__emit('state', self.__ref(conversation.peer()), conversation.state())
+
+    def delivery_changed(self, conversation: Conversation, index: int):
+        context = conversation.chat_message_contexts()[index]
+        self.__emit('delivery', self.__ref(conversation.peer()), index, context.delivery)
+
+
+def serve(factory: Callable[[selectors.BaseSelector, Peer], Client], personal: Peer, events_ring: str,
+          events_wake: socket.socket, commands_ring: str, commands_wake: socket.socket):
+    """
+    Entry point of the network process, runs the client until the UI destroys it or goes away
+    :param factory: Builds the client, given the selector driving it and this user
+    """
+    setup_logging()
+    selector = selectors.DefaultSelector()
+    client = factory(selector, personal)
+    events = Channel(SharedRing(events_ring), events_wake)
+    commands = Channel(SharedRing(commands_ring), commands_wake)
+    bridge = _Bridge(client, personal, events)
+    selector.register(commands, selectors.EVENT_READ, data=None)
+    _log.info('Network process started')
+
+    while bridge.running and not commands.is_closed():
+        try:
+            for key, mask in selector.select(timeout=client.run_timers()):
+                if not bridge.running:
+                    break  # Destroyed by a command earlier in the batch, the sockets left in it are freed
+                if key.fileobj is commands:
+                    for record in commands.receive():
+                        bridge.command(record)
+                else:
+                    client.handle_connection(key.fileobj, mask)
+        except socket.error:
+            client.destroy()
+            break
+        bridge.flush()
+
+    bridge.flush()
+    events.close()
+    commands.close()
+
+
+class NetworkProcess:
+    """
+    The UI's handle on the network process, sending it commands and handing each batch of its events over
+    """
+
+    def __init__(self, factory: Callable[[selectors.BaseSelector, Peer], Client], personal: Peer,
+                 on_batch: Callable[[List[Tuple]], None]):
+        """
+        :param factory: Builds the client in the network process, must be a module-level function
+        :param personal: Peer information pertaining to this user
+        :param on_batch: Called with each batch of events, from a thread waiting on the network process
+        """
+        self.__events, events_ring, events_wake = Channel.pair()
+        self.__commands, commands_ring, commands_wake = Channel.pair()
+        self.__commands_lock = threading.Lock()  # The UI sends from its own thread, and from the waiting one
+
+        # Spawned, as a fork would copy whatever threads and toolkit state the UI's process already has
+        context = multiprocessing.get_context('spawn')
+        self.__process = context.Process(target=serve, name='uchat-network', daemon=True,
+                                         args=(factory, personal, events_ring, events_wake, commands_ring,
+                                               commands_wake))
+        self.__process.start()
+        events_wake.close()
+        commands_wake.close()
+
+        self.__on_batch = on_batch
+        self.__waiter = threading.Thread(target=self.__wait, name='uchat-network-events', daemon=True)
+        self.__waiter.start()
+
+    def call(self, name: str, *args):
+        """
+        Has the network process run a command
+        """
+        with self.__commands_lock:
+            if not self.__commands.is_closed():
+                self.__commands.send([pickle.dumps((name, args), pickle.HIGHEST_PROTOCOL)])
+
+    def __wait(self):
+        while not self.__events.is_closed():
+            self.__events.wait()
+            for record in self.__events.receive():
+                self.__on_batch(pickle.loads(record))
+        _log.info('Network process exited')
+
+    def stop(self):
+        """
+        Destroys the client in the network process, waiting for it to say farewell before ending the process
+        """
+        self.call('destroy')
+        self.__process.join(_STOP_TIMEOUT)
+        if self.__process.is_alive():
+            self.__process.terminate()
+        self.__waiter.join(_STOP_TIMEOUT)
+        with self.__commands_lock:
+            self.__commands.close()
+        self.__events.close()
+
+    def pid(self) -> Optional[int]:
+        return self.__process.pid
@@ -0,0 +1,155 @@
+"""
+Flood protection, limiting the frames each connection, and each remote IP, may have decoded per second
+Frames are admitted once whole, but before their payload is decoded, so a flooding peer costs little more than the
+reads themselves. Frames over the limit are dropped, left unread until the peer is back within it, or end the connection
+"""
+import threading
+import time
+import weakref
+from enum import Enum
+from typing import Dict, Optional
+
+from Uchat.helper import metrics
+from Uchat.helper.globals import RATE_LIMIT_POLICY, RATE_LIMIT_FRAMES, RATE_LIMIT_BURST, RATE_LIMIT_IP_FRAMES, \
+    RATE_LIMIT_IP_BURST
+from Uchat.helper.log import get_logger
+
+_log = get_logger('network.rate_limit')
+
+
+class RatePolicy(Enum):
+    """
+    What is done with a frame over the limit
+    """
+    DROP = 'drop'  # Discarded undecoded
+    DELAY = 'delay'  # Left unread, and the socket with it, so the peer is slowed by its own send buffer filling
+    DISCONNECT = 'disconnect'  # The connection is closed
+
+
+_limited = {(scope, policy): metrics.counter('uchat_rate_limited_frames_total', 'Frames over a rate limit, by the '
+                                             'limit hit and the policy applied', scope=scope, policy=policy.value)
+            for scope in ('connection', 'ip') for policy in RatePolicy}
+
+
+class TokenBucket:
+    """
+    Refills at a steady rate up to its burst, each frame admitted takes a token
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp', '__weakref__')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # Tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def wait(self, now: float) -> float:
+        """
+        :return: seconds until a token is available, 0 if one is
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        """
+        :return: whether the bucket refilled completely, and so is no different from a new one
+        """
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """
+    Limits shared by a client's connections, and the bucket of every remote IP they come from
+    """
+
+    def __init__(self, policy: RatePolicy = RatePolicy(RATE_LIMIT_POLICY), rate: float = RATE_LIMIT_FRAMES,
+                 burst: float = RATE_LIMIT_BURST, ip_rate: float = RATE_LIMIT_IP_FRAMES,
+                 ip_burst: float = RATE_LIMIT_IP_BURST):
+        """
+        :param policy: What is done with frames over either limit
+        :param rate: Frames per second each connection may have decoded, sustained
+        :param burst: Frames each connection may have decoded at once, after a quiet spell
+        :param ip_rate: Frames per second every connection from one IP may have decoded, together
+        :param ip_burst: Frames every connection from one IP may have decoded at once, together
+        """
+        self.__policy = policy
+        self.__rate = (rate, burst)
+        self.__ip_rate = (ip_rate, ip_burst)
+        self.__lock = threading.Lock()
+        self.__ips: Dict[str, TokenBucket] = dict()  # Remote IP -> bucket, until it refills
+        self.__held = weakref.WeakValueDictionary()  # Remote IP -> bucket, while a connection from it is open
+
+    def connection(self, ip: str) -> 'ConnectionLimit':
+        """
+        :param ip: Remote IP of a new connection
+        :return: the limit its frames are admitted through
+        """
+        now = time.monotonic()
+        with self.__lock:
+            # Buckets that refilled are no different from new ones, they are kept only while a connection holds them
+            for idle in [address for address, bucket in self.__ips.items() if bucket.is_full(now)]:
+                del self.__ips[idle]
+            if not (ip_bucket := self.__ips.get(ip) or self.__held.get(ip)):
+                ip_bucket = TokenBucket(*self.__ip_rate)
+            self.__ips[ip] = self.__held[ip] = ip_bucket
+        return ConnectionLimit(ip, self.__policy, TokenBucket(*self.__rate), ip_bucket)
+
+    # Getters
+
+    def policy(self) -> RatePolicy:
+        return self.__policy
+
+
+class ConnectionLimit:
+    """
+    Admits one connection's frames, through its own bucket and its IP's
+    Only used by the network thread, as are the IP buckets it shares with other connections
+    """
+
+    def __init__(self, ip: str, policy: RatePolicy, bucket: TokenBucket, ip_bucket: TokenBucket):
+        self.__ip = ip
+        self.__policy = policy
+        self.__bucket = bucket
+        self.__ip_bucket = ip_bucket
+        self.__delay = 0.0
+        self.__exceeded = False
+
+    def admit(self) -> bool:
+        """
+        Takes a token for a frame from both buckets, if both have one
+        :return: whether the frame may be decoded, if not the policy says what is done with it
+        """
+        now = time.monotonic()
+        own_wait = self.__bucket.wait(now)
+        ip_wait = self.__ip_bucket.wait(now)
+        if not (own_wait or ip_wait):
+            self.__bucket.tokens -= 1
+            self.__ip_bucket.tokens -= 1
+            self.__delay = 0.0
+            return True
+
+        _limited[('connection' if own_wait >= ip_wait else 'ip', self.__policy)].inc()
+        if self.__policy is RatePolicy.DELAY:
+            self.__delay = max(own_wait, ip_wait)
+        elif self.__policy is RatePolicy.DISCONNECT and not self.__exceeded:
+            self.__exceeded = True
+            _log.warning('%s went over its rate limit, disconnecting', self.__ip)
+        return False
+
+    # Getters
+
+    def policy(self) -> RatePolicy:
+        return self.__policy
+
+    def delay(self) -> Optional[float]:
+        """
+        :return: seconds reading should pause for, if the last frame was delayed
+        """
+        return self.__delay or None
+
+    def exceeded(self) -> bool:
+        """
+        :return: whether a frame went over the limit, and the connection is to be closed
+        """
+        return self.__exceeded
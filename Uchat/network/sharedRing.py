@@ -0,0 +1,213 @@
+"""
+One-way channel between two processes, records copied through a ring buffer in shared memory
+The producer appends records and, once per batch, writes a byte to a socket pair the consumer waits on, so signalling
+costs a single system call however many records a batch holds, and the records themselves never cross a pipe
+"""
+import socket
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import IPC_RING_BYTES
+
+_HEADER = struct.Struct('QQ')  # Bytes ever written, bytes ever read, the consumer and producer each own one
+_LENGTH = struct.Struct('I')
+_WRAP = 0xFFFFFFFF  # Length marking the rest of the ring as unused, the record following it starts at the beginning
+_FULL_WAIT = 0.001  # Seconds a producer sleeps while the ring is full, waiting on the consumer
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attaches to a segment the other process created, leaving that process to remove it
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before 3.13 attaching registers the segment with the resource tracker, which a spawned process shares with
+        # the one that spawned it, so the registration is the creator's own, dropped once the creator unlinks
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedRing:
+    """
+    Single producer, single consumer ring of length-prefixed records
+    Each side only ever writes its own counter, after the bytes it covers, so neither needs a lock
+    """
+
+    def __init__(self, name: Optional[str] = None, capacity: int = IPC_RING_BYTES):
+        """
+        :param name: Name of a ring the other process created, None to create one
+        :param capacity: Bytes of records the ring holds, when creating it
+        """
+        self.__owner = name is None
+        self.__memory = shared_memory.SharedMemory(create=True, size=_HEADER.size + capacity) if self.__owner \
+            else _attach(name)
+        self.__buffer = self.__memory.buf
+        self.__capacity = self.__memory.size - _HEADER.size
+        if self.__owner:
+            _HEADER.pack_into(self.__buffer, 0, 0, 0)
+
+    def put(self, record: bytes) -> bool:
+        """
+        Appends a record, if there is room for it
+        :return: whether it was appended, False while the ring is full
+        """
+        need = _LENGTH.size + len(record)
+        written, read = _HEADER.unpack_from(self.__buffer, 0)
+        offset = written % self.__capacity
+        tail = self.__capacity - offset
+        skip = tail if tail < need else 0  # Records are never split, one that doesn't fit starts at the beginning
+        if self.__capacity - (written - read) < skip + need:
+            return False
+
+        if skip:
+            if tail >= _LENGTH.size:
+                _LENGTH.pack_into(self.__buffer, _HEADER.size + offset, _WRAP)
+            offset = 0
+        start = _HEADER.size + offset
+        _LENGTH.pack_into(self.__buffer, start, len(record))
+        self.__buffer[start + _LENGTH.size:start + need] = record
+        struct.pack_into('Q', self.__buffer, 0, written + skip + need)  # Published only once the record is whole
+        return True
+
+    def take(self) -> List[bytes]:
+        """
+        :return: every record appended since last taken, oldest first
+        """
+        written, read = _HEADER.unpack_from(self.__buffer, 0)
+        records = list()
+        while read < written:
+            offset = read % self.__capacity
+            tail = self.__capacity - offset
+            length = _LENGTH.unpack_from(self.__buffer, _HEADER.size + offset)[0] if tail >= _LENGTH.size else _WRAP
+            if length == _WRAP:
+                read += tail
+                continue
+
+            start = _HEADER.size + offset + _LENGTH.size
+            records.append(bytes(self.__buffer[start:start + length]))
+            read += _LENGTH.size + length
+        struct.pack_into('Q', self.__buffer, 8, read)
+        return records
+
+    def fits(self, record: bytes) -> bool:
+        """
+        :return: whether the record could ever be appended, rings hold records up to half their capacity
+        """
+        return _LENGTH.size + len(record) <= self.__capacity // 2
+
+    def name(self) -> str:
+        return self.__memory.name
+
+    def close(self):
+        """
+        Detaches from the ring, removing it once the side that created it is done
+        """
+        self.__buffer.release()
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
+
+
+class Channel:
+    """
+    A ring and the socket pair its consumer is woken through, either end usable from its own process
+    """
+
+    def __init__(self, ring: SharedRing, wake: socket.socket):
+        self.__ring = ring
+        self.__wake = wake
+        self.__wake.setblocking(False)
+        self.__closed = False
+
+    @staticmethod
+    def pair(capacity: int = IPC_RING_BYTES) -> Tuple['Channel', str, socket.socket]:
+        """
+        Creates a channel in this process, the producer or consumer end, as the other process attaches to it
+        :return: this process's end, and the ring name and socket the other process's end is built from
+        """
+        near, far = socket.socketpair()
+        ring = SharedRing(capacity=capacity)
+        return Channel(ring, near), ring.name(), far
+
+    def send(self, records: List[bytes]) -> bool:
+        """
+        Appends a batch of records, waiting on the consumer while the ring is full, then wakes it once
+        :return: whether the consumer is still there
+        """
+        for record in records:
+            if not self.__ring.fits(record):
+                print_err(4, "Dropped a record of {} bytes, too large for the shared ring".format(len(record)))
+                continue
+            while not self.__ring.put(record):
+                if self.__closed or self.__consumer_gone():
+                    self.__closed = True
+                    return False
+                time.sleep(_FULL_WAIT)
+
+        try:
+            self.__wake.send(b'\0')
+        except BlockingIOError:
+            pass  # The consumer has wake-ups pending already
+        except OSError:
+            self.__closed = True
+        return not self.__closed
+
+    def __consumer_gone(self) -> bool:
+        """
+        :return: whether the consumer's end of the wake socket closed, as it does when its process exits
+        """
+        try:
+            return not self.__wake.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    def receive(self) -> List[bytes]:
+        """
+        Takes every record sent so far, to be called once the wake socket is readable
+        """
+        try:
+            while self.__wake.recv(4096):
+                pass
+            self.__closed = True  # The producer's process is gone
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.__closed = True
+        return self.__ring.take()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the producer wakes this end, for consumers without a selector
+        :return: whether woken, False on timing out
+        """
+        self.__wake.settimeout(timeout)
+        try:
+            if not self.__wake.recv(1, socket.MSG_PEEK):
+                self.__closed = True
+            return True
+        except socket.timeout:
+            return False
+        except OSError:
+            self.__closed = True
+            return True
+        finally:
+            self.__wake.setblocking(False)
+
+    def is_closed(self) -> bool:
+        """
+        :return: whether the other end's process is gone
+        """
+        return self.__closed
+
+    def fileno(self) -> int:
+        return self.__wake.fileno()
+
+    def close(self):
+        self.__closed = True
+        self.__wake.close()
+        self.__ring.close()
@@ -3,11 +3,191 @@ Sets forth abstractions on TCP communications
 """
 from __future__ import annotations
 import socket
+import ssl
 import struct
-from typing import Optional, Tuple
+import threading
+from collections import deque
+from typing import Optional, Tuple, Callable, Deque, List
 
+from Uchat.helper import metrics
 from Uchat.helper.error import print_err
-from Uchat.network.messages.message import GreetingMessage, MessageType, Message, ChatMessage, FarewellMessage
+from Uchat.helper.globals import FRAME_MAX_BYTES
+from Uchat.helper.log import get_logger
+from Uchat.network import capture
+from Uchat.network.rateLimit import ConnectionLimit, RatePolicy
+from Uchat.network.messages.message import GreetingMessage, MessageType, Message, ChatMessage, FarewellMessage, \
+    GroupChatMessage, AckMessage, SyncMessage, HistoryMessage, ImageMessage, AvatarMessage, AvatarRequestMessage, \
+    WIRE_V1, WIRE_V2, WIRE_VERSION, read_varint, frame_type
+
+_log = get_logger('network.tcp')
+_bytes_in = metrics.counter('uchat_tcp_bytes_total', 'Bytes moved over conversation sockets', direction='in')
+_bytes_out = metrics.counter('uchat_tcp_bytes_total', 'Bytes moved over conversation sockets', direction='out')
+_frames_in = {m_type: metrics.counter('uchat_tcp_frames_total', 'Frames moved over conversation sockets',
+                                      direction='in', type=m_type.name.lower()) for m_type in MessageType}
+_frames_out = {m_type: metrics.counter('uchat_tcp_frames_total', 'Frames moved over conversation sockets',
+                                       direction='out', type=m_type.name.lower()) for m_type in MessageType}
+_errors = {op: metrics.counter('uchat_tcp_errors_total', 'Failed socket operations', op=op)
+           for op in ('connect', 'send', 'recv', 'decode')}
+_oversized = metrics.counter('uchat_rate_limited_frames_total', 'Frames over a rate limit, by the limit hit and the '
+                             'policy applied', scope='size', policy=RatePolicy.DISCONNECT.value)
+
+# Sends from the queue, and reads of sockets reported readable, must never wait, regardless of the socket's timeout
+_DONT_WAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+_RECV_SIZE = 1 << 16  # Bytes read from the socket at once
+_LENGTH_PREFIX = struct.Struct('I')
+
+
+def next_frame(buffer: bytearray, version: int = WIRE_V1) -> Optional[bytes]:
+    """
+    :param buffer: Bytes received on a stream, possibly holding partial or several frames
+    :param version: Wire version the stream is framed in
+    :return: the payload of the next whole frame in buffer, removed from it, if one has arrived
+    """
+    if not (bounds := _frame_bounds(buffer, version)):
+        return None
+
+    frame = bytes(buffer[bounds[0]:bounds[1]])
+    del buffer[:bounds[1]]
+    return frame
+
+
+def drop_oversized(buffer: bytearray, version: int = WIRE_V1) -> bool:
+    """
+    Empties buffer if its next frame is longer than any a peer may send, as such frames are never read
+    :return: whether a frame was dropped, and the connection it arrived on is to be closed
+    """
+    if not (header := _frame_header(buffer, version)) or header[0] <= FRAME_MAX_BYTES:
+        return False
+
+    _oversized.inc()
+    _log.warning('Peer declared a frame of %d bytes, longer than %d, disconnecting', header[0], FRAME_MAX_BYTES)
+    buffer.clear()
+    return True
+
+
+def _frame_header(buffer: bytearray, version: int) -> Optional[Tuple[int, int]]:
+    """
+    :return: the length of the next frame in buffer and where its payload starts, if its length has arrived
+    """
+    if version >= WIRE_V2:
+        try:
+            return read_varint(buffer)
+        except IndexError:
+            return None  # The length itself hasn't fully arrived
+    if len(buffer) < _LENGTH_PREFIX.size:
+        return None
+    return _LENGTH_PREFIX.unpack_from(buffer)[0], _LENGTH_PREFIX.size
+
+
+def _frame_bounds(buffer: bytearray, version: int) -> Optional[Tuple[int, int]]:
+    """
+    :return: where the payload of the next frame in buffer starts and ends, if the whole frame has arrived
+    """
+    if not (header := _frame_header(buffer, version)) or header[0] > FRAME_MAX_BYTES:
+        return None
+
+    end = header[1] + header[0]
+    return (header[1], end) if len(buffer) >= end else None
+
+
+def read_frames(buffer: bytearray, wire: WireNegotiation, limit: Optional[ConnectionLimit],
+                record: Optional[Callable[[bytes, int], None]] = None) -> List[Optional[Message]]:
+    """
+    Decodes the whole frames in buffer, removing them from it, as far as the rate limit admits them
+    Frames the limit delays are left in buffer, those it drops are removed undecoded
+    :param wire: Versions of the connection the frames arrived on
+    :param limit: Rate limit of the connection, if it has one
+    :param record: Called with each frame admitted and the version it's read in, before it's decoded
+    :return: the messages decoded, possibly none
+    """
+    messages = list()
+    while bounds := _frame_bounds(buffer, wire.recv_version):
+        if limit and not limit.admit():
+            if limit.policy() is not RatePolicy.DROP:
+                break  # Delayed, or the connection is being closed
+            del buffer[:bounds[1]]
+            continue
+
+        frame = bytes(buffer[bounds[0]:bounds[1]])
+        del buffer[:bounds[1]]
+        if record:
+            record(frame, wire.recv_version)
+        messages.append(decode_message(frame, wire.recv_version))
+        wire.received(messages[-1])  # Frames after a greeting may be in the version it agreed
+    return messages
+
+
+def decode_message(message_bytes: bytes, version: int = WIRE_V1) -> Optional[Message]:
+    """
+    :param message_bytes: Payload of a frame, following its length prefix
+    :param version: Wire version the frame was sent in
+    :return: the message it holds, if it can be decoded
+    """
+    try:
+        message_type = MessageType(message_bytes[0])
+        _frames_in[message_type].inc()
+
+        # Parse bytes to rebuild mag
+        if message_type is MessageType.GREETING:
+            return GreetingMessage.from_bytes(message_bytes)
+        elif message_type is MessageType.CHAT:
+            return ChatMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.FAREWELL:
+            return FarewellMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.GROUP_CHAT:
+            return GroupChatMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.ACK:
+            return AckMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.SYNC:
+            return SyncMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.HISTORY:
+            return HistoryMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.IMAGE:
+            return ImageMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.AVATAR:
+            return AvatarMessage.from_bytes(message_bytes, version)
+        elif message_type is MessageType.AVATAR_REQUEST:
+            return AvatarRequestMessage.from_bytes(message_bytes, version)
+        else:
+            return None
+    except (struct.error, ValueError, IndexError) as decode_err:
+        _errors['decode'].inc()
+        print_err(3, "Unable to decode bytes on listening socket.\n" + str(decode_err))
+        return None
+
+
+class WireNegotiation:
+    """
+    Wire versions one connection is sent and read in, agreed through the greetings exchanged over it
+    Frames following a received greeting that offers v2 are read in v2, as its sender has already sent its own greeting
+    Frames are sent in v2 once this side has both sent its greeting and received one offering v2
+    """
+
+    def __init__(self):
+        self.send_version = WIRE_V1
+        self.recv_version = WIRE_V1
+        self.__greeted = False  # Whether this side sent its greeting
+
+    def sent(self, frame: bytes):
+        """
+        Notes a frame as it's sent, looking for this side's greeting
+        """
+        if not self.__greeted and frame_type(frame, WIRE_V1) is MessageType.GREETING:
+            self.__greeted = True
+            self.__agree()
+
+    def received(self, message: Optional[Message]):
+        """
+        Notes a message as it's decoded, before the frames following it are
+        """
+        if message and message.m_type is MessageType.GREETING and message.version >= WIRE_V2:
+            self.recv_version = min(message.version, WIRE_VERSION)
+            self.__agree()
+
+    def __agree(self):
+        if self.__greeted and self.recv_version >= WIRE_V2:
+            self.send_version = self.recv_version
+
 
 class TcpSocket:
     """
@@ -28,6 +208,18 @@ class TcpSocket:
         # Address of socket; '' means the socket should bind to any appropriate interface
         self.__address = ('', port if port else self.__sock.getsockname()[1])
 
+        # Frames waiting for room in the kernel's send buffer, each with a callback run once it is fully sent
+        self.__send_queue: Deque[List] = deque()
+        self.__send_lock = threading.Lock()
+        self.__dont_wait = _DONT_WAIT  # TLS sockets take no flags, they are made non-blocking instead
+
+        # Bytes received but not yet decoded, frames may arrive split over several reads or several in one
+        self.__recv_buffer = bytearray()
+        self.__closed = False  # Whether the peer closed its end, or the connection went over its rate limit
+        self.__wire = WireNegotiation()
+        self.__limit: Optional[ConnectionLimit] = None
+        self.__capture_id = 0  # Number of the connection in the capture file, once a frame of it is recorded
+
     def listen(self):
         """
         Binds the socket to its address and listens for incoming messages
@@ -37,7 +229,7 @@ class TcpSocket:
             self.__sock.bind(self.__address)
             self.__sock.setblocking(False)
             self.__sock.listen()
-            print('Client listening on: {}'.format(self.__address))
+            _log.info('Listening on %s', self.__address)
         except OSError as os_err:
             print_err(2, "Error raised on attempt to establish listening socket\n" + str(os_err))
 
@@ -50,14 +242,15 @@ class TcpSocket:
         """
         try:
             self.__sock.connect(conn_addr)
-            print('New connection: \n L {} -> R {}'.format(
-                self.get_local_addr(), self.get_remote_addr()))
+            _log.info('New connection L %s -> R %s', self.get_local_addr(), self.get_remote_addr())
             return True
         except InterruptedError as int_err:
+            _errors['connect'].inc()
             print_err(2, "Connection time-out. Failure to connect to host: {}\n".format(
                 self.get_remote_addr()) + str(int_err))
             return False
         except OSError as os_err:
+            _errors['connect'].inc()
             print_err(2, "Failure to connect to host: {}\n".format(self.get_remote_addr()) + str(os_err))
             return False
 
@@ -68,35 +261,233 @@ class TcpSocket:
         """
         try:
             self.__sock.sendall(message)
+            _bytes_out.inc(len(message))
+            if m_type := frame_type(message, self.__wire.send_version):
+                _frames_out[m_type].inc()
+            self.__wire.sent(message)
         except OSError as os_err:
+            _errors['send'].inc()
             print_err(2, "Failure to send {}... to peer\n".format(message[:10]) + str(os_err))
 
+    def queue_bytes(self, message: bytes, on_sent: Optional[Callable[[bool], None]] = None) -> bool:
+        """
+        Sends as much of message as the kernel accepts without blocking, queueing the rest
+        The same bytes object may be queued on many sockets, it is never copied
+
+        :param message: Frame to send
+        :param on_sent: Called with True once the whole frame is handed to the kernel, or False if the socket fails
+        :return: whether bytes remain queued, in which case flush must be called once the socket is writable
+        """
+        if m_type := frame_type(message, self.__wire.send_version):
+            _frames_out[m_type].inc()
+        self.__wire.sent(message)
+
+        with self.__send_lock:
+            self.__send_queue.append([memoryview(message), on_sent])
+            return self.__flush()
+
+    def flush(self) -> bool:
+        """
+        Sends queued frames, until the kernel's send buffer is full
+        :return: whether bytes remain queued
+        """
+        with self.__send_lock:
+            return self.__flush()
+
+    def __flush(self) -> bool:
+        while self.__send_queue:
+            entry = self.__send_queue[0]
+            try:
+                sent = self.__sock.send(entry[0], self.__dont_wait)
+            except (BlockingIOError, socket.timeout, ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                return True
+            except OSError as os_err:
+                _errors['send'].inc()
+                print_err(2, "Failure to send queued frames to peer\n" + str(os_err))
+                failed = list(self.__send_queue)
+                self.__send_queue.clear()
+                for _, on_sent in failed:
+                    if on_sent:
+                        on_sent(False)
+                return False
+
+            _bytes_out.inc(sent)
+            if sent < len(entry[0]):
+                entry[0] = entry[0][sent:]
+                return True
+
+            self.__send_queue.popleft()
+            if entry[1]:
+                entry[1](True)
+        return False
+
+    def has_queued_bytes(self) -> bool:
+        return bool(self.__send_queue)
+
     def recv_message(self) -> Optional[Message]:
         """
-        Decodes incoming bytes on the communication socket
+        Decodes incoming bytes on the communication socket, reading until a whole frame has arrived
         :return: A Message application, if possible
         """
-        try:
-            incoming_bytes = self.__sock.recv(4)
-            message_len = struct.Struct('I').unpack(incoming_bytes)[0]
-            message_bytes = self.__sock.recv(message_len)
-            message_type = MessageType(struct.Struct('B').unpack(message_bytes[:1])[0])
-
-            # Parse bytes to rebuild mag
-            if message_type is MessageType.GREETING:
-                return GreetingMessage.from_bytes(message_bytes)
-            elif message_type is MessageType.CHAT:
-                return ChatMessage.from_bytes(message_bytes)
-            elif message_type is MessageType.FAREWELL:
-                return FarewellMessage.from_bytes()
-            else:
+        while (frame := next_frame(self.__recv_buffer, self.__wire.recv_version)) is None:
+            if drop_oversized(self.__recv_buffer, self.__wire.recv_version):
+                self.__closed = True
                 return None
-        except struct.error as struct_err:
-            print_err(3, "Unable to decode bytes on listening socket.\n" + str(struct_err))
-            return None
+            if not self.__fill():
+                if self.__closed:
+                    _errors['decode'].inc()
+                    print_err(3, "Unable to decode bytes on listening socket.\nConnection closed mid-frame")
+                return None
+
+        if capture.recording():
+            self.__record(frame, self.__wire.recv_version)
+        message = decode_message(frame, self.__wire.recv_version)
+        self.__wire.received(message)
+        return message
+
+    def recv_messages(self) -> List[Optional[Message]]:
+        """
+        Reads what has arrived without waiting for more, for sockets the selector reported readable
+        :return: every whole frame now received, decoded, possibly none
+        """
+        self.__fill(self.__dont_wait)
+
+        messages = read_frames(self.__recv_buffer, self.__wire, self.__limit,
+                               self.__record if capture.recording() else None)
+        if drop_oversized(self.__recv_buffer, self.__wire.recv_version) or (self.__limit and self.__limit.exceeded()):
+            self.__closed = True
+        return messages
+
+    def __record(self, frame: bytes, version: int):
+        """
+        Writes a received frame to the capture file, numbering the connection on its first frame
+        """
+        if not self.__capture_id:
+            self.__capture_id = capture.open_connection(self.get_remote_addr())
+        capture.record_frame(self.__capture_id, version, frame)
+
+    def __fill(self, flags: int = 0) -> bool:
+        """
+        Reads available bytes into the receive buffer, and whatever the TLS layer already decrypted
+        :param flags: Passed to recv, to not wait for bytes to arrive
+        :return: whether any bytes were read
+        """
+        try:
+            chunk = self.__sock.recv(_RECV_SIZE, flags)
+            while chunk and isinstance(self.__sock, ssl.SSLSocket) and self.__sock.pending():
+                chunk += self.__sock.recv(self.__sock.pending())
+        except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return False
         except OSError as os_err:
+            _errors['recv'].inc()
             print_err(2, "Unable to receive bytes on listening socket.\n" + str(os_err))
+            self.__closed = True
+            return False
+
+        if not chunk:
+            self.__closed = True
+            return False
+
+        _bytes_in.inc(len(chunk))
+        self.__recv_buffer += chunk
+        return True
+
+    # TLS
+
+    def start_tls_client(self, context: ssl.SSLContext, session: Optional[ssl.SSLSession] = None) -> bool:
+        """
+        Encrypts a connected socket, running the client side of the handshake before returning
+        The socket is left non-blocking, as selector-driven TLS sockets must be
+        :param context: Client context to handshake with
+        :param session: Session of an earlier connection to the same peer, to resume instead of a full handshake
+        :return: whether the handshake succeeded
+        """
+        try:
+            self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Records are written one by one
+            self.__sock = context.wrap_socket(self.__sock, session=session)
+        except (OSError, ValueError) as err:
+            _errors['connect'].inc()
+            print_err(2, "TLS handshake with {} failed\n".format(self.get_remote_addr()) + str(err))
+            return False
+
+        self.__sock.setblocking(False)
+        self.__dont_wait = 0
+        return True
+
+    def start_tls_server(self, context: ssl.SSLContext):
+        """
+        Encrypts an accepted socket, the handshake is then driven by continue_handshake as the peer's records arrive
+        :param context: Server context to handshake with
+        """
+        self.__sock.setblocking(False)
+        self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__sock = context.wrap_socket(self.__sock, server_side=True, do_handshake_on_connect=False)
+        self.__dont_wait = 0
+
+    def continue_handshake(self) -> Optional[bool]:
+        """
+        Advances the server side of a handshake without blocking
+        :return: True once complete, None while waiting on the peer, False if it failed
+        """
+        try:
+            self.__sock.do_handshake()
+            return True
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
             return None
+        except OSError as err:
+            _errors['connect'].inc()
+            print_err(2, "TLS handshake with {} failed\n".format(self.get_remote_addr()) + str(err))
+            return False
+
+    def peek(self, size: int = 1) -> bytes:
+        """
+        :return: up to size bytes that have arrived, left unread, empty if the peer closed the connection
+        """
+        try:
+            return self.__sock.recv(size, socket.MSG_PEEK)
+        except OSError:
+            return b''
+
+    def is_tls(self) -> bool:
+        return isinstance(self.__sock, ssl.SSLSocket)
+
+    def tls_session(self) -> Optional[ssl.SSLSession]:
+        """
+        :return: the session of a client TLS socket, which a later connection to the same peer may resume
+        """
+        if self.is_tls() and not self.__sock.server_side:
+            return self.__sock.session
+        return None
+
+    def tls_session_reused(self) -> bool:
+        return self.is_tls() and self.__sock.session_reused
+
+    def peer_certificate(self) -> Optional[bytes]:
+        """
+        :return: the DER encoded certificate the peer presented, if the socket is encrypted
+        """
+        return self.__sock.getpeercert(binary_form=True) if self.is_tls() else None
+
+    def is_closed(self) -> bool:
+        """
+        :return: whether the peer closed its end of the connection, or it was closed for going over its rate limit
+        """
+        return self.__closed
+
+    def rate_limit(self, new_limit: Optional[ConnectionLimit] = None) -> Optional[ConnectionLimit]:
+        """
+        :param new_limit: Limit frames received are admitted through before they are decoded
+        :return: the socket's rate limit, if it has one
+        """
+        if new_limit:
+            self.__limit = new_limit
+        return self.__limit
+
+    def wire_version(self) -> int:
+        """
+        :return: the wire version messages must be encoded in to be sent on this socket
+        """
+        return self.__wire.send_version
 
     def accept_conn(self) -> Optional[TcpSocket]:
         """
@@ -144,6 +535,9 @@ class TcpSocket:
         """
         Used to unbind a TCP socket and free its port
         """
+        if self.__capture_id:
+            capture.close_connection(self.__capture_id)
+            self.__capture_id = 0
         try:
             self.__sock.shutdown(socket.SHUT_RDWR)  # Send FIN to peer
             self.__sock.close()  # Decrement the handle count by 1
@@ -0,0 +1,106 @@
+"""
+Timers run by the network thread, between selector wake-ups
+"""
+import heapq
+import itertools
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+
+from Uchat.helper.log import get_logger
+
+_log = get_logger('network.timers')
+
+
+class Timer:
+    """
+    Handle of a scheduled callback
+    """
+
+    __slots__ = ('deadline', 'callback', 'cancelled')
+
+    def __init__(self, deadline: float, callback: Callable[[], None]):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    """
+    Callbacks due at a monotonic deadline, in a heap
+    Timers may be scheduled from any thread, the network thread is woken through a socket pair when the earliest
+    deadline moves forward, so registering the queue with the selector is enough to never oversleep
+    """
+
+    def __init__(self):
+        self.__heap: List = list()
+        self.__order = itertools.count()  # Breaks ties between equal deadlines, in scheduling order
+        self.__lock = threading.Lock()
+
+        self.__wake_reader, self.__wake_writer = socket.socketpair()
+        self.__wake_reader.setblocking(False)
+        self.__wake_writer.setblocking(False)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """
+        :param delay: Seconds from now
+        :param callback: Run on the network thread once due
+        :return: a handle that cancels the callback
+        """
+        timer = Timer(time.monotonic() + delay, callback)
+
+        with self.__lock:
+            earliest = not self.__heap or timer.deadline < self.__heap[0][0]
+            heapq.heappush(self.__heap, (timer.deadline, next(self.__order), timer))
+
+        if earliest:
+            self.__wake()
+        return timer
+
+    def run_due(self) -> Optional[float]:
+        """
+        Runs every callback now due
+        :return: seconds until the next deadline, None if none is scheduled
+        """
+        while True:
+            with self.__lock:
+                while self.__heap and self.__heap[0][2].cancelled:
+                    heapq.heappop(self.__heap)
+                if not self.__heap:
+                    return None
+
+                wait = self.__heap[0][0] - time.monotonic()
+                if wait > 0:
+                    return wait
+                timer = heapq.heappop(self.__heap)[2]
+
+            try:
+                timer.callback()
+            except Exception:
+                _log.exception('Timer callback failed')
+
+    def __wake(self):
+        try:
+            self.__wake_writer.send(b'\0')
+        except BlockingIOError:
+            pass  # Already woken, the reader holds unread wake-ups
+
+    def drain_wakeups(self):
+        """
+        Clears wake-ups, once the selector reported the queue readable
+        """
+        try:
+            while self.__wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def fileno(self) -> int:
+        """
+        Lets the queue be registered with a selector, which it makes readable when woken
+        """
+        return self.__wake_reader.fileno()
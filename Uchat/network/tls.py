@@ -0,0 +1,217 @@
+"""
+Encrypted transport for conversations, using the standard library's TLS
+Each user holds a self-signed identity, and the identity a friend presents is pinned on first use, as SSH pins host keys
+Sessions are remembered per address, so reconnecting to a known friend resumes instead of repeating the full handshake
+"""
+import hashlib
+import os
+import shutil
+import ssl
+import subprocess
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from Uchat.helper import metrics
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import TLS_CERT_DAYS, TLS_HANDSHAKE_TIMEOUT, TLS_SESSION_CACHE
+from Uchat.helper.log import get_logger
+from Uchat.helper.logger import DataType, FileName, get_file_path, write_to_data_file, get_pinned_identities
+from Uchat.network.tcp import TcpSocket
+
+_log = get_logger('network.tls')
+_handshakes = {mode: metrics.counter('uchat_tls_handshakes_total', 'TLS handshakes completed as a client, by kind',
+                                     mode=mode) for mode in ('full', 'resumed')}
+_handshake_latency = {mode: metrics.histogram('uchat_tls_handshake_seconds', 'Time taken by client TLS handshakes',
+                                              mode=mode) for mode in ('full', 'resumed')}
+_pin_failures = metrics.counter('uchat_tls_pin_failures_total',
+                                'Peers presenting an identity other than the pinned one')
+
+HANDSHAKE_RECORD = 0x16  # First byte of a TLS ClientHello, plaintext frames open with a greeting's length instead
+_CERTIFICATE_MESSAGE = 11  # Type of the handshake message carrying a side's certificate chain
+
+
+def fingerprint(certificate: bytes) -> str:
+    """
+    :param certificate: DER encoded certificate
+    :return: the certificate's SHA-256 fingerprint, as colon separated hex
+    """
+    return hashlib.sha256(certificate).digest().hex(':')
+
+
+def _leaf_certificate(message: bytes, version: int) -> Optional[bytes]:
+    """
+    :param message: Certificate handshake message, its header included
+    :param version: TLS version the message was sent in
+    :return: the DER encoded certificate leading the chain, None if the chain is empty
+    """
+    offset = 4  # Message type and length
+    if version == ssl.TLSVersion.TLSv1_3:
+        offset += 1 + message[offset]  # Request context
+    offset += 3  # Length of the chain
+    length = int.from_bytes(message[offset:offset + 3], 'big')
+    return bytes(message[offset + 3:offset + 3 + length]) or None
+
+
+def generate_identity(username: str, cert_path: str, key_path: str) -> bool:
+    """
+    Creates a self-signed certificate and its private key, using the openssl command line tool
+    :return: whether the identity was written
+    """
+    if not (openssl := shutil.which('openssl')):
+        print_err(2, "Unable to create a TLS identity, openssl was not found")
+        return False
+
+    os.makedirs(os.path.dirname(cert_path), exist_ok=True)
+    try:
+        subprocess.run([openssl, 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                        '-nodes', '-days', str(TLS_CERT_DAYS), '-subj', '/CN=uchat-{}'.format(username or 'user'),
+                        '-keyout', key_path, '-out', cert_path],
+                       check=True, capture_output=True, timeout=30)
+        os.chmod(key_path, 0o600)
+    except (OSError, subprocess.SubprocessError) as err:
+        print_err(2, "Unable to create a TLS identity\n" + str(err))
+        return False
+
+    _log.info('Created TLS identity %s', cert_path)
+    return True
+
+
+class TlsIdentity:
+    """
+    This user's certificate, the contexts built from it, the pins of known peers and the sessions held with them
+    """
+
+    def __init__(self, cert_path: str, key_path: str):
+        """
+        :param cert_path: PEM file holding this user's certificate
+        :param key_path: PEM file holding its private key
+        """
+        # Initiators present their identity too, optionally, as clients predating mutual pinning present none
+        # The standard library has no verify callback, so the certificate presented is trusted as it arrives instead,
+        # OpenSSL then only checks the initiator holds its key, and who is behind it is decided by its pin
+        self.__server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.__server_context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.__server_context.load_cert_chain(cert_path, key_path)
+        self.__server_context.verify_mode = ssl.CERT_OPTIONAL
+        self.__server_context._msg_callback = self.__trust_presented
+
+        # Peers are self-signed, so nothing is verified against a CA, the presented identity is pinned instead
+        self.__client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.__client_context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.__client_context.check_hostname = False
+        self.__client_context.verify_mode = ssl.CERT_NONE
+        self.__client_context.load_cert_chain(cert_path, key_path)
+
+        with open(cert_path, 'r') as file:
+            self.__fingerprint = fingerprint(ssl.PEM_cert_to_DER_cert(file.read()))
+
+        self.__pins: Dict[str, str] = get_pinned_identities()
+        self.__sessions: Dict[Tuple[str, int], ssl.SSLSession] = OrderedDict()  # Remote address -> last session
+
+    @classmethod
+    def load(cls, username: str) -> Optional['TlsIdentity']:
+        """
+        Loads this user's identity from data/user, creating it on first use
+        :return: the identity, or None if one could not be created
+        """
+        cert_path = str(get_file_path(DataType.USER, FileName.IDENTITY_CERT))
+        key_path = str(get_file_path(DataType.USER, FileName.IDENTITY_KEY))
+
+        if not (os.path.isfile(cert_path) and os.path.isfile(key_path)) and \
+                not generate_identity(username, cert_path, key_path):
+            return None
+
+        try:
+            return cls(cert_path, key_path)
+        except (OSError, ssl.SSLError) as err:
+            print_err(2, "Unable to load TLS identity\n" + str(err))
+            return None
+
+    def secure(self, sock: TcpSocket, address: Tuple[str, int]) -> bool:
+        """
+        Runs the client side of the handshake over a freshly connected socket, resuming a past session if one is known
+        The peer's identity is then checked against the one pinned for its host
+        :param sock: Connected socket
+        :param address: Remote address, under which sessions are remembered
+        :return: whether the socket is encrypted and the peer's identity trusted
+        """
+        session = self.__sessions.get(address)
+        start = time.perf_counter_ns()
+
+        sock.set_timeout(TLS_HANDSHAKE_TIMEOUT)
+        if not sock.start_tls_client(self.__client_context, session):
+            return False
+
+        mode = 'resumed' if sock.tls_session_reused() else 'full'
+        _handshakes[mode].inc()
+        _handshake_latency[mode].record((time.perf_counter_ns() - start) // 1000)
+        _log.debug('%s TLS handshake with %s', mode.capitalize(), address)
+
+        return self.check_pin(address, sock.peer_certificate())
+
+    def check_pin(self, address: Tuple[str, int], certificate: Optional[bytes]) -> bool:
+        """
+        Trusts the first identity presented at an address, and afterwards only that identity
+        :param address: Listening address of the peer
+        :param certificate: DER encoded certificate the peer presented
+        :return: whether the certificate matches the address' pin
+        """
+        if not certificate:
+            return False
+
+        host = '{}:{}'.format(*address)
+        presented = fingerprint(certificate)
+        if (pinned := self.__pins.get(host)) is None:
+            self.__pins[host] = presented
+            write_to_data_file(DataType.USER, FileName.PINS, self.__pins, False)
+            _log.info('Pinned identity of %s', host, extra={'fields': {'fingerprint': presented}})
+            return True
+
+        if pinned != presented:
+            _pin_failures.inc()
+            print_err(2, "Identity of {} changed since it was pinned, refusing the connection\n"
+                         "Pinned {}\nPresented {}".format(host, pinned, presented))
+            return False
+        return True
+
+    def __trust_presented(self, conn, direction: str, version: int, content_type: int, msg_type: int, data: bytes):
+        """
+        Adds the certificate an initiator presents to the server context's trusted ones, before OpenSSL verifies it
+        A certificate is held once, however often it is presented
+        """
+        if direction != 'read' or content_type != HANDSHAKE_RECORD or msg_type != _CERTIFICATE_MESSAGE:
+            return
+        try:
+            if certificate := _leaf_certificate(data, version):
+                self.__server_context.load_verify_locations(cadata=certificate)
+        except (IndexError, ssl.SSLError):
+            pass  # Malformed, OpenSSL fails the handshake on it
+
+    def remember_session(self, address: Tuple[str, int], sock: TcpSocket):
+        """
+        Keeps the session of a closing client socket, so the next connection to address can resume it
+        """
+        if session := sock.tls_session():
+            self.__sessions.pop(address, None)
+            self.__sessions[address] = session
+            while len(self.__sessions) > TLS_SESSION_CACHE:
+                self.__sessions.popitem(last=False)
+
+    def forget_pin(self, address: Tuple[str, int]):
+        """
+        Drops an address' pin, so that a friend who legitimately replaced their identity can be trusted again
+        """
+        if self.__pins.pop('{}:{}'.format(*address), None):
+            write_to_data_file(DataType.USER, FileName.PINS, self.__pins, False)
+
+    # Getters
+
+    def server_context(self) -> ssl.SSLContext:
+        return self.__server_context
+
+    def client_context(self) -> ssl.SSLContext:
+        return self.__client_context
+
+    def fingerprint(self) -> str:
+        return self.__fingerprint
@@ -0,0 +1,658 @@
+"""
+Reliable transport over UDP, for conversations that shouldn't pay for TCP's retransmission timers and head-of-line
+stalls across a lossy path
+Frames are carried as a numbered stream of datagrams, acknowledged cumulatively and selectively, retransmitted on
+timeout or once later datagrams are acknowledged past them, and paced out over the round trip under a congestion window
+UdpSocket presents the parts of TcpSocket's interface that Client relies on
+"""
+from __future__ import annotations
+import secrets
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Optional, Tuple, Callable, Deque, Dict, List
+
+from Uchat.helper import metrics
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import UDP_CONNECT_TIMEOUT, UDP_MAX_PAYLOAD, UDP_INITIAL_WINDOW, UDP_RECV_WINDOW, \
+    UDP_INITIAL_RTO, UDP_MIN_RTO, UDP_MAX_RTO, UDP_MAX_RETRANSMITS, UDP_DELAYED_ACK, UDP_DUP_THRESHOLD, \
+    UDP_PACING_GAIN
+from Uchat.helper.log import get_logger
+from Uchat.network.messages.message import Message
+from Uchat.network.rateLimit import ConnectionLimit
+from Uchat.network.tcp import read_frames, drop_oversized, WireNegotiation
+from Uchat.network.timers import TimerQueue, Timer
+
+_log = get_logger('network.udp')
+_datagrams = {direction: metrics.counter('uchat_udp_datagrams_total', 'Datagrams moved by the UDP transport',
+                                         direction=direction) for direction in ('in', 'out')}
+_retransmits = {cause: metrics.counter('uchat_udp_retransmits_total', 'Datagrams sent again, by what detected the loss',
+                                       cause=cause) for cause in ('timeout', 'sack')}
+_rtt = metrics.histogram('uchat_udp_rtt_seconds', 'Round trips measured by the UDP transport')
+_errors = {op: metrics.counter('uchat_udp_errors_total', 'Failed UDP transport operations', op=op)
+           for op in ('connect', 'send', 'recv', 'timeout')}
+
+_HEADER = struct.Struct('!BHII')  # Type, receive window, sequence number, cumulative acknowledgement
+_RANGE = struct.Struct('!II')  # Selectively acknowledged sequence numbers, from start up to end
+_MAX_RANGES = 4  # Ranges carried by an acknowledgement
+_MAX_DATAGRAM = _HEADER.size + 1 + _MAX_RANGES * _RANGE.size + UDP_MAX_PAYLOAD
+
+
+class PacketType(Enum):
+    """
+    Enumerates the kinds of datagram the transport sends
+    """
+    SYN = 1  # Opens a connection, its sequence number is a token echoed back
+    SYN_ACK = 2  # Accepts a connection, sent from the socket the connection then continues on
+    DATA = 3  # Carries stream bytes, and piggybacks a cumulative acknowledgement
+    ACK = 4  # Acknowledges cumulatively, then selectively
+    FIN = 5  # Closes the connection
+
+
+class _Segment:
+    """
+    Stream bytes sent as one datagram, until acknowledged
+    """
+
+    __slots__ = ('seq', 'payload', 'sent_at', 'transmissions', 'in_flight', 'sacked', 'on_sent')
+
+    def __init__(self, seq: int, payload: memoryview):
+        self.seq = seq
+        self.payload = payload
+        self.sent_at = 0.0
+        self.transmissions = 0
+        self.in_flight = False  # Sent and neither acknowledged nor declared lost
+        self.sacked = False
+        self.on_sent: Optional[Callable[[bool], None]] = None  # Run once the frame ending here is acknowledged
+
+
+def _packet(p_type: PacketType, window: int = 0, seq: int = 0, ack: int = 0) -> bytes:
+    return _HEADER.pack(p_type.value, window, seq, ack)
+
+
+class UdpSocket:
+    """
+    A reliable, ordered stream over UDP, between two connected datagram sockets
+    Listening sockets answer each new peer from a fresh socket, connected to the peer, which the conversation then uses
+    Timers, and acknowledgements received by recv_messages, drive sending, so the socket never needs write interest
+    """
+
+    def __init__(self, timers: TimerQueue, port: int = None, sock: socket.socket = None):
+        """
+        :param timers: Queue run by the network thread, for retransmission, pacing and delayed acknowledgements
+        :param port: The port to bind the socket to
+        :param sock: Already connected datagram socket, of an accepted connection
+        """
+        self.__timers = timers
+        self.__sock = sock if sock else socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__address = ('', port if port else 0)
+        self.__lock = threading.RLock()
+        self.__connect_timeout = UDP_CONNECT_TIMEOUT
+        self.__closed = False
+        self.__closing = False  # Freed, but still waiting for sent bytes to be acknowledged
+        self.__accepted: Dict[Tuple[str, int], UdpSocket] = dict()  # Listening sockets only, peer -> connection
+        self.__token: Optional[int] = None  # Accepted connections only, the token of the SYN they answered
+
+        # Sending
+        self.__segments: Dict[int, _Segment] = dict()  # Unacknowledged, in order of sequence number
+        self.__unsent: Deque[int] = deque()
+        self.__lost: Deque[int] = deque()  # Declared lost, sent again before anything new
+        self.__next_seq = 0
+        self.__snd_una = 0  # Oldest unacknowledged sequence number
+        self.__in_flight = 0
+        self.__highest_sacked = -1
+        self.__delivered_sent_at = 0.0  # Latest send time of any datagram the peer acknowledged
+        self.__peer_window = UDP_RECV_WINDOW
+
+        # Congestion control, a window in datagrams that halves on loss and grows by slow start, then additively
+        self.__cwnd = float(UDP_INITIAL_WINDOW)
+        self.__ssthresh = float(UDP_RECV_WINDOW)
+        self.__recovery_end = 0  # Losses below this belong to the episode already reacted to
+        self.__srtt: Optional[float] = None
+        self.__rttvar = 0.0
+        self.__rto = UDP_INITIAL_RTO
+        self.__next_send_at = 0.0  # Pacing, when the next datagram may leave
+        self.__rto_timer: Optional[Timer] = None
+        self.__pace_timer: Optional[Timer] = None
+
+        # Receiving
+        self.__rcv_next = 0
+        self.__out_of_order: Dict[int, bytes] = dict()
+        self.__recv_buffer = bytearray()
+        self.__wire = WireNegotiation()
+        self.__limit: Optional[ConnectionLimit] = None
+        self.__unacked_received = 0
+        self.__ack_timer: Optional[Timer] = None
+
+    def listen(self):
+        """
+        Binds the socket to its address, to accept connections
+        """
+        try:
+            self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.__sock.bind(self.__address)
+            self.__sock.setblocking(False)
+            _log.info('Listening for UDP on %s', self.__address)
+        except OSError as os_err:
+            print_err(2, "Error raised on attempt to establish listening UDP socket\n" + str(os_err))
+
+    def connect(self, conn_addr) -> bool:
+        """
+        Opens a connection, blocking until it is accepted or the connect timeout passes
+
+        :param conn_addr: Address of a listening UDP socket
+        :return: whether a connection could successfully be established
+        """
+        token = secrets.randbits(32)
+        rto = UDP_INITIAL_RTO
+        deadline = time.monotonic() + self.__connect_timeout
+
+        try:
+            host = socket.gethostbyname(conn_addr[0])
+            while (left := deadline - time.monotonic()) > 0:
+                sent_at = time.monotonic()
+                self.__sock.sendto(_packet(PacketType.SYN, seq=token), (host, conn_addr[1]))
+                self.__sock.settimeout(min(rto, left))
+                rto *= 2
+
+                try:
+                    while True:
+                        datagram, source = self.__sock.recvfrom(_MAX_DATAGRAM)
+                        if source[0] == host and len(datagram) >= _HEADER.size:
+                            p_type, _, _, ack = _HEADER.unpack_from(datagram)
+                            if p_type == PacketType.SYN_ACK.value and ack == token:
+                                break
+                except socket.timeout:
+                    continue
+
+                self.__sock.connect(source)  # The connection continues on the socket that accepted it
+                self.__sock.setblocking(False)
+                self.__on_rtt(time.monotonic() - sent_at)
+                _log.info('New UDP connection L %s -> R %s', self.get_local_addr(), self.get_remote_addr())
+                return True
+        except OSError as os_err:
+            _errors['connect'].inc()
+            print_err(2, "Failure to connect to host over UDP: {}\n".format(conn_addr) + str(os_err))
+            return False
+
+        _errors['connect'].inc()
+        _log.info('No UDP handshake from %s', conn_addr)
+        return False
+
+    def accept_conn(self) -> Optional[UdpSocket]:
+        """
+        Reads a datagram sent to the listening socket, accepting the connection it opens
+        :return: the connection's socket, if the datagram opened a new one
+        """
+        try:
+            datagram, source = self.__sock.recvfrom(_MAX_DATAGRAM)
+        except OSError:
+            return None
+
+        if len(datagram) < _HEADER.size or datagram[0] != PacketType.SYN.value:
+            return None
+        token = _HEADER.unpack_from(datagram)[2]
+
+        for peer in [peer for peer, conn in self.__accepted.items() if conn.is_closed()]:
+            del self.__accepted[peer]
+
+        if conn := self.__accepted.get(source):
+            conn.__send(_packet(PacketType.SYN_ACK, UDP_RECV_WINDOW, 0, conn.__token))  # Our answer was lost
+            return None
+
+        try:
+            conn_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            conn_sock.bind((self.__address[0], 0))
+            conn_sock.connect(source)
+            conn_sock.setblocking(False)
+        except OSError as os_err:
+            print_err(2, "Unable to accept UDP connection\n" + str(os_err))
+            return None
+
+        conn = UdpSocket(self.__timers, sock=conn_sock)
+        conn.__token = token
+        conn.__send(_packet(PacketType.SYN_ACK, UDP_RECV_WINDOW, 0, token))
+        self.__accepted[source] = conn
+        return conn
+
+    # Sending
+
+    def queue_bytes(self, message: bytes, on_sent: Optional[Callable[[bool], None]] = None) -> bool:
+        """
+        Queues a frame on the stream, sending as much as the congestion window and pacing allow
+
+        :param message: Frame to send
+        :param on_sent: Called with True once the peer acknowledged the whole frame, or False if the connection fails
+        :return: False, the rest is sent by the network thread's timers and acknowledgements
+        """
+        with self.__lock:
+            if self.__closed or self.__closing:
+                if on_sent:
+                    on_sent(False)
+                return False
+
+            self.__wire.sent(message)
+            view = memoryview(message)
+            segment = None
+            for offset in range(0, len(view), UDP_MAX_PAYLOAD):
+                segment = _Segment(self.__next_seq, view[offset:offset + UDP_MAX_PAYLOAD])
+                self.__segments[segment.seq] = segment
+                self.__unsent.append(segment.seq)
+                self.__next_seq += 1
+            if segment:
+                segment.on_sent = on_sent
+
+            self.__pump()
+        return False
+
+    def flush(self) -> bool:
+        return False
+
+    def has_queued_bytes(self) -> bool:
+        return bool(self.__segments)
+
+    def __pump(self):
+        """
+        Sends lost, then new, datagrams while the window has room and pacing allows
+        Must be called with the lock held
+        """
+        now = time.monotonic()
+        window = min(self.__cwnd, self.__peer_window)
+
+        while (self.__lost or self.__unsent) and self.__in_flight < window and not self.__closed:
+            if now < self.__next_send_at:
+                if not self.__pace_timer:
+                    self.__pace_timer = self.__timers.call_later(self.__next_send_at - now, self.__on_pace)
+                return
+
+            seq = (self.__lost or self.__unsent).popleft()
+            if not (segment := self.__segments.get(seq)) or segment.sacked or segment.in_flight:
+                continue  # Acknowledged since it was queued
+
+            self.__transmit(segment, now)
+            if self.__srtt:
+                # Spreads the window over a round trip, rather than sending it in one burst
+                self.__next_send_at = max(self.__next_send_at, now) + self.__srtt / (window * UDP_PACING_GAIN)
+
+    def __transmit(self, segment: _Segment, now: float):
+        if segment.transmissions:
+            if segment.transmissions > UDP_MAX_RETRANSMITS:
+                _errors['timeout'].inc()
+                print_err(2, "Peer {} stopped acknowledging, closing the connection".format(self.get_remote_addr()))
+                self.__fail()
+                return
+
+        segment.transmissions += 1
+        segment.sent_at = now
+        segment.in_flight = True
+        self.__in_flight += 1
+
+        # Data piggybacks the cumulative acknowledgement, standing in for a delayed one
+        self.__send(_packet(PacketType.DATA, self.__recv_window(), segment.seq, self.__rcv_next) + segment.payload)
+        self.__unacked_received = 0
+        if self.__ack_timer:
+            self.__ack_timer.cancel()
+            self.__ack_timer = None
+
+        if not self.__rto_timer:
+            self.__rto_timer = self.__timers.call_later(self.__rto, self.__on_rto)
+
+    def __send(self, datagram: bytes):
+        try:
+            self.__sock.send(datagram)
+            _datagrams['out'].inc()
+        except BlockingIOError:
+            pass  # Dropped, as the network might have, retransmission recovers it
+        except ConnectionRefusedError:
+            self.__fail()  # Nothing listens on the peer's port anymore
+        except OSError as os_err:
+            _errors['send'].inc()
+            print_err(2, "Failure to send datagram to peer\n" + str(os_err))
+
+    def __on_pace(self):
+        with self.__lock:
+            self.__pace_timer = None
+            self.__pump()
+
+    def __on_rto(self):
+        """
+        Nothing was acknowledged for a whole timeout, every datagram in flight is presumed lost
+        """
+        with self.__lock:
+            self.__rto_timer = None
+            if self.__closed or not self.__segments:
+                return
+
+            lost = [segment.seq for segment in self.__segments.values() if segment.transmissions and not segment.sacked]
+            for seq in lost:
+                self.__segments[seq].in_flight = False
+            self.__in_flight = 0
+            self.__lost = deque(lost)
+
+            _retransmits['timeout'].inc(len(lost))
+            self.__ssthresh = max(self.__cwnd / 2, 2)
+            self.__cwnd = 1
+            self.__recovery_end = self.__next_seq
+            self.__rto = min(self.__rto * 2, UDP_MAX_RTO)
+            self.__next_send_at = 0
+
+            self.__pump()
+            if self.__segments and not self.__rto_timer:
+                self.__rto_timer = self.__timers.call_later(self.__rto, self.__on_rto)
+
+    def __on_ack(self, ack: int, ranges: List[Tuple[int, int]], window: int):
+        """
+        Releases acknowledged datagrams, measures the round trip, detects losses and adjusts the congestion window
+        Must be called with the lock held
+        """
+        now = time.monotonic()
+        self.__peer_window = max(1, window)
+        newly_acked = 0
+        rtt_sample = None
+        completed = list()
+
+        while self.__snd_una < min(ack, self.__next_seq):
+            if segment := self.__segments.pop(self.__snd_una, None):
+                self.__in_flight -= segment.in_flight
+                newly_acked += not segment.sacked
+                self.__delivered_sent_at = max(self.__delivered_sent_at, segment.sent_at)
+                if segment.transmissions == 1 and not segment.sacked:
+                    rtt_sample = now - segment.sent_at
+                if segment.on_sent:
+                    completed.append(segment.on_sent)
+            self.__snd_una += 1
+
+        for start, end in ranges:
+            for seq in range(max(start, self.__snd_una), min(end, self.__next_seq)):
+                if (segment := self.__segments.get(seq)) and not segment.sacked:
+                    segment.sacked = True
+                    self.__in_flight -= segment.in_flight
+                    segment.in_flight = False
+                    newly_acked += 1
+                    self.__delivered_sent_at = max(self.__delivered_sent_at, segment.sent_at)
+                    if segment.transmissions == 1:
+                        rtt_sample = now - segment.sent_at
+            self.__highest_sacked = max(self.__highest_sacked, end - 1)
+
+        if rtt_sample is not None:
+            self.__on_rtt(rtt_sample)
+
+        # Datagrams overtaken by several later ones, or by one sent a while after them, are presumed lost without
+        # waiting for the timeout, the latter as RACK does, as chat is too thin a stream to rely on counting alone
+        # Only overtaking by datagrams sent after them counts, or a retransmission would be presumed lost at once
+        reorder_window = (self.__srtt or UDP_INITIAL_RTO) / 4
+        lost = list()
+        for seq in range(self.__snd_una, self.__highest_sacked):
+            if (segment := self.__segments.get(seq)) and segment.in_flight and not segment.sacked and \
+                    segment.sent_at < self.__delivered_sent_at and \
+                    (seq <= self.__highest_sacked - UDP_DUP_THRESHOLD or
+                     segment.sent_at + reorder_window <= self.__delivered_sent_at):
+                segment.in_flight = False
+                self.__in_flight -= 1
+                lost.append(seq)
+
+        if lost:
+            _retransmits['sack'].inc(len(lost))
+            self.__lost.extend(lost)
+            if self.__snd_una >= self.__recovery_end:
+                # First loss of this window, later ones in the same window were caused by the same congestion
+                self.__ssthresh = max(self.__cwnd / 2, 2)
+                self.__cwnd = self.__ssthresh
+                self.__recovery_end = self.__next_seq
+        elif newly_acked:
+            growth = newly_acked if self.__cwnd < self.__ssthresh else newly_acked / self.__cwnd
+            self.__cwnd = min(self.__cwnd + growth, UDP_RECV_WINDOW)
+
+        if self.__rto_timer and (newly_acked or not self.__segments):
+            self.__rto_timer.cancel()
+            self.__rto_timer = None
+        if self.__segments and not self.__rto_timer:
+            self.__rto_timer = self.__timers.call_later(self.__rto, self.__on_rto)
+
+        for on_sent in completed:
+            on_sent(True)
+
+        self.__pump()
+
+    def __on_rtt(self, sample: float):
+        """
+        Updates the smoothed round trip and the retransmission timeout, as TCP does
+        """
+        _rtt.record(int(sample * 1e6))
+        if self.__srtt is None:
+            self.__srtt = sample
+            self.__rttvar = sample / 2
+        else:
+            self.__rttvar = 0.75 * self.__rttvar + 0.25 * abs(self.__srtt - sample)
+            self.__srtt = 0.875 * self.__srtt + 0.125 * sample
+        self.__rto = min(max(self.__srtt + 4 * self.__rttvar, UDP_MIN_RTO), UDP_MAX_RTO)
+
+    # Receiving
+
+    def recv_messages(self) -> List[Optional[Message]]:
+        """
+        Processes every datagram that has arrived, without waiting for more
+        :return: every whole frame now received in order, decoded, possibly none
+        """
+        with self.__lock:
+            self.__drain()
+
+            messages = read_frames(self.__recv_buffer, self.__wire, self.__limit)
+            oversized = drop_oversized(self.__recv_buffer, self.__wire.recv_version)
+            if (oversized or (self.__limit and self.__limit.exceeded())) and not self.__closed:
+                self.__send(_packet(PacketType.FIN))
+                self.__fail()
+        return messages
+
+    def read_ahead(self):
+        """
+        Processes and acknowledges arrived datagrams, keeping their frames for recv_messages
+        Used while a connection waits on the user, so the peer doesn't take the silence for loss
+        """
+        with self.__lock:
+            self.__drain()
+
+    def has_buffered_bytes(self) -> bool:
+        return bool(self.__recv_buffer)
+
+    def __drain(self):
+        while not self.__closed:
+            try:
+                datagram = self.__sock.recv(_MAX_DATAGRAM)
+            except BlockingIOError:
+                return
+            except ConnectionRefusedError:
+                self.__fail()
+                return
+            except OSError as os_err:
+                _errors['recv'].inc()
+                print_err(2, "Unable to receive datagram\n" + str(os_err))
+                self.__fail()
+                return
+
+            _datagrams['in'].inc()
+            self.__on_datagram(datagram)
+
+    def __on_datagram(self, datagram: bytes):
+        if len(datagram) < _HEADER.size:
+            return
+        p_type, window, seq, ack = _HEADER.unpack_from(datagram)
+
+        if p_type == PacketType.DATA.value:
+            self.__on_ack(ack, [], window)
+            self.__on_data(seq, datagram[_HEADER.size:])
+        elif p_type == PacketType.ACK.value:
+            count = datagram[_HEADER.size] if len(datagram) > _HEADER.size else 0
+            ranges = [_RANGE.unpack_from(datagram, _HEADER.size + 1 + index * _RANGE.size)
+                      for index in range(min(count, _MAX_RANGES))
+                      if len(datagram) >= _HEADER.size + 1 + (index + 1) * _RANGE.size]
+            self.__on_ack(ack, ranges, window)
+        elif p_type == PacketType.SYN.value and seq == self.__token:
+            # Our answer was lost, and the peer's retry reached this socket rather than the listener, as through a NAT
+            self.__send(_packet(PacketType.SYN_ACK, self.__recv_window(), 0, self.__token))
+        elif p_type == PacketType.FIN.value:
+            _log.info('%s closed the UDP connection', self.get_remote_addr())
+            self.__fail()
+
+    def __on_data(self, seq: int, payload: bytes):
+        if seq < self.__rcv_next or seq in self.__out_of_order:
+            self.__send_ack()  # A duplicate, the peer missed our acknowledgement
+            return
+        if seq >= self.__rcv_next + UDP_RECV_WINDOW:
+            return  # Beyond what we buffer, the peer will send it again
+
+        if seq != self.__rcv_next:
+            self.__out_of_order[seq] = payload
+            self.__send_ack()  # Reports the gap straight away
+            return
+
+        self.__recv_buffer += payload
+        self.__rcv_next += 1
+        filled_gap = False
+        while (payload := self.__out_of_order.pop(self.__rcv_next, None)) is not None:
+            self.__recv_buffer += payload
+            self.__rcv_next += 1
+            filled_gap = True
+
+        self.__unacked_received += 1
+        if filled_gap or self.__out_of_order or self.__unacked_received >= 2:
+            self.__send_ack()
+        elif not self.__ack_timer:
+            self.__ack_timer = self.__timers.call_later(UDP_DELAYED_ACK, self.__on_delayed_ack)
+
+    def __on_delayed_ack(self):
+        with self.__lock:
+            self.__ack_timer = None
+            if self.__unacked_received and not self.__closed:
+                self.__send_ack()
+
+    def __send_ack(self):
+        """
+        Acknowledges everything received in order, and up to a few ranges received beyond it
+        """
+        ranges = list()
+        for seq in sorted(self.__out_of_order):
+            if ranges and ranges[-1][1] == seq:
+                ranges[-1][1] = seq + 1
+            elif len(ranges) < _MAX_RANGES:
+                ranges.append([seq, seq + 1])
+            else:
+                break
+
+        self.__send(_packet(PacketType.ACK, self.__recv_window(), 0, self.__rcv_next) + bytes([len(ranges)]) +
+                    b''.join(_RANGE.pack(start, end) for start, end in ranges))
+        self.__unacked_received = 0
+        if self.__ack_timer:
+            self.__ack_timer.cancel()
+            self.__ack_timer = None
+
+    def __recv_window(self) -> int:
+        return UDP_RECV_WINDOW - len(self.__out_of_order)
+
+    # Closing
+
+    def __fail(self):
+        """
+        Ends the connection at once, failing every frame not yet acknowledged
+        Must be called with the lock held
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+
+        for timer in (self.__rto_timer, self.__pace_timer, self.__ack_timer):
+            if timer:
+                timer.cancel()
+
+        failed = [segment.on_sent for segment in self.__segments.values() if segment.on_sent]
+        self.__segments.clear()
+        self.__unsent.clear()
+        self.__lost.clear()
+        for on_sent in failed:
+            on_sent(False)
+
+        if self.__closing:
+            self.__sock.close()
+
+    def free(self):
+        """
+        Closes the connection once what was sent is acknowledged, as a lingering TCP socket would
+        Conversations unregister their socket before freeing it, so acknowledgements are read by a timer meanwhile
+        """
+        with self.__lock:
+            if self.__closing:
+                return
+            self.__closing = True
+
+            if not self.__closed and self.__segments:
+                self.__timers.call_later(self.__rto, lambda: self.__linger(time.monotonic() + UDP_MAX_RTO))
+                return
+            self.__finish()
+
+    def __linger(self, deadline: float):
+        with self.__lock:
+            self.__drain()
+            if self.__closed or not self.__segments or time.monotonic() >= deadline:
+                self.__finish()
+            else:
+                self.__timers.call_later(self.__rto, lambda: self.__linger(deadline))
+
+    def __finish(self):
+        if not self.__closed and self.get_remote_addr():
+            self.__send(_packet(PacketType.FIN))
+        self.__fail()
+        self.__sock.close()
+
+    # Getters and Setters
+
+    def fileno(self) -> int:
+        return self.__sock.fileno()
+
+    def is_closed(self) -> bool:
+        return self.__closed
+
+    def rate_limit(self, new_limit: Optional[ConnectionLimit] = None) -> Optional[ConnectionLimit]:
+        """
+        :param new_limit: Limit frames received are admitted through before they are decoded
+        :return: the socket's rate limit, if it has one
+        """
+        if new_limit:
+            self.__limit = new_limit
+        return self.__limit
+
+    def wire_version(self) -> int:
+        return self.__wire.send_version
+
+    def is_tls(self) -> bool:
+        return False
+
+    def tls_session(self) -> None:
+        return None
+
+    def get_local_addr(self) -> Optional[Tuple[str, int]]:
+        try:
+            return self.__sock.getsockname()
+        except OSError:
+            return None
+
+    def get_remote_addr(self) -> Optional[Tuple[str, int]]:
+        try:
+            return self.__sock.getpeername()
+        except OSError:
+            return None
+
+    def set_timeout(self, timeout_len: Optional[float]):
+        """
+        :param timeout_len: Seconds connecting may take, the connection itself never blocks
+        """
+        if timeout_len:
+            self.__connect_timeout = timeout_len
+
+    def congestion_window(self) -> float:
+        return self.__cwnd
+
+    def smoothed_rtt(self) -> Optional[float]:
+        return self.__srtt
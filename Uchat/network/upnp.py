@@ -1,12 +1,26 @@
 """
 All things UPNP
 """
+import time
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
-
-from miniupnpc import UPnP
+from typing import Optional, Dict
+from urllib.error import URLError
+from xml.sax.saxutils import escape
 
 from Uchat.helper.error import print_err
-from Uchat.helper.globals import LISTENING_PORT
+from Uchat.helper.globals import LISTENING_PORT, UPNP_CACHE_TTL, UPNP_REQUEST_TIMEOUT, UPNP_CLOSE_DEADLINE, \
+    UPNP_CLOSE_DISCOVERY_WAIT
+from Uchat.helper.log import get_logger
+from Uchat.helper.logger import get_cached_gateway, write_to_data_file, DataType, FileName
+
+_log = get_logger('network.upnp')
+
+# WAN connection services an IGD may expose port mapping actions on, most common first
+WAN_SERVICE_TYPES = ('urn:schemas-upnp-org:service:WANIPConnection:1',
+                     'urn:schemas-upnp-org:service:WANIPConnection:2',
+                     'urn:schemas-upnp-org:service:WANPPPConnection:1')
 
 
 class SupportedTransportProtocols(Enum):
@@ -14,9 +28,164 @@ class SupportedTransportProtocols(Enum):
     TCP = 'TCP'
 
 
+class Gateway:
+    """
+    An internet gateway device (IGD), as discovered on the LAN
+    Cached in memory and on disk, so that port mappings can be managed without repeating SSDP discovery
+    """
+
+    def __init__(self, control_url: str, lan_addr: str, service_type: Optional[str] = None):
+        self.__control_url = control_url  # URL that port mapping SOAP actions are posted to
+        self.__lan_addr = lan_addr  # This host's address on the gateway's LAN
+        self.__service_type = service_type  # WAN connection service that accepted our last action
+        self.__discovered_at = time.time()
+
+    def control_url(self) -> str:
+        return self.__control_url
+
+    def lan_addr(self) -> str:
+        return self.__lan_addr
+
+    def service_type(self, new_service_type: Optional[str] = None) -> Optional[str]:
+        if new_service_type:
+            self.__service_type = new_service_type
+        return self.__service_type
+
+    def is_expired(self, ttl: float = UPNP_CACHE_TTL) -> bool:
+        return time.time() - self.__discovered_at > ttl
+
+
+_gateway: Optional[Gateway] = None  # In-memory cache of the discovered gateway
+_discovery: Optional[Future] = None  # Pending, or completed, background discovery
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upnp')
+
+
+def start_gateway_discovery() -> Future:
+    """
+    Starts discovering the LAN's gateway on a background executor, to be called at boot
+    If a discovery is already pending, or a valid gateway is cached, no new discovery is started
+
+    :return: a future resolving to the discovered gateway, or None
+    """
+    global _discovery
+
+    if not _discovery or (_discovery.done() and (_discovery.exception() or not _discovery.result())):
+        _discovery = _executor.submit(get_gateway)
+    return _discovery
+
+
+def get_gateway(refresh: bool = False) -> Optional[Gateway]:
+    """
+    Gets the LAN's gateway, from memory, then disk, then by SSDP discovery
+    :param refresh: Ignore any cached gateway and rediscover
+    :return: the gateway, if one could be found
+    """
+    global _gateway
+
+    if not refresh:
+        if _gateway and not _gateway.is_expired():
+            return _gateway
+
+        try:
+            cached = get_cached_gateway()
+        except Exception as err:
+            # A corrupt or outdated cache is simply rediscovered
+            print_err(1, "Ignoring unreadable UPnP gateway cache\n" + repr(err))
+            cached = None
+
+        if isinstance(cached, Gateway) and not cached.is_expired():
+            _gateway = cached
+            return _gateway
+
+    if gateway := _discover_gateway():
+        _cache_gateway(gateway)
+    return gateway
+
+
+def cached_gateway() -> Optional[Gateway]:
+    """
+    Gets the LAN's gateway without ever running discovery, used where blocking is not an option
+    :return: the cached gateway, if any
+    """
+    global _gateway
+
+    if not _gateway:
+        try:
+            if isinstance(cached := get_cached_gateway(), Gateway):
+                _gateway = cached
+        except Exception:
+            pass
+    return _gateway
+
+
+def _discover_gateway() -> Optional[Gateway]:
+    """
+    Runs a full SSDP discovery for the LAN's internet gateway device
+    :return: the gateway, if one responded
+    """
+    from miniupnpc import UPnP  # Deferred, the extension is only loaded once UPnP is actually used
+
+    upnp = UPnP()
+    upnp.discoverdelay = 20  # Gives up after 20 ms
+
+    try:
+        if upnp.discover() > 0:
+            control_url = upnp.selectigd()
+            return Gateway(control_url, upnp.lanaddr)
+    except Exception as err:
+        print_err(2, "UPnP gateway discovery failed\n" + str(err))
+    return None
+
+
+def _cache_gateway(gateway: Gateway):
+    global _gateway
+
+    _gateway = gateway
+    write_to_data_file(DataType.CACHE, FileName.GATEWAY, gateway, False)
+
+
+def _soap_action(gateway: Gateway, action: str, arguments: Dict[str, str], deadline: float) -> bool:
+    """
+    Posts a SOAP action to the gateway's control URL, trying each WAN service type until one accepts it
+
+    :param gateway: Gateway to send the action to
+    :param action: Name of the action, ex. AddPortMapping
+    :param arguments: Ordered action arguments
+    :param deadline: time.monotonic() value by which the action must have completed
+    :return: whether or not the gateway accepted the action
+    """
+    service_types = [gateway.service_type()] if gateway.service_type() else WAN_SERVICE_TYPES
+    body_args = ''.join('<{0}>{1}</{0}>'.format(name, escape(str(value))) for name, value in arguments.items())
+
+    for service_type in service_types:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        body = ('<?xml version="1.0"?>'
+                '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+                's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+                '<s:Body><u:{0} xmlns:u="{1}">{2}</u:{0}></s:Body></s:Envelope>').format(action, service_type,
+                                                                                         body_args)
+        request = urllib.request.Request(gateway.control_url(), data=body.encode(), method='POST', headers={
+            'Content-Type': 'text/xml; charset="utf-8"',
+            'SOAPAction': '"{}#{}"'.format(service_type, action)
+        })
+
+        try:
+            with urllib.request.urlopen(request, timeout=min(remaining, UPNP_REQUEST_TIMEOUT)) as response:
+                if response.status == 200:
+                    gateway.service_type(service_type)
+                    return True
+        except (URLError, OSError):
+            # Wrong service type (SOAP fault), or the gateway is unreachable
+            continue
+    return False
+
+
 # THREADED
 def ensure_port_is_forwarded(protocol: SupportedTransportProtocols = SupportedTransportProtocols.TCP,
-                             external_port: int = LISTENING_PORT, internal_port=LISTENING_PORT):
+                             external_port: int = LISTENING_PORT, internal_port=LISTENING_PORT) -> bool:
     """
     Ensures that the given external to internal port mapping has been forwarded to allow inbound connections to this
     host on this port.
@@ -27,47 +196,72 @@ def ensure_port_is_forwarded(protocol: SupportedTransportProtocols = SupportedTr
     :param protocol: Transport protocol of port to be mapped
     :param external_port: Port as viewable from the internet
     :param internal_port: Port as viewable from the LAN
+    :return: whether or not the port mapping was added
     """
-    upnp = UPnP()
-    upnp.discoverdelay = 20  # Gives up after 20 ms
-
     port_forwarded = False
-    discovered_count = upnp.discover()
+    gateway = start_gateway_discovery().result()
+
+    for attempt in range(2):
+        if gateway:
+            arguments = {
+                'NewRemoteHost': '',
+                'NewExternalPort': external_port,
+                'NewProtocol': protocol.value,
+                'NewInternalPort': internal_port,
+                'NewInternalClient': gateway.lan_addr(),
+                'NewEnabled': 1,
+                'NewPortMappingDescription': 'UChat P2P Messaging',
+                'NewLeaseDuration': 0
+            }
+            port_forwarded = _soap_action(gateway, 'AddPortMapping', arguments,
+                                          time.monotonic() + UPNP_REQUEST_TIMEOUT * len(WAN_SERVICE_TYPES))
 
-    if discovered_count > 0:
-        upnp.selectigd()
-        port_forwarded = upnp.addportmapping(external_port, protocol.value, upnp.lanaddr, internal_port,
-                                             'UChat P2P Messaging', '')
+        if port_forwarded or attempt or not gateway:
+            break
+
+        # Cached gateway may be stale (router replaced, DHCP lease changed), rediscover once
+        gateway = get_gateway(refresh=True)
 
     if not port_forwarded:
         # Send signal to show failure message and how to set up static port forwarding
         print_err(2, "Unable to open UPnP {} port {}".format(protocol.value, external_port))
-    print("UPnP Port Mapping added")
+        return False
+
+    _cache_gateway(gateway)  # Remember the service type that accepted the mapping
+    _log.info('UPnP port mapping added for %s port %d', protocol.value, external_port)
+    return True
 
 
 def delete_port_mapping(protocol: SupportedTransportProtocols = SupportedTransportProtocols.TCP,
-                        external_port: int = LISTENING_PORT):
+                        external_port: int = LISTENING_PORT, deadline: float = UPNP_CLOSE_DEADLINE,
+                        discovery_wait: float = UPNP_CLOSE_DISCOVERY_WAIT) -> bool:
     """
     Removes any UPnP temporary port forwards, to be executed on the application's closure
+    Never rediscovers the gateway, as the application would otherwise be kept from exiting
+
     :param protocol: Transport protocol of port to be deleted
     :param external_port: Port as viewable from internet
+    :param deadline: Seconds the gateway is given to delete the mapping, at most
+    :param discovery_wait: Seconds a discovery still pending is waited on, at most, before the deadline starts
+    :return: whether or not the port mapping was deleted
     """
+    gateway = None
+
+    if _discovery and not _discovery.done():
+        # Boot time discovery still running, it may finish while we wait
+        try:
+            gateway = _discovery.result(timeout=discovery_wait)
+        except Exception:
+            pass
 
     port_forward_deleted = False
-    upnp = UPnP()
-    upnp.discoverdelay = 20  # Gives up after 20 ms
+    if gateway := gateway or cached_gateway():
+        arguments = {'NewRemoteHost': '', 'NewExternalPort': external_port, 'NewProtocol': protocol.value}
+        port_forward_deleted = _soap_action(gateway, 'DeletePortMapping', arguments, time.monotonic() + deadline)
 
-    try:
-        discovered_count = upnp.discover()
-        if discovered_count > 0:
-            upnp.selectigd()
-            port_forward_deleted = upnp.deleteportmapping(external_port, protocol.value)
-        if not port_forward_deleted:
-            # Send signal to show failure message and how to set up static port forwarding
-            print_err(2, "Failed to delete UPnP Port Mapping on {} port {}".format(protocol.value, external_port))
-            pass
-    except Exception as e:
-        print(type(e))
-        print(str(e))
-        pass
-    print("UPnP Port Mapping Deleted")
+    if not port_forward_deleted:
+        print_err(2, "Failed to delete UPnP Port Mapping on {} port {}".format(protocol.value, external_port))
+        return False
+
+    _log.info('UPnP port mapping deleted for %s port %d', protocol.value, external_port)
+    return True
@@ -6,13 +6,15 @@ class Peer:
     Used to represent another client from the user's perspective, stores information necessary for
     communications to them
     """
+    __avatar = ''  # Peers saved before avatars were exchanged have none
 
     def __init__(self, address: Tuple[str, int], is_self: bool, username: Optional[str] = None,
-                 color: Optional[str] = None):
+                 color: Optional[str] = None, avatar: Optional[str] = None):
         self.__address = address
         self.__is_self = is_self
         self.__username = username if username else address[0]
         self.__color = color.lstrip('#').lstrip('0x') if color else '6d0d7a'
+        self.__avatar = avatar if avatar else ''  # Hash of the avatar, as hex, empty if the peer hasn't one
 
     def username(self, new_username: Optional[str] = None):
         if new_username:
@@ -24,6 +26,11 @@ class Peer:
             self.__color = new_color.lstrip('#').lstrip('0x')
         return self.__color
 
+    def avatar(self, new_avatar: Optional[str] = None):
+        if new_avatar:
+            self.__avatar = new_avatar
+        return self.__avatar
+
     def color_as_int(self):
         """
         Converts the hexadecimal color code to its integer representation
@@ -41,3 +48,6 @@ class Peer:
 
     def is_self(self):
         return self.__is_self
+
+    def __str__(self):
+        return '{}@{}:{}'.format(self.__username, *self.__address)
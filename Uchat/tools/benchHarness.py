@@ -0,0 +1,236 @@
+"""
+Minimal timeit-style benchmark harness, shared by Uchat's benchmark suites
+Results are saved as JSON and compared against a stored baseline with a rank-sum test
+"""
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Uchat.helper.globals import VERSION
+
+DEFAULT_SAMPLES = 20  # Timed samples per benchmark
+DEFAULT_SAMPLE_TIME = 0.02  # Seconds each sample should take, loops are calibrated to it
+DEFAULT_WARMUPS = 2  # Untimed samples run before measuring
+
+
+class BenchmarkResult:
+    """
+    Per-operation timings of a single benchmark, in seconds
+    """
+
+    def __init__(self, name: str, samples: List[float], loops: int):
+        self.name = name
+        self.samples = samples
+        self.loops = loops
+
+    def median(self) -> float:
+        return statistics.median(self.samples)
+
+    def stdev(self) -> float:
+        return statistics.stdev(self.samples) if len(self.samples) > 1 else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'loops': self.loops,
+            'samples': self.samples,
+            'median': self.median(),
+            'mean': statistics.fmean(self.samples),
+            'stdev': self.stdev()
+        }
+
+
+def _time_loops(func: Callable[[], object], loops: int) -> float:
+    timer = time.perf_counter
+    start = timer()
+    for _ in range(loops):
+        func()
+    return timer() - start
+
+
+def measure(name: str, func: Callable[[], object], samples: int = DEFAULT_SAMPLES,
+            sample_time: float = DEFAULT_SAMPLE_TIME, warmups: int = DEFAULT_WARMUPS) -> BenchmarkResult:
+    """
+    Times func, calibrating the loop count so that each sample lasts about sample_time
+    Garbage collection is disabled while timing, as timeit does, to keep samples repeatable
+
+    :param name: Name the result is stored under
+    :param func: Zero-argument callable to benchmark
+    :param samples: Number of timed samples
+    :param sample_time: Target duration of each sample, in seconds
+    :param warmups: Number of untimed samples run first
+    :return: the benchmark's per-call timings
+    """
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        # Calibrate, doubling loops until a sample is long enough to time reliably
+        loops = 1
+        while (elapsed := _time_loops(func, loops)) < sample_time / 2 and loops < 1 << 24:
+            loops *= 2
+        loops = max(1, int(loops * sample_time / max(elapsed, 1e-9)))
+
+        for _ in range(warmups):
+            _time_loops(func, loops)
+
+        timings = [_time_loops(func, loops) / loops for _ in range(samples)]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return BenchmarkResult(name, timings, loops)
+
+
+def metadata() -> Dict:
+    """
+    :return: details of the environment results were measured in, saved alongside them
+    """
+    return {
+        'uchat_version': VERSION,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.time()
+    }
+
+
+def save_results(results: List[BenchmarkResult], file_path: str):
+    with open(file_path, 'w') as file:
+        json.dump({'metadata': metadata(), 'benchmarks': {r.name: r.to_dict() for r in results}}, file, indent=2)
+
+
+def load_results(file_path: str) -> Dict[str, List[float]]:
+    """
+    :return: a mapping of benchmark name to its samples
+    """
+    with open(file_path, 'r') as file:
+        return {name: data['samples'] for name, data in json.load(file)['benchmarks'].items()}
+
+
+def rank_sum_p_value(a: List[float], b: List[float]) -> float:
+    """
+    Two-sided Mann-Whitney U test, using the normal approximation (fine for 10+ samples each)
+    Robust to the skewed, outlier-prone distributions that benchmark timings usually have
+
+    :return: probability that a and b come from the same distribution
+    """
+    combined = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    ranks = [0.0] * len(combined)
+
+    # Average ranks across ties
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        i = j + 1
+
+    n_a, n_b = len(a), len(b)
+    rank_sum_a = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+    u = rank_sum_a - n_a * (n_a + 1) / 2
+    mean = n_a * n_b / 2
+    sigma = math.sqrt(n_a * n_b * (n_a + n_b + 1) / 12)
+
+    if sigma == 0:
+        return 1.0
+    z = abs(u - mean) / sigma
+    return math.erfc(z / math.sqrt(2))
+
+
+def compare(baseline: Dict[str, List[float]], current: Dict[str, List[float]], threshold: float = 0.05,
+            alpha: float = 0.01) -> List[Tuple[str, float, float, bool]]:
+    """
+    Compares current results against a baseline
+    A benchmark regressed if it is significantly slower (p < alpha) by more than threshold
+
+    :return: a list of (name, relative change of the median, p-value, regressed) tuples
+    """
+    comparison = list()
+
+    for name, samples in current.items():
+        if name not in baseline:
+            continue
+
+        base_median = statistics.median(baseline[name])
+        change = statistics.median(samples) / base_median - 1
+        p_value = rank_sum_p_value(baseline[name], samples)
+        comparison.append((name, change, p_value, p_value < alpha and change > threshold))
+
+    return comparison
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '{:.2f} {}'.format(seconds / scale, unit)
+    return '{:.1f} ns'.format(seconds / 1e-9)
+
+
+def print_results(results: List[BenchmarkResult]):
+    width = max((len(r.name) for r in results), default=0)
+    for result in results:
+        print('{:<{}}  {:>12} +- {:>10}'.format(result.name, width, format_time(result.median()),
+                                                format_time(result.stdev())))
+
+
+def print_comparison(comparison: List[Tuple[str, float, float, bool]]) -> int:
+    """
+    :return: the number of regressions
+    """
+    width = max((len(name) for name, _, _, _ in comparison), default=0)
+    regressions = 0
+
+    for name, change, p_value, regressed in comparison:
+        verdict = 'REGRESSION' if regressed else ('faster' if change < 0 and p_value < 0.01 else 'same')
+        print('{:<{}}  {:>+8.1%}  p={:<8.2g} {}'.format(name, width, change, p_value, verdict))
+        regressions += regressed
+
+    return regressions
+
+
+def run_suite(benchmarks: List[Tuple[str, Callable[[], object]]], argv: Optional[List[str]] = None,
+              description: str = '', preamble: Optional[Callable[[], str]] = None) -> int:
+    """
+    Runs a suite of benchmarks from the command line, saving and comparing results as requested
+    :param benchmarks: (name, zero-argument callable) pairs
+    :param argv: Command line arguments
+    :param description: Description of the suite, for --help
+    :param preamble: Builds text printed ahead of the results, once the arguments are parsed
+    :return: process exit status, non-zero if a regression was found
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', help='Save results as JSON to this file')
+    parser.add_argument('--compare', help='Compare against a baseline JSON file')
+    parser.add_argument('--filter', default='', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument('--sample-time', type=float, default=DEFAULT_SAMPLE_TIME)
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='Relative slowdown tolerated before a significant change counts as a regression')
+    args = parser.parse_args(argv)
+
+    if preamble:
+        print(preamble())
+
+    results = [measure(name, func, args.samples, args.sample_time)
+               for name, func in benchmarks if args.filter in name]
+    print_results(results)
+
+    if args.output:
+        save_results(results, args.output)
+
+    if args.compare:
+        print('\nCompared with {}:'.format(args.compare))
+        current = {result.name: result.samples for result in results}
+        if print_comparison(compare(load_results(args.compare), current, args.threshold)):
+            return 1
+    return 0
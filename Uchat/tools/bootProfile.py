@@ -0,0 +1,137 @@
+"""
+Measures the application's cold start, as both an import-time summary and a wall-clock boot timeline
+Exits with a non-zero status when the cold start exceeds its budget, so it can gate releases
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from Uchat.helper.globals import BOOT_PROFILE_ENV, BOOT_EXIT_ENV, BOOT_BUDGET_MS
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+# Modules that must only ever be loaded on first use, never while booting
+DEFERRED_MODULES = ('requests', 'miniupnpc', 'Uchat.network.ip', 'Uchat.network.upnp', 'Uchat.ui.accountCreation',
+                    'Uchat.ui.friends.friendDialogs', 'Uchat.ui.main.UserInfoDialog')
+
+
+def _child_env(**extra: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(PROJECT_ROOT), env.get('PYTHONPATH')]))
+    env.update(extra)
+    return env
+
+
+def import_times(module: str = 'Uchat.driver') -> List[Tuple[str, int, int]]:
+    """
+    Imports the given module in a fresh interpreter with -X importtime
+    :param module: Module whose (cold) import should be measured
+    :return: a list of (module name, self us, cumulative us) tuples, in import order
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            cwd=PROJECT_ROOT, env=_child_env(), capture_output=True, text=True)
+
+    entries = list()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    if result.returncode != 0:
+        raise RuntimeError('Unable to import {}:\n{}'.format(module, result.stderr.strip().splitlines()[-1]))
+    return entries
+
+
+def summarize_imports(entries: List[Tuple[str, int, int]], top: int = 15) -> str:
+    """
+    Builds an -X importtime style summary, grouping self time by top-level package
+    :param entries: Output of import_times
+    :param top: Number of slowest packages to show
+    :return: a printable summary
+    """
+    by_package: Dict[str, int] = dict()
+    for name, self_us, _ in entries:
+        package = name.split('.')[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+
+    total_us = sum(by_package.values())
+    lines = ['Import time by package (total {:.1f} ms):'.format(total_us / 1000)]
+
+    for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append('  {:<32} {:>9.2f} ms {:>5.1f}%'.format(package, self_us / 1000, 100 * self_us / total_us))
+
+    return '\n'.join(lines)
+
+
+def boot_timeline() -> Optional[List[Tuple[str, float, float]]]:
+    """
+    Boots the full application, quitting as soon as its main window is ready
+    :return: a list of (phase, duration ms, elapsed ms) tuples, or None if the GUI could not be started
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, str(PROJECT_ROOT / 'bin' / 'run.py')], cwd=PROJECT_ROOT,
+                            env=_child_env(**{BOOT_PROFILE_ENV: '1', BOOT_EXIT_ENV: '1'}),
+                            capture_output=True, text=True, timeout=60)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    timeline = list()
+    in_timeline = False
+    for line in result.stderr.splitlines():
+        if line.startswith('Boot timeline'):
+            in_timeline = True
+        elif in_timeline and line.startswith('  '):
+            name, duration, elapsed = line.rsplit(None, 2)
+            timeline.append((name.strip(), float(duration), float(elapsed)))
+        else:
+            in_timeline = False
+
+    if not timeline:
+        return None
+
+    timeline.append(('process exit', wall_ms - timeline[-1][2], wall_ms))
+    return timeline
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Profile the cold start of Uchat.')
+    parser.add_argument('--budget-ms', type=float, default=BOOT_BUDGET_MS,
+                        help='Fail if cold start exceeds this many milliseconds')
+    parser.add_argument('--imports-only', action='store_true',
+                        help='Only measure imports, without starting the GUI (for headless machines)')
+    args = parser.parse_args(argv)
+
+    failures = list()
+
+    entries = import_times()
+    print(summarize_imports(entries))
+
+    loaded = {name for name, _, _ in entries}
+    if eager := [module for module in DEFERRED_MODULES if module in loaded]:
+        failures.append('Deferred modules imported at boot: {}'.format(', '.join(eager)))
+
+    cold_start_ms = sum(self_us for _, self_us, _ in entries) / 1000
+
+    if not args.imports_only:
+        if timeline := boot_timeline():
+            print('\nBoot timeline:')
+            for name, duration, elapsed in timeline:
+                print('  {:<28} {:>9.2f} ms {:>9.2f} ms'.format(name, duration, elapsed))
+
+            # Budget covers everything up to a ready window, tearing down is not part of a cold start
+            cold_start_ms = timeline[-2][2]
+        else:
+            print('\nUnable to start the GUI, falling back to the import budget', file=sys.stderr)
+
+    print('\nCold start: {:.1f} ms (budget {:.1f} ms)'.format(cold_start_ms, args.budget_ms))
+    if cold_start_ms > args.budget_ms:
+        failures.append('Cold start of {:.1f} ms exceeds budget of {:.1f} ms'.format(cold_start_ms, args.budget_ms))
+
+    for failure in failures:
+        print('FAIL: ' + failure, file=sys.stderr)
+    return 1 if failures else 0
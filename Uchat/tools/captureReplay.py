@@ -0,0 +1,148 @@
+"""
+Replays a capture of received frames through the decode path and the handlers of a headless client
+Each captured connection becomes a conversation over a loopback socket whose far end discards what the client answers,
+so the client runs as it did when the traffic was captured, at the original timing or as fast as it can
+"""
+import argparse
+import contextlib
+import json
+import platform
+import selectors
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from Uchat.client import Client
+from Uchat.helper.globals import VERSION
+from Uchat.network import capture
+from Uchat.network.capture import CaptureRecord
+from Uchat.network.tcp import TcpSocket, decode_message
+from Uchat.peer import Peer
+from Uchat.tools.codecBench import loopback_pair
+from Uchat.tools.loadGenerator import percentiles
+
+
+class _Replayed:
+    """
+    A captured connection, replayed as a conversation with the client
+    """
+
+    def __init__(self, client: Client, remote: str):
+        host, _, port = remote.rpartition(':')
+        self.peer = Peer((host, int(port or 0)), False, host or 'replayed')
+        near, self.far = loopback_pair()
+        self.far.setblocking(False)
+        self.sock = TcpSocket(sock=near)
+        client.create_conversation(self.peer, self.sock)
+        client.accept_connection(self.peer, self.sock)
+
+    def drain(self):
+        """
+        Discards what the client sent, so its sends never wait for room
+        """
+        try:
+            while self.far.recv(1 << 16):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+
+def replay(records: List[CaptureRecord], speed: float = 1.0) -> Dict:
+    """
+    Runs the replay
+    :param records: Records of a capture, in the order they were written
+    :param speed: Factor the original timing is sped up by, 0 to replay as fast as possible
+    :return: the machine-readable report
+    """
+    selector = selectors.DefaultSelector()
+    client = Client(selector, Peer(('', 0), True, 'replay', '#2a9d8f'))
+    connections: Dict[int, _Replayed] = dict()
+    handling: List[float] = list()
+    types = Counter()
+    failures = 0
+
+    def pump(timeout: Optional[float]):
+        timers = client.run_timers()
+        if timers is not None:
+            timeout = min(timeout, timers) if timeout is not None else timers
+        for key, mask in selector.select(timeout=timeout):
+            client.handle_connection(key.fileobj, mask)
+        for replayed in connections.values():
+            replayed.drain()
+
+    start = time.perf_counter()
+    for record in records:
+        if speed > 0:
+            due = start + record.time_ns / 1e9 / speed
+            while (now := time.perf_counter()) < due:
+                pump(due - now)
+
+        if record.kind == capture.OPENED:
+            connections[record.connection] = _Replayed(client, record.data.decode(errors='replace'))
+        elif record.kind == capture.FRAME and (replayed := connections.get(record.connection)):
+            began = time.perf_counter()
+            message = decode_message(record.data, record.version)
+            client.handle_receipt(replayed.peer, message)
+            handling.append(time.perf_counter() - began)
+            if message:
+                types[message.m_type.name.lower()] += 1
+            else:
+                failures += 1
+        elif record.kind == capture.CLOSED and (replayed := connections.pop(record.connection, None)):
+            client.delete_conversation(replayed.peer)
+            replayed.far.close()
+        pump(0)
+
+    elapsed = time.perf_counter() - start
+    for replayed in connections.values():
+        client.delete_conversation(replayed.peer)
+        replayed.far.close()
+    with contextlib.suppress(OSError):
+        client.destroy()
+
+    opened = sum(record.kind == capture.OPENED for record in records)
+    return {
+        'tool': 'uchat-replay',
+        'uchat_version': VERSION,
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'config': {
+            'speed': speed
+        },
+        'results': {
+            'connections': opened,
+            'frames': len(handling),
+            'frames_by_type': dict(types),
+            'decode_failures': failures,
+            'elapsed_s': elapsed,
+            'frames_per_sec': len(handling) / elapsed if elapsed else 0,
+            'frame_handling_ms': percentiles(handling) if handling else {}
+        }
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Replay a capture of received frames through a headless client.')
+    parser.add_argument('capture', help='Capture file, as recorded with UCHAT_CAPTURE set')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Factor the original timing is sped up by, 0 to replay as fast as possible')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    try:
+        records = list(capture.read_capture(args.capture))
+    except (OSError, ValueError) as err:
+        parser.error(str(err))
+
+    # Keep stdout for the report alone, the client prints its diagnostics
+    with contextlib.redirect_stdout(sys.stderr):
+        report = replay(records, args.speed)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
@@ -0,0 +1,128 @@
+"""
+Microbenchmarks of the wire codec's hot paths
+"""
+import socket
+from typing import Callable, List, Optional, Tuple
+
+from Uchat.MessageContext import MessageContext
+from Uchat.model.conversation import Conversation
+from Uchat.model.conversationFsm import ConversationState, transition_key, next_state
+from Uchat.network.messages import message
+from Uchat.network.messages.message import GreetingMessage, ChatMessage, FarewellMessage, MessageType, WIRE_V1, \
+    WIRE_V2
+from Uchat.network.tcp import TcpSocket, next_frame
+from Uchat.peer import Peer
+
+CHAT_SIZES = (1, 64, 1024, 16384, 65535)  # Characters per chat message, up to the largest a frame can hold
+
+
+def loopback_pair() -> Tuple[socket.socket, socket.socket]:
+    """
+    :return: a connected pair of TCP sockets over the loopback interface
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+
+    for sock in (client, server):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    return client, server
+
+
+def _recv_benchmark(frame: bytes, version: int = WIRE_V1) -> Callable[[], object]:
+    writer, reader = loopback_pair()
+    receiver = TcpSocket(sock=reader)
+    if version >= WIRE_V2:
+        writer.sendall(GreetingMessage(0x6d0d7a, 'benchmark', True, True, version).to_bytes())
+        receiver.recv_message()  # Reads the following frames in the version it offers
+
+    def recv():
+        writer.sendall(frame)
+        return receiver.recv_message()
+
+    return recv
+
+
+def _add_message_benchmark() -> Callable[[], object]:
+    me = Peer(('', 0), True, 'me')
+    conversation = Conversation(me, Peer(('127.0.0.1', 0), False, 'them'), None)
+    context = MessageContext(ChatMessage('hello'), me)
+
+    return lambda: conversation.add_message(context)
+
+
+def _transition_benchmark() -> Callable[[], object]:
+    greeting = GreetingMessage(0x6d0d7a, 'benchmark', True, True)
+
+    return lambda: next_state(transition_key(ConversationState.AWAIT, greeting, False))
+
+
+def _expecting_benchmark() -> Callable[[], object]:
+    conversation = Conversation(Peer(('', 0), True, 'me'), Peer(('127.0.0.1', 0), False, 'them'), None)
+
+    return lambda: MessageType.CHAT in conversation.expecting_types()
+
+
+def benchmarks() -> List[Tuple[str, Callable[[], object]]]:
+    greeting = GreetingMessage(0x6d0d7a, 'benchmark', True, True)
+    greeting_payload = greeting.to_bytes()[4:]
+    farewell = FarewellMessage()
+
+    suite = [
+        ('greeting.to_bytes', greeting.to_bytes),
+        ('greeting.from_bytes', lambda: GreetingMessage.from_bytes(greeting_payload)),
+        ('farewell.to_bytes', farewell.to_bytes),
+        ('farewell.from_bytes', FarewellMessage.from_bytes),
+        ('message._pack', lambda: message._pack(GreetingMessage._greeting_format, 0, WIRE_V2, 0x6d0d7a, True, True,
+                                                b'benchmark')),
+    ]
+
+    for size in CHAT_SIZES:
+        chat = ChatMessage('x' * size)
+        chat_payload = chat.to_bytes()[4:]
+        suite += [
+            ('chat.to_bytes[{}]'.format(size), chat.to_bytes),
+            ('chat.from_bytes[{}]'.format(size), lambda payload=chat_payload: ChatMessage.from_bytes(payload)),
+            ('tcp.recv_message[chat {}]'.format(size), _recv_benchmark(chat.to_bytes())),
+        ]
+
+        chat_payload = next_frame(bytearray(chat.to_bytes(WIRE_V2)), WIRE_V2)
+        suite += [
+            ('chat.to_bytes[{} v2]'.format(size), lambda chat=chat: chat.to_bytes(WIRE_V2)),
+            ('chat.from_bytes[{} v2]'.format(size),
+             lambda payload=chat_payload: ChatMessage.from_bytes(payload, WIRE_V2)),
+            ('tcp.recv_message[chat {} v2]'.format(size), _recv_benchmark(chat.to_bytes(WIRE_V2), WIRE_V2)),
+        ]
+
+    suite += [
+        # Offering v1, as a greeting offering v2 switches the frames read after it, so greetings can't follow it
+        ('tcp.recv_message[greeting]', _recv_benchmark(GreetingMessage(0x6d0d7a, 'benchmark', True, True,
+                                                                       WIRE_V1).to_bytes())),
+        ('conversation.add_message', _add_message_benchmark()),
+        ('conversation.next_state', _transition_benchmark()),
+        ('conversation.expecting_types', _expecting_benchmark()),
+    ]
+    return suite
+
+
+def frame_sizes() -> List[Tuple[str, int, int]]:
+    """
+    :return: bytes each kind of message takes on the wire, in v1 then in v2
+    """
+    messages = [('farewell', FarewellMessage()), ('ack', message.AckMessage(1234))]
+    messages += [('chat[{}]'.format(size), ChatMessage('x' * size, seq=1234, ack=1234)) for size in CHAT_SIZES[:3]]
+    return [(name, len(msg.to_bytes(WIRE_V1)), len(msg.to_bytes(WIRE_V2))) for name, msg in messages]
+
+
+def _frame_size_table() -> str:
+    return '\n'.join('{:<12} {:>6} B v1 {:>6} B v2'.format(name, v1_size, v2_size)
+                     for name, v1_size, v2_size in frame_sizes())
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from Uchat.tools.benchHarness import run_suite
+
+    return run_suite(benchmarks(), argv, 'Microbenchmarks of the Uchat wire codec.', _frame_size_table)
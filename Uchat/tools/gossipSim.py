@@ -0,0 +1,235 @@
+"""
+Simulates a relayed group chat between hundreds of real clients in one process, over localhost
+Members are wired into a random overlay, each holding conversations with a few others, and messages spread by gossip
+"""
+import argparse
+import json
+import platform
+import random
+import selectors
+import sys
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+
+from Uchat.client import Client, ClientListener
+from Uchat.helper import metrics
+from Uchat.helper.globals import VERSION, GOSSIP_FANOUT
+from Uchat.network.messages.message import ChatMessage
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+from Uchat.tools.loadGenerator import percentiles
+
+GROUP_ID = 0x6055  # Shared by every simulated member's copy of the group
+
+
+class SimulatedMember(ClientListener):
+    """
+    Listener of one simulated member's client, accepting every connection and timing every group message it receives
+    """
+
+    def __init__(self, simulation: 'GossipSimulation', client: Client):
+        self.__simulation = simulation
+        self.__client = client
+        self.neighbors: List[Peer] = list()
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        self.__client.accept_connection(peer, sock)
+
+    def chat_started(self, peer: Peer):
+        self.neighbors.append(peer)
+
+    def chat_received(self, peer: Peer):
+        if (group := self.__client.group(GROUP_ID)) and peer is group.peer():
+            # Text is 'origin|sequence|perf_counter_ns at send'
+            origin, seq, sent_at = group.chat_message_contexts()[-1].msg.message.split('|')[:3]
+            self.__simulation.record_delivery(int(origin), int(seq), time.perf_counter_ns() - int(sent_at))
+
+
+class GossipSimulation:
+    """
+    Holds every simulated member, driven by a single network thread
+    """
+
+    def __init__(self, members: int, degree: int, fanout: int, base_port: int):
+        self.__degree = degree
+        self.__fanout = fanout
+        self.__lock = threading.Lock()
+        self.__latencies: List[float] = list()
+        self.__deliveries: Dict[Tuple[int, int], int] = dict()  # (Origin, sequence) -> members reached
+
+        # Clients' selectors are themselves registered with one selector, so a single thread drives every member
+        self.__selector = selectors.DefaultSelector()
+        self.clients: List[Client] = list()
+        self.listeners: List[SimulatedMember] = list()
+        self.ports: List[int] = list()
+
+        for index in range(members):
+            selector = selectors.DefaultSelector()
+            port = base_port + index
+            client = Client(selector, Peer(('', port), True, 'sim{}'.format(index), '#2a9d8f'))
+            listener = SimulatedMember(self, client)
+            client.add_listener(listener)
+
+            self.__selector.register(selector, selectors.EVENT_READ, data=(client, selector))
+            self.clients.append(client)
+            self.listeners.append(listener)
+            self.ports.append(port)
+
+        threading.Thread(target=self.__poll, daemon=True).start()
+
+    def __poll(self):
+        timeout = None
+        while True:
+            for key, mask in self.__selector.select(timeout=timeout):
+                client, selector = key.data
+                for client_key, client_mask in selector.select(timeout=0):
+                    client.handle_connection(client_key.fileobj, client_mask)
+
+            waits = [wait for wait in (client.run_timers() for client in self.clients) if wait is not None]
+            timeout = min(waits) if waits else None
+
+    def build_overlay(self, timeout: float = 30) -> bool:
+        """
+        Connects each member to the next around a ring, so every member can be reached, and to random others up to
+        degree / 2, then waits for every conversation to become active
+        :return: whether every conversation was established in time
+        """
+        links = set()
+        count = len(self.clients)
+
+        for index in range(count):
+            others = [other for other in range(count) if other not in (index, (index + 1) % count)]
+            chosen = [(index + 1) % count] + random.sample(others, min(len(others), max(0, self.__degree // 2 - 1)))
+            for other in chosen:
+                if other == index or (other, index) in links or (index, other) in links:
+                    continue
+                links.add((index, other))
+
+                peer = Peer(('127.0.0.1', self.ports[other]), False, 'sim{}'.format(other))
+                self.clients[index].create_conversation(peer, None)
+                self.clients[index].send_greeting(peer, False)
+
+        expected = sum(2 for _ in links)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if sum(len(listener.neighbors) for listener in self.listeners) >= expected:
+                break
+            time.sleep(0.05)
+        else:
+            return False
+
+        for client, listener in zip(self.clients, self.listeners):
+            client.create_group(listener.neighbors, GROUP_ID, 'sim', self.__fanout)
+        return True
+
+    def record_delivery(self, origin: int, seq: int, latency_ns: int):
+        with self.__lock:
+            self.__latencies.append(latency_ns / 1e9)
+            self.__deliveries[(origin, seq)] = self.__deliveries.get((origin, seq), 0) + 1
+
+    def send(self, origin: int, seq: int):
+        client = self.clients[origin]
+        text = '{}|{}|{}|'.format(origin, seq, time.perf_counter_ns())
+        client.send_chat(client.group(GROUP_ID).peer(), ChatMessage(text))
+
+    def latencies(self) -> List[float]:
+        with self.__lock:
+            return list(self.__latencies)
+
+    def deliveries(self) -> Dict[Tuple[int, int], int]:
+        with self.__lock:
+            return dict(self.__deliveries)
+
+
+def run_simulation(members: int, degree: int, fanout: int, messages: int, rate: float, base_port: int) -> Dict:
+    """
+    Runs the simulation
+    :param members: Number of simulated members
+    :param degree: Average number of conversations each member holds with others
+    :param fanout: Members each message is sent or forwarded to
+    :param messages: Number of messages sent, each by a random member
+    :param rate: Messages per second
+    :param base_port: First of the consecutive ports members listen on
+    :return: the machine-readable report
+    """
+    simulation = GossipSimulation(members, degree, fanout, base_port)
+    connected = simulation.build_overlay()
+
+    origins = list()
+    for seq in range(messages):
+        origin = random.randrange(members)
+        origins.append(origin)
+        simulation.send(origin, seq)
+        time.sleep(1 / rate)
+
+    # Wait for messages to stop spreading
+    deadline = time.monotonic() + 5
+    settled = -1
+    while time.monotonic() < deadline and settled != len(simulation.latencies()):
+        settled = len(simulation.latencies())
+        time.sleep(0.5)
+
+    deliveries = simulation.deliveries()
+    reached = [deliveries.get((origin, seq), 0) for seq, origin in enumerate(origins)]
+    received = {result: metrics.counter('uchat_gossip_received_total', result=result).value()
+                for result in ('new', 'duplicate')}
+    hops = metrics.histogram('uchat_gossip_hops', unit_scale=1)
+    frames_sent = [client.group(GROUP_ID).frames_sent() for client in simulation.clients]
+
+    return {
+        'tool': 'uchat-gossip-sim',
+        'uchat_version': VERSION,
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'config': {
+            'members': members,
+            'degree': degree,
+            'fanout': fanout,
+            'messages': messages,
+            'rate': rate
+        },
+        'results': {
+            'overlay_established': connected,
+            'delivery_ratio': sum(reached) / (messages * (members - 1)) if messages and members > 1 else 0,
+            'fully_delivered_messages': sum(1 for count in reached if count == members - 1),
+            'duplicate_rate': received['duplicate'] / max(1, received['new'] + received['duplicate']),
+            'hops_p50': hops.quantile(0.5),
+            'hops_max': hops.quantile(1.0),
+            'delivery_latency_ms': percentiles(simulation.latencies()),
+            'frames_uploaded_per_member': {
+                'mean': sum(frames_sent) / members,
+                'max': max(frames_sent),
+                'mean_per_message': sum(frames_sent) / members / messages if messages else 0
+            },
+            'direct_frames_per_message': members - 1  # What each sender would upload without relaying
+        }
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Simulate a relayed Uchat group chat on localhost.')
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--degree', type=int, default=8, help='Conversations each member holds with others')
+    parser.add_argument('--fanout', type=int, default=GOSSIP_FANOUT, help='Members each message is forwarded to')
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=20, help='Messages per second, across every member')
+    parser.add_argument('--base-port', type=int, default=41000, help='Members listen on consecutive ports from here')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = run_simulation(args.members, args.degree, args.fanout, args.messages, args.rate, args.base_port)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if not report['results']['overlay_established']:
+        return 1
+    if report['results']['delivery_ratio'] != 1.0:
+        print('Messages were lost, delivery ratio {}'.format(report['results']['delivery_ratio']), file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,98 @@
+"""
+Benchmarks the cost of fanning a group message out to every member
+"""
+import selectors
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from Uchat.MessageContext import MessageContext
+from Uchat.client import Client
+from Uchat.network.messages.message import ChatMessage, GreetingMessage, GroupChatMessage, WIRE_V1
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+from Uchat.tools.codecBench import loopback_pair
+
+GROUP_SIZES = (50, 500)  # Members per group
+MESSAGE_SIZE = 64  # Characters per chat message
+
+
+def _drain(selector: selectors.BaseSelector):
+    while True:
+        for key, mask in selector.select():
+            key.fileobj.recv(1 << 20)
+
+
+def _serve(selector: selectors.BaseSelector, client: Client):
+    while True:
+        for key, mask in selector.select(timeout=client.run_timers()):
+            client.handle_connection(key.fileobj, mask)
+
+
+def group_fixture(members: int) -> Tuple[Client, List[Peer], Peer]:
+    """
+    Builds a client holding an active conversation with each of members loopback peers, and a group of them all
+    Members' ends of the connections are drained in the background, as real peers would read them
+    :return: the client, the members, and the pseudo-peer of the group
+    """
+    client_selector = selectors.DefaultSelector()
+    drain_selector = selectors.DefaultSelector()
+    client = Client(client_selector, Peer(('', 0), True, 'bench', '#6d0d7a'))
+    peers = list()
+
+    for index in range(members):
+        local, remote = loopback_pair()
+        peer = Peer(remote.getsockname(), False, 'member{}'.format(index))
+
+        # Greetings are exchanged over the connection, so it's spoken in a version members read groups in
+        sock = TcpSocket(sock=local)
+        sock.send_bytes(GreetingMessage(0x6d0d7a, 'bench', False).to_bytes(WIRE_V1))
+        remote.sendall(GreetingMessage(0x6d0d7a, peer.username(), True).to_bytes(WIRE_V1))
+
+        conv = client.create_conversation(peer, sock)
+        conv.add_message(MessageContext(sock.recv_message(), peer))  # Now active
+        client_selector.register(conv.sock(), selectors.EVENT_READ, data=peer)
+        drain_selector.register(remote, selectors.EVENT_READ)
+        peers.append(peer)
+
+    threading.Thread(target=_serve, args=(client_selector, client), daemon=True).start()
+    threading.Thread(target=_drain, args=(drain_selector,), daemon=True).start()
+
+    group = client.create_group(peers, name='bench')
+    return client, peers, group.peer()
+
+
+def _fan_out_benchmark(members: int) -> Callable[[], object]:
+    client, _, group_peer = group_fixture(members)
+    chat = ChatMessage('x' * MESSAGE_SIZE)
+
+    return lambda: client.send_chat(group_peer, chat)
+
+
+def _encode_per_member_benchmark(members: int) -> Callable[[], object]:
+    """
+    Baseline, sends to each member as pairwise messages are sent, encoding and writing one frame at a time
+    """
+    client, peers, _ = group_fixture(members)
+    text = 'x' * MESSAGE_SIZE
+
+    def send():
+        for peer in peers:
+            client.send(peer, GroupChatMessage(1, 1, 1, text))
+
+    return send
+
+
+def benchmarks() -> List[Tuple[str, Callable[[], object]]]:
+    suite = list()
+    for members in GROUP_SIZES:
+        suite += [
+            ('group.fan_out[{}]'.format(members), _fan_out_benchmark(members)),
+            ('group.encode_per_member[{}]'.format(members), _encode_per_member_benchmark(members)),
+        ]
+    return suite
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from Uchat.tools.benchHarness import run_suite
+
+    return run_suite(benchmarks(), argv, 'Benchmarks of group message fan-out.')
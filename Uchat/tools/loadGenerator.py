@@ -0,0 +1,305 @@
+"""
+Spins up simulated clients against real Uchat clients on localhost and measures their throughput and latency
+Simulated clients speak the real greeting / chat / farewell protocol, targets are headless clients that echo chats
+"""
+import argparse
+import contextlib
+import heapq
+import json
+import platform
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple, Optional, Dict
+
+from Uchat.client import Client, ClientListener
+from Uchat.helper.globals import VERSION
+from Uchat.network.messages.message import GreetingMessage, ChatMessage, FarewellMessage, MessageType
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+
+class EchoResponder(ClientListener):
+    """
+    Turns a headless client into a load target, accepting every connection and echoing every chat back
+    """
+
+    def __init__(self, client: Client):
+        self.__client = client
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        self.__client.accept_connection(peer, sock)
+
+    def chat_received(self, peer: Peer):
+        if conv := self.__client.conversation(peer):
+            received = conv.chat_message_contexts()[-1].msg
+            self.__client.send_chat(peer, ChatMessage(received.message))
+
+
+def run_responder(port: int):
+    """
+    Runs a headless, echoing Uchat client until interrupted
+    :param port: Port to listen for simulated clients on
+    """
+    selector = selectors.DefaultSelector()
+    client = Client(selector, Peer(('', port), True, 'target{}'.format(port), '#2a9d8f'))
+    client.add_listener(EchoResponder(client))
+
+    while True:
+        for key, mask in selector.select(timeout=client.run_timers()):
+            client.handle_connection(key.fileobj, mask)
+
+
+class SimulatedClient:
+    """
+    A single simulated user, holding one conversation with a target
+    """
+
+    def __init__(self, index: int, target: Tuple[str, int], message_size: int):
+        self.index = index
+        self.target = target
+        self.sock: Optional[TcpSocket] = None
+        self.is_active = False
+        self.seq = 0
+        self.in_flight: Dict[int, float] = dict()  # Sequence number -> perf_counter at send
+        self.padding = 'x' * max(0, message_size - len(self.__text(0)))
+
+    def __text(self, seq: int) -> str:
+        return '{}:{}:'.format(self.index, seq)
+
+    def connect(self) -> Optional[float]:
+        """
+        Connects to the target and runs the greeting handshake
+        :return: setup latency in seconds, or None if the target did not accept
+        """
+        start = time.perf_counter()
+        self.sock = TcpSocket()
+        self.sock.set_timeout(5)
+
+        if not self.sock.connect(self.target):
+            return None
+
+        self.sock.send_bytes(GreetingMessage(0x6d0d7a, 'load{}'.format(self.index), False).to_bytes())
+        reply = self.sock.recv_message()
+
+        if not (reply and reply.m_type is MessageType.GREETING and reply.ack and reply.wants_to_talk):
+            return None
+
+        self.is_active = True
+        return time.perf_counter() - start
+
+    def send_chat(self):
+        self.seq += 1
+        self.in_flight[self.seq] = time.perf_counter()
+        self.sock.send_bytes(ChatMessage(self.__text(self.seq) + self.padding).to_bytes(self.sock.wire_version()))
+
+    def receive(self) -> Optional[float]:
+        """
+        Reads one echoed chat
+        :return: the message's round trip latency in seconds, if it was one of ours
+        """
+        msg = self.sock.recv_message()
+        if msg and msg.m_type is MessageType.CHAT:
+            seq = int(msg.message.split(':', 2)[1])
+            if sent_at := self.in_flight.pop(seq, None):
+                return time.perf_counter() - sent_at
+        return None
+
+    def close(self):
+        if self.is_active:
+            self.sock.send_bytes(FarewellMessage().to_bytes(self.sock.wire_version()))
+            self.is_active = False
+        self.sock.free()
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """
+    :param samples: Latency samples in seconds
+    :return: summary statistics of samples, in milliseconds
+    """
+    if not samples:
+        return dict()
+
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) * 1000,
+        'min': ordered[0] * 1000,
+        'p50': rank(0.50),
+        'p99': rank(0.99),
+        'p999': rank(0.999),
+        'max': ordered[-1] * 1000
+    }
+
+
+def run_load(targets: List[Tuple[str, int]], clients: int, rate: float, duration: float,
+             message_size: int) -> Dict:
+    """
+    Runs the load test
+    :param targets: Addresses of the clients under test, simulated clients are spread across them round-robin
+    :param clients: Number of simulated clients
+    :param rate: Messages per second sent by each simulated client
+    :param duration: Seconds to send messages for, after every client is connected
+    :param message_size: Characters per chat message
+    :return: the machine-readable report
+    """
+    simulated = [SimulatedClient(i, targets[i % len(targets)], message_size) for i in range(clients)]
+    selector = selectors.DefaultSelector()
+
+    setup_latencies = list()
+    for sim in simulated:
+        if (latency := sim.connect()) is not None:
+            setup_latencies.append(latency)
+            sim.sock.set_timeout(None)
+            selector.register(sim.sock, selectors.EVENT_READ, data=sim)
+
+    active = [sim for sim in simulated if sim.is_active]
+    interval = 1 / rate
+
+    # Stagger first sends, so clients don't fire in lock-step
+    schedule = [(time.perf_counter() + interval * i / max(1, len(active)), sim.index, sim)
+                for i, sim in enumerate(active)]
+    heapq.heapify(schedule)
+
+    round_trips = list()
+    sent = 0
+    start = time.perf_counter()
+    end = start + duration
+    drain_end = end + 2  # Allow echoes still in flight to arrive
+
+    while (now := time.perf_counter()) < drain_end:
+        while schedule and schedule[0][0] <= now and now < end:
+            due, index, sim = heapq.heappop(schedule)
+            sim.send_chat()
+            sent += 1
+            heapq.heappush(schedule, (due + interval, index, sim))
+
+        if now >= end and not any(sim.in_flight for sim in active):
+            break
+
+        timeout = max(0.0, schedule[0][0] - now) if schedule and now < end else 0.05
+        for key, mask in selector.select(timeout=timeout):
+            if (latency := key.data.receive()) is not None:
+                round_trips.append(latency)
+
+    elapsed = time.perf_counter() - start
+
+    for sim in simulated:
+        if sim.sock:
+            if sim.is_active:
+                selector.unregister(sim.sock)
+            sim.close()
+
+    return {
+        'tool': 'uchat-loadgen',
+        'uchat_version': VERSION,
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'config': {
+            'targets': ['{}:{}'.format(*target) for target in targets],
+            'clients': clients,
+            'rate_per_client': rate,
+            'duration_s': duration,
+            'message_size': message_size
+        },
+        'results': {
+            'connections_attempted': clients,
+            'connections_established': len(active),
+            'messages_sent': sent,
+            'messages_echoed': len(round_trips),
+            'messages_lost': sent - len(round_trips),
+            'messages_per_sec': len(round_trips) / elapsed if elapsed else 0,
+            'connection_setup_ms': percentiles(setup_latencies),
+            'end_to_end_round_trip_ms': percentiles(round_trips)
+        }
+    }
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _spawn_responders(count: int) -> Tuple[List[subprocess.Popen], List[Tuple[str, int]]]:
+    processes, targets = list(), list()
+
+    for _ in range(count):
+        port = _free_port()
+        processes.append(subprocess.Popen([sys.executable, str(PROJECT_ROOT / 'bin' / 'loadgen.py'),
+                                           'respond', '--port', str(port)], cwd=PROJECT_ROOT,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        targets.append(('127.0.0.1', port))
+
+    # Wait for every responder to be listening
+    deadline = time.monotonic() + 10
+    for target in targets:
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(target, timeout=0.5).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+    return processes, targets
+
+
+def _parse_target(txt: str) -> Tuple[str, int]:
+    host, port = txt.rsplit(':', 1)
+    return host, int(port)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test Uchat clients on localhost.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    respond = commands.add_parser('respond', help='Run a headless, echoing target client')
+    respond.add_argument('--port', type=int, required=True)
+
+    load = commands.add_parser('run', help='Run simulated clients against targets')
+    load.add_argument('--target', type=_parse_target, action='append', default=[],
+                      help='host:port of a running target, may be repeated')
+    load.add_argument('--spawn-targets', type=int, default=0, help='Spawn this many headless targets')
+    load.add_argument('--clients', type=int, default=10)
+    load.add_argument('--rate', type=float, default=10, help='Messages per second, per simulated client')
+    load.add_argument('--duration', type=float, default=10, help='Seconds to generate load for')
+    load.add_argument('--message-size', type=int, default=64)
+    load.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'respond':
+        run_responder(args.port)
+        return 0
+
+    processes, targets = _spawn_responders(args.spawn_targets)
+    targets += args.target
+
+    if not targets:
+        parser.error('Provide at least one --target or --spawn-targets')
+
+    try:
+        # Keep stdout for the report alone, clients print their diagnostics
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run_load(targets, args.clients, args.rate, args.duration, args.message_size)
+    finally:
+        for process in processes:
+            process.terminate()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    return 0 if report['results']['connections_established'] else 1
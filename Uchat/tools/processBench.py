@@ -0,0 +1,223 @@
+"""
+Compares running the networking core in the UI's process, on a thread, with running it in a network process
+A sender process streams chats to a headless client, each stamped with when it was sent, while the UI's thread spends
+a fixed time rendering every chat it's handed, so latency and CPU time are measured as a busy UI would see them
+"""
+import argparse
+import contextlib
+import json
+import platform
+import queue
+import selectors
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from Uchat.client import Client, ClientListener
+from Uchat.helper.globals import VERSION
+from Uchat.model.conversation import ConversationListener
+from Uchat.network.messages.message import ChatMessage
+from Uchat.network.networkProcess import NetworkProcess
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+from Uchat.tools.loadGenerator import PROJECT_ROOT, SimulatedClient, _free_port, percentiles
+
+MODES = ('thread', 'process')
+_IDLE_TIMEOUT = 5  # Seconds without a chat after which the UI stops waiting for the rest
+
+
+def run_sender(port: int, messages: int, rate: float, message_size: int):
+    """
+    Connects to the client under test and sends it chats, each starting with the monotonic time it was sent at
+    """
+    sim = SimulatedClient(0, ('127.0.0.1', port), message_size)
+    if sim.connect() is None:
+        return
+    padding = 'x' * max(0, message_size - len('{:.9f}:'.format(time.monotonic())))
+    interval = 1 / rate if rate else 0
+    next_send = time.monotonic()
+    for _ in range(messages):
+        if (delay := next_send - time.monotonic()) > 0:
+            time.sleep(delay)
+        next_send += interval
+        sim.sock.send_bytes(ChatMessage('{:.9f}:'.format(time.monotonic()) + padding)
+                            .to_bytes(sim.sock.wire_version()))
+    time.sleep(_IDLE_TIMEOUT)  # Leaving the conversation open, so its farewell doesn't race the last chats
+    sim.close()
+
+
+def _bench_client(selector: selectors.BaseSelector, info: Peer) -> Client:
+    return Client(selector, info)
+
+
+def _render(render_us: float):
+    """
+    Holds the interpreter for as long as painting a chat would
+    """
+    end = time.perf_counter() + render_us / 1e6
+    while time.perf_counter() < end:
+        pass
+
+
+class _Forwarder(ClientListener, ConversationListener):
+    """
+    Hands what the network thread receives to the UI's thread, as QtClient's queued signals do, shaped as the network
+    process's events are
+    """
+
+    def __init__(self, client: Client, inbox: queue.Queue):
+        self.__client = client
+        self.__inbox = inbox
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        self.__inbox.put(('requested', peer, sock))
+
+    def conversation_created(self, peer: Peer, conversation):
+        conversation.add_listener(self)
+
+    def chat_message_added(self, conversation, index: int):
+        self.__inbox.put(('chat', conversation.peer(), conversation.chat_message_contexts()[index].msg))
+
+
+def _consume(inbox: queue.Queue, messages: int, render_us: float, accept) -> List[float]:
+    """
+    Plays the UI's thread, rendering each chat handed to it
+    :param accept: Called with the details of each connection request
+    :return: the latency of each chat, from being sent to being rendered
+    """
+    latencies = list()
+    while len(latencies) < messages:
+        try:
+            batch = inbox.get(timeout=_IDLE_TIMEOUT)
+        except queue.Empty:
+            break
+        for name, *args in (batch if isinstance(batch, list) else [batch]):
+            if name == 'requested':
+                accept(*args)
+            elif name == 'chat' and isinstance(chat := args[1], ChatMessage):
+                _render(render_us)
+                latencies.append(time.monotonic() - float(chat.message.split(':', 1)[0]))
+    return latencies
+
+
+def _run_thread(port: int) -> Dict:
+    selector = selectors.DefaultSelector()
+    client = _bench_client(selector, Peer(('', port), True, 'bench', '#6d0d7a'))
+    inbox = queue.Queue()
+    client.add_listener(_Forwarder(client, inbox))
+
+    def poll():
+        while True:
+            for key, mask in selector.select(timeout=client.run_timers()):
+                client.handle_connection(key.fileobj, mask)
+
+    threading.Thread(target=poll, daemon=True).start()
+    return {'inbox': inbox, 'accept': client.accept_connection, 'stop': client.destroy,
+            'network_cpu': lambda: 0.0}
+
+
+def _run_process(port: int) -> Dict:
+    inbox = queue.Queue()
+    process = NetworkProcess(_bench_client, Peer(('', port), True, 'bench', '#6d0d7a'), inbox.put)
+    stopped: List[float] = list()
+
+    def stop():
+        process.stop()
+        while not inbox.empty():
+            stopped.extend(args[0] for name, *args in inbox.get() if name == 'stopped')
+
+    return {'inbox': inbox, 'accept': lambda ref: process.call('accept_connection', ref), 'stop': stop,
+            'network_cpu': lambda: sum(stopped)}
+
+
+def run_mode(mode: str, messages: int, rate: float, message_size: int, render_us: float) -> Dict:
+    """
+    Streams chats at one client, its networking run as mode says
+    :return: the mode's results
+    """
+    port = _free_port()
+    cpu_start = time.process_time()
+    harness = (_run_thread if mode == 'thread' else _run_process)(port)
+    time.sleep(0.5)  # Until the client under test listens
+
+    sender = subprocess.Popen([sys.executable, str(PROJECT_ROOT / 'bin' / 'bench_process.py'), 'send',
+                               '--port', str(port), '--messages', str(messages), '--rate', str(rate),
+                               '--message-size', str(message_size)], cwd=PROJECT_ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.perf_counter()
+    try:
+        latencies = _consume(harness['inbox'], messages, render_us, harness['accept'])
+        elapsed = time.perf_counter() - start
+    finally:
+        sender.terminate()
+        harness['stop']()
+    ui_cpu = time.process_time() - cpu_start
+    network_cpu = harness['network_cpu']()
+
+    return {
+        'messages_sent': messages,
+        'messages_rendered': len(latencies),
+        'messages_per_sec': len(latencies) / elapsed if elapsed else 0,
+        'send_to_render_ms': percentiles(latencies),
+        'cpu_s': {
+            'ui_process': ui_cpu,
+            'network_process': network_cpu,
+            'total': ui_cpu + network_cpu
+        },
+        'wall_s': elapsed
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compare networking on a thread of the UI with a network process.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    send = commands.add_parser('send', help='Send timestamped chats to a client under test')
+    send.add_argument('--port', type=int, required=True)
+    send.add_argument('--messages', type=int, required=True)
+    send.add_argument('--rate', type=float, required=True)
+    send.add_argument('--message-size', type=int, required=True)
+
+    run = commands.add_parser('run', help='Run the comparison')
+    run.add_argument('--mode', choices=MODES, action='append', help='Mode to run, may be repeated, defaults to both')
+    run.add_argument('--messages', type=int, default=5000)
+    run.add_argument('--rate', type=float, default=2000, help='Chats sent per second, 0 to send as fast as possible')
+    run.add_argument('--message-size', type=int, default=256)
+    run.add_argument('--render-us', type=float, default=200, help='Microseconds the UI spends rendering each chat')
+    run.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'send':
+        run_sender(args.port, args.messages, args.rate, args.message_size)
+        return 0
+
+    # Keep stdout for the report alone, clients print their diagnostics
+    with contextlib.redirect_stdout(sys.stderr):
+        results = {mode: run_mode(mode, args.messages, args.rate, args.message_size, args.render_us)
+                   for mode in args.mode or MODES}
+
+    report = {
+        'tool': 'uchat-process-bench',
+        'uchat_version': VERSION,
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'config': {
+            'messages': args.messages,
+            'rate': args.rate,
+            'message_size': args.message_size,
+            'render_us': args.render_us
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    return 0 if all(result['messages_rendered'] for result in results.values()) else 1
@@ -0,0 +1,107 @@
+"""
+Benchmarks the encrypted transport on loopback: full versus resumed handshakes, and the cost of encryption on throughput
+"""
+import os
+import socket
+import ssl
+import tempfile
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from Uchat.network.tls import TlsIdentity, generate_identity
+from Uchat.tools.codecBench import loopback_pair
+
+CHUNK_SIZES = (1024, 65536)  # Bytes written per operation, a chat message and a large frame
+
+
+def _identity() -> TlsIdentity:
+    """
+    :return: a throwaway identity, so benchmarks never touch the user's own
+    """
+    directory = tempfile.mkdtemp(prefix='uchat-tls-bench-')
+    cert_path, key_path = os.path.join(directory, 'bench.crt'), os.path.join(directory, 'bench.key')
+    if not generate_identity('bench', cert_path, key_path):
+        raise RuntimeError('Unable to create a TLS identity for benchmarking')
+    return TlsIdentity(cert_path, key_path)
+
+
+def _serve_handshakes(listener: socket.socket, context: ssl.SSLContext):
+    """
+    Handshakes every connection, then writes a byte so the client reads past the session tickets sent after it
+    """
+    while True:
+        raw, _ = listener.accept()
+        raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # As conversation sockets are, once encrypted
+        try:
+            with context.wrap_socket(raw, server_side=True) as sock:
+                sock.sendall(b'x')
+                sock.recv(1)  # Until the client closes
+        except OSError:
+            pass
+
+
+def _handshake_benchmark(identity: TlsIdentity, resume: bool) -> Callable[[], object]:
+    listener = socket.create_server(('127.0.0.1', 0))
+    threading.Thread(target=_serve_handshakes, args=(listener, identity.server_context()), daemon=True).start()
+    address = listener.getsockname()
+    session: List[Optional[ssl.SSLSession]] = [None]
+
+    def handshake():
+        raw = socket.create_connection(address)
+        raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with identity.client_context().wrap_socket(raw, session=session[0] if resume else None) as sock:
+            sock.recv(1)
+            session[0] = sock.session
+        return sock
+
+    handshake()  # Primes the session resumed from
+    return handshake
+
+
+def _tls_pair(identity: TlsIdentity) -> Tuple[ssl.SSLSocket, ssl.SSLSocket]:
+    client, server = loopback_pair()
+    accepted = list()
+
+    handshake = threading.Thread(target=lambda: accepted.append(
+        identity.server_context().wrap_socket(server, server_side=True)))
+    handshake.start()
+    client = identity.client_context().wrap_socket(client)
+    handshake.join()
+    return client, accepted[0]
+
+
+def _throughput_benchmark(writer: socket.socket, reader: socket.socket, size: int) -> Callable[[], object]:
+    chunk = b'x' * size
+    buffer = bytearray(size)
+
+    def transfer():
+        writer.sendall(chunk)
+        view = memoryview(buffer)
+        while view:
+            view = view[reader.recv_into(view):]
+
+    return transfer
+
+
+def benchmarks() -> List[Tuple[str, Callable[[], object]]]:
+    identity = _identity()
+
+    suite = [
+        ('tls.handshake[full]', _handshake_benchmark(identity, False)),
+        ('tls.handshake[resumed]', _handshake_benchmark(identity, True)),
+    ]
+
+    plain_pair = loopback_pair()
+    tls_pair = _tls_pair(identity)
+    for size in CHUNK_SIZES:
+        suite += [
+            ('transport.plain[{}]'.format(size), _throughput_benchmark(*plain_pair, size)),
+            ('transport.tls[{}]'.format(size), _throughput_benchmark(*tls_pair, size)),
+        ]
+    return suite
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from Uchat.tools.benchHarness import run_suite
+
+    return run_suite(benchmarks(), argv, 'Benchmarks of the encrypted transport.')
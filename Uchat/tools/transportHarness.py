@@ -0,0 +1,295 @@
+"""
+Compares chat latency over the TCP and UDP transports on localhost, across a path with artificial loss and delay
+By default the path is a relay in this process, which delays both transports but can only drop UDP datagrams, TCP
+retransmits inside the kernel. With --netem the loopback interface itself is impaired for both, which requires root
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import platform
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from Uchat.client import Client, ClientListener
+from Uchat.helper import metrics
+from Uchat.helper.globals import VERSION
+from Uchat.model.conversation import ConversationState
+from Uchat.network.messages.message import ChatMessage
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+from Uchat.tools.loadGenerator import percentiles
+
+
+class _ImpairedPath:
+    """
+    Delivers each chunk after the configured delay and jitter, from a single thread
+    """
+
+    def __init__(self, delay: float, jitter: float, loss: float, seed: int):
+        self._delay = delay
+        self._jitter = jitter
+        self._loss = loss
+        self._random = random.Random(seed)
+        self._selector = selectors.DefaultSelector()
+        self._pending: List = list()  # (Due, order, send callable, chunk)
+        self._order = itertools.count()
+        self.dropped = 0
+
+    def _schedule(self, send, chunk: bytes, not_before: float = 0.0) -> float:
+        due = max(time.monotonic() + self._delay + self._random.uniform(0, self._jitter), not_before)
+        heapq.heappush(self._pending, (due, next(self._order), send, chunk))
+        return due
+
+    def _drop(self) -> bool:
+        if self._random.random() < self._loss:
+            self.dropped += 1
+            return True
+        return False
+
+    def run(self):
+        while True:
+            timeout = max(0.0, self._pending[0][0] - time.monotonic()) if self._pending else None
+            for key, mask in self._selector.select(timeout):
+                key.data(key.fileobj)
+
+            now = time.monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                _, _, send, chunk = heapq.heappop(self._pending)
+                try:
+                    send(chunk)
+                except OSError:
+                    pass
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+class UdpRelay(_ImpairedPath):
+    """
+    Forwards datagrams between clients and a target, dropping and delaying them
+    Each client is given its own upstream socket, and replies are followed to whichever port the target answers from
+    """
+
+    def __init__(self, port: int, target: Tuple[str, int], delay: float, jitter: float, loss: float, seed: int):
+        super().__init__(delay, jitter, loss, seed)
+        self.__target = target
+        self.__front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__front.bind(('127.0.0.1', port))
+        self.__sessions: Dict[Tuple[str, int], list] = dict()  # Client -> [upstream socket, target address]
+        self._selector.register(self.__front, selectors.EVENT_READ, data=self.__from_client)
+
+    def __from_client(self, front: socket.socket):
+        datagram, client = front.recvfrom(1 << 16)
+        if not (session := self.__sessions.get(client)):
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            upstream.bind(('127.0.0.1', 0))
+            session = [upstream, self.__target]
+            self.__sessions[client] = session
+            self._selector.register(upstream, selectors.EVENT_READ,
+                                    data=lambda sock, client=client: self.__from_target(sock, client))
+
+        if not self._drop():
+            self._schedule(lambda chunk, session=session: session[0].sendto(chunk, session[1]), datagram)
+
+    def __from_target(self, upstream: socket.socket, client: Tuple[str, int]):
+        datagram, source = upstream.recvfrom(1 << 16)
+        self.__sessions[client][1] = source
+        if not self._drop():
+            self._schedule(lambda chunk: self.__front.sendto(chunk, client), datagram)
+
+
+class TcpRelay(_ImpairedPath):
+    """
+    Forwards TCP connections to a target, delaying their bytes in order
+    """
+
+    def __init__(self, port: int, target: Tuple[str, int], delay: float, jitter: float, seed: int):
+        super().__init__(delay, jitter, 0.0, seed)
+        self.__target = target
+        self.__listener = socket.create_server(('127.0.0.1', port))
+        self._selector.register(self.__listener, selectors.EVENT_READ, data=self.__accept)
+
+    def __accept(self, listener: socket.socket):
+        client, _ = listener.accept()
+        upstream = socket.create_connection(self.__target)
+        for sock in (client, upstream):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        for source, destination in ((client, upstream), (upstream, client)):
+            last_due = [0.0]  # Jitter must not reorder a byte stream
+            self._selector.register(source, selectors.EVENT_READ,
+                                    data=lambda sock, dest=destination, last=last_due: self.__forward(sock, dest, last))
+
+    def __forward(self, source: socket.socket, destination: socket.socket, last_due: List[float]):
+        if not (chunk := source.recv(1 << 16)):
+            self._selector.unregister(source)
+            self._schedule(lambda _: destination.shutdown(socket.SHUT_WR), b'', last_due[0])
+            return
+        last_due[0] = self._schedule(destination.sendall, chunk, last_due[0])
+
+
+class _Receiver(ClientListener):
+    def __init__(self, client: Client):
+        self.__client = client
+        self.latencies: List[float] = list()
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        self.__client.accept_connection(peer, sock)
+
+    def chat_received(self, peer: Peer):
+        sent_at = self.__client.conversation(peer).chat_message_contexts()[-1].msg.message.split('|')[0]
+        self.latencies.append((time.perf_counter_ns() - int(sent_at)) / 1e9)
+
+
+def _start_client(port: int, name: str, udp: bool) -> Client:
+    selector = selectors.DefaultSelector()
+    client = Client(selector, Peer(('', port), True, name, '#264653'), udp=udp)
+
+    def drive():
+        while True:
+            for key, mask in selector.select(timeout=client.run_timers()):
+                client.handle_connection(key.fileobj, mask)
+
+    threading.Thread(target=drive, daemon=True).start()
+    return client
+
+
+def _netem(spec: Optional[str]):
+    """
+    Impairs, or with None restores, the loopback interface
+    """
+    command = ['tc', 'qdisc', 'replace', 'dev', 'lo', 'root', 'netem'] + spec.split() if spec else \
+        ['tc', 'qdisc', 'del', 'dev', 'lo', 'root']
+    subprocess.run(command, check=bool(spec), capture_output=True)
+
+
+def measure(transport: str, port: int, messages: int, rate: float, size: int, path_port: Optional[int]) -> Dict:
+    """
+    Sends chat messages from one client to another over a transport, timing each from sending to receipt
+    :param transport: 'tcp' or 'udp'
+    :param port: First of two ports the clients listen on
+    :param path_port: Port of the relay standing between the clients, None to connect directly
+    :return: the transport's results
+    """
+    receiver = _start_client(port, 'receiver', udp=True)
+    listener = _Receiver(receiver)
+    receiver.add_listener(listener)
+    sender = _start_client(port + 1, 'sender', udp=transport == 'udp')
+
+    peer = Peer(('127.0.0.1', path_port or port), False, 'receiver')
+    sender.create_conversation(peer, None)
+    connect_start = time.perf_counter()
+    sender.send_greeting(peer, False)
+
+    deadline = time.monotonic() + 10
+    while (conv := sender.conversation(peer)) and conv.state() is not ConversationState.ACTIVE:
+        if time.monotonic() > deadline:
+            return {'established': False}
+        time.sleep(0.001)
+    established_in = time.perf_counter() - connect_start
+
+    padding = 'x' * max(0, size - 24)
+    for _ in range(messages):
+        sender.send_chat(peer, ChatMessage('{}|{}'.format(time.perf_counter_ns(), padding)))
+        time.sleep(1 / rate)
+
+    deadline = time.monotonic() + 10
+    while len(listener.latencies) < messages and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    return {
+        'established': True,
+        'transport_used': 'udp' if type(conv.sock()).__name__ == 'UdpSocket' else 'tcp',
+        'greeting_round_trip_ms': established_in * 1000,
+        'delivered': len(listener.latencies),
+        'latency_ms': percentiles(listener.latencies)
+    }
+
+
+def run(messages: int, rate: float, size: int, delay: float, jitter: float, loss: float, netem: bool,
+        base_port: int, seed: int) -> Dict:
+    results = dict()
+    retransmits = {cause: metrics.counter('uchat_udp_retransmits_total', cause=cause) for cause in ('timeout', 'sack')}
+
+    if netem:
+        _netem('delay {:.0f}ms {:.0f}ms loss {}%'.format(delay * 1000, jitter * 1000, loss * 100))
+    try:
+        for index, transport in enumerate(('tcp', 'udp')):
+            port = base_port + 10 * index
+            path_port = None
+            if not netem:
+                path_port = port + 5
+                relay = TcpRelay(path_port, ('127.0.0.1', port), delay, jitter, seed) if transport == 'tcp' else \
+                    UdpRelay(path_port, ('127.0.0.1', port), delay, jitter, loss, seed)
+                relay.start()
+
+            before = {cause: counter.value() for cause, counter in retransmits.items()}
+            results[transport] = measure(transport, port, messages, rate, size, path_port)
+            results[transport]['loss_applied'] = netem or transport == 'udp'
+            if transport == 'udp':
+                results[transport]['retransmits'] = {cause: counter.value() - before[cause]
+                                                     for cause, counter in retransmits.items()}
+                if not netem:
+                    results[transport]['relay_dropped'] = relay.dropped
+    finally:
+        if netem:
+            _netem(None)
+
+    return {
+        'tool': 'uchat-transport-harness',
+        'uchat_version': VERSION,
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'config': {
+            'messages': messages,
+            'rate': rate,
+            'message_size': size,
+            'delay_ms': delay * 1000,
+            'jitter_ms': jitter * 1000,
+            'loss': loss,
+            'impairment': 'netem' if netem else 'relay'
+        },
+        'results': results
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compare Uchat chat latency over TCP and UDP, with loss and delay.')
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=50, help='Messages per second')
+    parser.add_argument('--message-size', type=int, default=64)
+    parser.add_argument('--delay', type=float, default=20, help='One-way delay, in milliseconds')
+    parser.add_argument('--jitter', type=float, default=5, help='Extra random delay, in milliseconds')
+    parser.add_argument('--loss', type=float, default=0.02, help='Probability of dropping each packet')
+    parser.add_argument('--netem', action='store_true', help='Impair the loopback interface itself, requires root')
+    parser.add_argument('--base-port', type=int, default=43000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.netem and os.geteuid() != 0:
+        parser.error('--netem requires root')
+
+    try:
+        report = run(args.messages, args.rate, args.message_size, args.delay / 1000, args.jitter / 1000, args.loss,
+                     args.netem, args.base_port, args.seed)
+    except subprocess.CalledProcessError as err:
+        print('Unable to impair the loopback interface: {}'.format(err.stderr.decode().strip()), file=sys.stderr)
+        return 2
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    return 0 if all(result['established'] for result in report['results'].values()) else 1
@@ -8,11 +8,14 @@ from PyQt5 import QtCore
 from PyQt5.QtCore import QObject, Qt, QRegExp, QSize, pyqtSignal
 from PyQt5.QtGui import QRegExpValidator
 from PyQt5.QtWidgets import QWidget, QStackedWidget, QPushButton, QVBoxLayout, QFrame, QLineEdit, QHBoxLayout, QLabel, \
-    QCheckBox
+    QCheckBox, QFileDialog
 
+from Uchat.helper.error import print_err
 from Uchat.helper.globals import LISTENING_PORT
 from Uchat.helper.logger import write_to_data_file, FileName, DataType
 from Uchat.model.account import Account
+from Uchat.model.avatarStore import store_avatar
+from Uchat.ui.delegate.thumbnailCache import thumbnail_cache
 from Uchat.ui.main.ProfilePhotoView import ProfilePhotoView
 
 
@@ -133,7 +136,7 @@ class CreationSlide(QFrame):
 
 def validate_line_edit(widget: QLineEdit, validator) -> bool:
     if not widget.validator():
-        print('%s does not have a validator!' % widget)
+        print_err(4, '{} does not have a validator!'.format(widget))
         return False
 
     state = widget.validator().validate(widget.text(), 0)[0]
@@ -142,7 +145,7 @@ def validate_line_edit(widget: QLineEdit, validator) -> bool:
 
 class AccountDetailsFrame(CreationSlide):
     """
-    Asks the user for a username and profile-color
+    Asks the user for a username and profile-color, and optionally a photo shown instead
     """
 
     def __init__(self, parent: QObject):
@@ -153,6 +156,8 @@ class AccountDetailsFrame(CreationSlide):
         self.__username_field: QLineEdit = QLineEdit(self)
         self.__color_field: QLineEdit = QLineEdit('#', parent=self)
         self.__profile_photo_preview = ProfilePhotoView(self)
+        self.__photo_button = QPushButton("Choose photo…", self)
+        self.__avatar = ''  # Hash of the photo chosen, once stored
 
         self.__setup_ui()
 
@@ -175,12 +180,31 @@ class AccountDetailsFrame(CreationSlide):
     def fill_account_details(self, account: Account):
         account.username(self.__username_field.text())
         account.hex_code(self.__color_field.text())
+        account.avatar(self.__avatar)
 
     # Event Handlers
     @QtCore.pyqtSlot()
     def profile_photo_did_change(self):
         self.remove_error_outline(self.sender())
-        self.__profile_photo_preview.update_label(self.__username_field.text(), self.__color_field.text())
+        self.__profile_photo_preview.update_label(self.__username_field.text(), self.__color_field.text(),
+                                                  self.__avatar)
+
+    @QtCore.pyqtSlot()
+    def choose_photo(self):
+        """
+        Lets the user pick a photo, cropped and scaled down by a worker, off the GUI thread, before it's stored
+        """
+        path, _ = QFileDialog.getOpenFileName(self, "Choose photo", "",
+                                              "Images (*.png *.jpg *.jpeg *.gif *.bmp *.webp)")
+        if path:
+            thumbnail_cache().prepare_avatar(path, self.__photo_prepared)
+
+    def __photo_prepared(self, avatar: bytes):
+        if digest := store_avatar(avatar):
+            self.__avatar = digest
+            thumbnail_cache().avatar_received(None, digest)
+            self.__profile_photo_preview.update_label(self.__username_field.text(), self.__color_field.text(),
+                                                      self.__avatar)
 
     # Helper Functions
     def remove_error_outline(self, widget: QWidget):
@@ -200,6 +224,8 @@ class AccountDetailsFrame(CreationSlide):
         # Set up welcome labels and profile photo preview
         profile_manager.addWidget(self.__profile_photo_preview, 0, Qt.AlignRight | Qt.AlignVCenter)
         profile_manager.addSpacing(10)
+        profile_manager.addWidget(self.__photo_button, 0, Qt.AlignLeft | Qt.AlignVCenter)
+        self.__photo_button.clicked.connect(self.choose_photo)
 
         # Only allow alphanumeric usernames between length 3 and 12
         self.__username_field.setValidator(QRegExpValidator(QRegExp('[0-9a-zA-Z]{3,20}'), self.__username_field))
@@ -1,14 +1,15 @@
 import sys
 from typing import Optional
 
-from PyQt5.QtCore import QSize, QPoint, QObject
+from PyQt5.QtCore import QSize, QPoint, QObject, QTimer
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget
 
-from Uchat.client import Client
+from Uchat.helper import bootTimer
 from Uchat.helper.booter import execute_closure_methods
 from Uchat.helper.globals import WINDOW_TITLE
 from Uchat.helper.logger import get_user_account_data
 from Uchat.model.account import Account
+from Uchat.ui.qtClient import QtClient
 from Uchat.ui.landingWindow import LandingWindow
 
 
@@ -28,11 +29,12 @@ class Application(QObject):
     Represents entire Uchat application
     """
 
-    def __init__(self, client: Client):
+    def __init__(self, client: QtClient):
         super().__init__(None)
 
         self.app_dimensions = QSize(700, 700)
         self.__app = QApplication(sys.argv)
+        bootTimer.mark_phase('qapplication')
         self.__main_win = QMainWindow(parent=None)
         self.__client = client
         self.__account = get_user_account_data()
@@ -50,20 +52,30 @@ class Application(QObject):
         :return: Application's exit code
         """
 
-        with open('style/darkstyle.qss', 'r') as file:
-            self.__app.setStyleSheet(file.read())
-
         QApplication.setApplicationDisplayName(WINDOW_TITLE)
         self.__main_win.setGeometry(0, 0, self.app_dimensions.height(), self.app_dimensions.width())
 
         if len(sys.argv) > 1 and sys.argv[1] != 'DEBUG':
             self.__main_win.move(get_center_pos(self.__main_win))
+
+        # Show the bare window before any styling or widget construction, so the user sees it immediately
         self.__main_win.show()
+        self.__app.processEvents()
+        bootTimer.mark_phase('window shown')
+
+        with open('style/darkstyle.qss', 'r') as file:
+            self.__app.setStyleSheet(file.read())
+        bootTimer.mark_phase('stylesheet applied')
 
         # Load central widget
         landing_window = LandingWindow(self.__main_win, account, self.__client)
         self.__main_win.setCentralWidget(landing_window)
         self.__main_win.setMenuBar(landing_window.menu_bar())
+        bootTimer.mark_phase('landing window built')
+        bootTimer.report()
+
+        if bootTimer.should_exit_after_boot():
+            QTimer.singleShot(0, self.__app.quit)
 
         sys.exit(self.__app.exec())
 
@@ -1,11 +1,17 @@
 """
 Defines the custom delegate used for displaying messages in a QListView
 """
+from typing import Union
+
 from PyQt5 import QtGui, QtCore
 from PyQt5.QtCore import QObject, Qt, QSize, QRect
 from PyQt5.QtGui import QFontMetrics, QPixmap, QPainter, QColor
 from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionViewItem, QApplication
 
+from Uchat.helper.profiler import profiled
+from Uchat.model.inlineImage import InlineImage
+from Uchat.ui.delegate.thumbnailCache import display_size, thumbnail_cache
+
 
 class MessageItemDelegate(QStyledItemDelegate):
     """
@@ -17,11 +23,24 @@ class MessageItemDelegate(QStyledItemDelegate):
     padding = 20
     total_pfp_width = icon_radius + profile_padding
 
+    def __init__(self, parent: QObject):
+        super().__init__(parent)
+        thumbnail_cache().ready.connect(self.__pixmap_ready)
+        thumbnail_cache().avatar_ready.connect(self.__pixmap_ready)
+
+    def __pixmap_ready(self, source: Union[int, str]):  # An image's id, or an avatar's hash
+        if view := self.parent():
+            view.viewport().update()
+
     def sizeHint(self, option: 'QStyleOptionViewItem', index: QtCore.QModelIndex) -> QtCore.QSize:
         if not index.isValid():
             return QSize()
 
         context = index.model().chat_message_contexts()[index.row()]
+        if isinstance(context.msg, InlineImage):
+            # Sized from the dimensions sent ahead of the image, so rows don't move once it's decoded
+            return QSize(option.rect.width(), max(MessageItemDelegate.icon_radius, display_size(context.msg).height()
+                                                  + MessageItemDelegate.profile_padding))
 
         msg_text = index.data(Qt.DisplayRole)
         msg_font = QApplication.font()
@@ -40,6 +59,7 @@ class MessageItemDelegate(QStyledItemDelegate):
 
         return msg_size
 
+    @profiled('delegate.paint')
     def paint(self, painter: QtGui.QPainter, option: 'QStyleOptionViewItem', index: QtCore.QModelIndex) -> None:
         """
         Paints the message on the screen
@@ -61,6 +81,11 @@ class MessageItemDelegate(QStyledItemDelegate):
         message_text = index.data(Qt.DisplayRole)
         profile_pix: QPixmap = index.data(Qt.DecorationRole)
 
+        if isinstance(context.msg, InlineImage):
+            self.__paint_image(painter, option, context.msg, context.is_sender, profile_pix)
+            painter.restore()
+            return
+
         # Determine message rect
         message_font = QApplication.font()
         message_fm = QFontMetrics(message_font)
@@ -68,14 +93,14 @@ class MessageItemDelegate(QStyledItemDelegate):
         if context.is_sender:
             # Paint text with 10 pixel padding
             message_rect = message_fm.boundingRect(option.rect.left(),
-                                                   option.rect.top() + MessageItemDelegate.profile_padding / 2,
+                                                   option.rect.top() + MessageItemDelegate.profile_padding // 2,
                                                    option.rect.width() - MessageItemDelegate.total_pfp_width,
                                                    0,
                                                    Qt.AlignRight | Qt.AlignTop | Qt.TextWordWrap, message_text)
 
             # Draw bubble rect
-            bubble_rect = QRect(message_rect.left() - MessageItemDelegate.profile_padding / 2,
-                                message_rect.top() - MessageItemDelegate.profile_padding / 2,
+            bubble_rect = QRect(message_rect.left() - MessageItemDelegate.profile_padding // 2,
+                                message_rect.top() - MessageItemDelegate.profile_padding // 2,
                                 message_rect.width() + MessageItemDelegate.profile_padding,
                                 message_rect.height() + MessageItemDelegate.profile_padding)
             blue = QColor(35, 57, 93)
@@ -100,14 +125,14 @@ class MessageItemDelegate(QStyledItemDelegate):
 
             # Paint text with 10 pixel padding
             message_rect = message_fm.boundingRect(profile_rect.right() + MessageItemDelegate.profile_padding,
-                                                   option.rect.top() + MessageItemDelegate.profile_padding / 2,
+                                                   option.rect.top() + MessageItemDelegate.profile_padding // 2,
                                                    option.rect.width() - MessageItemDelegate.total_pfp_width, 0,
 
                                                    Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap, message_text)
 
             # Draw bubble rect
-            bubble_rect = QRect(message_rect.left() - MessageItemDelegate.profile_padding / 2,
-                                message_rect.top() - MessageItemDelegate.profile_padding / 2,
+            bubble_rect = QRect(message_rect.left() - MessageItemDelegate.profile_padding // 2,
+                                message_rect.top() - MessageItemDelegate.profile_padding // 2,
                                 message_rect.width() + MessageItemDelegate.profile_padding,
                                 message_rect.height() + MessageItemDelegate.profile_padding)
             gray = QColor(105, 105, 105)
@@ -121,3 +146,32 @@ class MessageItemDelegate(QStyledItemDelegate):
 
         painter.restore()  # Reset to state before changes
         # super().paint(painter, option, index)
+
+    @staticmethod
+    def __paint_image(painter: QtGui.QPainter, option: 'QStyleOptionViewItem', image: InlineImage, is_sender: bool,
+                      profile_pix: QPixmap):
+        """
+        Paints an inline image from pixmaps already made, never decoding, a blank of its size stands in meanwhile
+        """
+        size = display_size(image)
+        top = option.rect.top() + MessageItemDelegate.profile_padding // 2
+
+        if is_sender:
+            image_rect = QRect(option.rect.left() + option.rect.width() - MessageItemDelegate.total_pfp_width
+                               - size.width(), top, size.width(), size.height())
+            profile_rect = QRect(image_rect.right() + MessageItemDelegate.profile_padding, option.rect.top(),
+                                 MessageItemDelegate.icon_radius, MessageItemDelegate.icon_radius)
+        else:
+            profile_rect = QRect(option.rect.left(), option.rect.top(),
+                                 MessageItemDelegate.icon_radius, MessageItemDelegate.icon_radius)
+            image_rect = QRect(profile_rect.right() + MessageItemDelegate.profile_padding, top, size.width(),
+                               size.height())
+        painter.drawPixmap(profile_rect, profile_pix)
+
+        if pixmap := thumbnail_cache().pixmap(image):
+            painter.drawPixmap(image_rect, pixmap)
+        else:
+            gray = QColor(105, 105, 105)
+            painter.setBrush(gray)
+            painter.setPen(gray)
+            painter.drawRoundedRect(image_rect, 5, 5)
@@ -2,14 +2,18 @@ from PyQt5.QtCore import QPoint, Qt, QRectF
 from PyQt5.QtGui import QPixmap, QColor, QPainter, QBrush, QFont
 from PyQt5.QtWidgets import QApplication
 
+from Uchat.ui.delegate.thumbnailCache import thumbnail_cache
 
-def build_pixmap(color: str, username: str, radius: int = 35) -> QPixmap:
+
+def build_pixmap(color: str, username: str, radius: int = 35, nearby: bool = False, avatar: str = '') -> QPixmap:
     """
     Generate a pixmap for displaying the profile photo bubble
 
     :param radius: Radius of circle
     :param color: Hex code to fill the background with
     :param username: Username to draw the first letter from
+    :param nearby: Whether to mark the user as present on the LAN
+    :param avatar: Hash of the user's avatar, drawn instead of the letter once scaled to the bubble
     :return: a pixmap to be displayed
     """
 
@@ -26,16 +30,27 @@ def build_pixmap(color: str, username: str, radius: int = 35) -> QPixmap:
 
     painter = QPainter(pix)
     painter.setRenderHints(QPainter.Antialiasing, True)
-    painter.setBrush(QColor(rgb[0], rgb[1], rgb[2]))
-    painter.setPen(Qt.NoPen)
-
-    painter.drawEllipse(0, 0, radius, radius)
 
-    # Paint center_letter
-    app_font = QApplication.font()
-    app_font.setPixelSize(20)
-    painter.setFont(app_font)
-    painter.setPen(Qt.white)
-    painter.drawText(QRectF(0, 0, radius, radius), Qt.AlignCenter, center_letter)
+    if avatar and (scaled := thumbnail_cache().avatar(avatar, radius)) is not None:
+        painter.drawPixmap(0, 0, scaled)
+    else:
+        painter.setBrush(QColor(rgb[0], rgb[1], rgb[2]))
+        painter.setPen(Qt.NoPen)
+
+        painter.drawEllipse(0, 0, radius, radius)
+
+        # Paint center_letter
+        app_font = QApplication.font()
+        app_font.setPixelSize(20)
+        painter.setFont(app_font)
+        painter.setPen(Qt.white)
+        painter.drawText(QRectF(0, 0, radius, radius), Qt.AlignCenter, center_letter)
+
+    if nearby:
+        # Presence dot, in the bottom right of the bubble
+        dot = radius // 3
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(46, 204, 113))
+        painter.drawEllipse(radius - dot, radius - dot, dot, dot)
 
     return pix
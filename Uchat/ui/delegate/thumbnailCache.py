@@ -0,0 +1,374 @@
+"""
+Thumbnails of inline images, made by a pool of worker threads and kept on disk, so painting never decodes an image
+Workers decode and scale images into QImages, which the GUI thread turns into pixmaps held in QPixmapCache. Until an
+image's thumbnail is ready it's painted from its preview, itself decoded by a worker, or as a blank of its size
+Avatars are scaled by the same workers, to each size they're shown at, and kept beside the avatar they were made from
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Optional, Set, Tuple
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QObject, QRect, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QBrush, QImage, QImageReader, QPainter, QPixmap, QPixmapCache
+
+from Uchat.helper import metrics
+from Uchat.helper.error import print_err
+from Uchat.helper.globals import THUMBNAIL_PIXELS, PREVIEW_PIXELS, THUMBNAIL_WORKERS, THUMBNAIL_QUEUE, \
+    THUMBNAIL_CACHE_BYTES, PIXMAP_CACHE_BYTES, IMAGE_MAX_BYTES, AVATAR_PIXELS, AVATAR_SIZES
+from Uchat.helper.log import get_logger
+from Uchat.helper.logger import DataType, get_file_path
+from Uchat.model.avatarStore import avatar_path, variant_path
+from Uchat.model.inlineImage import InlineImage
+
+_log = get_logger('ui.thumbnails')
+_made = metrics.counter('uchat_thumbnails_made_total', 'Thumbnails scaled from a whole image')
+_disk_hits = metrics.counter('uchat_thumbnail_disk_hits_total', 'Thumbnails read back from the disk cache')
+_dropped = metrics.counter('uchat_thumbnail_requests_dropped_total', 'Thumbnails no longer waited on, as others were '
+                                                                     'asked for since')
+_disk_bytes = metrics.gauge('uchat_thumbnail_disk_bytes', 'Bytes of thumbnails kept on disk')
+_avatars_scaled = metrics.counter('uchat_avatars_scaled_total', 'Avatars scaled to a size they are shown at')
+
+Prepared = Tuple[str, int, int, bytes]  # Path of an image to send, its width and height, and its preview
+
+
+def display_size(image: InlineImage) -> QSize:
+    """
+    :return: the size an image is shown at, its own fit within a thumbnail, known without decoding it
+    """
+    size = QSize(max(1, image.width), max(1, image.height))
+    if size.width() > THUMBNAIL_PIXELS or size.height() > THUMBNAIL_PIXELS:
+        size = size.scaled(THUMBNAIL_PIXELS, THUMBNAIL_PIXELS, Qt.KeepAspectRatio)
+    return size
+
+
+def prepare_image(path: str) -> Optional[Prepared]:
+    """
+    Reads the size of an image to be sent, and encodes its preview
+    :return: what send_image is given, None if the file can't be decoded as an image
+    """
+    reader = QImageReader(path)
+    size = reader.size()
+    if not reader.canRead() or not size.isValid():
+        print_err(1, "Unable to read {} as an image\n".format(path) + reader.errorString())
+        return None
+    if os.path.getsize(path) > IMAGE_MAX_BYTES:
+        print_err(4, "{} is larger than the {} bytes an image may be".format(path, IMAGE_MAX_BYTES))
+        return None
+
+    reader.setScaledSize(size.scaled(PREVIEW_PIXELS, PREVIEW_PIXELS, Qt.KeepAspectRatio))
+    preview = QByteArray()
+    buffer = QBuffer(preview)
+    buffer.open(QIODevice.WriteOnly)
+    reader.read().save(buffer, 'PNG')
+    return path, size.width(), size.height(), bytes(preview)
+
+
+def _square_reader(path: str, size: int) -> Optional[QImageReader]:
+    """
+    :return: a reader decoding the middle square of an image straight to size pixels across, None if it can't
+    """
+    reader = QImageReader(path)
+    full = reader.size()
+    if not reader.canRead() or not full.isValid():
+        return None
+    side = min(full.width(), full.height())
+    reader.setClipRect(QRect((full.width() - side) // 2, (full.height() - side) // 2, side, side))
+    reader.setScaledSize(QSize(size, size))
+    return reader
+
+
+def encode_avatar(path: str) -> Optional[bytes]:
+    """
+    Crops a photo chosen as this user's avatar to a square and scales it down, so it's small enough to send
+    :return: the avatar, encoded, None if the file can't be decoded as an image
+    """
+    if (reader := _square_reader(path, AVATAR_PIXELS)) is None or (image := reader.read()).isNull():
+        print_err(1, "Unable to read {} as an image".format(path))
+        return None
+    encoded = QByteArray()
+    buffer = QBuffer(encoded)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, 'JPG', 90)
+    return bytes(encoded)
+
+
+def scale_avatar(path: str, size: int) -> Optional[QImage]:
+    """
+    :return: the avatar at path, cut to a circle size pixels across, None if none is stored there
+    """
+    if (reader := _square_reader(path, size)) is None or (square := reader.read()).isNull():
+        return None
+    avatar = QImage(size, size, QImage.Format_ARGB32_Premultiplied)
+    avatar.fill(Qt.transparent)
+    painter = QPainter(avatar)
+    painter.setRenderHints(QPainter.Antialiasing, True)
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(QBrush(square))
+    painter.drawEllipse(0, 0, size, size)
+    painter.end()
+    return avatar
+
+
+class ThumbnailCache(QObject):
+    """
+    Answers the delegate's paints from pixmaps already made, asking workers for those that are missing
+    Requests are served newest first, so the rows on screen are made before those scrolled past
+    """
+
+    ready = pyqtSignal(int)  # Emitted with the id of an image whose thumbnail, or preview, can now be painted
+    avatar_ready = pyqtSignal(str)  # Emitted with the hash of an avatar that can now be painted at another size
+    _loaded = pyqtSignal(int, str, object)  # Image id, pixmap cache key, and the QImage a worker made for it
+    _avatar_loaded = pyqtSignal(str, str, object)  # Avatar hash, pixmap cache key, and the QImage a worker scaled
+    _prepared = pyqtSignal(object, object)  # Callback, and the image a worker prepared for sending
+
+    def __init__(self, directory: Optional[Path] = None, budget: int = THUMBNAIL_CACHE_BYTES):
+        """
+        :param directory: Folder thumbnails are kept in, data/thumbnails by default
+        :param budget: Bytes of thumbnails kept there, the least recently shown are removed beyond it
+        """
+        super().__init__(None)
+        self.__directory = directory if directory else get_file_path(DataType.THUMBNAILS, file_name_str='')
+        self.__budget = budget
+        self.__requested: Set[str] = set()  # Keys of pixmaps being made, only used from the GUI thread
+
+        self.__jobs: Deque[Tuple[Optional[str], Callable, tuple]] = deque()  # Key, if it may be dropped, and job
+        self.__jobs_ready = threading.Condition()
+        self.__workers = list()
+
+        self.__lock = threading.Lock()  # Guards the disk index and the images waiting to be whole
+        self.__files: Dict[str, int] = OrderedDict()  # Thumbnail file name -> bytes, least recently used first
+        self.__size = 0
+        self.__waiting: Dict[int, InlineImage] = dict()  # Image id -> image asked for before it was whole
+        self.__load_index()
+
+        QPixmapCache.setCacheLimit(PIXMAP_CACHE_BYTES // 1024)
+        self._loaded.connect(self.__insert)
+        self._avatar_loaded.connect(self.__insert_avatar)
+        self._prepared.connect(lambda callback, prepared: callback(prepared))
+
+    # GUI thread
+
+    def pixmap(self, image: InlineImage) -> Optional[QPixmap]:
+        """
+        Finds what to paint an image with, without decoding anything, those missing are asked of the workers
+        :return: the image's thumbnail, else its preview, None while neither is ready
+        """
+        key = _key(image.image_id)
+        if (thumbnail := QPixmapCache.find(key)) is not None:
+            return thumbnail
+
+        self.__request(key, self.__make_thumbnail, image)
+        if image.preview:
+            preview_key = _key(image.image_id, 'preview')
+            if (preview := QPixmapCache.find(preview_key)) is not None:
+                return preview
+            self.__request(preview_key, self.__make_preview, image)
+        return None
+
+    def image_received(self, peer, image_id: int):
+        """
+        Makes the thumbnail of an image that was asked for before every chunk of it arrived
+        """
+        with self.__lock:
+            image = self.__waiting.pop(image_id, None)
+        if image:
+            self.__submit(_key(image_id), self.__make_thumbnail, image)
+
+    def avatar(self, digest: str, size: int) -> Optional[QPixmap]:
+        """
+        Finds an avatar scaled to be shown size pixels across, without decoding anything, a worker scales it if missing
+        :return: the scaled avatar, None while it isn't ready, or isn't stored
+        """
+        key = _avatar_key(digest, size)
+        if (avatar := QPixmapCache.find(key)) is not None:
+            return avatar
+        self.__request(key, self.__make_avatar, digest, size, key)
+        return None
+
+    def avatar_received(self, peer, digest: str):
+        """
+        Scales an avatar that was just stored to every size it's shown at, before it's painted at any
+        """
+        for size in AVATAR_SIZES:
+            key = _avatar_key(digest, size)
+            self.__requested.discard(key)  # Asked for before it was stored, and not found
+            if QPixmapCache.find(key) is None:
+                self.__request(key, self.__make_avatar, digest, size, key)
+
+    def prepare_avatar(self, path: str, callback: Callable[[bytes], None]):
+        """
+        Has a worker crop and scale a photo chosen as this user's avatar, then calls back on the GUI thread
+        """
+        self.__submit(None, self.__prepare_avatar, path, callback)
+
+    def prepare(self, path: str, callback: Callable[[Prepared], None]):
+        """
+        Has a worker prepare an image for sending, then calls back on the GUI thread
+        """
+        self.__submit(None, self.__prepare, path, callback)
+
+    def __request(self, key: str, job: Callable, *args):
+        if key not in self.__requested:
+            self.__requested.add(key)
+            self.__submit(key, job, *args)
+
+    def __submit(self, key: Optional[str], job: Callable, *args):
+        with self.__jobs_ready:
+            if key is not None and len(self.__jobs) >= THUMBNAIL_QUEUE:
+                # Asked for longest ago, so likely scrolled past, it's asked for again if painted again
+                for index, (old_key, _, _) in enumerate(self.__jobs):
+                    if old_key is not None:
+                        del self.__jobs[index]
+                        self.__requested.discard(old_key)
+                        _dropped.inc()
+                        break
+            self.__jobs.append((key, job, args))
+            self.__jobs_ready.notify()
+
+            if len(self.__workers) < THUMBNAIL_WORKERS:
+                worker = threading.Thread(target=self.__work, name='uchat-thumbnail', daemon=True)
+                self.__workers.append(worker)
+                worker.start()
+
+    def __insert(self, image_id: int, key: str, image: QImage):
+        QPixmapCache.insert(key, QPixmap.fromImage(image))
+        self.__requested.discard(key)  # Made again on being painted, should the pixmap cache evict it
+        self.ready.emit(image_id)
+
+    def __insert_avatar(self, digest: str, key: str, avatar: QImage):
+        QPixmapCache.insert(key, QPixmap.fromImage(avatar))
+        self.__requested.discard(key)
+        self.avatar_ready.emit(digest)
+
+    # Workers
+
+    def __work(self):
+        while True:
+            with self.__jobs_ready:
+                while not self.__jobs:
+                    self.__jobs_ready.wait()
+                _, job, args = self.__jobs.pop()
+            try:
+                job(*args)
+            except Exception as err:  # A worker outlives any image it fails on
+                print_err(3, "Unable to make a thumbnail\n" + repr(err))
+
+    def __make_preview(self, image: InlineImage):
+        preview = QImage.fromData(image.preview)
+        if not preview.isNull():
+            self._loaded.emit(image.image_id, _key(image.image_id, 'preview'),
+                              preview.scaled(display_size(image), Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+
+    def __make_thumbnail(self, image: InlineImage):
+        name = '{:016x}.png'.format(image.image_id)
+        path = self.__directory / name
+
+        thumbnail = QImage()
+        with self.__lock:
+            cached = name in self.__files
+            if cached:
+                self.__files.move_to_end(name)
+        if cached and thumbnail.load(str(path)):
+            _disk_hits.inc()
+            os.utime(path)  # Kept in order of use across restarts
+        else:
+            with self.__lock:
+                self.__waiting[image.image_id] = image
+            if not image.is_complete():
+                return  # Made once its last chunk arrives
+            with self.__lock:
+                if not self.__waiting.pop(image.image_id, None):
+                    return  # Arrived meanwhile, and already submitted again
+
+            reader = QImageReader(str(image.path()))
+            reader.setScaledSize(display_size(image))  # Formats that can, decode straight to the smaller size
+            thumbnail = reader.read()
+            if thumbnail.isNull():
+                print_err(3, "Unable to decode image {}\n".format(image.path()) + reader.errorString())
+                return
+            _made.inc()
+            self.__store(name, path, thumbnail)
+
+        self._loaded.emit(image.image_id, _key(image.image_id), thumbnail)
+
+    def __make_avatar(self, digest: str, size: int, key: str):
+        path = variant_path(digest, size)
+        avatar = QImage()
+        if not avatar.load(str(path)):
+            if (avatar := scale_avatar(str(avatar_path(digest)), size)) is None:
+                return  # Not stored yet, asked for again once it is
+            _avatars_scaled.inc()
+            if not avatar.save(str(path), 'PNG'):
+                print_err(1, "Unable to keep the scaled avatar {}".format(path))
+        self._avatar_loaded.emit(digest, key, avatar)
+
+    def __prepare(self, path: str, callback: Callable[[Prepared], None]):
+        if prepared := prepare_image(path):
+            self._prepared.emit(callback, prepared)
+
+    def __prepare_avatar(self, path: str, callback: Callable[[bytes], None]):
+        if (avatar := encode_avatar(path)) is not None:
+            self._prepared.emit(callback, avatar)
+
+    # Disk cache
+
+    def __load_index(self):
+        try:
+            files = sorted(self.__directory.glob('*.png'), key=lambda file: file.stat().st_mtime)
+            for file in files:
+                self.__files[file.name] = file.stat().st_size
+                self.__size += self.__files[file.name]
+        except OSError as err:
+            print_err(1, "Unable to read the thumbnail cache\n" + repr(err))
+        _disk_bytes.set(self.__size)
+
+    def __store(self, name: str, path: Path, thumbnail: QImage):
+        try:
+            self.__directory.mkdir(parents=True, exist_ok=True)
+            if not thumbnail.save(str(path), 'PNG'):
+                raise OSError('Unable to write {}'.format(path))
+            size = path.stat().st_size
+        except OSError as err:
+            print_err(1, "Unable to cache a thumbnail\n" + repr(err))
+            return
+
+        evicted = list()
+        with self.__lock:
+            self.__size += size - self.__files.pop(name, 0)
+            self.__files[name] = size
+            while self.__size > self.__budget and len(self.__files) > 1:
+                old_name, old_size = self.__files.popitem(last=False)
+                self.__size -= old_size
+                evicted.append(old_name)
+            _disk_bytes.set(self.__size)
+
+        for old_name in evicted:
+            try:
+                (self.__directory / old_name).unlink()
+            except OSError:
+                pass
+        if evicted:
+            _log.debug('Removed %d thumbnails from the disk cache', len(evicted))
+
+
+def _key(image_id: int, kind: str = 'thumbnail') -> str:
+    return 'uchat-{}-{:016x}'.format(kind, image_id)
+
+
+def _avatar_key(digest: str, size: int) -> str:
+    return 'uchat-avatar-{}-{}'.format(size, digest)
+
+
+_cache: Optional[ThumbnailCache] = None
+
+
+def thumbnail_cache() -> ThumbnailCache:
+    """
+    :return: the cache shared by every conversation's view, made on first use, from the GUI thread
+    """
+    global _cache
+    if not _cache:
+        _cache = ThumbnailCache()
+    return _cache
@@ -1,7 +1,7 @@
 """
 Defines the view for adding, removing, and interacting with friends
 """
-from typing import Optional
+from typing import Optional, List
 
 from PyQt5 import QtCore
 from PyQt5.QtCore import QSize, QModelIndex, Qt, QPoint
@@ -9,14 +9,15 @@ from PyQt5.QtGui import QFontMetrics
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListView, QHBoxLayout, QLineEdit, QPushButton, QDialog, \
     QFrame, QMenu, QAction
 
-from Uchat.client import Client
+from Uchat.ui.qtClient import QtClient
 from Uchat.helper.error import print_err
+from Uchat.helper.log import get_logger
 from Uchat.helper.globals import LISTENING_PORT
 from Uchat.model.peerList import PeerList
 from Uchat.network.tcp import TcpSocket
 from Uchat.peer import Peer
-from Uchat.ui.friends.friendDialogs import AddFriendDialog, ConnectionRequestDialog
-from Uchat.ui.main.UserInfoDialog import UserInfoDialog
+
+_log = get_logger('ui.peers')
 
 
 class PeerListView(QFrame):
@@ -51,7 +52,7 @@ class PeerListView(QFrame):
         """
         Slot connected to returnPressed signal, initiates a search
         """
-        print("Search!")
+        _log.debug('Search initiated')
 
     def _setup_ui(self):
         """
@@ -98,19 +99,23 @@ class FriendsListView(PeerListView):
     View that displays a list of all friends
     """
 
-    def __init__(self, parent: Optional[QWidget], client: Client):
+    def __init__(self, parent: Optional[QWidget], client: QtClient):
         super().__init__(parent, "Search for a friend...", False)
 
         self._client = client
         self.__add_btn = QPushButton('+')
+        self._peer_list_view.setSelectionMode(QListView.ExtendedSelection)  # Several friends can start a group
 
         # Connect events
         self.__add_btn.clicked.connect(self._add_friend)
         self._peer_list_view.doubleClicked.connect(self._item_double_clicked)
         self._peer_list_view.customContextMenuRequested.connect(self.show_context_menu)
         self._client.new_friend_added_signal.connect(self.handle_new_friend_added)
+        self._client.peer_discovered_signal.connect(lambda peer: self._peer_model.set_nearby(peer, True))
+        self._client.peer_lost_signal.connect(lambda peer: self._peer_model.set_nearby(peer, False))
 
         self.__setup_ui()
+        self.__mark_nearby()
 
     def __setup_ui(self):
         """
@@ -126,13 +131,24 @@ class FriendsListView(PeerListView):
         """
         Generates a dialog for getting information needed to add a new friend
         """
-        dialog = AddFriendDialog(self, self._search_bar.text())
+        from Uchat.ui.friends.friendDialogs import AddFriendDialog  # Deferred, dialogs are loaded on first use
+
+        dialog = AddFriendDialog(self, self._search_bar.text(), self._client.nearby_peers())
         if dialog.exec() == QDialog.Accepted:
             self._peer_model.add_peer(dialog.new_friend())
+            self.__mark_nearby()
 
     @QtCore.pyqtSlot(Peer)
     def handle_new_friend_added(self, new_friend: Peer):
         self._peer_model.add_peer(new_friend)
+        self.__mark_nearby()
+
+    def __mark_nearby(self):
+        """
+        Marks friends present on the LAN, which friends added after their neighbour was found would miss
+        """
+        for neighbour in self._client.nearby_peers():
+            self._peer_model.set_nearby(neighbour, True)
 
     @QtCore.pyqtSlot(QModelIndex)
     def _item_double_clicked(self, index: QModelIndex):
@@ -140,6 +156,8 @@ class FriendsListView(PeerListView):
         Opens an editable info pane of the selected item
         :item: Index of selected item
         """
+        from Uchat.ui.main.UserInfoDialog import UserInfoDialog  # Deferred, dialogs are loaded on first use
+
 
         friend = self._peer_model.at(index.row())
         if dialog := UserInfoDialog(self, friend):
@@ -171,16 +189,28 @@ class FriendsListView(PeerListView):
             menu.addAction(del_action)
             # TODO: menu.addAction("Chat", self.)
 
+            selected = [self._peer_model.at(selected.row()) for selected in self._peer_list_view.selectedIndexes()]
+            if len(selected) > 1:
+                menu.addAction("Start Group", lambda: self._start_group(selected))
+
             menu.exec(global_pos)
             del menu
 
 
+    def _start_group(self, members: List[Peer]):
+        """
+        Starts a group conversation with the given friends, greeting any that aren't already being spoken to
+        """
+        group = self._client.create_group(members)
+        self._client.start_chat(group.peer())
+
+
 class ConversationsListView(PeerListView):
     """
     View for viewing active conversations
     """
 
-    def __init__(self, parent: Optional[QWidget], client: Client):
+    def __init__(self, parent: Optional[QWidget], client: QtClient):
         super().__init__(parent, "Search for a conversation...", True)
 
         self._client = client
@@ -199,6 +229,8 @@ class ConversationsListView(PeerListView):
         :param peer: Peer requesting communication
         :param sock: Socket requesting to establish a conversation with this client
         """
+        from Uchat.ui.friends.friendDialogs import ConnectionRequestDialog  # Deferred, dialogs are loaded on first use
+
         # Determine if remote host is already known
         remote_addr = sock.get_remote_addr()
 
@@ -229,7 +261,7 @@ class ConversationsListView(PeerListView):
         friend = self._peer_model.at(index.row())
 
         if self._client.conversation(friend):
-            self._client.start_chat_signal.emit(friend)
+            self._client.start_chat(friend)
         else:
             print_err(4, "No conversation exists!")
 
@@ -255,7 +287,7 @@ class ConversationsListView(PeerListView):
         """
         peer = self._peer_model.at(index.row())
         peer.address((peer.address()[0], LISTENING_PORT))
-        self._client.new_friend_added_signal.emit(peer)
+        self._client.add_friend(peer)
 
     def __handle_leave_conversation(self, index: QModelIndex):
         if peer := self._peer_model.remove_at(index.row()):
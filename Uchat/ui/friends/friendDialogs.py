@@ -2,9 +2,10 @@
 Defines pop-ups necessary to facilitate full-functionality for the friends list
 """
 
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List
 
-from PyQt5.QtWidgets import QDialog, QWidget, QFormLayout, QLineEdit, QPushButton, QLabel, QVBoxLayout, QHBoxLayout
+from PyQt5.QtWidgets import QDialog, QWidget, QFormLayout, QLineEdit, QPushButton, QLabel, QVBoxLayout, QHBoxLayout, \
+    QComboBox
 from PyQt5 import QtCore
 
 from Uchat.helper.globals import LISTENING_PORT
@@ -14,12 +15,15 @@ from Uchat.peer import Peer
 
 class AddFriendDialog(QDialog):
     """
-    Pop-up used to get the IP and port of a new friend
+    Pop-up used to get the IP and port of a new friend, typed in or picked from the clients found on the LAN
     """
 
-    def __init__(self, parent: Optional[QWidget], search_bar_text: str):
+    def __init__(self, parent: Optional[QWidget], search_bar_text: str, nearby: List[Peer] = ()):
         super().__init__(parent)
 
+        self._nearby = list(nearby)
+        self._nearby_box = QComboBox()
+
         self.setWindowTitle(" ")
         self.setStyleSheet(self.styleSheet() +
                            "font-size: 15px;"
@@ -32,6 +36,7 @@ class AddFriendDialog(QDialog):
 
         # Connect events
         self._submit_btn.clicked.connect(self._submit_button_pressed)
+        self._nearby_box.currentIndexChanged.connect(self._nearby_peer_picked)
 
         self._setup_ui(search_bar_text)
 
@@ -48,10 +53,37 @@ class AddFriendDialog(QDialog):
             self._ip_field.setText(search_bar_text)
         self._port_field.setText(str(LISTENING_PORT))
 
+        if self._nearby:
+            self._nearby_box.addItem("Choose...")
+            for peer in self._nearby:
+                self._nearby_box.addItem("{} ({}:{})".format(peer.username(), *peer.address()))
+            self._layout_manager.addRow("Nearby", self._nearby_box)
+
         self._layout_manager.addRow("Friend's IPv4", self._ip_field)
         self._layout_manager.addRow("Friend's Port", self._port_field)
         self._layout_manager.addRow("", self._submit_btn)
 
+    @QtCore.pyqtSlot(int)
+    def _nearby_peer_picked(self, index: int):
+        """
+        Fills in the address of the nearby client picked
+        """
+        if 0 < index <= len(self._nearby):  # After the placeholder
+            peer = self._nearby[index - 1]
+            self._ip_field.setText(peer.ipv4())
+            self._port_field.setText(str(peer.address()[1]))
+
+    def _picked_peer(self) -> Optional[Peer]:
+        """
+        :return: the nearby client picked, while the form still holds its address
+        """
+        index = self._nearby_box.currentIndex()
+        if 0 < index <= len(self._nearby):
+            peer = self._nearby[index - 1]
+            if (self._ip_field.text(), self._port_field.text()) == (peer.ipv4(), str(peer.address()[1])):
+                return peer
+        return None
+
     @QtCore.pyqtSlot()
     def _submit_button_pressed(self):
         """
@@ -69,6 +101,8 @@ class AddFriendDialog(QDialog):
         :return: the new peer
         """
 
+        if picked := self._picked_peer():
+            return Peer(picked.address(), False, picked.username(), picked.color())
         return Peer((self._ip_field.text(), int(self._port_field.text())), False, self._ip_field.text())
 
 
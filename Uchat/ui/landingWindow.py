@@ -6,20 +6,20 @@ from PyQt5.QtGui import QColorConstants, QBrush
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QSplitter, QStackedWidget, QListWidget, \
     QFrame, QListWidgetItem, QListView, QErrorMessage
 
-from Uchat.client import Client
+from Uchat.ui.qtClient import QtClient
 from Uchat.helper.booter import BootThread
 from Uchat.helper.colorScheme import load_themed_icon
 from Uchat.helper.logger import DataType, get_file_path
 from Uchat.model.account import Account
 from Uchat.peer import Peer
-from Uchat.ui.accountCreation import AccountCreationPresenter
 from Uchat.ui.friends.PeerViews import FriendsListView, ConversationsListView
+from Uchat.ui.delegate.thumbnailCache import thumbnail_cache
 from Uchat.ui.main.ConversationView import ConversationView
 from Uchat.ui.menuBar import MenuBar
 
 
 class LandingWindow(QWidget):
-    def __init__(self, parent: Optional[QWidget], account: Optional[Account], client: Client):
+    def __init__(self, parent: Optional[QWidget], account: Optional[Account], client: QtClient):
         super(QWidget, self).__init__(parent)
 
         self.__client = client
@@ -41,6 +41,8 @@ class LandingWindow(QWidget):
             # Connect signals to slots
             self.__client.chat_received_signal.connect(self.handle_chat_received)
         else:
+            from Uchat.ui.accountCreation import AccountCreationPresenter  # Deferred, only needed on first launch
+
             self.account_creation = AccountCreationPresenter(self)
             self.__layout_manager.addWidget(self.account_creation)
 
@@ -114,12 +116,23 @@ class LandingWindow(QWidget):
 
         # Connect events
         self.__client.start_chat_signal.connect(self.chat_started)
+        self.__client.image_received_signal.connect(thumbnail_cache().image_received)
+        self.__client.avatar_received_signal.connect(thumbnail_cache().avatar_received)
+        thumbnail_cache().avatar_ready.connect(self.avatar_ready)
 
     def menu_bar(self):
         return self.__menu_bar
 
     # SLOTS
 
+    @QtCore.pyqtSlot(str)
+    def avatar_ready(self, digest: str):
+        """
+        Repaints the lists of peers, so those with the avatar are shown by it
+        """
+        self.__friends_list.viewport().update()
+        self.__convs_list.viewport().update()
+
     @QtCore.pyqtSlot(Peer)
     def chat_started(self, peer: Peer):
         """
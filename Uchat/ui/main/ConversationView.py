@@ -2,14 +2,16 @@ from typing import Optional
 
 from PyQt5.QtCore import Qt, QSize
 from PyQt5.QtGui import QKeyEvent
-from PyQt5.QtWidgets import QListView, QWidget, QVBoxLayout, QPlainTextEdit, QFrame, QLabel, QSizePolicy, QHBoxLayout
+from PyQt5.QtWidgets import QListView, QWidget, QVBoxLayout, QPlainTextEdit, QFrame, QLabel, QSizePolicy, QHBoxLayout, \
+    QFileDialog
 from PyQt5 import QtCore
 
-from Uchat.client import Client
+from Uchat.ui.qtClient import QtClient
 from Uchat.model.peerList import PeerList
 from Uchat.network.messages.message import ChatMessage
 from Uchat.peer import Peer
 from Uchat.ui.delegate.messageItemDelegate import MessageItemDelegate
+from Uchat.ui.delegate.thumbnailCache import thumbnail_cache
 from Uchat.ui.main.MessageSendView import MessageSendView
 from Uchat.ui.main.ProfilePhotoView import ProfilePhotoView
 
@@ -22,7 +24,7 @@ class ConversationView(QFrame):
     messages to the recipient
     """
 
-    def __init__(self, parent: Optional[QWidget], client: Client, peer: Peer,
+    def __init__(self, parent: Optional[QWidget], client: QtClient, peer: Peer,
                  friends_list: PeerList, conversation_list: PeerList):
 
         super().__init__(parent)
@@ -32,7 +34,7 @@ class ConversationView(QFrame):
         self._client = client
         self._friends_list = friends_list
         self._conversation_list = conversation_list
-        self._conversation_model = self._client.conversation(self._peer)  # Model containing messages
+        self._conversation_model = self._client.conversation_model(self._peer)  # Model containing messages
         self._layout_manager = QVBoxLayout(self)
 
         # Configure message list
@@ -68,6 +70,7 @@ class ConversationView(QFrame):
 
         # Connect to signals
         self._send_view.text_edit().keyPressEvent = self.send_view_did_change
+        self._send_view.image_button().clicked.connect(self.choose_image)
         self._message_list.verticalScrollBar().rangeChanged.connect(self.scroll_to_message)
 
     # Listeners
@@ -98,6 +101,16 @@ class ConversationView(QFrame):
         else:
             QPlainTextEdit.keyPressEvent(text_field, event)
 
+    @QtCore.pyqtSlot()
+    def choose_image(self):
+        """
+        Lets the user pick an image to send, its size and preview are read by a worker, off the GUI thread
+        """
+        path, _ = QFileDialog.getOpenFileName(self, "Send image", "", "Images (*.png *.jpg *.jpeg *.gif *.bmp *.webp)")
+        if path:
+            peer = self._peer
+            thumbnail_cache().prepare(path, lambda prepared: self._client.send_image(peer, *prepared))
+
     def peer(self):
         """
         Getter
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QVBoxLayout, QSizePolicy
+from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QVBoxLayout, QSizePolicy, QPushButton
 
 
 class MessageSendView(QWidget):
@@ -19,8 +19,19 @@ class MessageSendView(QWidget):
         self.__text_field.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         self.layout_manager.addWidget(self.__text_field, 1)
 
+        # Image picker
+        self.__image_button = QPushButton("Send image…", self)
+        self.__image_button.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.layout_manager.addWidget(self.__image_button)
+
     def text_edit(self) -> QPlainTextEdit:
         """
         :return: The QPlainTextEdit of this widget
         """
         return self.__text_field
+
+    def image_button(self) -> QPushButton:
+        """
+        :return: The button choosing an image to send
+        """
+        return self.__image_button
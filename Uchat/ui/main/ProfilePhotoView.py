@@ -1,6 +1,8 @@
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QLabel
 
+from Uchat.ui.delegate.thumbnailCache import thumbnail_cache
+
 
 def validate_hex_code(hex_code: str) -> str:
     """
@@ -24,13 +26,16 @@ class ProfilePhotoView(QLabel):
     """
     This class is used to display a user's profile photo
     Given their username and a hex color code, a proper profile photo is generated
+    Users with an avatar are shown by it instead, once it's scaled to the view
     """
 
-    def __init__(self, parent: QWidget, username: str = '', hex_code: str = '', radius: int = 35):
+    def __init__(self, parent: QWidget, username: str = '', hex_code: str = '', radius: int = 35, avatar: str = ''):
         super().__init__(parent)
         self.setObjectName('pfp-view')
 
         diameter = radius * 2
+        self.__diameter = diameter
+        self.__avatar = avatar
         self.setStyleSheet(
             """
             color: white;
@@ -39,18 +44,32 @@ class ProfilePhotoView(QLabel):
             """.format(radius + 10, radius))
         self.setMinimumSize(diameter, diameter)
         self.setAlignment(Qt.AlignCenter)
-        self.update_label(username, hex_code)
+        self.update_label(username, hex_code, avatar)
+        thumbnail_cache().avatar_ready.connect(self.__avatar_ready)
 
-    def update_label(self, username: str, hex_code: str):
+    def update_label(self, username: str, hex_code: str, avatar: str = ''):
         """
         Updates profile photo's color and displayed username
         :param username: Username to extract first letter from
         :param hex_code: Hex code string to use as profile background
+        :param avatar: Hash of the avatar shown instead, once it's scaled
         """
+        self.__avatar = avatar
 
         __hex_code = validate_hex_code(hex_code)
         self.setStyleSheet(self.styleSheet() +
                            """
             background-color: {};
             """.format(__hex_code))
-        self.setText(username[0].upper() if username else 'U')
+        if not self.__show_avatar():
+            self.setText(username[0].upper() if username else 'U')
+
+    def __show_avatar(self) -> bool:
+        if self.__avatar and (avatar := thumbnail_cache().avatar(self.__avatar, self.__diameter)) is not None:
+            self.setPixmap(avatar)
+            return True
+        return False
+
+    def __avatar_ready(self, digest: str):
+        if digest == self.__avatar:
+            self.__show_avatar()
@@ -24,7 +24,7 @@ class UserInfoDialog(QDialog):
 
         self._peer = peer
         self._layout_manager = QVBoxLayout(self)
-        self._pfp = ProfilePhotoView(self, peer.username(), peer.color())
+        self._pfp = ProfilePhotoView(self, peer.username(), peer.color(), avatar=peer.avatar())
         self._username_field = QLineEdit(peer.username())
         self._ipv4_field = QLineEdit(peer.address()[0])
         self._port_field = QLineEdit(str(peer.address()[1]))
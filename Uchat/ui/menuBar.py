@@ -8,11 +8,10 @@ from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtGui import QKeySequence
 from PyQt5.QtWidgets import QMenuBar, QMenu, QMessageBox
 
+from Uchat.helper import profiler
 from Uchat.helper.globals import LISTENING_PORT, VERSION
 from Uchat.helper.logger import get_user_account_data
-from Uchat.network.ip import get_external_ip
 from Uchat.peer import Peer
-from Uchat.ui.main.UserInfoDialog import UserInfoDialog
 
 
 class MenuBar(QMenuBar):
@@ -20,10 +19,10 @@ class MenuBar(QMenuBar):
         super().__init__(parent)
 
         # Lay out menu
-        self.__menus = [FileMenu(self), ViewMenu(self)]
+        self.__menus = [FileMenu(self), ViewMenu(self), ProfileMenu(self)]
 
-        self.addMenu(self.__menus[0])
-        self.addMenu(self.__menus[1])
+        for menu in self.__menus:
+            self.addMenu(menu)
 
     def at_index(self, index: int) -> Optional[QMenu]:
         if 0 <= index < len(self.__menus):
@@ -62,6 +61,10 @@ class FileMenu(QMenu):
         """
         Used to show user's account details, to provide to a potential friend
         """
+        # Deferred imports, HTTP and the dialog are only needed once the user asks for their details
+        from Uchat.network.ip import get_external_ip
+        from Uchat.ui.main.UserInfoDialog import UserInfoDialog
+
         account = get_user_account_data()
         user = Peer((get_external_ip(), LISTENING_PORT), True, account.username())
         account_dialog = UserInfoDialog(self, user)
@@ -107,3 +110,47 @@ class ViewMenu(QMenu):
         Shows conversations tab
         """
         self.show_conversations_signal.emit()
+
+
+class ProfileMenu(QMenu):
+    """
+    Toggles the built-in profiler, to see where time goes when the application is sluggish
+    """
+
+    def __init__(self, parent: QObject):
+        super().__init__("Profile", parent)
+        self.setSeparatorsCollapsible(True)
+
+        # Set up options
+        self.__timing_action = self.addAction("Time Sections", self.handle_toggle_timing)
+        self.__timing_action.setCheckable(True)
+        self.__sampling_action = self.addAction("Sample Stacks", self.handle_toggle_sampling)
+        self.__sampling_action.setCheckable(True)
+        self.addSeparator()
+        self.addAction("Save Profile", self.handle_save_profile)
+
+        # Reflect profiling enabled at start up
+        self.aboutToShow.connect(self.__sync_checked)
+
+    def __sync_checked(self):
+        self.__timing_action.setChecked(profiler.is_timing())
+        self.__sampling_action.setChecked(profiler.is_sampling())
+
+    def handle_toggle_timing(self):
+        """
+        Starts or stops timing the network and UI hot paths
+        """
+        profiler.set_timing(self.__timing_action.isChecked())
+
+    def handle_toggle_sampling(self):
+        """
+        Starts or stops sampling every thread's stack
+        """
+        profiler.set_sampling(self.__sampling_action.isChecked())
+
+    def handle_save_profile(self):
+        """
+        Writes the profile collected so far, and tells the user where to find it
+        """
+        paths = profiler.dump_profile()
+        QMessageBox.information(self, "Profile Saved", "Profile written to:\n" + "\n".join(paths))
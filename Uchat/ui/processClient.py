@@ -0,0 +1,179 @@
+"""
+Qt client whose networking runs in a child process, offering the UI what QtClient does
+Events arrive from the network process in batches, each applied on the GUI thread in one go, so views only ever see
+conversations ready to render. What the UI asks of the client is sent back to the network process as commands
+"""
+import selectors
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from Uchat.MessageContext import MessageContext
+from Uchat.client import Client
+from Uchat.model.conversation import ConversationState
+from Uchat.model.conversationModel import ConversationModel
+from Uchat.model.remoteConversation import RemoteConversation
+from Uchat.network.messages.message import ChatMessage
+from Uchat.network.networkProcess import NetworkProcess, PeerTable
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+
+
+class ProcessClient(QObject):
+    """
+    Client used by the GUI when networking runs in a child process, emitting the signals QtClient does
+    """
+
+    # Signals a client can emit
+    new_friend_added_signal = pyqtSignal(Peer)  # Emitted when a friend is added
+    tcp_conn_received_signal = pyqtSignal(Peer, TcpSocket)  # Emitted when a user needs to permit a new connection rqst
+    start_chat_signal = pyqtSignal(Peer)
+    chat_received_signal = pyqtSignal(Peer)
+    peer_discovered_signal = pyqtSignal(Peer)  # Emitted when a client on the LAN is found, or changes
+    peer_lost_signal = pyqtSignal(Peer)  # Emitted when a client on the LAN leaves, or goes quiet
+    image_received_signal = pyqtSignal(Peer, int)  # Emitted with an image's id once every chunk of it arrived
+    avatar_received_signal = pyqtSignal(Peer, str)  # Emitted with the hash of a peer's avatar, once it's stored
+    _batch_signal = pyqtSignal(object)  # Emitted by the thread waiting on the network process, applied on the GUI's
+
+    def __init__(self, info: Peer, factory: Callable[[selectors.BaseSelector, Peer], Client]):
+        """
+        :param info: Peer information pertaining to this user
+        :param factory: Builds the headless client in the network process, must be a module-level function
+        """
+        super().__init__(None)
+        self._info = info
+        self.__peers = PeerTable(info, 1)
+        self.__conversations: Dict[Peer, RemoteConversation] = dict()
+        self.__models: Dict[Peer, ConversationModel] = dict()
+        self.__nearby: List[Peer] = list()
+
+        self.__handlers: Dict[str, Callable] = {
+            'created': self.__created,
+            'deleted': self.__deleted,
+            'chat': self.__chat,
+            'state': lambda ref, state: self.__with_conversation(ref, lambda conv: conv.change_state(state)),
+            'delivery': lambda ref, index, delivery: self.__with_conversation(
+                ref, lambda conv: conv.change_delivery(index, delivery)),
+            'friend': lambda ref: self.new_friend_added_signal.emit(self.__peer(ref)),
+            'requested': lambda ref: self.tcp_conn_received_signal.emit(self.__peer(ref), None),
+            'started': lambda ref: self.start_chat_signal.emit(self.__peer(ref)),
+            'received': lambda ref: self.chat_received_signal.emit(self.__peer(ref)),
+            'discovered': lambda ref: self.peer_discovered_signal.emit(self.__peer(ref)),
+            'lost': lambda ref: self.peer_lost_signal.emit(self.__peer(ref)),
+            'image': lambda ref, image_id: self.image_received_signal.emit(self.__peer(ref), image_id),
+            'avatar': lambda ref, digest: self.avatar_received_signal.emit(self.__peer(ref), digest),
+            'nearby': self.__set_nearby,
+            'stopped': lambda cpu_time: None
+        }
+
+        self._batch_signal.connect(self.__apply)
+        self.__process = NetworkProcess(factory, info, self._batch_signal.emit)
+
+    # Events
+
+    def __apply(self, batch: List[Tuple]):
+        for name, *args in batch:
+            self.__handlers[name](*args)
+
+    def __peer(self, ref) -> Peer:
+        return self.__peers.peer(ref)
+
+    def __with_conversation(self, ref, change: Callable[[RemoteConversation], None]):
+        if conv := self.__conversations.get(self.__peer(ref)):
+            change(conv)
+
+    def __created(self, ref, state: ConversationState, is_group: bool):
+        peer = self.__peer(ref)
+        if conv := self.__conversations.get(peer):
+            conv.change_state(state)
+        else:
+            self.__conversations[peer] = RemoteConversation(self._info, peer, state, is_group)
+
+    def __deleted(self, ref):
+        peer = self.__peer(ref)
+        self.__conversations.pop(peer, None)
+        if model := self.__models.pop(peer, None):
+            model.detach()
+
+    def __chat(self, ref, chat: ChatMessage, sender_ref, delivery):
+        if conv := self.__conversations.get(self.__peer(ref)):
+            context = MessageContext(chat, self.__peer(sender_ref))
+            context.delivery = delivery
+            conv.add_message(context)
+
+    def __set_nearby(self, refs):
+        self.__nearby = [self.__peer(ref) for ref in refs]
+
+    # Commands
+
+    def create_conversation(self, peer: Peer, comm_sock: Optional[TcpSocket] = None) -> RemoteConversation:
+        conv = RemoteConversation(self._info, peer)
+        self.__conversations[peer] = conv
+        self.__process.call('create_conversation', self.__peers.ref(peer))
+        return conv
+
+    def create_group(self, members: List[Peer], group_id: Optional[int] = None, name: Optional[str] = None,
+                     relay_fanout: int = 0) -> RemoteConversation:
+        pseudo_peer = Peer(('', 0), False, name or ', '.join(member.username() for member in members))
+        group = RemoteConversation(self._info, pseudo_peer, ConversationState.ACTIVE, True)
+        self.__conversations[pseudo_peer] = group
+        self.__process.call('create_group', [self.__peers.ref(member) for member in members],
+                            self.__peers.ref(pseudo_peer), group_id, name, relay_fanout)
+        return group
+
+    def send_greeting(self, peer: Peer, ack: bool, wants_to_talk: bool = True):
+        self.__process.call('send_greeting', self.__peers.ref(peer), ack, wants_to_talk)
+
+    def send_chat(self, peer: Peer, chat_message: ChatMessage):
+        self.__process.call('send_chat', self.__peers.ref(peer), chat_message)
+
+    def send_image(self, peer: Peer, path: str, width: int, height: int, preview: bytes) -> None:
+        """
+        Has the network process send an image, which it adds to the conversation as it would a chat
+        """
+        self.__process.call('send_image', self.__peers.ref(peer), path, width, height, preview)
+
+    def send_farewell(self, peer: Peer):
+        self.__process.call('send_farewell', self.__peers.ref(peer))
+
+    def accept_connection(self, new_peer: Peer, new_sock: Optional[TcpSocket]):
+        self.__process.call('accept_connection', self.__peers.ref(new_peer))
+
+    def reject_connection(self, peer: Peer):
+        self.__process.call('reject_connection', self.__peers.ref(peer))
+
+    def delete_conversation(self, peer: Peer):
+        self.__deleted(self.__peers.ref(peer))
+        self.__process.call('delete_conversation', self.__peers.ref(peer))
+
+    def add_friend(self, peer: Peer):
+        self.new_friend_added_signal.emit(peer)
+
+    def start_chat(self, peer: Peer):
+        self.start_chat_signal.emit(peer)
+
+    def destroy(self):
+        self.__process.stop()
+
+    # Getters
+
+    def conversation(self, peer: Peer) -> Optional[RemoteConversation]:
+        return self.__conversations.get(peer)
+
+    def nearby_peers(self) -> List[Peer]:
+        return list(self.__nearby)
+
+    def conversation_model(self, peer: Peer) -> Optional[ConversationModel]:
+        """
+        Gets the list model of the conversation held with peer, building it on first use
+        :param peer: Peer whose conversation should be modeled
+        :return: the model, if a conversation exists
+        """
+        if not (conv := self.conversation(peer)):
+            return None
+
+        model = self.__models.get(peer)
+        if not model or model.conversation() is not conv:
+            model = ConversationModel(None, conv)
+            self.__models[peer] = model
+        return model
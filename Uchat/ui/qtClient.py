@@ -0,0 +1,102 @@
+"""
+Thin Qt adapter over the headless client, translating its events into signals and its conversations into models
+"""
+from typing import Dict, Optional
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from Uchat.client import Client, ClientListener
+from Uchat.model.inlineImage import InlineImage
+from Uchat.model.conversationModel import ConversationModel
+from Uchat.model.outbox import Outbox
+from Uchat.network.rateLimit import RateLimiter
+from Uchat.network.tcp import TcpSocket
+from Uchat.network.tls import TlsIdentity
+from Uchat.peer import Peer
+
+
+class ClientSignals(QObject, ClientListener):
+    """
+    Re-emits a client's events as Qt signals, queued onto the GUI thread when emitted from the network thread
+    """
+
+    # Signals a client can emit
+    new_friend_added_signal = pyqtSignal(Peer)  # Emitted when a friend is added
+    tcp_conn_received_signal = pyqtSignal(Peer, TcpSocket)  # Emitted when a user needs to permit a new connection rqst
+    start_chat_signal = pyqtSignal(Peer)
+    chat_received_signal = pyqtSignal(Peer)
+    peer_discovered_signal = pyqtSignal(Peer)  # Emitted when a client on the LAN is found, or changes
+    peer_lost_signal = pyqtSignal(Peer)  # Emitted when a client on the LAN leaves, or goes quiet
+    image_received_signal = pyqtSignal(Peer, int)  # Emitted with an image's id once every chunk of it arrived
+    avatar_received_signal = pyqtSignal(Peer, str)  # Emitted with the hash of a peer's avatar, once it's stored
+
+    def friend_added(self, peer: Peer):
+        self.new_friend_added_signal.emit(peer)
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        self.tcp_conn_received_signal.emit(peer, sock)
+
+    def chat_started(self, peer: Peer):
+        self.start_chat_signal.emit(peer)
+
+    def chat_received(self, peer: Peer):
+        self.chat_received_signal.emit(peer)
+
+    def peer_discovered(self, peer: Peer):
+        self.peer_discovered_signal.emit(peer)
+
+    def peer_lost(self, peer: Peer):
+        self.peer_lost_signal.emit(peer)
+
+    def image_received(self, peer: Peer, image: InlineImage):
+        self.image_received_signal.emit(peer, image.image_id)
+
+    def avatar_received(self, peer: Peer, digest: str):
+        self.avatar_received_signal.emit(peer, digest)
+
+
+class QtClient(Client):
+    """
+    Client used by the GUI, exposing the headless client's events under their signal names
+    """
+
+    def __init__(self, selector, info: Peer, identity: Optional[TlsIdentity] = None, udp: bool = False,
+                 discovery: bool = False, outbox: Optional[Outbox] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        super().__init__(selector, info, identity, udp, discovery, outbox, rate_limiter)
+
+        self.__signals = ClientSignals()
+        self.__models: Dict[Peer, ConversationModel] = dict()
+        self.add_listener(self.__signals)
+
+        self.new_friend_added_signal = self.__signals.new_friend_added_signal
+        self.tcp_conn_received_signal = self.__signals.tcp_conn_received_signal
+        self.start_chat_signal = self.__signals.start_chat_signal
+        self.chat_received_signal = self.__signals.chat_received_signal
+        self.peer_discovered_signal = self.__signals.peer_discovered_signal
+        self.peer_lost_signal = self.__signals.peer_lost_signal
+        self.image_received_signal = self.__signals.image_received_signal
+        self.avatar_received_signal = self.__signals.avatar_received_signal
+
+    def conversation_model(self, peer: Peer) -> Optional[ConversationModel]:
+        """
+        Gets the list model of the conversation held with peer, building it on first use
+        Must be called from the GUI thread, which the model then belongs to
+
+        :param peer: Peer whose conversation should be modeled
+        :return: the model, if a conversation exists
+        """
+        if not (conv := self.conversation(peer)):
+            return None
+
+        model = self.__models.get(peer)
+        if not model or model.conversation() is not conv:
+            model = ConversationModel(None, conv)
+            self.__models[peer] = model
+        return model
+
+    # Override
+    def delete_conversation(self, peer: Peer):
+        if model := self.__models.pop(peer, None):
+            model.detach()
+        super().delete_conversation(peer)
@@ -1,6 +1,10 @@
-from Uchat.driver import run
+from Uchat.helper import bootTimer
 import os
 
+from Uchat.driver import run
+
+bootTimer.mark_phase('core imports')
+
 if __name__ == "__main__":
 
     # Set working directory, relatively, to root of project
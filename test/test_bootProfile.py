@@ -0,0 +1,18 @@
+"""
+Keeps the cold start within its budget, measured by importing the application as the boot profile does
+"""
+from Uchat.tools import bootProfile
+
+
+def test_imports_within_budget(capsys):
+    status = bootProfile.main(['--imports-only'])
+    assert status == 0, capsys.readouterr().err
+
+
+def test_driver_defers_widget_toolkit():
+    """
+    The widget toolkit is loaded once the client is built, never by importing the driver
+    """
+    loaded = {name for name, _, _ in bootProfile.import_times()}
+    assert not [name for name in loaded if name.split('.')[0] == 'PyQt5']
+    assert not [name for name in bootProfile.DEFERRED_MODULES if name in loaded]
@@ -0,0 +1,57 @@
+"""
+Frames declaring more bytes than any a peer may send are never buffered, their connection is closed
+"""
+import socket
+import struct
+
+import pytest
+
+from Uchat.helper import metrics
+from Uchat.helper.globals import AVATAR_MAX_BYTES, FRAME_MAX_BYTES
+from Uchat.network.messages.message import AvatarMessage, WIRE_V1, WIRE_V3, _varint
+from Uchat.network.tcp import TcpSocket, drop_oversized, next_frame
+
+
+def _oversized_count() -> int:
+    return metrics.counter('uchat_rate_limited_frames_total', scope='size', policy='disconnect').value()
+
+
+@pytest.mark.parametrize('version, prefix', [(WIRE_V1, struct.pack('I', 0xFFFFFFFF)),
+                                             (WIRE_V3, _varint((1 << 64) - 1))])
+def test_oversized_length_dropped(version, prefix):
+    buffer = bytearray(prefix + b'x' * 1024)
+    before = _oversized_count()
+
+    assert next_frame(buffer, version) is None
+    assert drop_oversized(buffer, version)
+    assert not buffer
+    assert _oversized_count() == before + 1
+
+
+def test_largest_frame_read():
+    """
+    An avatar as large as may be sent still fits a frame
+    """
+    frame = AvatarMessage(b'\x01' * 32, b'\x02' * AVATAR_MAX_BYTES).to_bytes(WIRE_V3)
+    buffer = bytearray(frame)
+
+    assert not drop_oversized(buffer, WIRE_V3)
+    assert AvatarMessage.from_bytes(next_frame(buffer, WIRE_V3), WIRE_V3).data == b'\x02' * AVATAR_MAX_BYTES
+
+
+def test_flooding_peer_disconnected():
+    listener = socket.create_server(('127.0.0.1', 0))
+    remote = socket.create_connection(listener.getsockname())
+    local, _ = listener.accept()
+    listener.close()
+    sock = TcpSocket(sock=local)
+    before = _oversized_count()
+    try:
+        remote.sendall(struct.pack('I', FRAME_MAX_BYTES + 1) + b'x' * (64 << 10))
+
+        assert sock.recv_messages() == []
+        assert sock.is_closed()
+        assert _oversized_count() == before + 1
+    finally:
+        remote.close()
+        local.close()
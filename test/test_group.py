@@ -0,0 +1,173 @@
+"""
+Group conversations, held with members over loopback connections
+"""
+import selectors
+import socket
+import threading
+import time
+from typing import Callable, List
+
+import pytest
+
+from Uchat.MessageContext import MessageContext
+from Uchat.client import Client, ClientListener
+from Uchat.model.conversation import ConversationState, DeliveryState
+from Uchat.network.messages.message import ChatMessage, GreetingMessage, WIRE_V1, WIRE_VERSION
+from Uchat.network.tcp import TcpSocket
+from Uchat.peer import Peer
+from Uchat.tools.codecBench import loopback_pair
+from Uchat.tools.gossipSim import run_simulation
+
+
+_remotes = list()  # Members' ends of the connections, kept open for the whole session
+
+
+def _greeted(client: Client, username: str, version: int) -> Peer:
+    """
+    :return: a member an active conversation is held with, whose greeting offered version
+    """
+    local, remote = loopback_pair()
+    _remotes.append(remote)
+    peer = Peer(remote.getsockname(), False, username)
+    sock = TcpSocket(sock=local)
+    sock.send_bytes(GreetingMessage(0x6d0d7a, 'alice', False).to_bytes(WIRE_V1))
+    remote.sendall(GreetingMessage(0x6d0d7a, username, True, True, version).to_bytes(WIRE_V1))
+
+    conv = client.create_conversation(peer, sock)
+    conv.add_message(MessageContext(sock.recv_message(), peer))
+    return peer
+
+
+def test_v1_members_left_out():
+    """
+    Clients predating groups can't read group messages, they're neither added to groups nor sent to
+    """
+    client = Client(selectors.DefaultSelector(), Peer(('', 0), True, 'alice', '#6d0d7a'))
+    current, old = _greeted(client, 'bob', WIRE_VERSION), _greeted(client, 'carol', 0)
+
+    group = client.create_group([current, old])
+    assert group.members() == [current]
+
+    group.add_member(old)  # As when it was greeted after joining
+    client.send_chat(group.peer(), ChatMessage('hello'))
+    assert group.delivery(1) == {current: DeliveryState.SENT, old: DeliveryState.FAILED}
+
+
+class _Member(ClientListener):
+    """
+    Accepts every connection, as a member asked to join would
+    """
+
+    def __init__(self, client: Client):
+        self.client = client
+        client.add_listener(self)
+
+    def connection_requested(self, peer: Peer, sock: TcpSocket):
+        self.client.accept_connection(peer, sock)
+
+
+@pytest.fixture
+def members():
+    """
+    Three clients listening on loopback, each driven by the same network thread until the test ends
+    """
+    ports = list()
+    for _ in range(3):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            ports.append(probe.getsockname()[1])
+
+    selectors_ = [selectors.DefaultSelector() for _ in ports]
+    clients = [Client(selector, Peer(('', port), True, name, '#2a9d8f'))
+               for selector, port, name in zip(selectors_, ports, ('alice', 'bob', 'carol'))]
+    for client in clients:
+        _Member(client)
+
+    running = True
+
+    def poll():
+        while running:
+            for client, selector in zip(clients, selectors_):
+                for key, mask in selector.select(timeout=0.01):
+                    client.handle_connection(key.fileobj, mask)
+                client.run_timers()
+
+    thread = threading.Thread(target=poll, daemon=True)
+    thread.start()
+    yield clients, ports
+
+    running = False
+    thread.join()
+    for client in clients:
+        client.destroy()
+
+
+def _wait(condition: Callable[[], bool], timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def _timeline(client: Client, group_id: int) -> List[str]:
+    group = client.group(group_id)
+    return [context.msg.message for context in group.chat_message_contexts()] if group else []
+
+
+def test_members_reach_each_other(members):
+    """
+    Members that joined on the creator's message only hold a conversation with the creator, who relays between them
+    """
+    (alice, bob, carol), ports = members
+    invited = [Peer(('127.0.0.1', port), False, name) for port, name in zip(ports[1:], ('bob', 'carol'))]
+    for peer in invited:
+        alice.create_conversation(peer, None)
+        alice.send_greeting(peer, False)
+    assert _wait(lambda: all(alice.conversation(peer).state() is ConversationState.ACTIVE for peer in invited))
+
+    group_id = alice.create_group(invited).group_id()
+    alice.send_chat(alice.group(group_id).peer(), ChatMessage('from alice'))
+    assert _wait(lambda: bob.group(group_id) and carol.group(group_id))
+
+    bob.send_chat(bob.group(group_id).peer(), ChatMessage('from bob'))
+    assert _wait(lambda: len(_timeline(carol, group_id)) == 2)
+    carol.send_chat(carol.group(group_id).peer(), ChatMessage('from carol'))
+
+    expected = {'from alice', 'from bob', 'from carol'}
+    assert _wait(lambda: all(set(_timeline(client, group_id)) == expected for client in (alice, bob, carol)))
+    assert all(len(_timeline(client, group_id)) == 3 for client in (alice, bob, carol))  # None shown twice
+
+    authors = [context.sender.username() for context in carol.group(group_id).chat_message_contexts()]
+    assert authors == ['alice', 'bob', 'carol']
+
+
+def _free_ports(count: int) -> int:
+    """
+    :return: the first of count consecutive ports nothing listens on
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        base = probe.getsockname()[1]
+
+    for start in range(base, base + 1000, count):
+        try:
+            probes = [socket.create_server(('', port)) for port in range(start, start + count)]
+        except OSError:
+            continue
+        for probe in probes:
+            probe.close()
+        return start
+    pytest.skip('No {} consecutive ports are free'.format(count))
+
+
+def test_relayed_group_reaches_everyone():
+    """
+    Members not sent a relayed message at once are sent it a moment later, so none are left out
+    """
+    members = 24
+    report = run_simulation(members, degree=6, fanout=2, messages=20, rate=100, base_port=_free_ports(members))
+
+    assert report['results']['overlay_established']
+    assert report['results']['delivery_ratio'] == 1.0
@@ -0,0 +1,110 @@
+"""
+Resolves the external IP against lookup endpoints served on loopback
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from Uchat.helper.globals import EXTERNAL_IP_TTL
+from Uchat.network import ip
+
+SLOW_DELAY = 1  # Seconds the slow endpoint takes to answer
+
+
+class _LookupHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if self.path == '/slow':
+            time.sleep(SLOW_DELAY)
+
+        if self.path == '/fail':
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        if self.path == '/json':
+            body = json.dumps({'ip': self.server.answer}).encode()
+        elif self.path == '/garbage':
+            body = b'<html>not an address</html>'
+        else:
+            body = (self.server.answer if self.path != '/slow' else '198.51.100.9').encode()
+
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def lookup():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _LookupHandler)
+    server.daemon_threads = True
+    server.hits = list()
+    server.answer = '203.0.113.7'
+    server.url = lambda path: 'http://127.0.0.1:{}{}'.format(server.server_port, path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(lookup, monkeypatch):
+    """
+    Empties the cached IP, lookups going to the loopback endpoint
+    """
+    monkeypatch.setattr(ip, 'IP_API_ENDPOINTS', [(lookup.url('/fast'), False)])
+    monkeypatch.setattr(ip, '_external_ip', None)
+    monkeypatch.setattr(ip, '_resolved_at', 0)
+    monkeypatch.setattr(ip, '_refresh', None)
+    return lookup
+
+
+def test_first_answer_wins(lookup):
+    start = time.monotonic()
+    assert ip.resolve_external_ip([(lookup.url('/slow'), False), (lookup.url('/fast'), False)]) == '203.0.113.7'
+    assert time.monotonic() - start < SLOW_DELAY
+
+
+def test_failing_endpoints_ignored(lookup):
+    endpoints = [(lookup.url('/fail'), False), (lookup.url('/garbage'), False), (lookup.url('/json'), True)]
+    assert ip.resolve_external_ip(endpoints) == '203.0.113.7'
+
+
+def test_no_valid_answer(lookup):
+    assert ip.resolve_external_ip([(lookup.url('/fail'), False), (lookup.url('/garbage'), False)]) is None
+
+
+def test_slow_endpoint_given_up(lookup):
+    start = time.monotonic()
+    assert ip.resolve_external_ip([(lookup.url('/slow'), False)], timeout=SLOW_DELAY / 4) is None
+    assert time.monotonic() - start < SLOW_DELAY
+
+
+def test_cached_within_ttl(cache):
+    assert ip.get_external_ip() == '203.0.113.7'
+    cache.answer = '203.0.113.8'
+    assert ip.get_external_ip() == '203.0.113.7'
+    assert len(cache.hits) == 1
+
+
+def test_stale_ip_refreshed_in_background(cache, monkeypatch):
+    assert ip.get_external_ip() == '203.0.113.7'
+    monkeypatch.setattr(ip, '_resolved_at', time.monotonic() - EXTERNAL_IP_TTL - 1)
+    monkeypatch.setattr(ip, 'IP_API_ENDPOINTS', [(cache.url('/slow'), False)])
+
+    # The stale IP is answered at once, while a single refresh is in flight
+    start = time.monotonic()
+    assert ip.get_external_ip() == '203.0.113.7'
+    assert ip.get_external_ip() == '203.0.113.7'
+    refresh = ip.refresh_external_ip()
+    assert time.monotonic() - start < SLOW_DELAY
+
+    assert refresh.result(timeout=5) == '198.51.100.9'
+    assert ip.get_external_ip() == '198.51.100.9'
+    assert cache.hits == ['/fast', '/slow']
@@ -0,0 +1,57 @@
+"""
+Both sides of a handshake present their self-signed identity, so each can pin the other's
+"""
+import shutil
+import socket
+import ssl
+import threading
+
+import pytest
+
+from Uchat.network.tls import TlsIdentity, fingerprint, generate_identity
+
+pytestmark = pytest.mark.skipif(not shutil.which('openssl'), reason='Identities are created with openssl')
+
+
+def _identity(directory, username: str) -> TlsIdentity:
+    cert_path, key_path = str(directory / '{}.pem'.format(username)), str(directory / '{}.key'.format(username))
+    assert generate_identity(username, cert_path, key_path)
+    return TlsIdentity(cert_path, key_path)
+
+
+def _handshake(acceptor: TlsIdentity, context: ssl.SSLContext) -> bytes:
+    """
+    :return: the certificate the acceptor was presented, empty if none
+    """
+    presented = list()
+    with socket.create_server(('127.0.0.1', 0)) as listener:
+        def accept():
+            sock, _ = listener.accept()
+            with acceptor.server_context().wrap_socket(sock, server_side=True) as tls_sock:
+                presented.append(tls_sock.getpeercert(binary_form=True) or b'')
+                tls_sock.sendall(b'x')
+
+        thread = threading.Thread(target=accept)
+        thread.start()
+        with context.wrap_socket(socket.create_connection(listener.getsockname())) as sock:
+            sock.recv(1)
+        thread.join()
+    return presented[0]
+
+
+def test_initiator_presents_identity(tmp_path):
+    alice, bob = _identity(tmp_path, 'alice'), _identity(tmp_path, 'bob')
+
+    for _ in range(2):  # The second is trusted already
+        assert fingerprint(_handshake(bob, alice.client_context())) == alice.fingerprint()
+
+
+def test_initiator_without_identity_accepted(tmp_path):
+    """
+    Clients predating mutual pinning present no identity, and are still let through
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    assert _handshake(_identity(tmp_path, 'bob'), context) == b''
@@ -0,0 +1,131 @@
+"""
+Drives gateway caching and port mapping against an internet gateway device served on loopback
+SSDP itself is replaced, discovery answering with the loopback gateway, everything past it runs as it would on a LAN
+"""
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from Uchat.helper.globals import UPNP_CACHE_TTL
+from Uchat.network import upnp
+
+ACCEPTED_SERVICE = 'urn:schemas-upnp-org:service:WANIPConnection:2'  # The only service the stub maps ports on
+LAN_ADDR = '192.168.1.5'
+
+
+class _IgdHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.server.actions.append((self.headers['SOAPAction'].strip('"'), body))
+        time.sleep(self.server.delay)
+
+        # Gateways answer actions on services they don't expose with a SOAP fault
+        self.send_response(200 if self.headers['SOAPAction'].startswith('"' + ACCEPTED_SERVICE) else 500)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def igd():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _IgdHandler)
+    server.daemon_threads = True
+    server.actions = list()
+    server.delay = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def discoveries(igd, tmp_path, monkeypatch):
+    """
+    :return: the gateways discovered, each discovery answered by the loopback gateway
+    """
+    monkeypatch.chdir(tmp_path)  # The gateway is cached on disk under data/
+    monkeypatch.setattr(upnp, '_gateway', None)
+    monkeypatch.setattr(upnp, '_discovery', None)
+
+    discovered = list()
+
+    def discover():
+        discovered.append(upnp.Gateway('http://127.0.0.1:{}/ctl'.format(igd.server_port), LAN_ADDR))
+        return discovered[-1]
+
+    monkeypatch.setattr(upnp, '_discover_gateway', discover)
+    return discovered
+
+
+def _expire(gateway: upnp.Gateway):
+    gateway._Gateway__discovered_at -= UPNP_CACHE_TTL + 1
+
+
+def test_gateway_cached_in_memory_and_on_disk(discoveries):
+    gateway = upnp.start_gateway_discovery().result()
+    assert upnp.get_gateway() is gateway
+    assert upnp.start_gateway_discovery().result() is gateway
+
+    upnp._gateway = None  # As after a restart
+    assert upnp.get_gateway().control_url() == gateway.control_url()
+    assert len(discoveries) == 1
+
+
+def test_expired_gateway_rediscovered(discoveries):
+    gateway = upnp.get_gateway()
+    _expire(gateway)
+    upnp._cache_gateway(gateway)
+
+    assert upnp.get_gateway() is not gateway
+    assert len(discoveries) == 2
+
+    _expire(upnp._gateway)
+    upnp._cache_gateway(upnp._gateway)
+    upnp._gateway = None  # Only the disk cache is left, and it too is expired
+    upnp.get_gateway()
+    assert len(discoveries) == 3
+
+
+def test_add_and_delete_port_mapping(igd, discoveries):
+    assert upnp.ensure_port_is_forwarded(external_port=40000, internal_port=40001)
+
+    actions = [action for action, _ in igd.actions]
+    assert actions[-1] == ACCEPTED_SERVICE + '#AddPortMapping'
+    assert all(action.endswith('#AddPortMapping') for action in actions)
+    body = igd.actions[-1][1]
+    assert '<NewExternalPort>40000</NewExternalPort>' in body
+    assert '<NewInternalPort>40001</NewInternalPort>' in body
+    assert '<NewInternalClient>{}</NewInternalClient>'.format(LAN_ADDR) in body
+
+    igd.actions.clear()
+    upnp._gateway = None  # Deleted through the cache on disk, which remembers the service that accepted the mapping
+    assert upnp.delete_port_mapping(external_port=40000)
+    assert [action for action, _ in igd.actions] == [ACCEPTED_SERVICE + '#DeletePortMapping']
+    assert '<NewExternalPort>40000</NewExternalPort>' in igd.actions[0][1]
+    assert len(discoveries) == 1
+
+
+def test_delete_not_starved_by_pending_discovery(igd, discoveries):
+    """
+    Waiting on a discovery that never finishes leaves the deletion its whole deadline
+    """
+    upnp._cache_gateway(upnp._discover_gateway())
+    upnp._discovery = Future()  # Still running as the application closes
+    igd.delay = 0.3
+
+    start = time.monotonic()
+    assert upnp.delete_port_mapping(deadline=1, discovery_wait=0.3)
+    assert time.monotonic() - start < 2
+
+
+def test_delete_gives_up_at_deadline(igd, discoveries):
+    upnp._cache_gateway(upnp._discover_gateway())
+    igd.delay = 2
+
+    start = time.monotonic()
+    assert not upnp.delete_port_mapping(deadline=0.3)
+    assert time.monotonic() - start < 1
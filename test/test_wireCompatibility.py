@@ -0,0 +1,75 @@
+"""
+Checks v1 is still the wire format of clients predating wire versions, against bytes those clients produced
+"""
+import sys
+
+import pytest
+
+from Uchat.network.messages.message import ChatMessage, GreetingMessage, FarewellMessage, MessageType, frame_type, \
+    WIRE_V1, WIRE_V2, WIRE_VERSION
+from Uchat.network.tcp import WireNegotiation
+
+# Packed by the baseline codec, which laid messages out natively, on a little-endian machine
+BASELINE_CHAT = bytes.fromhex('1300000001000b0020bcbe4e68656c6c6f207468657265')  # 'hello there' at 1600000000.5
+BASELINE_GREETING = bytes.fromhex('1e000000000000007a0d6d00000105616c6963650000000000000000000000000000')
+BASELINE_FAREWELL = bytes.fromhex('0100000002')
+
+pytestmark = pytest.mark.skipif(sys.byteorder != 'little', reason='Baseline bytes were packed little-endian')
+
+
+def test_chat_encodes_as_baseline():
+    assert ChatMessage('hello there', 1600000000.5).to_bytes(WIRE_V1) == BASELINE_CHAT
+
+
+def test_chat_decodes_from_baseline():
+    assert frame_type(BASELINE_CHAT, WIRE_V1) is MessageType.CHAT
+    msg = ChatMessage.from_bytes(BASELINE_CHAT[4:], WIRE_V1)
+    assert msg.message == 'hello there'
+    assert msg.time_stamp == 1600000000  # v1 stamps are 32-bit floats, which can't hold the half second
+    assert msg.seq == 0 and msg.ack == 0  # Unnumbered, so neither deduplicated nor acknowledged
+
+
+def test_numbered_chat_encodes_as_baseline():
+    """
+    Numbers given to a chat aren't sent to v1 peers, which couldn't read them
+    """
+    msg = ChatMessage('hello there', 1600000000.5, seq=7, ack=3)
+    assert msg.to_bytes(WIRE_V1) == BASELINE_CHAT
+
+
+def test_greeting_round_trips_baseline():
+    msg = GreetingMessage.from_bytes(BASELINE_GREETING[4:], WIRE_V1)
+    assert msg.get_username() == 'alice'
+    assert msg.get_hex_code() == '0x6d0d7a'
+    assert not msg.ack and msg.wants_to_talk
+    assert msg.version == 0
+    assert msg.to_bytes(WIRE_V1) == BASELINE_GREETING
+
+
+def test_greeting_offers_version_in_padding():
+    """
+    Greetings offering a version differ from the baseline's only in bytes it packed as padding
+    """
+    offered = GreetingMessage(0x6d0d7a, 'alice', False, True).to_bytes(WIRE_V1)
+    assert len(offered) == len(BASELINE_GREETING)
+    assert [i for i in range(len(offered)) if offered[i] != BASELINE_GREETING[i]] == [5]
+    assert offered[5] == WIRE_VERSION
+
+
+def test_farewell_round_trips_baseline():
+    assert FarewellMessage().to_bytes(WIRE_V1) == BASELINE_FAREWELL
+    assert frame_type(BASELINE_FAREWELL, WIRE_V1) is MessageType.FAREWELL
+
+
+def test_baseline_greeting_keeps_v1():
+    negotiation = WireNegotiation()
+    negotiation.sent(GreetingMessage(0x6d0d7a, 'bob', False, True).to_bytes(WIRE_V1))
+    negotiation.received(GreetingMessage.from_bytes(BASELINE_GREETING[4:], WIRE_V1))
+    assert negotiation.send_version == WIRE_V1 and negotiation.recv_version == WIRE_V1
+
+
+def test_versioned_greeting_moves_to_v2():
+    negotiation = WireNegotiation()
+    negotiation.sent(GreetingMessage(0x6d0d7a, 'bob', False, True).to_bytes(WIRE_V1))
+    negotiation.received(GreetingMessage(0x6d0d7a, 'alice', True, True, WIRE_V2))
+    assert negotiation.send_version == WIRE_V2 and negotiation.recv_version == WIRE_V2